@@ -158,4 +158,164 @@ def FitModelFixed(modelFcn, startParameters, fitWhich, data, *args, **kwargs):
     return [out]
 
     
-#def FitModelPoissonS(modelFcn, startParmeters, data, *args):
\ No newline at end of file
+#def FitModelPoissonS(modelFcn, startParmeters, data, *args):
+
+###############################################
+# Batched fitting
+#
+# Fits many small, independent ROIs (e.g. all the candidate molecules in a frame) with a single, vectorised
+# Levenberg-Marquardt loop. This avoids the per-ROI overhead of calling `optimize.leastsq` (and the python level
+# model / jacobian callbacks it makes) once per ROI, which dominates on dense frames.
+
+def _batch_subset(args, idx):
+    return tuple([a[idx] for a in args])
+
+def _batch_jacobian(modelFcn, p, f0, shared_args, args):
+    """Forward difference jacobian for model functions which don't provide an analytical one (as `modelFcn.D`)"""
+    n_rois, n_params = p.shape
+    J = np.empty(f0.shape + (n_params,), 'f8')
+    for i in range(n_params):
+        dp = EPS_FCN*np.abs(p[:, i]) + EPS_FCN
+        pt = p.copy()
+        pt[:, i] += dp
+        J[:, :, i] = (modelFcn(pt, *(shared_args + args)).reshape(n_rois, -1) - f0)/dp[:, None]
+        
+    return J
+
+def _batch_model_and_jacobian(modelFcn, p, shared_args, args):
+    n_rois = p.shape[0]
+    f = modelFcn(p, *(shared_args + args)).reshape(n_rois, -1)
+    if 'D' in dir(modelFcn):
+        J = modelFcn.D(p, *(shared_args + args)).reshape(n_rois, f.shape[1], -1)
+    else:
+        J = _batch_jacobian(modelFcn, p, f, shared_args, args)
+    
+    return f, J
+
+def _batch_solve(A, b):
+    try:
+        return np.linalg.solve(A, b[:, :, None])[:, :, 0]
+    except np.linalg.LinAlgError:
+        # at least one of the systems is singular - fall back to the (slower) pseudo-inverse
+        return np.einsum('nij,nj->ni', np.linalg.pinv(A), b)
+
+def FitModelWeightedBatch(modelFcn, startParameters, data, sigmas, *args, **kwargs):
+    """
+    Weighted least squares fit of a model to a batch of independent ROIs using a vectorised Levenberg-Marquardt
+    solver. This is the batched analogue of `FitModelWeighted` / `FitModelWeightedJac`.
+    
+    Parameters
+    ----------
+    modelFcn : callable
+        model function, called as ``modelFcn(p, *shared_args, *args)`` with ``p`` a ``(n_rois, n_params)`` array. It
+        should return an array of shape ``(n_rois, ...)`` matching ``data``. If the model function has a ``D``
+        attribute, this is used to compute an analytical jacobian of shape ``(n_rois, ..., n_params)``, otherwise a
+        forward difference approximation is used.
+    startParameters : array_like
+        ``(n_rois, n_params)`` array of starting parameters
+    data : np.ndarray
+        ``(n_rois, ...)`` array of data to fit
+    sigmas : np.ndarray
+        ``(n_rois, ...)`` array of per-pixel errors. Pixels with an infinite sigma get zero weight, which lets
+        ROIs of differing sizes (e.g. clipped at the edge of the frame) be padded into a common shape.
+    args :
+        additional per-ROI arguments to the model function. These must be arrays with the ROI index as the first
+        dimension, so that they can be subset as individual ROIs converge.
+    shared_args : tuple, optional (keyword only)
+        arguments which are common to all ROIs (e.g. an interpolator object). Passed to the model before ``args``.
+    maxiter : int, optional (keyword only)
+        maximum number of Levenberg-Marquardt iterations
+    ftol, xtol : float, optional (keyword only)
+        relative tolerances in chi-squared and parameters used to decide convergence (as for `optimize.leastsq`)
+
+    Returns
+    -------
+    res : np.ndarray
+        ``(n_rois, n_params)`` array of fitted parameters
+    cov_x : np.ndarray
+        ``(n_rois, n_params, n_params)`` array of (unscaled) covariance matrices. Singular matrices are NaN.
+    infodict : dict
+        'fvec' - ``(n_rois, n_pixels)`` weighted residuals at the solution, 'nfev' - number of iterations performed
+    mesg : str
+    resCode : np.ndarray
+        per-ROI integer result codes, following the `optimize.leastsq` conventions (1-4 = converged, 5 = maximum
+        number of iterations reached)
+    """
+    shared_args = tuple(kwargs.get('shared_args', ()))
+    maxiter = kwargs.get('maxiter', 100)
+    ftol = kwargs.get('ftol', 1.49012e-08)
+    xtol = kwargs.get('xtol', 1.49012e-08)
+    
+    p = np.array(startParameters, dtype='f8', ndmin=2)
+    n_rois, n_params = p.shape
+    
+    d = np.asarray(data, dtype='f8').reshape(n_rois, -1)
+    w = (1.0/np.asarray(sigmas, dtype='f8')).reshape(n_rois, -1)
+    
+    f = modelFcn(p, *(shared_args + args)).reshape(n_rois, -1)
+    chi2 = (((d - f)*w)**2).sum(1)
+    
+    lam = np.full(n_rois, 1e-3)
+    resCode = np.full(n_rois, 5, dtype='i4')
+    active = np.ones(n_rois, dtype=bool)
+    
+    n_iter = 0
+    while n_iter < maxiter and np.any(active):
+        n_iter += 1
+        idx = np.flatnonzero(active)
+        p_a, w_a, d_a, chi2_a = p[idx], w[idx], d[idx], chi2[idx]
+        args_a = _batch_subset(args, idx)
+        
+        f_a, J = _batch_model_and_jacobian(modelFcn, p_a, shared_args, args_a)
+        J *= w_a[:, :, None]
+        r = (d_a - f_a)*w_a
+        
+        JtJ = np.einsum('nmi,nmj->nij', J, J)
+        g = np.einsum('nmi,nm->ni', J, r)
+        
+        # Marquardt scaling of the damping term, guarding against parameters which don't affect the model
+        diag = np.diagonal(JtJ, axis1=1, axis2=2)
+        diag = np.maximum(diag, 1e-12*diag.max(1)[:, None] + 1e-30)
+        A = JtJ + (lam[idx][:, None]*diag)[:, :, None]*np.eye(n_params)[None, :, :]
+        
+        dp = _batch_solve(A, g)
+        p_new = p_a + dp
+        
+        f_new = modelFcn(p_new, *(shared_args + args_a)).reshape(len(idx), -1)
+        chi2_new = (((d_a - f_new)*w_a)**2).sum(1)
+        
+        accept = np.isfinite(chi2_new) & (chi2_new <= chi2_a)
+        
+        f_conv = accept & ((chi2_a - chi2_new) <= ftol*chi2_a)
+        x_conv = np.all(np.abs(dp) <= xtol*(np.abs(p_a) + xtol), axis=1)
+        stalled = lam[idx] > 1e10
+        
+        a_idx = idx[accept]
+        p[a_idx] = p_new[accept]
+        chi2[a_idx] = chi2_new[accept]
+        lam[idx] = np.where(accept, lam[idx]*0.1, lam[idx]*10)
+        
+        converged = f_conv | x_conv | stalled
+        resCode[idx[converged]] = np.where(f_conv & x_conv, 3, np.where(f_conv, 1, 2))[converged]
+        active[idx[converged]] = False
+    
+    # evaluate residuals and covariance at the solution
+    f, J = _batch_model_and_jacobian(modelFcn, p, shared_args, args)
+    J *= w[:, :, None]
+    fvec = (d - f)*w
+    JtJ = np.einsum('nmi,nmj->nij', J, J)
+    
+    try:
+        cov_x = np.linalg.inv(JtJ)
+    except np.linalg.LinAlgError:
+        cov_x = np.full_like(JtJ, np.nan)
+        for i in range(n_rois):
+            try:
+                cov_x[i] = np.linalg.inv(JtJ[i])
+            except np.linalg.LinAlgError:
+                pass
+    
+    infodict = {'fvec': fvec, 'nfev': n_iter}
+    mesg = 'Batched Levenberg-Marquardt: %d of %d ROIs converged in %d iterations' % ((resCode < 5).sum(), n_rois, n_iter)
+    
+    return p, cov_x, infodict, mesg, resCode
@@ -118,6 +118,70 @@ def rendQTan(ar, qt, maxDepth=100):
         ar[ix0:ix1,iy0:iy1] += float(l.numRecords)/float((ix1-ix0)*(iy1-iy0))
 
 
+# Quadtree rendering from pixel counts, without building a tree of records. Used for rendering in bounded memory
+# (the pipeline's out-of-core mode), where the points are counted a chunk at a time. Whether a node is split only
+# depends on the number of points in it, so the leaves (and hence the rendering) can be worked out from the counts in the
+# finest level pixels.
+
+def quadCounts(x, y, x0, y0, pixelSize, size):
+    """
+    Number of points in each (finest level) pixel of a quadtree covering [x0, x0 + size*pixelSize), [y0, y0 +
+    size*pixelSize). Points outside the tree are counted in the edge pixels, as they are by pointQT.
+    """
+    ix = np.clip(np.floor((np.asarray(x) - x0)/pixelSize), 0, size - 1).astype('i8')
+    iy = np.clip(np.floor((np.asarray(y) - y0)/pixelSize), 0, size - 1).astype('i8')
+
+    return np.bincount(ix*size + iy, minlength=size*size).reshape(size, size)
+
+def rendQTCounts(counts, max_leaf_size=10):
+    """
+    Render a quadtree from the number of points in each of its finest level pixels (see quadCounts). Gives the same
+    result as rendQTa (for a tree built by inserting the points with the same max_leaf_size, and an array the size of
+    `counts`).
+
+    Parameters
+    ----------
+    counts : ndarray
+        [N, N] array of counts, where N is a power of 2
+    max_leaf_size : int
+        the maximum number of records in a leaf
+    """
+    size = counts.shape[0]
+    maxDepth = int(round(np.log2(size)))
+    if (counts.shape != (size, size)) or (2**maxDepth != size):
+        raise ValueError('counts should be square, with a power of 2 size')
+
+    # counts at each depth, from the finest up
+    levels = [np.asarray(counts, 'f8')]
+    for d in range(maxDepth):
+        c = levels[-1]
+        m = c.shape[0]//2
+        levels.append(c.reshape(m, 2, m, 2).sum(axis=(1, 3)))
+    levels = levels[::-1]
+
+    ar = np.zeros((size, size))
+    done = np.zeros((size, size), bool)
+
+    # a node is a leaf if it has few enough records (or we have reached the finest level). Counts only decrease going
+    # down the tree, so each pixel belongs to the shallowest leaf above it.
+    for depth, c in enumerate(levels):
+        if depth < maxDepth:
+            leaf = c <= max_leaf_size
+            if not leaf.any():
+                continue
+        else:
+            leaf = np.ones(c.shape, bool)
+
+        f = size//c.shape[0]
+        leaf = np.repeat(np.repeat(leaf, f, 0), f, 1) & ~done
+        val = np.repeat(np.repeat(c*2.0**(2*(depth - maxDepth)), f, 0), f, 1)
+
+        ar[leaf] = val[leaf]
+        done |= leaf
+
+    return ar
+
+
 class QTRendererNode:
     def __init__(self, node, i=0):
         self.children = []
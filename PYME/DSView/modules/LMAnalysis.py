@@ -769,7 +769,7 @@ class LMAnalyser2(Plugin):
 
     def _refresh_analysis_cluster(self):
         import requests
-        from io import BytesIO
+        from PYME.IO import columnar
         try:
             # import cPickle on py2
             import cPickle as pickle
@@ -784,9 +784,9 @@ class LMAnalyser2(Plugin):
             # load from server as pickle (try this instead of numpy loading to get around np.load slowness if performance is an issue)
             #newResults = pickle.loads(requests.get(self.analysisController.pusher.resultsURI.replace('__aggregate_h5r/', '') + '/FitResults?from=%d' % len(self.fitResults)).content)
             
-            # load from server as .npy
-            cont = requests.get(self.analysisController.pusher.worker_resultsURI.replace('__aggregate_h5r/', '') + '/FitResults.npy?from=%d' % len(self.fitResults)).content
-            newResults = np.load(BytesIO(cont))
+            # load from server in columnar format (see PYME.IO.columnar)
+            cont = requests.get(self.analysisController.pusher.worker_resultsURI.replace('__aggregate_h5r/', '') + '/FitResults.pyrc?from=%d' % len(self.fitResults)).content
+            newResults = columnar.loads(cont)
             
             self._add_new_results(newResults)
         
@@ -66,6 +66,10 @@ class ArrayDataSource(BaseDataSource): #permit indexing with more dimensions lar
         return self.data.dtype
     
     def __getattr__(self, name):
+        if name == 'data':
+            # not set yet (e.g. when unpickling) - don't recurse
+            raise AttributeError(name)
+        
         return getattr(self.data, name)
     
     def __getitem__(self, keys):
@@ -208,6 +212,10 @@ class XYZTCArrayDataSource(BaseDataSource): #permit indexing with more dimension
         return self.data.dtype
     
     def __getattr__(self, name):
+        if name == 'data':
+            # not set yet (e.g. when unpickling) - don't recurse
+            raise AttributeError(name)
+        
         return getattr(self.data, name)
     
     def __getitem__(self, keys):
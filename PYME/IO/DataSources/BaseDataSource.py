@@ -216,6 +216,10 @@ class XYZSubvolume(object):
         return tuple(self._datasource.shape[:3])
     
     def __getattr__(self, name):
+        if name == '_datasource':
+            # not set yet (e.g. when unpickling) - don't recurse
+            raise AttributeError(name)
+        
         return getattr(self._datasource, name)
     
     def __getitem__(self, item):
@@ -38,10 +38,20 @@ SHAPE_LIFESPAN = 5
 from PYME.IO import clusterIO
 from PYME.IO import PZFFormat
 from PYME.IO import MetaDataHandler
+from PYME import config
 
 class DataSource(XYZTCDataSource):
     moduleName = 'ClusterPZFDataSource'
-    def __init__(self, url, queue=None):
+    def __init__(self, url, queue=None, read_ahead=None):
+        """
+        Parameters
+        ----------
+        url : str
+            PYME-CLUSTER:// url of the series
+        read_ahead : int, optional
+            the number of frames to fetch (in a single batched request) whenever we get a frame which we haven't
+            already fetched. Defaults to the `clusterpzf-read-ahead` config option. 0 disables read-ahead.
+        """
         self.seriesName = url
         #print url
         self.clusterfilter = url.split('://')[1].split('/')[0]
@@ -50,6 +60,12 @@ class DataSource(XYZTCDataSource):
         #print self.sequenceName
         self.lastShapeTime = 0
         
+        if read_ahead is None:
+            read_ahead = config.get('clusterpzf-read-ahead', 0)
+        
+        self._read_ahead = int(read_ahead)
+        self._prefetched = {}
+        
         mdfn = '/'.join([self.sequenceName, 'metadata.json'])  
         
         #print mdfn
@@ -76,9 +92,26 @@ class DataSource(XYZTCDataSource):
         self.numFrames = len(frameNames)
         self.lastShapeTime = time.time()
     
+    def _frameName(self, ind):
+        return '%s/frame%05d.pzf' % (self.sequenceName, ind)
+    
+    def _getFrameData(self, ind):
+        if self._read_ahead > 1:
+            try:
+                return self._prefetched[ind]
+            except KeyError:
+                pass
+            
+            # fetch this frame and the following ones in a single request. Replace, rather than add to, the
+            # prefetched frames so that memory usage is bounded.
+            inds = range(ind, max(min(ind + self._read_ahead, self.numFrames), ind + 1))
+            self._prefetched = dict(zip(inds, clusterIO.get_files([self._frameName(i) for i in inds], self.clusterfilter)))
+            return self._prefetched[ind]
+        
+        return clusterIO.get_file(self._frameName(ind), self.clusterfilter)
+    
     def getSlice(self, ind):
-        frameName = '%s/frame%05d.pzf' % (self.sequenceName, ind)
-        sl = PZFFormat.loads(clusterIO.get_file(frameName, self.clusterfilter))[0]
+        sl = PZFFormat.loads(self._getFrameData(ind))[0]
         
         #print sl.shape, sl.dtype
         return sl.squeeze()
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+##################
+# FilteredDataSource.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##################
+"""
+A data source which computes its data on demand, one unit (a plane, volume, or time series) at a time. Used for the
+lazy outputs of recipe filters (see :meth:`PYME.recipes.base.Filter.lfilter`).
+"""
+import threading
+from collections import OrderedDict
+
+from .BaseDataSource import XYZTCDataSource
+
+from PYME import config
+
+
+class DataSource(XYZTCDataSource):
+    """
+    Parameters
+    ----------
+    unit_fn : callable
+        ``unit_fn((z, t, c))`` computes the data for one unit. Dimensions which are computed together (i.e. the
+        dimensions in `dimensionality`, after X and Y) are passed as None. The result should have the full (unsqueezed)
+        shape of the unit - e.g. [x, y, z] for an XYZ unit.
+    shape : tuple
+        the (5D, XYZTC) shape of the data
+    dimensionality : str
+        the dimensions computed together - one of 'XY', 'XYZ', or 'XYZT'
+    cache_size : int
+        number of computed units to keep. Defaults to the ``recipes-lazy-cache-size`` config option (32).
+    """
+    moduleName = 'FilteredDataSource'
+
+    def __init__(self, unit_fn, shape, dimensionality='XY', cache_size=None):
+        if cache_size is None:
+            cache_size = config.get('recipes-lazy-cache-size', 32)
+
+        if dimensionality not in ['XY', 'XYZ', 'XYZT']:
+            raise RuntimeError('Dimensionality: %s not supported' % dimensionality)
+
+        self._unit_fn = unit_fn
+        self._slice_shape = tuple(shape[:2])
+        self._dimensionality = dimensionality
+        self._cache_size = max(int(cache_size), 1)
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.n_computed = 0  # number of units computed (for diagnostics)
+
+        XYZTCDataSource.__init__(self, input_order='XYZTC', size_z=shape[2], size_t=shape[3], size_c=shape[4])
+
+    def _unit_key(self, z, t, c):
+        if self._dimensionality == 'XY':
+            return (z, t, c)
+        elif self._dimensionality == 'XYZ':
+            return (None, t, c)
+        else:
+            return (None, None, c)
+
+    def _get_unit(self, key):
+        with self._lock:
+            data = self._cache.get(key, None)
+            if data is not None:
+                self._cache.move_to_end(key)
+                return data
+
+        # compute outside the lock, so that other units can be computed (or read) concurrently
+        data = self._unit_fn(key)
+
+        with self._lock:
+            self.n_computed += 1
+            if self._dtype is None:
+                self._dtype = data.dtype
+            self._cache[key] = data
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+        return data
+
+    def getSlice(self, ind):
+        size_z, size_t, size_c = self._sizes
+        z = ind % size_z
+        t = (ind // size_z) % size_t
+        c = ind // (size_z * size_t)
+
+        unit = self._get_unit(self._unit_key(z, t, c))
+
+        if self._dimensionality == 'XY':
+            return unit.reshape(self._slice_shape)
+        elif self._dimensionality == 'XYZ':
+            return unit[:, :, z]
+        else:
+            return unit[:, :, z, t]
+
+    def __getitem__(self, keys):
+        if self._dtype is None:
+            # we need the dtype to allocate the output - find it by computing the first requested plane, rather than
+            # plane 0 (which we might not otherwise need)
+            zi, ti, ci = [k.indices(n)[0] if isinstance(k, slice) else int(k) % n
+                          for k, n in zip(list(keys)[2:], self._sizes)]
+            self.getSlice(self._c_stride*ci + self._t_stride*ti + self._z_stride*zi)
+
+        return XYZTCDataSource.__getitem__(self, keys)
+
+    def getSliceShape(self):
+        return self._slice_shape
+
+    def getNumSlices(self):
+        return int(self._sizes[0] * self._sizes[1] * self._sizes[2])
+
+    def getEvents(self):
+        return []
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
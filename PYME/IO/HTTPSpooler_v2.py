@@ -97,6 +97,16 @@ class Spooler(sp.Spooler):
     def finished(self):
         # FIXME - this probably needs a bit more work.
         return self._stopping
+    
+    def status(self):
+        status = sp.Spooler.status(self)
+        
+        backend = getattr(self, '_backend', None) # NB - deleted in cleanup()
+        stats = backend.get_stats() if backend is not None else {}
+        if stats:
+            status['streaming'] = stats
+            
+        return status
         
     def getURL(self):
         #print CLUSTERID, self.seriesName
@@ -22,6 +22,7 @@ from multiprocessing import cpu_count
 
 import threading
 import logging
+from PYME import config
 logging.basicConfig(level=logging.DEBUG)
 
 try:
@@ -30,99 +31,270 @@ except ImportError:
     logging.warning('''Could not import pymecompress library - saving or loading compressed PZF will fail
     (the library is installable from david_baddely conda channel, but requires an AVX capable processor)''')
 
-NUM_COMP_THREADS = 2#cpu_count()
+#: number of threads (and chunks) used for `DATA_COMP_HUFFCODE_CHUNKS`. Change with :func:`set_num_threads`.
+NUM_COMP_THREADS = int(config.get('pzf-num-threads', 2))
 
-compPool = ThreadPool(NUM_COMP_THREADS)
+_pool = None
+_pool_lock = threading.Lock()
 
-def ChunkedHuffmanCompress(data, quantization=None):
-    num_chunks = NUM_COMP_THREADS
-    
-    chunk_size = int(np.ceil(float(len(data))/num_chunks))
-    raw_chunks = [data[j*chunk_size:(j+1)*chunk_size].data for j in range(num_chunks)]
-    
-    #compPool = ThreadPool(NUM_COMP_THREADS)
+def set_num_threads(num_threads):
+    """
+    Set the number of worker threads (and hence the number of chunks) used for chunked Huffman compression. The
+    worker pool is persistent and shared between all callers - it gets re-created on the next (de)compression if the
+    number of threads changes.
+    """
+    global NUM_COMP_THREADS, _pool
     
-    comp_chunk_d = {}
-
-    if quantization is None:
-        def _compChunk(c, j):
-            comp_chunk_d[j] = bcl.HuffmanCompress(c)
-
-        threads = [threading.Thread(target = _compChunk, args=(rc, j)) for j, rc in enumerate(raw_chunks)]
-    else:
-        def _compChunk(c, j):
-            comp_chunk_d[j] = bcl.HuffmanCompressQuant(c, *quantization)
-
-        threads = [threading.Thread(target=_compChunk, args=(rc, j)) for j, rc in enumerate(raw_chunks)]
+    with _pool_lock:
+        if int(num_threads) != NUM_COMP_THREADS:
+            NUM_COMP_THREADS = int(num_threads)
+            
+            if _pool is not None:
+                # let any tasks which are already running finish
+                _pool.close()
+                _pool = None
+
+def get_pool():
+    """ Get the persistent thread pool used for chunked (de)compression, creating it if necessary"""
+    global _pool
+    
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(NUM_COMP_THREADS)
             
-    for p in threads:
-        #print p
-        p.start()
+        return _pool
+
+def _as_writable_u1(buf):
+    """ View a buffer as a uint8 array, without copying unless we have to (the compression library needs writable
+    buffers, so read-only buffers such as `bytes` still get copied)"""
+    d = np.frombuffer(buf, 'u1')
+    if not d.flags.writeable:
+        d = d.copy()
+        
+    return d
 
-    for p in threads:
-        p.join()
+def _flat_u1_view(out):
+    """ Flat uint8 view of a caller supplied output array"""
+    if not (out.flags['C_CONTIGUOUS'] or out.flags['F_CONTIGUOUS']):
+        raise ValueError('Output array must be contiguous')
+    
+    return out.ravel(order='K').view('u1')
 
+def _chunk_parts(comp_chunks, raw_lens):
+    """ The pieces of a chunked stream (chunk count, then (compressed length, raw length, data) for each chunk), ready
+    to be joined or written into an output buffer"""
+    parts = [np.array([len(comp_chunks)], 'u2').tobytes()]
     
-    #comp_chunks = compPool.map(bcl.HuffmanCompress, raw_chunks) 
+    for c, r in zip(comp_chunks, raw_lens):
+        parts.append(np.array([c.nbytes, r], 'u4').tobytes())
+        parts.append(memoryview(c).cast('B'))
+        
+    return parts
+
+def _write_parts(out, parts):
+    """ Write a sequence of buffers contiguously into out, returning a memoryview of the written portion"""
+    out = memoryview(out).cast('B')
     
-    s = np.array([num_chunks], 'u2').tostring()
+    nbytes = sum([memoryview(p).nbytes for p in parts])
+    if nbytes > out.nbytes:
+        raise ValueError('Output buffer too small (%d bytes, need %d)' % (out.nbytes, nbytes))
     
-    for j, r in enumerate(raw_chunks):
-        c = comp_chunk_d[j]
-        s += np.array([len(c), len(r)], 'u4').tostring()
-        s += c.tostring()
+    offset = 0
+    for p in parts:
+        p = memoryview(p).cast('B')
+        out[offset:(offset + p.nbytes)] = p
+        offset += p.nbytes
         
-    return s
+    return out[:offset]
 
-def ChunkedHuffmanCompress_o(data):
+def _compress_chunks(data, quantization=None):
+    """
+    Huffman compress data in NUM_COMP_THREADS chunks on the persistent worker pool.
+    
+    Returns a list of compressed chunks, and a list of the number of bytes each chunk decompresses to.
+    """
     num_chunks = NUM_COMP_THREADS
     
-    chunk_size = int(np.ceil(float(len(data))/num_chunks))
-    raw_chunks = [data[j*chunk_size:(j+1)*chunk_size].data for j in range(num_chunks)]
+    # flatten in memory order - this is a view for both C and F contiguous data
+    d = np.asarray(data).ravel(order='K')
+    if quantization is None:
+        # compress bytes
+        d = d.view('u1')
     
-    #compPool = ThreadPool(NUM_COMP_THREADS)
+    chunk_size = int(np.ceil(float(len(d))/num_chunks))
+    raw_chunks = [d[j*chunk_size:(j+1)*chunk_size] for j in range(num_chunks)]
     
-    comp_chunks = compPool.map(bcl.HuffmanCompress, raw_chunks) 
+    if quantization is None:
+        comp_chunks = get_pool().map(bcl.HuffmanCompress, raw_chunks)
+        raw_lens = [c.nbytes for c in raw_chunks]
+    else:
+        comp_chunks = get_pool().map(lambda c: bcl.HuffmanCompressQuant(c, *quantization), raw_chunks)
+        # quantized data decompresses to one byte per pixel
+        raw_lens = [c.size for c in raw_chunks]
     
-    s = np.array([num_chunks], 'u2').tostring()
+    return comp_chunks, raw_lens
     
-    for c, r in zip(comp_chunks, raw_chunks):
-        s += np.array([len(c), len(r)], 'u4').tostring()
-        s += c.tostring()
-        
-    return s
-
-def _chunkDecompress(args):
-    chunk, length = args
-    return bcl.HuffmanDecompress(np.fromstring(chunk, 'u1'), length)
+def ChunkedHuffmanCompress(data, quantization=None):
+    """
+    Huffman compress data in chunks, with the chunks compressed in parallel on a persistent thread pool.
     
-def ChunkedHuffmanDecompress(datastring):
-    num_chunks = np.fromstring(datastring[:2], 'u2')
+    Parameters
+    ----------
+    data : ndarray
+        the data to compress
+    quantization : tuple, optional
+        (offset, scale) to sqrt-quantize the data with before compression
     
-    #compPool = ThreadPool(NUM_COMP_THREADS)
+    Returns
+    -------
+    
+    bytes with the encoded chunks
+    """
+    return b''.join(_chunk_parts(*_compress_chunks(data, quantization)))
+
+def _read_chunk_table(datastring):
+    buf = memoryview(datastring).cast('B')
+    num_chunks = int(np.frombuffer(buf[:2], 'u2')[0])
     
     sp = 2
     
     comp_chunks = []
     for i in range(num_chunks):
-        chunk_len, raw_len = np.fromstring(datastring[sp:(sp+8)], 'u4')
+        chunk_len, raw_len = np.frombuffer(buf[sp:(sp + 8)], 'u4')
         sp += 8
-        comp_chunks.append((datastring[sp:(sp+ chunk_len)], raw_len))
+        comp_chunks.append((buf[sp:(sp + chunk_len)], int(raw_len)))
         sp += chunk_len
         
+    return comp_chunks
+    
+def ChunkedHuffmanDecompress(datastring, out=None):
+    """
+    Decompress a chunked Huffman stream (as generated by :func:`ChunkedHuffmanCompress`), decompressing the chunks in
+    parallel.
+    
+    Parameters
+    ----------
+    datastring : bytes, bytearray, or memoryview
+        the encoded chunks
+    out : ndarray, optional
+        a (contiguous) array to decompress into. Must be the same size (in bytes) as the decompressed data.
+    
+    Returns
+    -------
+    
+    the decompressed data as a uint8 array (a view into `out` if supplied)
+    """
+    comp_chunks = _read_chunk_table(datastring)
+    
+    offsets = np.cumsum([0] + [r for c, r in comp_chunks])
+    
+    if out is None:
+        out = np.empty(offsets[-1], 'u1')
+    else:
+        out = _flat_u1_view(out)
+        if not out.nbytes == offsets[-1]:
+            raise ValueError('Output array size (%d bytes) does not match decompressed size (%d bytes)' % (out.nbytes, offsets[-1]))
+    
+    def _decompress_chunk(j):
+        chunk, raw_len = comp_chunks[j]
+        out[offsets[j]:offsets[j + 1]] = bcl.HuffmanDecompress(_as_writable_u1(chunk), raw_len)
+    
+    get_pool().map(_decompress_chunk, range(len(comp_chunks)))
+    
+    return out
+
+#: dtype of the index of band sizes at the start of a `DATA_COMP_HUFFCODE_BANDS` stream
+band_index_dtype = [('CompressedLength', 'u4'), ('RawLength', 'u4')]
+
+def _band_parts(data, band_rows, quantization=None):
+    """
+    Huffman compress (C-contiguous) data in bands of `band_rows` rows (along the first axis) so that a subset of rows
+    can later be decoded without decoding the whole frame.
+    
+    The stream consists of the number of bands and the rows per band (as u4), an index giving the compressed and raw
+    length of each band (see `band_index_dtype`), and then the compressed bands. Bands are compressed in parallel on the
+    persistent worker pool.
+    """
+    bands = [data[i:(i + band_rows)].reshape(-1) for i in range(0, data.shape[0], band_rows)]
+    
+    if quantization is None:
+        comp_bands = get_pool().map(lambda b: bcl.HuffmanCompress(b.view('u1')), bands)
+        raw_lens = [b.nbytes for b in bands]
+    else:
+        comp_bands = get_pool().map(lambda b: bcl.HuffmanCompressQuant(b, *quantization), bands)
+        # quantized data decompresses to one byte per pixel
+        raw_lens = [b.size for b in bands]
+    
+    index = np.zeros(len(bands), band_index_dtype)
+    index['CompressedLength'] = [c.nbytes for c in comp_bands]
+    index['RawLength'] = raw_lens
+    
+    return [np.array([len(bands), band_rows], 'u4').tobytes(), index.tobytes()] + comp_bands
+
+def _decompress_bands(datastring, row_start, row_stop, row_bytes, out=None):
+    """
+    Decode rows [row_start, row_stop) from a banded stream (see `_band_parts`), decompressing only those bands which
+    overlap the requested rows.
+    
+    Parameters
+    ----------
+    datastring : bytes, bytearray, or memoryview
+        the banded stream
+    row_start, row_stop : int
+        the rows to decode
+    row_bytes : int
+        the number of (decompressed) bytes in each row
+    out : ndarray, optional
+        a flat uint8 array to decode into
+        
+    Returns
+    -------
     
-    decomp_chunks = compPool.map(_chunkDecompress, comp_chunks) 
+    the decompressed rows as a flat uint8 array (`out` if supplied)
+    """
+    buf = memoryview(datastring).cast('B')
+    num_bands, band_rows = [int(v) for v in np.frombuffer(buf[:8], 'u4')]
+    index = np.frombuffer(buf[8:(8 + 8*num_bands)], band_index_dtype)
+    offsets = 8 + 8*num_bands + np.cumsum([0] + list(index['CompressedLength']))
+    
+    nbytes = max(row_stop - row_start, 0)*row_bytes
+    if nbytes == 0:
+        return np.zeros(0, 'u1') if out is None else out
+    
+    b0 = row_start // band_rows
+    b1 = min(-(-row_stop // band_rows), num_bands)
+    raw_offsets = np.cumsum([0] + list(index['RawLength'][b0:b1]))
+    start = (row_start - b0*band_rows)*row_bytes
+    
+    if (out is not None) and (start == 0) and (raw_offsets[-1] == nbytes):
+        # requested rows are aligned with bands - decompress straight into the output
+        tmp = out
+    else:
+        tmp = np.empty(raw_offsets[-1], 'u1')
+        
+    def _decompress_band(j):
+        b = b0 + j
+        tmp[raw_offsets[j]:raw_offsets[j + 1]] = bcl.HuffmanDecompress(_as_writable_u1(buf[offsets[b]:offsets[b + 1]]),
+                                                                       int(index['RawLength'][b]))
     
-    data = np.hstack(decomp_chunks)
+    get_pool().map(_decompress_band, range(b1 - b0))
     
-    #print data.shape #, comp_chunks
-    return data
+    if tmp is out:
+        return out
+    elif out is None:
+        return tmp[start:(start + nbytes)]
+    else:
+        out[:] = tmp[start:(start + nbytes)]
+        return out
 
 #except ImportError:
 #    pass
 
 FILE_FORMAT_ID = b'BD'
 FORMAT_VERSION = 3
+#: version used for frames with banded compression (same header as v3). Only written if banded compression is
+#: requested, so that other frames can still be read by older readers.
+FORMAT_VERSION_BANDS = 4
 
 DATA_FMT_UINT8 = 0
 DATA_FMT_UINT16 = 1
@@ -134,6 +306,7 @@ DATA_FMTS_SIZES = [1,2,4]
 DATA_COMP_RAW = 0
 DATA_COMP_HUFFCODE = 1
 DATA_COMP_HUFFCODE_CHUNKS = 2
+DATA_COMP_HUFFCODE_BANDS = 3
 
 DATA_QUANT_NONE = 0
 DATA_QUANT_SQRT = 1
@@ -185,7 +358,7 @@ HEADER_LENGTH = np.zeros(1, header_dtype).nbytes
 
 HEADER_LENGTH_V3 = np.zeros(1, header_dtype_v3).nbytes
 
-def dumps(data, sequenceID=0, frameNum=0, frameTimestamp=0, compression = DATA_COMP_RAW, quantization=DATA_QUANT_NONE, quantizationOffset=0, quantizationScale=1):
+def dumps(data, sequenceID=0, frameNum=0, frameTimestamp=0, compression = DATA_COMP_RAW, quantization=DATA_QUANT_NONE, quantizationOffset=0, quantizationScale=1, out=None, band_rows=64):
     """Dump an image frame (supplied as a numpy array) into a string in PZF format.
     
     Parameters
@@ -207,10 +380,14 @@ def dumps(data, sequenceID=0, frameNum=0, frameTimestamp=0, compression = DATA_C
     
     compression:  int (enum)
             compression method to use - one of: `PZFFormat.DATA_COMP_RAW`,
-            `PZFFormat.DATA_COMP_HUFFCODE`, or `PZFFormat.DATA_COMP_HUFFCODE_CHUNKS`
+            `PZFFormat.DATA_COMP_HUFFCODE`, `PZFFormat.DATA_COMP_HUFFCODE_CHUNKS`,
+            or `PZFFormat.DATA_COMP_HUFFCODE_BANDS`.
             Where raw stores the data with no compression, huffcode uses
             Huffman coding, and huffcode chunks breaks the data into chunks
-            first, with each chunk meing encodes by a separate thread.
+            first, with each chunk meing encodes by a separate thread. Huffcode
+            bands compresses bands of `band_rows` rows separately and records an
+            index of the bands so that :func:`loads` can decode a subset of rows
+            without decoding the whole frame (written as format version 4).
                   
     quantization: int (enum)
             Whether or not the data is quantized before saving.
@@ -219,6 +396,18 @@ def dumps(data, sequenceID=0, frameNum=0, frameTimestamp=0, compression = DATA_C
             compression:
                   
             .. math:: data_{quant} =  \\frac{\\sqrt{data - quantizationOffset}}{quantizationScale}
+    
+    out: bytearray or writable memoryview, optional
+            A pre-allocated buffer to write the encoded frame into. Re-using a buffer avoids allocating a new output
+            string for every frame when spooling. Raises a ValueError if the buffer is too small.
+    
+    band_rows: int
+            The number of rows (along the first axis) in each band when using `DATA_COMP_HUFFCODE_BANDS`.
+            
+    Returns
+    =======
+    
+    bytes, or a memoryview of the written portion of `out` if supplied (only valid until `out` is next re-used).
     """
     
     header = np.zeros(1, header_dtype_v3)
@@ -271,43 +460,69 @@ def dumps(data, sequenceID=0, frameNum=0, frameTimestamp=0, compression = DATA_C
         header['DataCompression'] = DATA_COMP_HUFFCODE
 
         if quantization:
-            dataString = bcl.HuffmanCompressQuant(d1, quantizationOffset, quantizationScale).tostring()
+            parts = [bcl.HuffmanCompressQuant(d1, quantizationOffset, quantizationScale)]
         else:
-            d2 = bcl.HuffmanCompress(d1)
-            dataString = d2.tostring()
+            parts = [bcl.HuffmanCompress(d1)]
     elif compression == DATA_COMP_HUFFCODE_CHUNKS:
         header['DataCompression'] = DATA_COMP_HUFFCODE_CHUNKS
         
-        dataString = ChunkedHuffmanCompress(d1)
-    else:
-        #print('saving raw')
-        #print(header['DimOrder'][0])
-        dataString = d1.tostring(order=header['DimOrder'][0])
+        if quantization:
+            parts = _chunk_parts(*_compress_chunks(d1, (quantizationOffset, quantizationScale)))
+        else:
+            parts = _chunk_parts(*_compress_chunks(d1))
+    elif compression == DATA_COMP_HUFFCODE_BANDS:
+        header['Version'] = FORMAT_VERSION_BANDS
+        header['DataCompression'] = DATA_COMP_HUFFCODE_BANDS
         
-    return header.tostring() + dataString
+        # bands are along the first axis, so need C order
+        header['DimOrder'] = 'C'
+        d1 = np.ascontiguousarray(d1)
+        
+        if quantization:
+            parts = _band_parts(d1, int(band_rows), (quantizationOffset, quantizationScale))
+        else:
+            parts = _band_parts(d1, int(band_rows))
+    else:
+        # raw data - d1 is contiguous, so flattening in memory order is a view and gives the same byte order as
+        # d1.tostring(order=header['DimOrder'][0])
+        parts = [d1.ravel(order='K').view('u1')]
+    
+    parts = [header.tobytes()] + [memoryview(p).cast('B') for p in parts]
+    
+    if out is None:
+        return b''.join(parts)
+    else:
+        return _write_parts(out, parts)
  
 
 def load_header(datastring):
     if (_ord(datastring[2]) >= 3):
-        return np.fromstring(datastring[:HEADER_LENGTH_V3], header_dtype_v3)
+        return np.frombuffer(datastring[:HEADER_LENGTH_V3], header_dtype_v3).copy()
     else:
-        return np.fromstring(datastring[:HEADER_LENGTH], header_dtype)
+        return np.frombuffer(datastring[:HEADER_LENGTH], header_dtype).copy()
 
    
-def loads(datastring):
+def loads(datastring, out=None, rows=None):
     """
     Loads image data from a string in PZF format.
     
     Parameters
     ----------
-    datastring : string / bytes
-        The encoded data
+    datastring : string / bytes / bytearray / memoryview
+        The encoded data. Passing a writable buffer (e.g. a bytearray) avoids a copy of the compressed data.
+    out : ndarray, optional
+        A pre-allocated, contiguous, array to decode into (e.g. a slot in a frame buffer). Must have the same dtype
+        and number of elements as the decoded data.
+    rows : tuple, optional
+        A (start, stop) range of rows (along the first axis) to decode. Only the bands covering these rows are
+        decompressed for frames saved with `DATA_COMP_HUFFCODE_BANDS`, and only the relevant bytes are copied for raw
+        (C-ordered) frames. Other frames are decoded in full and then cropped.
     
     Returns
     -------
     
     data : ndarray
-        The image data as a numpy array
+        The image data as a numpy array (a view into `out` if supplied)
         
     header : recarray
         The image header, as a numpy record array with the :const:`header_dtype` dtype.
@@ -319,47 +534,93 @@ def loads(datastring):
         raise RuntimeError("Invalid format: This doesn't appear to be a PZF file")
 
     if header['Version'] >= 2:
-        dimOrder = header['DimOrder'][0]
+        dimOrder = header['DimOrder'][0].decode()
     else:
         dimOrder = 'C'
         
     #print(dimOrder)
         
-    w, h, d = header['Width'][0], header['Height'][0], header['Depth'][0]
+    w, h, d = int(header['Width'][0]), int(header['Height'][0]), int(header['Depth'][0])
+    dtype = DATA_FMTS[int(header['DataFormat'][0])]
+    compression = int(header['DataCompression'][0])
+    quantized = (header['DataQuantization'][0] == DATA_QUANT_SQRT)
 
-    if header['DataQuantization'] == DATA_QUANT_SQRT:
+    if quantized:
         #quantized data is always 8 bit
-        outsize = w * h * d
+        row_bytes = h*d
     else:
-        outsize = w*h*d*DATA_FMTS_SIZES[int(header['DataFormat'])]
-    
+        row_bytes = h*d*DATA_FMTS_SIZES[int(header['DataFormat'][0])]
+        
+    outsize = w*row_bytes
     
     if header['Version'] < 3:
         data_offset = HEADER_LENGTH
     else:
-        data_offset = int(header['DataOffset'])
+        data_offset = int(header['DataOffset'][0])
+        
+    data_s = memoryview(datastring).cast('B')[data_offset:]
+    
+    if rows is None:
+        r0, r1 = 0, w
+    else:
+        r0, r1 = slice(*rows).indices(w)[:2]
+        r1 = max(r0, r1)
+    
+    n_rows = r1 - r0
+    
+    # can we decode just the rows we need?
+    direct = (compression == DATA_COMP_HUFFCODE_BANDS) or (n_rows == w) or (compression == DATA_COMP_RAW and dimOrder == 'C')
+    
+    if out is not None:
+        if not (out.dtype == dtype and out.size == n_rows*h*d):
+            raise ValueError('Output array (%s, %d elements) does not match data (%s, %d elements)' % (out.dtype, out.size, dtype, n_rows*h*d))
         
-    data_s = datastring[data_offset:]
+        out_u1 = _flat_u1_view(out)
+    else:
+        out_u1 = None
+        
+    if out_u1 is None:
+        decomp_out = None
+    elif quantized or (not direct) or (not out.flags[dimOrder + '_CONTIGUOUS']):
+        # quantized or cropped data (or an output array in the wrong memory order) needs to go through a temporary
+        # buffer
+        decomp_out = None
+    else:
+        decomp_out = out_u1
 
     #logging.debug('About to decompress')
     #logging.debug({k:header[0][k] for k in header.dtype.names})
 
     #logging.debug('Compressed size: %s' % len(data_s))
     
-    if header['DataCompression'] == DATA_COMP_RAW:
+    if compression == DATA_COMP_RAW:
         #no need to decompress
-        data = np.fromstring(data_s, 'u1')
-    elif header['DataCompression'] == DATA_COMP_HUFFCODE:
+        if direct:
+            data = np.frombuffer(data_s, 'u1')[(r0*row_bytes):(r1*row_bytes)]
+        else:
+            data = np.frombuffer(data_s, 'u1')[:outsize]
+            
+        if decomp_out is None:
+            data = data.copy()
+        else:
+            decomp_out[:] = data
+            data = decomp_out
+    elif compression == DATA_COMP_HUFFCODE:
         #logging.debug('Decompressing ...')
-        data = bcl.HuffmanDecompress(np.fromstring(data_s, 'u1'), outsize)
-    elif header['DataCompression'] == DATA_COMP_HUFFCODE_CHUNKS:
-        data = ChunkedHuffmanDecompress(data_s)
+        data = bcl.HuffmanDecompress(_as_writable_u1(data_s), outsize)
+        if decomp_out is not None:
+            decomp_out[:] = data
+            data = decomp_out
+    elif compression == DATA_COMP_HUFFCODE_CHUNKS:
+        data = ChunkedHuffmanDecompress(data_s, out=decomp_out)
+    elif compression == DATA_COMP_HUFFCODE_BANDS:
+        data = _decompress_bands(data_s, r0, r1, row_bytes, out=decomp_out)
     else:
         raise RuntimeError('Compression type not understood')
 
     #logging.debug('Uncompressed shape: %s, %s, (%d, %d, %d)' % (data.shape, w * h * d, w, h, d))
         
-    if header['DataQuantization'] == DATA_QUANT_SQRT:
+    if quantized:
         #un-quantize data
         #logging.debug('Dequantizing')
         
@@ -367,9 +628,17 @@ def loads(datastring):
 
         data = data.astype('f')*header['QuantScale']
         #print('data dtype: %s' % data.dtype)
-        data = (data*data + header['QuantOffset']).astype(DATA_FMTS[int(header['DataFormat'])])
+        data = (data*data + header['QuantOffset']).astype(dtype)
     
     #print(dimOrder, [w, h, d])
-    data = data.view(DATA_FMTS[int(header['DataFormat'])]).reshape([w,h,d], order=dimOrder)
+    if direct:
+        data = data.view(dtype).reshape([n_rows, h, d], order=dimOrder)
+    else:
+        data = data.view(dtype).reshape([w, h, d], order=dimOrder)[r0:r1]
+        
+    if (out is not None) and (decomp_out is None):
+        res = out.reshape([n_rows, h, d], order='A')
+        np.copyto(res, data)
+        data = res
     
-    return data, header
\ No newline at end of file
+    return data, header
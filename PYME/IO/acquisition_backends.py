@@ -120,6 +120,11 @@ class Backend(abc.ABC):
     
     def finished(self):
         return self._finished
+    
+    def get_stats(self):
+        """ Backend specific performance statistics (e.g. streaming throughput), as a dictionary. Over-ride in
+        derived classes if appropriate."""
+        return {}
 
 
 class MemoryBackend(Backend):
@@ -169,12 +174,15 @@ class ClusterBackend(Backend):
                 cluster_h5=False, serverfilter=clusterIO.local_serverfilter, **kwargs):
         from PYME.IO import cluster_streaming
         from PYME.IO import PZFFormat
+        from PYME import config
 
         Backend.__init__(self, dim_order, shape, spoof_timestamps=kwargs.pop('spoof_timestamps', False), cycle_time=kwargs.pop('cycle_time', None))
 
         self.series_name = series_name
         self.serverfilter = serverfilter
         self._cluster_h5 = cluster_h5
+        
+        use_async = config.get('cluster-streaming-async', False)
 
         if cluster_h5:
             # we need to send all frames to the one server
@@ -183,7 +191,8 @@ class ClusterBackend(Backend):
                 return server_n
 
             distribution_fcn = dist_fcn_1_server
-        elif distribution_fcn is None:
+        elif (distribution_fcn is None) and not use_async:
+            # NB - the async streamer sends to the least loaded server if no distribution function is given
             distribution_fcn = distfcn_random
 
         
@@ -197,7 +206,10 @@ class ClusterBackend(Backend):
             frame_data, im_num = data # packed together as a tuple
             return PZFFormat.dumps(frame_data, sequenceID=self.sequence_id, frameNum = im_num, **self._check_comp_settings(compression_settings))
 
-        self._streamer = cluster_streaming.Streamer(serverfilter=serverfilter, filter=_pzfify, distribution_fcn=distribution_fcn)
+        if use_async:
+            self._streamer = cluster_streaming.AsyncStreamer(serverfilter=serverfilter, filter=_pzfify, distribution_fcn=distribution_fcn)
+        else:
+            self._streamer = cluster_streaming.Streamer(serverfilter=serverfilter, filter=_pzfify, distribution_fcn=distribution_fcn)
         
     @classmethod
     def _check_comp_settings(cls, compression_settings):
@@ -230,6 +242,13 @@ class ClusterBackend(Backend):
         '''Get URL for the series to pass to other processes so they can open it'''
         return 'PYME-CLUSTER://%s/%s' % (self.serverfilter, self.series_name)
     
+    def get_stats(self):
+        """ Streaming statistics (queue depth, throughput, latency) if using the async streamer"""
+        if hasattr(self._streamer, 'get_stats'):
+            return self._streamer.get_stats()
+        
+        return {}
+    
     def store_frame(self, n, frame_data):
         fn = '/'.join([self._series_location, 'frame%05d.pzf' % n])
 
@@ -36,6 +36,7 @@ And finally some functions to facilitate efficient (and data local) operations
     | :func:`get_local_path` which returns a local path if a file is local
     | :func:`locate_file` which returns a list of http urls where the given file can be found
     | :func:`put_files` which implements a streamed, high performance, put of multiple files
+    | :func:`get_files` which gets multiple files with a single request to each server
     
 There are are also higher level functions in :mod:`PYME.IO.unifiedIO`  which allows files to be accessed in a consistent
 way given either a cluster URI or a local path and :mod:`PYME.IO.clusterResults` which helps with saving tabular data to
@@ -86,6 +87,8 @@ import six
 import socket
 import requests
 import time
+import json
+import struct
 import numpy as np
 import threading
 from PYME.IO import unifiedIO
@@ -148,11 +151,12 @@ logging.getLogger("urllib3").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 from .cluster_directory import _LimitedSizeDict, get_ns, DirectoryInfoManager
+from .lru_cache import LRUByteCache
 
 #_locateCache = _LimitedSizeDict(size_limit=500)
 #_dirCache = _LimitedSizeDict(size_limit=100)
 #DIR_CACHE_TIME = 1
-_fileCache = _LimitedSizeDict(size_limit=100)
+_fileCache = LRUByteCache(max_bytes=config.get('clusterIO-file-cache-size', 100e6))
 _dir_managers = {}
 
 def get_dir_manager(serverfilter=local_serverfilter):
@@ -539,13 +543,134 @@ def get_file(filename, serverfilter=local_serverfilter, numRetries=3, use_file_c
 
     content = r.content
 
-    if len(content) < 1000000:
-        #cache small files
-        _fileCache[(filename, serverfilter)] = content
+    # cache (NB - files which are larger than the cache budget will not be cached)
+    _fileCache[(filename, serverfilter)] = content
 
     return content
 
 
+def _parse_batch_response(content, n_files):
+    """ Parse the response from a dataserver __batch_get request (see HTTPDataServer._batch_get)"""
+    content = memoryview(content)
+    files = []
+    sp = 0
+    for i in range(n_files):
+        size = struct.unpack('<q', content[sp:(sp + 8)])[0]
+        sp += 8
+        if size < 0:
+            files.append(None)
+        else:
+            files.append(bytes(content[sp:(sp + size)]))
+            sp += size
+            
+    return files
+
+def _get_files_from_server(server_url, filenames, timeout=5):
+    """
+    Get multiple files from a single dataserver in one request
+    
+    Returns
+    -------
+    
+    a list of file contents (or None for files which weren't found), or None if the server doesn't support batched
+    gets.
+    """
+    url = server_url + '__batch_get'
+    s = _getSession(url)
+    t = time.time()
+    r = s.post(url, data=json.dumps(filenames), timeout=timeout)
+    dt = time.time() - t
+    if dt > 1:
+        logger.warning('get_files(%d files from %s) took > 1s (%3.2fs)' % (len(filenames), server_url, dt))
+    
+    try:
+        if r.status_code in [404, 405, 501]:
+            # an older server without batch support
+            return None
+        elif not r.status_code == 200:
+            msg = 'Batch request to %s failed with error: %d' % (url, r.status_code)
+            logger.error(msg)
+            raise RuntimeError(msg)
+        
+        return _parse_batch_response(r.content, len(filenames))
+    finally:
+        r.close()
+
+def get_files(filenames, serverfilter=local_serverfilter, numRetries=3, use_file_cache=True, local_short_circuit=True, timeout=5):
+    """
+    Get multiple files from the cluster, fetching all the files which are held on a given dataserver in a single
+    request. This is much faster than repeated calls to :func:`get_file` when, e.g., reading a block of frames.
+    
+    Parameters
+    ----------
+    filenames : list of strings
+        filenames relative to cluster root
+    serverfilter, numRetries, use_file_cache, local_short_circuit, timeout :
+        see :func:`get_file`
+    
+    Returns
+    -------
+    
+    list of file contents (as bytes), in the same order as filenames
+    """
+    results = [None]*len(filenames)
+    by_server = {}
+    
+    for i, filename in enumerate(filenames):
+        if use_file_cache:
+            try:
+                results[i] = _fileCache[(filename, serverfilter)]
+                continue
+            except KeyError:
+                pass
+            
+        localpath = get_local_path(filename, serverfilter) if local_short_circuit else None
+        if localpath:
+            with open(localpath, 'rb') as f:
+                results[i] = f.read()
+            continue
+            
+        locs = locate_file(filename, serverfilter, return_first_hit=True)
+        if len(locs) == 0:
+            # let get_file handle retries / raising an error
+            results[i] = get_file(filename, serverfilter, numRetries=numRetries, use_file_cache=use_file_cache,
+                                  local_short_circuit=local_short_circuit, timeout=timeout)
+            continue
+        
+        url = urlparse(_chooseLocation(locs))
+        server_url = '%s://%s/' % (url.scheme, url.netloc)
+        by_server.setdefault(server_url, []).append((i, url.path.lstrip('/')))
+        
+    for server_url, files in by_server.items():
+        idxs, paths = zip(*files)
+        
+        nTries = 0
+        while True:
+            try:
+                nTries += 1
+                contents = _get_files_from_server(server_url, list(paths), timeout=timeout)
+                break
+            except (requests.Timeout, requests.ConnectionError):
+                logger.exception('Timeout on batch get from %s' % server_url)
+                if nTries >= numRetries:
+                    raise
+        
+        if contents is None:
+            contents = [None]*len(paths)
+            
+        for i, content in zip(idxs, contents):
+            filename = filenames[i]
+            if content is None:
+                # fall back to an individual get (will raise an IOError if the file really doesn't exist)
+                content = get_file(filename, serverfilter, numRetries=numRetries, use_file_cache=False,
+                                   local_short_circuit=local_short_circuit, timeout=timeout)
+            
+            _fileCache[(filename, serverfilter)] = content
+            results[i] = content
+            
+    return results
+
+
 _last_access_time = {}
 _lastwritespeed = {}
 #_diskfreespace = {}
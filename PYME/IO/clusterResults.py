@@ -2,6 +2,8 @@ from . import clusterIO
 from . import image
 #from . import PZFFormat
 from . import MetaDataHandler
+from . import columnar
+from PYME import config
 import requests
 import numpy as np
 #import cStringIO
@@ -63,6 +65,31 @@ def fileFormattedResults(URI, data, mimetype=None, compression=True):
     else:
         raise RuntimeError('Unknown protocol %s' % URI.split(':')[0])
 
+def finaliseResults(URI):
+    """
+    Tell the dataserver that we have finished filing results to an .h5r file. Any results which the server has accepted
+    but not yet written (see PYME.cluster.h5r_aggregator) are written and synced to disk before this returns.
+
+    Parameters
+    ----------
+    URI : str
+        the URI of the results file, e.g. pyme-cluster://<serverfilter>/__aggregate_h5r/path/to/file.h5r
+    """
+    if not '__aggregate_h5r' in URI:
+        # results are not aggregated, nothing to do
+        return
+
+    ext = '.h5r' if '.h5r' in URI else '.hdf'
+    URI = URI.split(ext)[0] + ext + '/__finalise'
+    
+    if URI.startswith('PYME-CLUSTER') or URI.startswith('pyme-cluster'):
+        clusterfilter = URI.split('://')[1].split('/')[0]
+        sequenceName = URI.split('://%s/' % clusterfilter)[1]
+        URI = pickResultsServer(sequenceName, clusterfilter)
+    
+    fileFormattedResults(URI, b'', compression=False)
+
+
 _loc_cache = {}
 def pickResultsServer(filename, serverfilter=clusterIO.local_serverfilter):
     #logging.debug('pickResultsServer - input: ' + filename)
@@ -148,6 +175,15 @@ def format_results(data_raw, URI=''):
             df = pd.DataFrame(data_raw)
             data = df.to_json().encode()
     
+    elif URI.endswith(columnar.EXTENSION):
+        output_format = columnar.MIME_TYPE
+        data_raw = np.asarray(data_raw)
+        if data_raw.dtype.names is None and data_raw.size == 0:
+            # e.g. an empty list returned for a table which does not (yet) exist
+            data_raw = np.zeros(0, dtype=np.dtype([]))
+            
+        data = columnar.dumps(data_raw, compression=columnar.CODEC_ZLIB)
+    
     elif URI.endswith('.pzf'):
         raise RuntimeError('PZF format needs parameters, pack data yourself and call fileFormattedResults')
     
@@ -162,6 +198,12 @@ def format_results(data_raw, URI=''):
         np.save(data, np.array(data_raw))
         data = data.getvalue()
     
+    elif isinstance(data_raw, np.ndarray) and (data_raw.dtype.names is not None) and (not data_raw.dtype.hasobject) and \
+            (config.get('clusterResults-wire-format', 'columnar') == 'columnar'):
+        # record arrays (e.g. fit results) - use our columnar format, which is fast to decode and safe to load. NB - we
+        # don't compress here as fileFormattedResults gzips the whole request.
+        data = columnar.dumps(data_raw)
+    
     elif isinstance(data_raw, np.ndarray):
         #very reluctantly use pickle to serialize numpy arrays rather than the better .npy format as reading .npy is really slow.
         data = data_raw.dumps()
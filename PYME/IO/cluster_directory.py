@@ -16,6 +16,7 @@ import sys
 import numpy as np
 
 from PYME import config
+from PYME.IO.lru_cache import LRUByteCache
 
 from multiprocessing.pool import ThreadPool
 
@@ -89,8 +90,8 @@ class _LimitedSizeDict(OrderedDict):
 
 class DirectoryInfoManager(object):
     def __init__(self, ns=None, serverfilter=''):
-        self._dirCache = _LimitedSizeDict(size_limit=100)
-        self._locateCache = _LimitedSizeDict(size_limit=500)
+        self._dirCache = LRUByteCache(max_bytes=config.get('clusterIO-dir-cache-size', 10e6))
+        self._locateCache = LRUByteCache(max_bytes=config.get('clusterIO-locate-cache-size', 1e6))
         
         if not ns:
             self._ns = get_ns()
@@ -3,6 +3,11 @@ import socket
 import queue
 import threading
 import logging
+import asyncio
+import collections
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 QUEUE_MAX_SIZE = 200 # ~10k frames
@@ -211,6 +216,417 @@ class Streamer(object):
             s.close()
 
 
+class StreamStats(object):
+    """
+    Throughput and latency counters for a stream. Updated from the streaming event loop, and safe to read (with
+    :meth:`as_dict`) from other threads.
+    """
+    def __init__(self, window=1000):
+        self.queued = 0 # files waiting to be sent
+        self.in_flight = 0 # files sent, but not yet acknowledged
+        self.bytes_sent = 0
+        self.n_acked = 0
+        self.n_errors = 0
+        
+        # exponentially weighted moving average of the ack latency (None until we have seen an ack)
+        self.latency_ewma = None
+        
+        self._latencies = collections.deque(maxlen=window)
+        self._acks = collections.deque(maxlen=window) # (ack time, n bytes) for throughput calculation
+        
+    def record_ack(self, nbytes, latency):
+        self.in_flight -= 1
+        self.n_acked += 1
+        self._latencies.append(latency)
+        self._acks.append((time.time(), nbytes))
+        
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = 0.9*self.latency_ewma + 0.1*latency
+            
+    def bytes_per_s(self):
+        acks = list(self._acks)
+        if len(acks) < 2:
+            return 0.0
+        
+        dt = max(time.time() - acks[0][0], 1e-3)
+        return sum([nb for t, nb in acks[1:]])/dt
+        
+    def as_dict(self):
+        latencies = np.array(list(self._latencies))
+        
+        return {'queue_depth': self.queued,
+                'in_flight': self.in_flight,
+                'bytes_sent': self.bytes_sent,
+                'n_acked': self.n_acked,
+                'n_errors': self.n_errors,
+                'bytes_per_s': self.bytes_per_s(),
+                'mean_latency_s': float(latencies.mean()) if len(latencies) else 0.0,
+                'p99_latency_s': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+                }
+    
+    
+async def _read_response(reader):
+    """ asyncio version of clusterIO._parse_response"""
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by server')
+        
+        status_line = line.split(None, 2)
+        status = int(status_line[1])
+        reason = status_line[2].strip() if len(status_line) > 2 else b''
+        
+        headers = {}
+        while True:
+            line = (await reader.readline()).strip()
+            if not line:
+                break
+            
+            key, value = line.split(b':', 1)
+            headers[key.strip().lower()] = value.strip()
+            
+        # skip any 100 continue responses
+        if status != 100:
+            break
+            
+    length = int(headers.get(b'content-length', 0))
+    if length > 0:
+        data = await reader.readexactly(length)
+    else:
+        data = b''
+        
+    return status, reason, data
+    
+
+class _AsyncServerStream(object):
+    """
+    Pipelined PUTs to a single server, with at most `max_in_flight` un-acknowledged requests. Must be created and used
+    from within the :class:`AsyncStreamer` event loop.
+    """
+    def __init__(self, server_address, server_port, max_in_flight, filter=None, executor=None, on_done=None,
+                 on_failed=None):
+        if not isinstance(server_address, str):
+            server_address = socket.inet_ntoa(server_address)
+            
+        self.server_address = server_address
+        self.server_port = server_port
+        
+        self._filter = filter
+        self._executor = executor
+        self._on_done = on_done # called (in the event loop) once each file has been acknowledged
+        # called (in the event loop) as on_failed(stream, filename, data, pinned, reason, retry) if a file could not be
+        # sent. `retry` is True if the connection failed (and the file could be sent to another server).
+        self._on_failed = on_failed
+        
+        self.stats = StreamStats()
+        self.alive = False
+        self.max_in_flight = max_in_flight
+        
+        self._queue = asyncio.Queue()
+        self._sent = asyncio.Queue()
+        self._window = asyncio.Semaphore(max_in_flight)
+        
+    @property
+    def name(self):
+        return '%s:%d' % (self.server_address, self.server_port)
+    
+    def load(self):
+        """ Estimated time for this server to get through the files it has been given"""
+        return (self.stats.queued + self.stats.in_flight + 1)*(self.stats.latency_ewma or 1e-3)
+    
+    def has_capacity(self):
+        return (self.stats.queued + self.stats.in_flight) < self.max_in_flight
+        
+    async def start(self):
+        self._reader, self._writer = await asyncio.open_connection(self.server_address, self.server_port)
+        self._writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.alive = True
+        
+        self._t_send = asyncio.ensure_future(self._send_loop())
+        self._t_recv = asyncio.ensure_future(self._recv_loop())
+        
+    def put(self, filename, data, pinned=False):
+        self.stats.queued += 1
+        self._queue.put_nowait((filename, data, pinned))
+        
+    async def close(self):
+        self._queue.put_nowait((None, None, None))
+        await self._t_send
+        await self._t_recv
+        
+        self._writer.close()
+        
+    def _fail(self, filename, data, pinned, reason, retry=False):
+        self.stats.n_errors += 1
+        self._on_failed(self, filename, data, pinned, reason, retry)
+        
+    async def _send_loop(self):
+        loop = asyncio.get_event_loop()
+        
+        try:
+            while True:
+                filename, raw_data, pinned = await self._queue.get()
+                if filename is None:
+                    break
+                
+                self.stats.queued -= 1
+                
+                if not self.alive:
+                    self._fail(filename, raw_data, pinned, 'connection closed', retry=True)
+                    continue
+                    
+                connection = b'keep-alive'
+                data = raw_data
+                if data is None:
+                    # sentinel that no more data will follow - switch off keep-alive
+                    connection = b'close'
+                    data = b''
+                elif self._filter is not None:
+                    # allow us to do, e.g. compression, without blocking the event loop
+                    data = await loop.run_in_executor(self._executor, self._filter, data)
+                    
+                dl = len(data)
+                header = b'PUT /%s HTTP/1.1\r\nConnection: %s\r\nContent-Length: %d\r\n\r\n' % (
+                    filename.encode(), connection, dl)
+                
+                await self._window.acquire()
+                
+                self._writer.write(header)
+                if dl > 0:
+                    self._writer.write(data)
+                
+                self.stats.in_flight += 1
+                self.stats.bytes_sent += dl
+                # NB - keep the un-filtered data until the file is acknowledged, so it can be re-sent elsewhere
+                self._sent.put_nowait((filename, raw_data, pinned, dl, time.time()))
+                
+                try:
+                    await self._writer.drain()
+                except (ConnectionError, OSError):
+                    # the error gets reported (and the file marked as failed) when we try to read the response
+                    self.alive = False
+                
+                if connection == b'close':
+                    # server will close the connection after this one
+                    self.alive = False
+        finally:
+            self._sent.put_nowait(None)
+        
+    async def _recv_loop(self):
+        while True:
+            item = await self._sent.get()
+            if item is None:
+                break
+                
+            filename, raw_data, pinned, dl, t_sent = item
+            
+            try:
+                status, reason, msg = await _read_response(self._reader)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+                self.alive = False
+                self.stats.in_flight -= 1
+                self._window.release()
+                self._fail(filename, raw_data, pinned, e, retry=True)
+                continue
+                
+            self._window.release()
+            
+            if not status == 200:
+                self.stats.in_flight -= 1
+                self._fail(filename, raw_data, pinned, 'Response %d - %s, msg: %s' % (status, reason, msg))
+            else:
+                self.stats.record_ack(dl, time.time() - t_sent)
+                self._on_done()
+                
+                
+class AsyncStreamer(object):
+    """
+    Drop-in alternative to :class:`Streamer` which uses asyncio (in a background thread) to pipeline many PUTs over a
+    single persistent connection to each server.
+    
+    - Each server has a bounded window of un-acknowledged PUTs (`max_in_flight`)
+    - The total number of files which are queued or in flight is bounded by `queue_size`. Once this is reached, `put()`
+      blocks until the servers catch up (back-pressure), rather than letting the queues grow without bound.
+    - Unless a distribution function is provided, files are held in a shared queue and only handed to a server once it
+      has space in its window, choosing the least loaded server (as estimated from the number of files it has
+      outstanding and its measured ack latency). A slow dataserver therefore gets fewer files.
+    - If the connection to a server fails, the files which were queued for, or in flight to, that server are re-sent
+      to the remaining servers (unless they were assigned to that server by the distribution function). Files which
+      cannot be sent anywhere (or which the server refused) are logged, and reported by raising an ``IOError`` from
+      the next call to `put()` or from `close()`.
+    - Throughput, queue depth and latency counters are available through :meth:`get_stats`.
+    """
+    def __init__(self, serverfilter=clusterIO.local_serverfilter, servers=None, distribution_fcn=None, filter=None,
+                 max_in_flight=32, queue_size=QUEUE_MAX_SIZE):
+        """
+        Parameters
+        ----------
+
+        serverfilter : string
+                The cluster identifier (when multiple clusters on one network)
+        servers : list
+                A manual list of (address, port) tuples. Usage is not recommended
+        distribution_fcn : callable
+                a function which assigns files to servers (see :class:`Streamer`). If None, files are sent to the least
+                loaded server.
+        filter: callable
+                a function which performs some operation on the data before it's saved. Typically format conversion
+                and/or compression. Run on a thread pool, with up to one thread per server.
+        max_in_flight : int
+                the maximum number of un-acknowledged PUTs for each server
+        queue_size : int
+                the maximum number of files which may be queued or in flight (across all servers) before `put()`
+                blocks.
+        """
+        if servers is None:
+            # FIXME - avoid private _ns usage
+            self.servers = [(socket.inet_ntoa(v.address), v.port) for k, v in clusterIO.get_dir_manager(serverfilter)._ns.get_advertised_services()]
+        else:
+            self.servers = servers
+            
+        assert len(self.servers) > 0, "No servers found for distribution. Make sure that cluster servers are running and can be reached from this device."
+        
+        self._n_servers = len(self.servers)
+        self._distribution_fcn = distribution_fcn
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._unrouted = collections.deque() # files waiting for a server (only accessed from the event loop)
+        self._failed = [] # (filename, reason) for files which could not be sent
+        self._failed_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(self._n_servers)
+        
+        self._loop = asyncio.new_event_loop()
+        self._t_loop = threading.Thread(target=self._loop.run_forever)
+        self._t_loop.daemon = True
+        self._t_loop.start()
+        
+        self._streams = asyncio.run_coroutine_threadsafe(self._start(filter, max_in_flight), self._loop).result(30)
+        
+    async def _start(self, filter, max_in_flight):
+        streams = [_AsyncServerStream(address, port, max_in_flight, filter=filter, executor=self._executor,
+                                      on_done=self._on_done, on_failed=self._on_failed)
+                   for address, port in self.servers]
+        
+        for s in streams:
+            await s.start()
+            
+        return streams
+    
+    def _on_done(self):
+        self._slots.release()
+        self._route()
+        
+    def _on_failed(self, stream, filename, data, pinned, reason, retry):
+        if retry and (not pinned) and any([s.alive for s in self._streams]):
+            logger.warning('Error spooling %s to %s: %s, re-sending to another server' % (filename, stream.name,
+                                                                                         reason))
+            # NB - keeps its slot, as it is still outstanding
+            self._unrouted.appendleft((filename, data))
+            self._route()
+            return
+        
+        logger.error('Error spooling %s to %s: %s' % (filename, stream.name, reason))
+        with self._failed_lock:
+            self._failed.append((filename, '%s: %s' % (stream.name, reason)))
+            
+        self._on_done()
+        
+    def _raise_failed(self):
+        with self._failed_lock:
+            failed, self._failed = self._failed, []
+            
+        if len(failed) > 0:
+            raise IOError('Failed to spool %d file(s), first failure: %s (%s)' % (len(failed), failed[0][0],
+                                                                                   failed[0][1]))
+        
+    def _route(self):
+        """ Hand files from the shared queue to the least loaded servers which have space in their windows"""
+        while len(self._unrouted) > 0:
+            streams = [s for s in self._streams if s.alive]
+            if len(streams) == 0:
+                # everything is dead - pass files to a stream to be failed, rather than blocking forever
+                streams = self._streams
+            else:
+                streams = [s for s in streams if s.has_capacity()]
+                
+            if len(streams) == 0:
+                return
+            
+            stream = min(streams, key=lambda s: s.load())
+            stream.put(*self._unrouted.popleft())
+    
+    def _dispatch(self, idx, filename, data):
+        if idx is None:
+            self._unrouted.append((filename, data))
+            self._route()
+        else:
+            self._streams[idx].put(filename, data, pinned=True)
+    
+    def put(self, filename, data, **kwargs):
+        """ Put, choosing a stream using the distribution function (or the least loaded server if we don't have one).
+        Blocks if the queue is full.
+
+        kwargs are used as arguments for the server distribution function.
+        """
+        if self._distribution_fcn is None:
+            idx = None
+        else:
+            idx = self._distribution_fcn(n_servers=self._n_servers, **kwargs)
+            
+        self.put_stream(idx, filename, data)
+        
+    def put_stream(self, idx, filename, data):
+        """ Put to a specific stream (or the least loaded if idx is None). Blocks if the queue is full.
+        
+        Raises an IOError if any files have failed to send since the last call.
+        """
+        self._raise_failed()
+        self._slots.acquire()
+        self._loop.call_soon_threadsafe(self._dispatch, idx, filename, data)
+        
+    def get_stats(self):
+        """
+        Get streaming statistics
+        
+        Returns
+        -------
+        
+        dict of totals across all servers ('queue_depth', 'in_flight', 'bytes_sent', 'n_acked', 'n_errors',
+        'bytes_per_s', 'mean_latency_s', and 'p99_latency_s'), with per-server stats under 'servers'.
+        """
+        per_server = {s.name: s.stats.as_dict() for s in self._streams}
+        latencies = np.array(sum([list(s.stats._latencies) for s in self._streams], []))
+        
+        stats = {k: sum([st[k] for st in per_server.values()]) for k in ['queue_depth', 'in_flight', 'bytes_sent',
+                                                                         'n_acked', 'n_errors', 'bytes_per_s']}
+        stats['queue_depth'] += len(self._unrouted)
+        stats['mean_latency_s'] = float(latencies.mean()) if len(latencies) else 0.0
+        stats['p99_latency_s'] = float(np.percentile(latencies, 99)) if len(latencies) else 0.0
+        stats['servers'] = per_server
+        
+        return stats
+    
+    async def _close(self):
+        while len(self._unrouted) > 0:
+            # wait for the shared queue to drain
+            await asyncio.sleep(0.01)
+            
+        for s in self._streams:
+            await s.close()
+        
+    def close(self):
+        """ Wait for everything to be sent and acknowledged, and then shut down. Raises an IOError if any files could
+        not be sent."""
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._t_loop.join()
+        self._loop.close()
+        self._executor.shutdown()
+        
+        self._raise_failed()
+
+
 def n_cluster_servers(serverfilter):
     """ Convenience function for hard-coding distribution functions in, e.g. the clusterh5  case"""
     return len(clusterIO.get_dir_manager(serverfilter).dataservers)
\ No newline at end of file
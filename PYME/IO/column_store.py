@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+A column-oriented on-disk store for localisation tables, used by the pipeline as a working cache of ``.h5r`` files.
+
+A store is a directory (with the extension ``.pyrcd``) containing one ``.npy`` file per column, and an ``index.json``
+describing the columns (plus the metadata and acquisition events, if any). Columns are memory mapped on first access
+(see :class:`PYME.IO.tabular.ColumnStoreSource`), so opening a store only reads the index, and only the columns which
+are actually used are ever read from disk - compared to reading the whole record table out of an ``.h5r`` file (and
+then extracting each field from the record array) this is much faster and lighter on memory for large data sets.
+
+Unlike :mod:`PYME.IO.columnar` (which is a compact single-buffer format for sending results over the network) a store
+is uncompressed and written once - to change a store, write a new one.
+
+Stores are written with :func:`write` (or :meth:`PYME.IO.tabular.TabularBase.to_column_store`), and converted from
+``.h5r`` files, in a single chunked pass over the table, with :func:`from_h5r`. :func:`cached_h5r` manages a cache
+directory of converted ``.h5r`` files (``pipeline-column-cache-dir`` config option).
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import logging
+
+import numpy as np
+
+from PYME import config
+
+logger = logging.getLogger(__name__)
+
+#: extension used for column store directories
+EXTENSION = '.pyrcd'
+
+FORMAT_VERSION = 1
+
+INDEX_FILE = 'index.json'
+EVENTS_FILE = '_events.npy'
+
+
+def _column_filename(i, key):
+    # use the column name for the file if it is safe to do so (makes stores easier to poke at by hand)
+    if re.match(r'^[A-Za-z0-9][A-Za-z0-9_\-]*$', key):
+        return key + '.npy'
+
+    return 'col%04d.npy' % i
+
+
+def _commit(tmp_path, path, index):
+    with open(os.path.join(tmp_path, INDEX_FILE), 'w') as f:
+        json.dump(index, f)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+
+def _mdh_json(mdh):
+    if mdh is None:
+        return None
+
+    return mdh.to_JSON()
+
+
+def write(path, columns, metadata=None, events=None):
+    """
+    Write a column store
+
+    Parameters
+    ----------
+    path : str
+        directory to write the store to (replaced if it already exists)
+    columns : dict-like
+        the columns to write - anything with ``keys()`` and ``__getitem__`` (e.g. a dict or a tabular data source).
+        Object columns are skipped.
+    metadata : PYME.IO.MetaDataHandler.MDHandlerBase, optional
+    events : np.ndarray, optional
+        acquisition events (as stored in the ``Events`` table of ``.h5r`` files)
+    """
+    tmp_path = path + '.%d.tmp' % os.getpid()
+    os.makedirs(tmp_path, exist_ok=True)
+    try:
+        index = {'version': FORMAT_VERSION, 'n_rows': None, 'columns': {}, 'mdh': _mdh_json(metadata)}
+        for i, k in enumerate(columns.keys()):
+            v = np.asarray(columns[k])
+            if v.dtype.hasobject:
+                logger.debug('Not storing object column %s' % k)
+                continue
+
+            if index['n_rows'] is None:
+                index['n_rows'] = len(v)
+            elif len(v) != index['n_rows']:
+                raise ValueError('Column %s has length %d, expected %d' % (k, len(v), index['n_rows']))
+
+            fn = _column_filename(i, k)
+            np.save(os.path.join(tmp_path, fn), np.ascontiguousarray(v))
+            index['columns'][k] = fn
+
+        if index['n_rows'] is None:
+            index['n_rows'] = 0
+
+        if events is not None:
+            np.save(os.path.join(tmp_path, EVENTS_FILE), np.asarray(events))
+            index['events'] = EVENTS_FILE
+
+        _commit(tmp_path, path, index)
+    except:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def _field(rec, path):
+    for name in path.split('/'):
+        rec = rec[name]
+
+    return rec
+
+
+def from_h5r(h5r_filename, path, tablename='FitResults', sort_key='tIndex', chunk_size_mb=64):
+    """
+    Convert a table in an ``.h5r`` file to a column store.
+
+    The table is read once, a chunk of rows (about `chunk_size_mb` in size) at a time, and the fields of each chunk are
+    written into the (memory mapped) column files, so that the whole table is never in memory at once. Nested columns
+    are flattened using the same names as :class:`PYME.IO.tabular.H5RSource` (e.g. ``fitResults_x0``), and rows are
+    sorted by `sort_key` (if present) as they are by :class:`H5RSource` - one column at a time, and only if the table
+    is not already sorted. The file metadata and acquisition events are stored alongside the columns.
+    """
+    from PYME.IO import MetaDataHandler, h5rFile
+
+    # NB - go through h5rFile so that we re-use the file handle if the file is already open (e.g. being written to)
+    with h5rFile.openH5R(h5r_filename, 'r') as f:
+        h5f = f._h5file
+        table = getattr(h5f.root, tablename)
+
+        mdh = None
+        if 'MetaData' in h5f.root:
+            mdh = MetaDataHandler.NestedClassMDHandler(MetaDataHandler.HDFMDHandler(h5f))
+
+        events = None
+        if ('Events' in h5f.root) and (mdh is not None) and ('StartTime' in mdh.keys()):
+            events = h5f.root.Events[:]
+
+        paths = list(table.colpathnames)
+        keys = [p.replace('/', '_') for p in paths]
+        n_rows = int(table.nrows)
+
+        tmp_path = path + '.%d.tmp' % os.getpid()
+        os.makedirs(tmp_path, exist_ok=True)
+        try:
+            index = {'version': FORMAT_VERSION, 'n_rows': n_rows, 'columns': {}, 'mdh': _mdh_json(mdh),
+                     'source': os.path.abspath(h5r_filename), 'table': tablename}
+            
+            columns = {}
+            for i, (p, k) in enumerate(zip(paths, keys)):
+                fn = _column_filename(i, k)
+                index['columns'][k] = fn
+                dt = _field(table.dtype, p)
+                if n_rows == 0:
+                    # can't memory map an empty file
+                    np.save(os.path.join(tmp_path, fn), np.empty((0,) + dt.shape, dt.base))
+                else:
+                    columns[p] = np.lib.format.open_memmap(os.path.join(tmp_path, fn), 'w+', dt.base,
+                                                           (n_rows,) + dt.shape)
+
+            chunk_rows = max(int(chunk_size_mb*1024*1024//max(table.dtype.itemsize, 1)), 1)
+            for start in range(0, n_rows, chunk_rows):
+                stop = min(start + chunk_rows, n_rows)
+                rec = table.read(start, stop)
+                for p in columns:
+                    columns[p][start:stop] = _field(rec, p)
+            
+            if (sort_key in keys) and (n_rows > 0):
+                t = columns[paths[keys.index(sort_key)]]
+                if np.any(t[1:] < t[:-1]):
+                    order = np.argsort(t, kind='stable')
+                    for p in columns:
+                        columns[p][:] = columns[p][order]
+                del t
+            
+            # flush and close the memory maps before the store is moved into place
+            for p in list(columns.keys()):
+                columns.pop(p).flush()
+
+            if events is not None:
+                np.save(os.path.join(tmp_path, EVENTS_FILE), events)
+                index['events'] = EVENTS_FILE
+
+            _commit(tmp_path, path, index)
+        except:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+
+def _cache_dir():
+    return config.get('pipeline-column-cache-dir', os.path.join(config.user_config_dir, 'column_cache'))
+
+
+def _evict(cache_dir, max_size):
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(EXTENSION):
+            continue
+        d = os.path.join(cache_dir, name)
+        try:
+            size = sum([os.path.getsize(os.path.join(d, fn)) for fn in os.listdir(d)])
+            entries.append((os.path.getmtime(d), size, d))
+        except OSError:
+            pass
+
+    entries.sort()
+    total = sum([e[1] for e in entries])
+    # never remove the most recent entry (which is the one we have just made)
+    for mtime, size, d in entries[:-1]:
+        if total <= max_size:
+            break
+        shutil.rmtree(d, ignore_errors=True)
+        total -= size
+
+
+def cached_h5r(h5r_filename, tablename='FitResults', cache_dir=None):
+    """
+    Get (converting if necessary) a column store of a table in an ``.h5r`` file from the column cache.
+
+    Entries are keyed on the file path, size, and modification time, so a file which is modified (e.g. analysis which
+    was still running when it was last opened) is converted again. The cache is limited to
+    ``pipeline-column-cache-size-mb`` (10 GB by default), removing the least recently used entries first.
+
+    Returns
+    -------
+    path : str
+        the path of the column store
+    """
+    if cache_dir is None:
+        cache_dir = _cache_dir()
+
+    st = os.stat(h5r_filename)
+    desc = json.dumps([os.path.abspath(h5r_filename), st.st_size, st.st_mtime, tablename])
+    path = os.path.join(cache_dir, hashlib.sha1(desc.encode()).hexdigest() + EXTENSION)
+
+    if os.path.exists(os.path.join(path, INDEX_FILE)):
+        try:
+            # mark as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    logger.info('Converting %s to column store %s' % (h5r_filename, path))
+    from_h5r(h5r_filename, path, tablename)
+
+    _evict(cache_dir, config.get('pipeline-column-cache-size-mb', 10240)*1024*1024)
+    return path
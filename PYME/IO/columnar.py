@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Defines a compact, self-describing, columnar 'wire' format for transmitting numpy record arrays (e.g. localisation
+results) between cluster workers and dataservers.
+
+Compared to the previous approaches (pickle, `np.save`, or JSON) this
+
+- does not execute arbitrary code on load (unlike pickle) - the header is JSON and the data is raw numeric columns
+- decodes without parsing (unlike JSON). Uncompressed columns are returned as zero-copy views into the input buffer by
+  :func:`loads_columns`, and :func:`loads` does a single copy per column into a record array
+- compresses well (optional per-column zlib with byte shuffling), as values within a column tend to be similar
+
+Layout (all integers little-endian)::
+
+    magic            4 bytes   b'PYRC'
+    version          uint8
+    flags            uint8     (reserved, 0)
+    reserved         uint16
+    header length    uint32
+    number of rows   uint64
+    header           JSON, utf-8 encoded, padded with spaces to a multiple of 8 bytes
+    column data      one block per leaf column, each block starting on an 8-byte boundary
+
+The header contains the (possibly nested) record dtype, and for each leaf column its path (list of field names), dtype,
+sub-array shape, codec, and the offset and length of its data block relative to the start of the column data.
+
+Most users will just want the :func:`dumps` and :func:`loads` functions.
+"""
+import json
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'PYRC'
+FORMAT_VERSION = 1
+
+#: MIME type to use for the columnar format in HTTP responses
+MIME_TYPE = 'application/x-pyme-columnar'
+
+#: file extension / URI suffix used to request the columnar format (e.g. .../FitResults.pyrc?from=0)
+EXTENSION = '.pyrc'
+
+CODEC_NONE = 'none'
+CODEC_ZLIB = 'zlib' # byte-shuffled, then zlib compressed
+
+_preamble = struct.Struct('<4sBBHIQ')
+
+
+def is_columnar(data):
+    """Test whether a buffer contains data in the columnar format (checks the magic number)"""
+    return bytes(data[:4]) == MAGIC
+
+
+def _dtype_to_json(dtype):
+    if dtype.names is not None:
+        return {'names': list(dtype.names),
+                'formats': [_dtype_to_json(dtype.fields[n][0]) for n in dtype.names],
+                'offsets': [dtype.fields[n][1] for n in dtype.names],
+                'itemsize': dtype.itemsize}
+    elif dtype.subdtype is not None:
+        base, shape = dtype.subdtype
+        return {'base': _dtype_to_json(base), 'shape': list(shape)}
+    elif dtype.hasobject:
+        raise TypeError('object dtypes cannot be serialized')
+    else:
+        return dtype.str
+
+
+def _dtype_from_json(desc):
+    if isinstance(desc, dict):
+        if 'names' in desc:
+            return np.dtype({'names': desc['names'],
+                             'formats': [_dtype_from_json(f) for f in desc['formats']],
+                             'offsets': desc['offsets'],
+                             'itemsize': desc['itemsize']})
+        else:
+            return np.dtype((_dtype_from_json(desc['base']), tuple(desc['shape'])))
+    else:
+        dt = np.dtype(str(desc))
+        if dt.hasobject:
+            raise TypeError('object dtypes are not supported')
+        return dt
+
+
+def _leaf_columns(data, path=()):
+    """Iterate over (path, array) for the leaf fields of a (nested) record array"""
+    if data.dtype.names is None:
+        yield path, data
+    else:
+        for n in data.dtype.names:
+            for c in _leaf_columns(data[n], path + (n,)):
+                yield c
+
+
+def _shuffle(a):
+    """byte-shuffle (group bytes of equal significance together) to improve compression"""
+    b = np.ascontiguousarray(a).view('u1').reshape(-1, a.dtype.itemsize)
+    return np.ascontiguousarray(b.T)
+
+
+def _unshuffle(buf, dtype, n_items):
+    b = np.frombuffer(buf, 'u1').reshape(dtype.itemsize, n_items)
+    return np.ascontiguousarray(b.T).view(dtype).ravel()
+
+
+def _pad(n):
+    return (-n) % 8
+
+
+def dumps(data, compression=None, level=1):
+    """
+    Serialize a record array to the columnar wire format
+
+    Parameters
+    ----------
+    data : np.ndarray
+        a (1D) structured / record array. Nested fields and sub-arrays are supported, object fields are not.
+    compression : str or None
+        None (default) for no compression, or 'zlib' to zlib compress (byte shuffled) columns.
+    level : int
+        zlib compression level
+
+    Returns
+    -------
+    bytes
+    """
+    data = np.atleast_1d(np.asarray(data))
+    if data.dtype.names is None:
+        raise TypeError('Expecting a structured / record array')
+
+    data = data.ravel()
+    n_rows = len(data)
+
+    columns = []
+    blocks = []
+    offset = 0
+    for path, col in _leaf_columns(data):
+        base = col.dtype.base if col.dtype.subdtype is None else col.dtype.subdtype[0]
+        col = np.ascontiguousarray(col)
+        if compression == CODEC_ZLIB:
+            block = zlib.compress(_shuffle(col.reshape(-1)), level)
+            codec = CODEC_ZLIB
+        elif compression is None or compression == CODEC_NONE:
+            block = memoryview(col.reshape(-1).view('u1'))
+            codec = CODEC_NONE
+        else:
+            raise ValueError('Unknown compression: %s' % compression)
+
+        columns.append({'path': list(path), 'dtype': base.str, 'shape': list(col.shape[1:]), 'codec': codec,
+                        'offset': offset, 'nbytes': len(block)})
+
+        blocks.append(block)
+        pad = _pad(len(block))
+        if pad:
+            blocks.append(b'\0'*pad)
+        offset += len(block) + pad
+
+    header = json.dumps({'dtype': _dtype_to_json(data.dtype), 'columns': columns}).encode('utf-8')
+    header += b' '*_pad(len(header))
+
+    return b''.join([_preamble.pack(MAGIC, FORMAT_VERSION, 0, 0, len(header), n_rows), header] + blocks)
+
+
+def loads_header(data):
+    """
+    Parse the header of a columnar buffer.
+
+    Returns
+    -------
+    header : dict
+        with keys 'dtype' (the record dtype), 'n_rows', 'columns' and 'data_offset' (start of the column data)
+    """
+    data = memoryview(data)
+    magic, version, flags, _, header_len, n_rows = _preamble.unpack(data[:_preamble.size])
+
+    if magic != MAGIC:
+        raise ValueError('Not a columnar record buffer')
+
+    if version > FORMAT_VERSION:
+        raise ValueError('Columnar format version %d is not supported (max supported version is %d)' % (version, FORMAT_VERSION))
+
+    header = json.loads(bytes(data[_preamble.size:(_preamble.size + header_len)]).decode('utf-8'))
+    header['dtype'] = _dtype_from_json(header['dtype'])
+    header['n_rows'] = n_rows
+    header['data_offset'] = _preamble.size + header_len
+
+    return header
+
+
+def _decode_column(data, header, col):
+    dtype = np.dtype(col['dtype'])
+    n_items = header['n_rows']*int(np.prod(col['shape']))
+    start = header['data_offset'] + col['offset']
+    block = data[start:(start + col['nbytes'])]
+
+    if col['codec'] == CODEC_NONE:
+        a = np.frombuffer(block, dtype, count=n_items)
+    elif col['codec'] == CODEC_ZLIB:
+        a = _unshuffle(zlib.decompress(block), dtype, n_items)
+    else:
+        raise ValueError('Unknown codec: %s' % col['codec'])
+
+    return a.reshape([header['n_rows'], ] + col['shape'])
+
+
+def loads_columns(data):
+    """
+    Decode a columnar buffer into a dictionary of column arrays without assembling a record array.
+
+    Uncompressed columns are zero-copy (read-only) views into `data`. Nested field names are joined with '_' (as in
+    :func:`PYME.IO.tabular.unnest_dtype`), so that the result can be passed directly to, e.g., `tabular.DictSource`.
+
+    Returns
+    -------
+    columns : dict
+        flattened column name -> array
+    """
+    data = memoryview(data)
+    header = loads_header(data)
+
+    return {'_'.join(c['path']): _decode_column(data, header, c) for c in header['columns']}
+
+
+def loads(data):
+    """
+    Decode a columnar buffer into a record array
+
+    Parameters
+    ----------
+    data : bytes (or other buffer)
+
+    Returns
+    -------
+    np.ndarray
+        structured array with the same dtype as was passed to :func:`dumps`
+    """
+    data = memoryview(data)
+    header = loads_header(data)
+
+    out = np.zeros(header['n_rows'], dtype=header['dtype'])
+    for c in header['columns']:
+        v = out
+        for n in c['path']:
+            v = v[n]
+        v[...] = _decode_column(data, header, c)
+
+    return out
@@ -69,6 +69,10 @@ class ListWrapper(BaseDataSource):
         return self.wrapList[0].is_complete()
     
     def __getattr__(self, name):
+        if name == 'wrapList':
+            # not set yet (e.g. when unpickling) - don't recurse
+            raise AttributeError(name)
+        
         return getattr(self.wrapList[0], name)
 
     def __getitem__(self, keys):
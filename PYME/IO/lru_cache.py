@@ -0,0 +1,202 @@
+"""
+A thread-safe, size-bounded LRU cache where the size limit is expressed in bytes rather than in number of entries.
+
+Used for caching file contents and directory listings in `clusterIO`, `cluster_directory` and the dataserver. A limit
+on the number of entries is a poor proxy for memory use when entry sizes vary by orders of magnitude (e.g. small
+metadata files and directory listings vs. multi-MB PZF frames), and FIFO eviction throws away hot entries just because
+they were inserted early. This cache tracks the (approximate) size of each entry, evicts the least recently used
+entries once the byte budget is exceeded, and keeps hit / miss statistics so that the budget can be tuned.
+
+Individual keys can be pinned (e.g. metadata which is accessed for every frame of a series) to exempt them from
+eviction.
+"""
+import sys
+import threading
+from collections import OrderedDict
+
+
+def sizeof(value):
+    """
+    Estimate the memory footprint (in bytes) of a cached value.
+
+    Exact for bytes, strings and numpy arrays. Tuples, lists and dicts (e.g. parsed directory listings) are estimated
+    by summing their contents.
+    """
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+
+    nbytes = getattr(value, 'nbytes', None) # numpy arrays, memoryviews
+    if nbytes is not None:
+        return int(nbytes)
+
+    if isinstance(value, (tuple, list)):
+        return 8*len(value) + sum([sizeof(v) for v in value])
+
+    if isinstance(value, dict):
+        return 16*len(value) + sum([sizeof(k) + sizeof(v) for k, v in value.items()])
+
+    return sys.getsizeof(value)
+
+
+class LRUByteCache(object):
+    """
+    A dictionary-like LRU cache with a byte budget.
+
+    Parameters
+    ----------
+    max_bytes : int
+        the budget for the total size of all cached values. Values larger than this are not cached at all.
+    size_fcn : callable, optional
+        function used to calculate the size of a value, defaults to :func:`sizeof`.
+
+    Notes
+    -----
+    Reading an entry (``cache[key]`` or ``cache.get(key)``) marks it as most recently used and updates the hit / miss
+    counters. ``key in cache`` does neither. Pinned entries count towards the budget but are never evicted - if the
+    pinned entries alone exceed the budget, the cache will be over budget until they are unpinned.
+    """
+    def __init__(self, max_bytes, size_fcn=sizeof):
+        self.max_bytes = int(max_bytes)
+        self._size_fcn = size_fcn
+
+        self._data = OrderedDict() # key -> (value, size)
+        self._pins = {} # key -> pin count
+        self._nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.RLock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                value, size = self._data[key]
+            except KeyError:
+                self.misses += 1
+                raise
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        size = self._size_fcn(value)
+
+        with self._lock:
+            self._remove(key)
+
+            if (size > self.max_bytes) and not key in self._pins:
+                # too big to cache (NB - we still remove any previous value for this key above)
+                return
+
+            self._data[key] = (value, size)
+            self._nbytes += size
+            self._evict()
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self._data:
+                raise KeyError(key)
+            self._remove(key)
+
+    def pop(self, key, *args):
+        with self._lock:
+            try:
+                value, size = self._data[key]
+            except KeyError:
+                if args:
+                    return args[0]
+                raise
+
+            self._remove(key)
+            return value
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def clear(self):
+        """Remove all (including pinned) entries. Pins are kept, so that keys stay pinned if re-inserted."""
+        with self._lock:
+            self._data.clear()
+            self._nbytes = 0
+
+    @property
+    def nbytes(self):
+        """Total size of the cached values (in bytes)"""
+        return self._nbytes
+
+    def pin(self, key):
+        """
+        Exempt a key from eviction. Pins are reference counted, and a key can be pinned before a value is inserted.
+        """
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+
+    def unpin(self, key):
+        """Release a pin obtained with :meth:`pin`, making the entry eligible for eviction once no pins remain."""
+        with self._lock:
+            n = self._pins[key] - 1
+            if n > 0:
+                self._pins[key] = n
+            else:
+                self._pins.pop(key)
+                self._evict()
+
+    def stats(self):
+        """Return a dictionary of cache statistics"""
+        with self._lock:
+            n_requests = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': float(self.hits)/n_requests if n_requests else 0.0,
+                    'evictions': self.evictions,
+                    'n_entries': len(self._data),
+                    'n_pinned': len(self._pins),
+                    'nbytes': self._nbytes,
+                    'max_bytes': self.max_bytes,
+                    }
+
+    def _remove(self, key):
+        try:
+            value, size = self._data.pop(key)
+            self._nbytes -= size
+        except KeyError:
+            pass
+
+    def _evict(self):
+        if self._nbytes <= self.max_bytes:
+            return
+
+        if not self._pins:
+            # fast path
+            while self._nbytes > self.max_bytes:
+                key, (value, size) = self._data.popitem(last=False)
+                self._nbytes -= size
+                self.evictions += 1
+            return
+
+        for key in list(self._data.keys()):
+            # iterate from least to most recently used
+            if key in self._pins:
+                continue
+
+            self._remove(key)
+            self.evictions += 1
+
+            if self._nbytes <= self.max_bytes:
+                break
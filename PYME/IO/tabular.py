@@ -29,6 +29,7 @@ understand additional values, e.g. 'error_x'
 import types
 import six
 import warnings
+import os
 import numpy as np
 
 from numpy import * #to allow the use of sin cos etc in mappings
@@ -37,6 +38,8 @@ from PYME.Analysis.piecewise import * #allow piecewise linear mappings
 import tables
 import logging
 
+from PYME import config
+
 logger = logging.getLogger(__name__)
 
 #helper function for renaming classes
@@ -56,6 +59,11 @@ def deprecated_name(name):
 
 class TabularBase(object):
     _image_bounds = False
+    
+    # Changes whenever the data in the source changes. Sources which can be modified in place must increment this when
+    # they are (see FitResultsSource.setResults), filters pass on the version of the source they wrap. Used to
+    # invalidate cached columns.
+    _version = 0
 
     def toDataFrame(self, keys=None):
         warnings.warn('toDataFrame is deprecated, use to_pandas instead', DeprecationWarning)
@@ -161,6 +169,27 @@ class TabularBase(object):
             #wait until data is written
             f.flush()
 
+    def to_column_store(self, path, keys=None, metadata=None):
+        """
+        Writes data to a column store (one memory-mappable file per column, see PYME.IO.column_store)
+        
+        Parameters
+        ----------
+        
+        path: string
+            the directory to save to (conventionally with a .pyrcd extension). Replaced if it already exists.
+        keys: list [optional]
+            a list of column names to save (if keys == None, all columns are saved)
+        metadata: a MetaDataHandler instance [optional]
+            associated metadata to write to the store
+        """
+        from PYME.IO import column_store
+        
+        if keys is None:
+            keys = list(self.keys())
+        
+        column_store.write(path, {k: self[k] for k in keys}, metadata=metadata, events=getattr(self, 'events', None))
+
     def to_csv(self, outFile, keys=None):
         if outFile.endswith('.csv'):
             delim = ', '
@@ -200,6 +229,36 @@ class TabularBase(object):
                 
     def __len__(self):
         return len(self[list(self.keys())[0]])
+
+    def iter_chunks(self, keys=None, chunk_size=None):
+        """
+        Iterate over the rows of the table in chunks, for processing tables which are too large to hold in memory
+        (the pipeline's out-of-core mode).
+
+        Parameters
+        ----------
+        keys : list of str
+            the columns to return (defaults to all columns)
+        chunk_size : int
+            the (maximum) number of rows to read from the underlying data source at once. Defaults to the
+            ``tabular-chunk-size`` config option (1,000,000). Filters can return smaller (or empty) chunks.
+
+        Returns
+        -------
+        an iterator over dictionaries of column chunks, {key: values}. Concatenating the chunks gives the same result
+        as reading the whole columns.
+        """
+        if keys is None:
+            keys = list(self.keys())
+
+        if chunk_size is None:
+            chunk_size = config.get('tabular-chunk-size', 1000000)
+        chunk_size = int(chunk_size)
+
+        n = len(self)
+        for start in range(0, n, chunk_size):
+            sl = slice(start, start + chunk_size)
+            yield {k: self[k, sl] for k in keys}
     
     def __getattr__(self, item):
         try:
@@ -335,6 +394,7 @@ class FitResultsSource(TabularBase):
         
     def setResults(self, fitResults, sort=True):
         self.fitResults = fitResults
+        self._version += 1
 
         if sort:
             #sort by time
@@ -533,6 +593,66 @@ class HDFSource(H5RSource):
     def getInfo(self):
         return 'PYME hdf Data Source\n\n %d points' % self.fitResults.shape[0]
 
+class ColumnStoreSource(FitResultsSource):
+    _name = "Column Store Source"
+    
+    def __init__(self, path):
+        """
+        Data source for a column store (see PYME.IO.column_store) - e.g. an .h5r file which has been converted to the
+        pipeline column cache. Opening only reads the store index, columns are memory mapped when first accessed.
+        
+        Metadata and events in the store are available as the `mdh` and `events` attributes.
+        """
+        import json
+        from PYME.IO import column_store, MetaDataHandler
+        
+        self.path = path
+        with open(os.path.join(path, column_store.INDEX_FILE)) as f:
+            self._index = json.load(f)
+        
+        self._files = self._index['columns']
+        self._keys = list(self._files.keys())
+        self._n_rows = self._index['n_rows']
+        self._columns = {}
+        
+        self._set_transkeys()
+        
+        if self._index.get('mdh', None):
+            self.mdh = MetaDataHandler.from_json(self._index['mdh'])
+        
+        if self._index.get('events', None):
+            self.events = np.load(os.path.join(path, self._index['events']))
+    
+    def _column(self, key):
+        try:
+            return self._columns[key]
+        except KeyError:
+            # np.asarray drops the memmap subclass (so that derived arrays are plain ndarrays), but keeps the mapping
+            col = np.asarray(np.load(os.path.join(self.path, self._files[key]), mmap_mode='r'))
+            self._columns[key] = col
+            return col
+    
+    def __getitem__(self, keys):
+        key, sl = self._getKeySlice(keys)
+        
+        # if we're using an alias replace with actual key
+        key = self.transkeys.get(key, key)
+        
+        if not key in self._keys:
+            raise KeyError('Key  (%s) not found' % key)
+        
+        return self._column(key)[sl]
+    
+    def __len__(self):
+        return self._n_rows
+    
+    def getInfo(self):
+        return 'PYME Column Store Source\n\n %d points' % self._n_rows
+    
+    def close(self):
+        self._columns.clear()
+
+
 # class h5rDSource(inputFilter):
 #     _name = "h5r Drift Source"
 #     def __init__(self, h5fFile):
@@ -791,6 +911,9 @@ class DictSource(TabularBase):
         if not len(values) == len(self):
             raise ValueError('Columns are different lengths')
         
+        self._source[name] = values
+        self._version += 1
+        
     def keys(self):
         return list(self._source.keys())
     
@@ -828,6 +951,69 @@ def scalar_column_source(**kwargs):
 #############################################
 
 
+def id_lookup(values, ids):
+    """
+    Find the position of each of `values` in `ids` (a vectorised, many-values version of list.index()).
+    
+    Used for set-membership tests and label mapping on large tables (e.g. 10M localisations against 100k cluster IDs),
+    where comparing against each ID in turn is far too slow. Integer IDs spanning a modest range use a direct lookup
+    table (O(N + M)), anything else a sorted search (O((N + M) log M)).
+    
+    Parameters
+    ----------
+    values : array-like
+        the values to look up (e.g. a clumpIndex column)
+    ids : array-like
+        the IDs to look for
+    
+    Returns
+    -------
+    index : np.ndarray
+        the same shape as `values`, with the index into `ids` of the first occurrence of each value, or -1 if the value
+        is not in `ids`
+    """
+    values = np.asarray(values)
+    ids = np.asarray(ids).ravel()
+    
+    out = np.full(values.shape, -1, dtype=np.intp)
+    if (len(ids) == 0) or (values.size == 0):
+        return out
+    
+    if (ids.dtype.kind in 'iub') and (values.dtype.kind in 'iub'):
+        lo, hi = int(ids.min()), int(ids.max())
+        if (hi - lo) <= 4*(values.size + len(ids)):
+            table = np.full(hi - lo + 1, -1, dtype=np.intp)
+            # assign in reverse, so that the first occurrence of duplicate IDs wins
+            table[ids[::-1].astype(np.int64) - lo] = np.arange(len(ids) - 1, -1, -1)
+            
+            in_range = (values >= lo) & (values <= hi)
+            out[in_range] = table[values[in_range].astype(np.int64) - lo]
+            return out
+    
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    
+    pos = np.searchsorted(sorted_ids, values)
+    np.minimum(pos, len(ids) - 1, out=pos)
+    found = sorted_ids[pos] == values
+    out[found] = order[pos[found]]
+    return out
+
+
+def in_ids(values, ids):
+    """Boolean mask, True where `values` is one of `ids` (see id_lookup)"""
+    return id_lookup(values, ids) >= 0
+
+
+def _compact_index(index, n):
+    """Integer index into a source of length n, as int32 if possible (halves the memory / bandwidth of int64)"""
+    index = np.asarray(index)
+    if n < 2**31:
+        return index.astype('i4', copy=False)
+    
+    return index
+
+
 class SelectionFilter(TabularBase):
     _name = "Selection Filter"
     
@@ -838,12 +1024,65 @@ class SelectionFilter(TabularBase):
         
         self.Index = index
     
+    def _gather_index(self):
+        """
+        The source to gather columns from, and an integer index into it.
+        
+        Chains of selection filters are composed into a single index into the first non-selection source, so that
+        each column is only gathered once (rather than once per filter in the chain). The result is cached, and
+        re-computed if `Index` (or the index of an upstream filter) is replaced.
+        """
+        upstream = None
+        if isinstance(self.resultsSource, SelectionFilter):
+            upstream = self.resultsSource._gather_index()
+        
+        cached = self.__dict__.get('_gather_cache', None)
+        if (cached is not None) and (cached[0] is self.Index) and (cached[1] is self.resultsSource) and \
+                ((upstream is None) or (cached[2] is upstream[1])):
+            return cached[3], cached[4]
+        
+        index = np.asarray(self.Index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+        
+        if upstream is not None:
+            source, source_index = upstream
+            index = source_index[index]
+        else:
+            source = self.resultsSource
+        
+        index = _compact_index(index, len(source))
+        self._gather_cache = (self.Index, self.resultsSource, None if upstream is None else upstream[1], source, index)
+        return source, index
+    
     def __getitem__(self, keys):
         key, sl = self._getKeySlice(keys)
-        return self.resultsSource[key][self.Index][sl]
+        source, index = self._gather_index()
+        return source[key][index][sl]
+    
+    def __len__(self):
+        return len(self._gather_index()[1])
+
+    def iter_chunks(self, keys=None, chunk_size=None):
+        # gather each chunk directly from the source (rather than gathering whole columns and slicing them)
+        if keys is None:
+            keys = self.keys()
+
+        if chunk_size is None:
+            chunk_size = config.get('tabular-chunk-size', 1000000)
+        chunk_size = int(chunk_size)
+
+        source, index = self._gather_index()
+        for start in range(0, len(index), chunk_size):
+            idx = index[start:(start + chunk_size)]
+            yield {k: source[k, idx] for k in keys}
     
     def keys(self):
         return list(self.resultsSource.keys())
+    
+    @property
+    def _version(self):
+        return getattr(self.resultsSource, '_version', 0)
 
 @deprecated_name('resultsFilter')
 class ResultsFilter(SelectionFilter):
@@ -863,20 +1102,62 @@ class ResultsFilter(SelectionFilter):
 
         self.resultsSource = resultsSource
 
-        #by default select everything
-        #self.Index = np.ones(self.resultsSource[list(resultsSource.keys())[0]].shape[0]) >  0.5
-        self.Index = np.ones(len(self.resultsSource), dtype=bool)
-
+        source_keys = self.resultsSource.keys()
         for k in kwargs.keys():
-            if not k in self.resultsSource.keys():
+            if not k in source_keys:
                 raise KeyError('Requested key not present: ' + k)
 
-            range = kwargs[k]
-            if not len(range) == 2:
+            if not len(kwargs[k]) == 2:
                 raise RuntimeError('Expected an iterable of length 2')
 
-            self.Index *= (self.resultsSource[k] > range[0])*(self.resultsSource[k] < range[1])
-    
+        self._ranges = dict(kwargs)
+
+        # the selection mask is only calculated when it is first needed (see Index) - when the filter is only read in
+        # chunks (see iter_chunks) it is never calculated.
+        self._index = None
+        self._index_from_ranges = True
+
+    @property
+    def Index(self):
+        if self._index is None:
+            self._index = self._mask(self.resultsSource, len(self.resultsSource))
+
+        return self._index
+
+    @Index.setter
+    def Index(self, index):
+        # an explicitly set selection, which might not match our ranges
+        self._index = index
+        self._index_from_ranges = False
+
+    def _mask(self, columns, n):
+        #by default select everything
+        mask = np.ones(n, dtype=bool)
+
+        for k, range in self._ranges.items():
+            # build the mask in place (rather than by multiplication, which allocates several temporaries per key)
+            col = columns[k]
+            mask &= (col > range[0])
+            mask &= (col < range[1])
+
+        return mask
+
+    def iter_chunks(self, keys=None, chunk_size=None):
+        if not self._index_from_ranges:
+            for chunk in SelectionFilter.iter_chunks(self, keys, chunk_size):
+                yield chunk
+            return
+
+        # filter each chunk of the source as we go, without ever calculating the full mask
+        if keys is None:
+            keys = self.keys()
+
+        range_keys = [k for k in self._ranges.keys() if k not in keys]
+        for chunk in self.resultsSource.iter_chunks(list(keys) + range_keys, chunk_size):
+            n = len(next(iter(chunk.values()))) if chunk else 0
+            mask = self._mask(chunk, n)
+            yield {k: chunk[k][mask] for k in keys}
+
 
 @deprecated_name('randomSelectionFilter')
 class RandomSelectionFilter(SelectionFilter):
@@ -922,15 +1203,7 @@ class IdFilter(SelectionFilter):
         self.id_column = id_column
         self.valid_ids = valid_ids
         
-        #self.Index = np.zeros(self.resultsSource[list(resultsSource.keys())[0]].shape)
-        self.Index = np.zeros(len(self.resultsSource))
-        
-        for id in valid_ids:
-            self.Index += (self.resultsSource[id_column] == id)
-            
-            
-            
-        self.Index = self.Index > 0.5
+        self.Index = in_ids(self.resultsSource[id_column], valid_ids)
 
 
 @deprecated_name('concatenateFilter')
@@ -941,22 +1214,92 @@ class ConcatenateFilter(TabularBase):
         """Class which concatenates two (or more) tabular data sources. The data sources should have the same keys.
 
         The filter class does not have any explicit knowledge of the keys
-        supported by the underlying data source."""
+        supported by the underlying data source.
+        
+        Columns are not concatenated up front. Slices are gathered from just the sources they overlap, and full
+        columns are concatenated (and cached) when first requested. The `concatKey` column gives the index of the
+        source each row came from (as a compact integer column)."""
 
         self.source0 = source0
         #self.source1 = source1
 
         self._sources = [source0, source1, ] + list(args)
         self._concat_key = concatKey
-
+        
+        self._offsets = None
+        self._cache = {}  # key -> (source versions, concatenated column)
+    
+    @property
+    def _version(self):
+        return tuple([getattr(s, '_version', 0) for s in self._sources])
+    
+    def clear_cache(self):
+        self._cache.clear()
+        self._offsets = None
+    
+    def _get_offsets(self, version):
+        """Start of each source (and the total length) in the concatenated table"""
+        if (self._offsets is None) or (self._offsets[0] != version):
+            self._offsets = (version, np.cumsum([0] + [len(s) for s in self._sources]))
+        
+        return self._offsets[1]
+    
+    def _full_column(self, key, version):
+        entry = self._cache.get(key, None)
+        if (entry is None) or (entry[0] != version):
+            if key == self._concat_key:
+                offsets = self._get_offsets(version)
+                dtype = 'i2' if len(self._sources) < 2**15 else 'i4'
+                col = np.repeat(np.arange(len(self._sources), dtype=dtype), np.diff(offsets))
+            else:
+                col = np.concatenate([s[key] for s in self._sources])
+            
+            # we hand out views of the cached column - make sure they can't be modified in place
+            col.flags.writeable = False
+            entry = (version, col)
+            self._cache[key] = entry
+        
+        return entry[1]
+    
+    def _gather_slice(self, key, sl, version):
+        """Gather a contiguous (step 1) slice from only the sources it overlaps"""
+        offsets = self._get_offsets(version)
+        start, stop, step = sl.indices(int(offsets[-1]))
+        
+        parts = []
+        for i, s in enumerate(self._sources):
+            # NB - max and min are numpy's here (from numpy import *), hence np.clip
+            s_start, s_stop = np.clip([start, stop], offsets[i], offsets[i + 1])
+            if s_start < s_stop:
+                if key == self._concat_key:
+                    dtype = 'i2' if len(self._sources) < 2**15 else 'i4'
+                    parts.append(np.full(s_stop - s_start, i, dtype=dtype))
+                else:
+                    parts.append(s[key][(s_start - offsets[i]):(s_stop - offsets[i])])
+        
+        if len(parts) == 1:
+            return parts[0]
+        elif len(parts) == 0:
+            # empty slice - still need the right dtype and trailing dimensions
+            return self._sources[0][key][0:0] if key != self._concat_key else np.zeros(0, 'i2')
+        
+        return np.concatenate(parts)
 
     def __getitem__(self, keys):
         key, sl = self._getKeySlice(keys)
-        if key == self._concat_key:
-            return np.hstack([i* np.ones(len(s[list(s.keys())[0]])) for i, s in enumerate(self._sources)])
-            #return np.hstack((np.zeros(len(self.source0[list(self.source0.keys())[0]])), np.ones(len(self.source1[list(self.source1.keys())[0]]))))
-        else:
-            return np.hstack([s[key] for s in self._sources])[sl]
+        version = self._version
+        
+        if key in self._cache:
+            return self._full_column(key, version)[sl]
+        
+        if isinstance(sl, slice) and (sl.step in (None, 1)) and not ((sl.start is None) and (sl.stop is None)):
+            # partial read of a column we don't have - don't concatenate the whole thing
+            return self._gather_slice(key, sl, version)
+        
+        return self._full_column(key, version)[sl]
+
+    def __len__(self):
+        return int(self._get_offsets(self._version)[-1])
 
     def keys(self):
         return set(self.source0.keys()).intersection(*[s.keys() for s in self._sources]).union([self._concat_key,])
@@ -1014,6 +1357,11 @@ class CachingResultsFilter(TabularBase):
 @deprecated_name('mappingFilter')
 class MappingFilter(TabularBase):
     _name = "Mapping Filter"
+    
+    # cache evaluated mappings (whole columns). Cached columns are invalidated when the mappings / variables / columns
+    # they depend on, or the underlying data source (see TabularBase._version), change.
+    cache_mappings = True
+    
     def __init__(self, resultsSource, **kwargs):
         """Class to permit transformations (e.g. drift correction) of fit results
         - masquarades as a dictionary. Takes mappings as keyword arguments, eg:
@@ -1037,10 +1385,17 @@ class MappingFilter(TabularBase):
         self._modifies_bounds = kwargs.pop('modifies_bounds', False)
         
         self.resultsSource = resultsSource
+        
+        # evaluated mapped columns, key -> (source version, values). Entries are removed when anything they depend on
+        # changes (see _definition_changed).
+        self._cache = {}
+        self._n_changes = 0
+        self._expressions = {} # key -> (code, expression string) for mappings given as strings (used with numexpr)
+        self._numexpr_failed = set()
 
-        self.mappings = {}
-        self.new_columns = {}
-        self.variables = {}
+        self.mappings = _TrackedDict(self._definition_changed)
+        self.new_columns = _TrackedDict(self._definition_changed)
+        self.variables = _TrackedDict(self._definition_changed)
         self.hidden_columns = []
 
         for k in kwargs.keys():
@@ -1065,6 +1420,41 @@ class MappingFilter(TabularBase):
         else:
             return self.resultsSource[keys]
 
+    def __len__(self):
+        return len(self.resultsSource)
+
+    def iter_chunks(self, keys=None, chunk_size=None):
+        # read the source in chunks, and evaluate mappings chunk by chunk (re-using cached columns if we have them, but
+        # not caching whole columns)
+        if keys is None:
+            keys = self.keys()
+
+        # the source columns we need, either directly or for evaluating mappings
+        source_keys = self.resultsSource.keys()
+        needed = [k for k in keys if not ((k in self.mappings.keys()) or (k in self.new_columns.keys()))]
+        for k in keys:
+            if k in self.mappings.keys():
+                needed += sorted(self._dependencies(k))
+        needed = [k for k in dict.fromkeys(needed) if k in source_keys]
+        if len(needed) == 0:
+            # we still need something to tell us how long each chunk is
+            needed = list(source_keys)[:1]
+
+        start = 0
+        for columns in self.resultsSource.iter_chunks(needed, chunk_size):
+            sl = slice(start, start + len(columns[needed[0]]))
+            start = sl.stop
+
+            chunk = {}
+            for k in keys:
+                if k in self.mappings.keys():
+                    chunk[k] = self._get_mapped(k, sl, (), use_cache=False, columns=columns)
+                elif k in self.new_columns.keys():
+                    chunk[k] = self.new_columns[k][sl]
+                else:
+                    chunk[k] = columns[k]
+            yield chunk
+
     def keys(self):
         keys = list(dict.fromkeys(list(self.resultsSource.keys()) + list(self.mappings.keys()) + list(self.new_columns.keys())))
         for k in self.hidden_columns:
@@ -1120,40 +1510,179 @@ class MappingFilter(TabularBase):
         self.new_columns[name] = values
 
 
+    @property
+    def _version(self):
+        return (self._n_changes, getattr(self.resultsSource, '_version', 0))
+
+    def _dependencies(self, key, _deps=None):
+        """All the names (columns, variables, and other mappings) which the mapping `key` depends on, directly or
+        through other mappings"""
+        if _deps is None:
+            _deps = set()
+        
+        map = self.mappings.get(key, None)
+        if map is None:
+            return _deps
+        
+        for vname in map.co_names:
+            if vname not in _deps:
+                _deps.add(vname)
+                self._dependencies(vname, _deps)
+        
+        return _deps
+
+    def _definition_changed(self, name):
+        """Called when a mapping, variable, or new column is added, changed or removed"""
+        self._n_changes += 1
+        
+        for k in list(self._cache.keys()):
+            if (k == name) or (name in self._dependencies(k)):
+                self._cache.pop(k, None)
+
+    def clear_cache(self):
+        self._cache.clear()
+
     def setMapping(self, key, mapping):
         if type(mapping) == types.CodeType:
             self.mappings[key] = mapping
         elif isinstance(mapping, six.string_types):
-            self.mappings[key] = compile(mapping, '/tmp/test1', 'eval')
+            code = compile(mapping, '/tmp/test1', 'eval')
+            self._expressions[key] = (code, mapping)
+            self.mappings[key] = code
         else:
             warnings.warn('setMapping should not be used to add a variable/data column', DeprecationWarning)
             self.__dict__[key] = mapping
+            self._definition_changed(key)
 
     def getMappedResults(self, key, sl):
+        return self._get_mapped(key, sl, ())
+    
+    def _get_mapped(self, key, sl, stack, use_cache=True, columns=None):
+        version = getattr(self.resultsSource, '_version', 0)
+        entry = self._cache.get(key, None)
+        if (entry is not None) and ((entry[0] != version) or not self._length_matches(entry[1])):
+            entry = None
+        
+        if (entry is None) and not (self.cache_mappings and use_cache):
+            return self._evaluate(key, sl, stack, use_cache, columns)
+        
+        if entry is None:
+            # evaluate (and cache) the whole column, then slice
+            res = self._evaluate(key, slice(None), stack)
+            if isinstance(res, np.ndarray):
+                # we hand out views of the cached values - make sure they can't be modified in place
+                res.flags.writeable = False
+            entry = (version, res)
+            self._cache[key] = entry
+        
+        res = entry[1]
+        if np.ndim(res) == 0:
+            return res
+        
+        return res[sl]
+
+    def _length_matches(self, res):
+        """Check a cached column against the length of the source, in case the source was modified in place without
+        changing its version"""
+        if (np.ndim(res) == 0) or not isinstance(self.resultsSource, TabularBase):
+            return True
+        
+        return len(res) == len(self.resultsSource)
+
+    def _evaluate(self, key, sl, stack, use_cache=True, columns=None):
+        """
+        Evaluate mapping `key` for rows `sl`. `columns` is an optional dictionary of source columns, already sliced (when
+        evaluating a chunk of the source, see iter_chunks)
+        """
         map = self.mappings[key]
-
+        
         #get all the variables needed for evaluation into local namespace
-        varnames = map.co_names
-        for vname in varnames:
-            if vname in globals():
-                pass
-            if vname in self.resultsSource.keys(): #look at original results first
-                locals()[vname] = self.resultsSource[vname][sl]
+        source_keys = self.resultsSource.keys()
+        ns = {}
+        for vname in map.co_names:
+            if vname in source_keys: #look at original results first
+                if columns is not None:
+                    ns[vname] = columns[vname]
+                elif isinstance(sl, slice) and (sl == slice(None)):
+                    ns[vname] = self.resultsSource[vname]
+                else:
+                    # only read the rows we need (matters for chunked evaluation of on-disk sources)
+                    ns[vname] = self.resultsSource[vname, sl]
             elif vname in self.new_columns.keys():
-                locals()[vname] = self.new_columns[vname][sl]
+                ns[vname] = self.new_columns[vname][sl]
             elif vname in self.variables.keys():
-                locals()[vname] = self.variables[vname]
+                ns[vname] = self.variables[vname]
             elif vname in self.__dict__.keys(): #look for constants
                 #FIXME - do we still need this now we have variables
-                locals()[vname] = self.__dict__[vname]
+                ns[vname] = self.__dict__[vname]
             elif vname in self.mappings.keys(): #finally try other mappings
                 #try to prevent infinite recursion here if mappings have circular references
-                if not vname == key and not key in self.mappings[vname].co_names:
-                    locals()[vname] = self.getMappedResults(vname, sl)
-                else:
+                if (vname == key) or (vname in stack):
                     raise RuntimeError('Circular reference detected in mapping')
-
-        return eval(map)
+                
+                ns[vname] = self._get_mapped(vname, sl, stack + (key,), use_cache, columns)
+        
+        expr = self._expressions.get(key, (None, None))
+        if (expr[0] is map) and (key not in self._numexpr_failed) and config.get('tabular-mapping-numexpr', False):
+            # numexpr evaluates expressions block-wise, without any full length temporaries (matters for long tables)
+            try:
+                import numexpr
+                return numexpr.evaluate(expr[1], local_dict=ns, global_dict={})
+            except Exception:
+                # not an expression numexpr supports (e.g. uses other functions) - don't try again
+                logger.debug('Could not evaluate mapping %s with numexpr, using eval' % key)
+                self._numexpr_failed.add(key)
+
+        return eval(map, globals(), ns)
+
+
+class _TrackedDict(dict):
+    """A dict which calls `on_change(key)` when an item is added, changed or removed (used by MappingFilter to
+    invalidate cached columns when mappings, variables, or new columns change)"""
+    def __init__(self, on_change):
+        dict.__init__(self)
+        self._on_change = on_change
+    
+    def _changed(self, key):
+        # NB - use __dict__ as items are restored before attributes when unpickling
+        on_change = self.__dict__.get('_on_change', None)
+        if on_change is not None:
+            on_change(key)
+    
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._changed(key)
+    
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._changed(key)
+    
+    def pop(self, key, *args):
+        had_key = key in self
+        value = dict.pop(self, key, *args)
+        if had_key:
+            self._changed(key)
+        return value
+    
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._changed(key)
+        return key, value
+    
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+    
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+    
+    def clear(self):
+        keys = list(self.keys())
+        dict.clear(self)
+        for key in keys:
+            self._changed(key)
 
 class _ChannelFilter(TabularBase):
     def __init__(self, colour_filter, channel):
@@ -1163,6 +1692,9 @@ class _ChannelFilter(TabularBase):
     def __getitem__(self, keys):
         return self.colour_filter.get_channel_column(self.channel, keys)
     
+    def iter_chunks(self, keys=None, chunk_size=None):
+        return self.colour_filter.iter_channel_chunks(self.channel, keys, chunk_size)
+    
     def keys(self):
         return list(self.colour_filter.keys())
 
@@ -1183,30 +1715,74 @@ class ColourFilter(TabularBase):
         self.t_p_dye = 0.1
         self.t_p_other = 0.1
         self.t_p_background = .01
+        
+        # channel -> (state, mask, source to gather from, integer index into it). See _channel_index.
+        self._index_cache = {}
 
     @property
     def index(self):
         return self._index(self.currentColour)
+    
+    @property
+    def _version(self):
+        return (getattr(self.resultsSource, '_version', 0), self.currentColour, self.t_p_dye, self.t_p_other,
+                self.t_p_background)
+    
+    def clear_cache(self):
+        self._index_cache.clear()
+    
+    def _calc_index(self, channel, colChans, columns=None):
+        if columns is None:
+            columns = self.resultsSource
+        
+        p_dye = columns['p_%s' % channel]
+
+        p_other = 0 * p_dye
+        p_tot = self.t_p_background * columns['ColourNorm']
+
+        for k in colChans:
+            p_k = columns['p_%s' % k]
+            p_tot += p_k
+            if not channel == k:
+                p_other = np.maximum(p_other, p_k)
+
+        return ((p_dye / p_tot) > self.t_p_dye) & ((p_other / p_tot) < self.t_p_other)
+    
+    def _channel_index(self, channel, colChans):
+        """
+        Selection mask for a channel, together with the source and (integer) index to gather columns through.
+        
+        These are cached, and recalculated if the thresholds, the source, or the data in the source change (call
+        clear_cache() to force recalculation if the source data is changed in some other way).
+        """
+        state = (self.resultsSource, getattr(self.resultsSource, '_version', 0), self.t_p_dye, self.t_p_other,
+                 self.t_p_background, tuple(colChans))
+        
+        cached = self._index_cache.get(channel, None)
+        if (cached is not None) and (cached[0][0] is state[0]) and (cached[0][1:] == state[1:]):
+            return cached[1:]
+        
+        mask = self._calc_index(channel, colChans)
+        mask.flags.writeable = False
+        
+        index = np.flatnonzero(mask)
+        if isinstance(self.resultsSource, SelectionFilter):
+            # compose with the upstream selection so that columns are gathered once, from the original source
+            source, source_index = self.resultsSource._gather_index()
+            index = source_index[index]
+        else:
+            source = self.resultsSource
+        
+        entry = (mask, source, _compact_index(index, len(source)))
+        self._index_cache[channel] = (state,) + entry
+        return entry
         
     def _index(self, channel):
         colChans = self.getColourChans()
         if not channel in colChans:
-            return np.ones(len(self.resultsSource[list(self.resultsSource.keys())[0]]), 'bool')
+            return np.ones(len(self.resultsSource), 'bool')
         else:
-            p_dye = self.resultsSource['p_%s' % channel]
-
-            p_other = 0 * p_dye
-            p_tot = self.t_p_background * self.resultsSource['ColourNorm']
-
-            for k in colChans:
-                p_tot += self.resultsSource['p_%s' % k]
-                if not channel == k:
-                    p_other = np.maximum(p_other, self.resultsSource['p_%s' % k])
-
-            p_dye = p_dye / p_tot
-            p_other = p_other / p_tot
-
-            return (p_dye > self.t_p_dye) * (p_other < self.t_p_other)
+            return self._channel_index(channel, colChans)[0]
 
 
     def __getitem__(self, keys):
@@ -1219,15 +1795,48 @@ class ColourFilter(TabularBase):
         if not chan in colChans:
             return self.resultsSource[keys]
         else:
+            mask, source, index = self._channel_index(chan, colChans)
+            
             #chromatic shift correction
             #print self.currentColour
             if chan in self.chromaticShifts.keys() and key in self.chromaticShifts[chan].keys():
-                return self.resultsSource[key][self._index(chan)][sl] + self.chromaticShifts[chan][key]
+                return source[key][index][sl] + self.chromaticShifts[chan][key]
             else:
-                return self.resultsSource[key][self._index(chan)][sl]
+                return source[key][index][sl]
             
     def get_channel_ds(self, chan):
         return _ChannelFilter(self, chan)
+    
+    def iter_chunks(self, keys=None, chunk_size=None):
+        return self.iter_channel_chunks(self.currentColour, keys, chunk_size)
+    
+    def iter_channel_chunks(self, chan, keys=None, chunk_size=None):
+        """
+        Chunked version of get_channel_column (see TabularBase.iter_chunks). The channel selection is calculated chunk
+        by chunk, rather than for the whole table.
+        """
+        if keys is None:
+            keys = self.keys()
+        
+        colChans = self.getColourChans()
+        if not chan in colChans:
+            for chunk in self.resultsSource.iter_chunks(keys, chunk_size):
+                yield chunk
+            return
+        
+        p_keys = [k for k in ['p_%s' % c for c in colChans] + ['ColourNorm'] if k not in keys]
+        shifts = self.chromaticShifts.get(chan, {})
+        for chunk in self.resultsSource.iter_chunks(list(keys) + p_keys, chunk_size):
+            mask = self._calc_index(chan, colChans, chunk)
+            
+            out = {}
+            for k in keys:
+                if k in shifts.keys():
+                    #chromatic shift correction
+                    out[k] = chunk[k][mask] + shifts[k]
+                else:
+                    out[k] = chunk[k][mask]
+            yield out
         
 
     @classmethod
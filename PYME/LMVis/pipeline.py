@@ -300,6 +300,9 @@ class Pipeline(object):
         self.colourFilter = None
         self.events = None
         
+        # work with the data a chunk at a time, rather than holding whole columns in memory (see _use_out_of_core)
+        self.out_of_core = False
+        
         self.recipe = Recipe(execute_on_invalidation=execute_on_invalidation)
         self.recipe.recipe_executed.connect(self.Rebuild)
 
@@ -650,6 +653,10 @@ class Pipeline(object):
                 self.mapping.mappings.update(old_mapping.mappings)
             else:
                 self.mapping = tabular.MappingFilter(self.selectedDataSource)
+            
+            self.out_of_core = self._use_out_of_core(self.selectedDataSource)
+            # evaluate mappings as they are read, rather than keeping whole mapped columns
+            self.mapping.cache_mappings = not self.out_of_core
 
             #the filter, however needs to be re-generated with new keys and or data source
             self.filter = tabular.ResultsFilter(self.mapping, **self.filterKeys)
@@ -666,6 +673,25 @@ class Pipeline(object):
 
         self.ClearGenerated()
         
+    def _use_out_of_core(self, ds):
+        """
+        Whether to use out-of-core mode for a data source - i.e. whether it has more rows than the
+        ``pipeline-out-of-core-rows`` config option. In out-of-core mode the pipeline filters are read a chunk at a time
+        (see tabular.TabularBase.iter_chunks) by the renderers which support it, so that (together with the column cache
+        for .h5r files, which memory maps the data) data sets larger than memory can be rendered.
+        """
+        from PYME import config
+        
+        max_rows = config.get('pipeline-out-of-core-rows', 50000000)
+        if not max_rows:
+            return False
+        
+        try:
+            return len(ds) > max_rows
+        except Exception:
+            logger.exception('Could not get the length of the data source')
+            return False
+        
     def ClearGenerated(self):
         self.Triangles = None
         self.edb = None
@@ -683,6 +709,30 @@ class Pipeline(object):
         while len(self.filesToClose) > 0:
             self.filesToClose.pop().close()
 
+    def _fit_results_from_column_cache(self, filename):
+        """
+        Open the FitResults table of an .h5r file from the column cache (see PYME.IO.column_store), converting the file
+        if it is not already in the cache. Returns None if the cache is disabled (``pipeline-column-cache`` config
+        option) or the file could not be converted, in which case the table should be read from the .h5r directly.
+        """
+        from PYME import config
+        from PYME.IO import column_store
+        
+        if not config.get('pipeline-column-cache', False):
+            return None
+        
+        try:
+            ds = tabular.ColumnStoreSource(column_store.cached_h5r(filename, 'FitResults'))
+        except Exception:
+            logger.exception('Could not use column cache for %s, reading directly' % filename)
+            return None
+        
+        if len(ds) == 0:
+            # match H5RSource, which refuses empty tables
+            return None
+        
+        return ds
+
     def _ds_from_file(self, filename, **kwargs):
         """
         loads a data set from a file
@@ -720,7 +770,17 @@ class Pipeline(object):
                 h5f = tables.open_file(filename)
                 self.filesToClose.append(h5f)
 
-                h5r_tables = self.recipe._get_tables_from_hdf5(filename, h5f=h5f)
+                column_ds = None
+                if filename == _original_filename:
+                    # a local file (rather than a temporary copy of a cluster file) - use the column cache
+                    column_ds = self._fit_results_from_column_cache(filename)
+                
+                if column_ds is not None:
+                    h5r_tables = {'FitResults': column_ds}
+                    if 'DriftResults' in h5f.root:
+                        h5r_tables['DriftResults'] = tabular.H5RDSource(h5f)
+                else:
+                    h5r_tables = self.recipe._get_tables_from_hdf5(filename, h5f=h5f)
 
                 try:
                     driftDS = h5r_tables['DriftResults']
@@ -238,6 +238,46 @@ class CurrentRenderer:
 class ColourRenderer(CurrentRenderer):
     """Base class for all other renderers which know about the colour filter"""
     
+    @property
+    def _out_of_core(self):
+        """Render a chunk of points at a time (the pipeline's out-of-core mode, for data sets which don't fit in
+        memory)"""
+        return getattr(self.pipeline, 'out_of_core', False)
+    
+    def _sum_chunks(self, rend, keys, mdh):
+        """
+        Render the colour filter output a chunk at a time (see tabular.TabularBase.iter_chunks), summing the chunk
+        images. Only suitable for renderings which are additive.
+
+        Parameters
+        ----------
+        rend : callable
+            ``rend(chunk)`` renders a chunk (a dictionary of columns)
+        keys : list
+            the columns `rend` needs
+        mdh : MetaDataHandler
+            the rendering metadata. The number of events rendered is added to Rendering.NEventsRendered.
+        """
+        im = None
+        n_events = 0
+        for chunk in self.colourFilter.iter_chunks(keys):
+            n = len(chunk[keys[0]])
+            if (n == 0) and (im is not None):
+                continue
+
+            n_events += n
+            if im is None:
+                im = rend(chunk)
+            else:
+                im += rend(chunk)
+
+        if im is None:
+            # no chunks at all - render an empty one to get an image of the right shape
+            im = rend({k: np.zeros(0) for k in keys})
+
+        mdh['Rendering.NEventsRendered'] = mdh.getOrDefault('Rendering.NEventsRendered', 0) + n_events
+        return im
+    
     def Generate(self, settings):
         mdh = MetaDataHandler.NestedClassMDHandler()
         copy_sample_metadata(self.pipeline.mdh, mdh)
@@ -245,7 +285,11 @@ class ColourRenderer(CurrentRenderer):
         if 'imageID' in self.pipeline.mdh.getEntryNames():
             mdh['Rendering.SourceImageID'] = self.pipeline.mdh['imageID']
         mdh['Rendering.SourceFilename'] = getattr(self.pipeline, 'filename', '')
-        mdh['Rendering.NEventsRendered'] = len(self.pipeline[self.pipeline.keys()[0]]) # in future good to use colourfilter for per channel info?
+        if self._out_of_core:
+            # counted as we render (summed over the rendered channels), rather than reading a whole column here
+            mdh['Rendering.NEventsRendered'] = 0
+        else:
+            mdh['Rendering.NEventsRendered'] = len(self.pipeline[self.pipeline.keys()[0]]) # in future good to use colourfilter for per channel info?
         mdh.Source = MetaDataHandler.NestedClassMDHandler(self.pipeline.mdh)
 
         for cb in renderMetadataProviders:
@@ -339,6 +383,10 @@ class HistogramRenderer(ColourRenderer):
     mode = 'histogram'
 
     def genIm(self, settings, imb, mdh):
+        if self._out_of_core:
+            return self._sum_chunks(lambda c: visHelpers.rendHist(c['x'], c['y'], imb, settings['pixelSize']),
+                                    ['x', 'y'], mdh)
+
         return visHelpers.rendHist(self.colourFilter['x'],self.colourFilter['y'], imb, settings['pixelSize'])
 
 class Histogram3DRenderer(HistogramRenderer):
@@ -349,6 +397,10 @@ class Histogram3DRenderer(HistogramRenderer):
 
     def genIm(self, settings, imb, mdh):
         mdh['Origin.z'] = settings['zBounds'][0]
+        if self._out_of_core:
+            return self._sum_chunks(lambda c: visHelpers.rendHist3D(c['x'], c['y'], c['z'], imb, settings['pixelSize'],
+                                                                    settings['zSliceThickness']), ['x', 'y', 'z'], mdh)
+
         return visHelpers.rendHist3D(self.colourFilter['x'],self.colourFilter['y'], self.colourFilter['z'], imb, settings['pixelSize'], settings['zSliceThickness'])
         
 class DensityFitRenderer(HistogramRenderer):
@@ -381,9 +433,36 @@ class GaussianRenderer(ColourRenderer):
         mdh['Rendering.JitterVariable'] = jitParamName
         mdh['Rendering.JitterScale'] = jitScale
 
+        if self._out_of_core:
+            if (jitParamName == '1.0') or (jitParamName in self.colourFilter.keys()):
+                return self._gen_im_out_of_core(jitParamName, jitScale, imb, pixelSize, mdh)
+            
+            # neighbour distances etc. need all the points at once
+            logger.warning('Jitter variable %s cannot be calculated out-of-core, rendering in memory' % jitParamName)
+            mdh['Rendering.NEventsRendered'] += len(self.colourFilter['x'])
+
         jitVals = self._genJitVals(jitParamName, jitScale)
 
         return visHelpers.rendGauss(self.colourFilter['x'],self.colourFilter['y'], jitVals, imb, pixelSize)
+    
+    def _gen_im_out_of_core(self, jitParamName, jitScale, imb, pixelSize, mdh):
+        if jitParamName == '1.0':
+            keys = ['x', 'y']
+            jit_vals = lambda c: jitScale*np.ones(len(c['x']))
+        else:
+            keys = ['x', 'y', jitParamName]
+            jit_vals = lambda c: jitScale*c[jitParamName]
+        
+        # rendGauss chooses the ROI size from the median jitter - this needs to be the same for all chunks, so base it
+        # on the first (non-empty) chunk.
+        roiSize = 3
+        for chunk in self.colourFilter.iter_chunks(keys):
+            if len(chunk['x']) > 0:
+                roiSize = int(3*np.median(np.maximum(jit_vals(chunk), pixelSize))/pixelSize)
+                break
+        
+        return self._sum_chunks(lambda c: visHelpers.rendGauss(c['x'], c['y'], jit_vals(c), imb, pixelSize,
+                                                               roiSize=roiSize), keys, mdh)
         
 class LHoodRenderer(ColourRenderer):
     """Log-likelihood of object"""
@@ -536,6 +615,9 @@ class QuadTreeRenderer(ColourRenderer):
         pixelSize = settings['pixelSize']
         leaf_size = settings.get('qtLeafSize', 10) #default to 10 record leaf size
 
+        if self._out_of_core:
+            return self._gen_im_out_of_core(pixelSize, leaf_size, imb, mdh)
+
         if not np.mod(np.log2(pixelSize/self.pipeline.QTGoalPixelSize), 1) == 0:#recalculate QuadTree to get right pixel size
                 self.pipeline.QTGoalPixelSize = pixelSize
                 self.pipeline.Quads = None
@@ -552,6 +634,25 @@ class QuadTreeRenderer(ColourRenderer):
         #FIXME - make this work for imb > quadtree size
         return im[int(max(imb.x0 - quads.x0, 0)/pixelSize):int((imb.x1 - quads.x0)/pixelSize),int(max(imb.y0 - quads.y0, 0)/pixelSize):int((imb.y1 - quads.y0)/pixelSize)]
 
+    def _gen_im_out_of_core(self, pixelSize, leaf_size, imb, mdh):
+        """Count the points a chunk at a time, and render the quadtree from the counts (see QTrend.rendQTCounts),
+        rather than building a tree of all the points"""
+        from PYME.Analysis.points.QuadTree import QTrend
+        
+        ib = self.pipeline.imageBounds
+        qtWidthPixels = int(2**np.ceil(np.log2(max(ib.x1 - ib.x0, ib.y1 - ib.y0)/pixelSize)))
+        
+        counts = np.zeros((qtWidthPixels, qtWidthPixels), 'i8')
+        n_events = 0
+        for chunk in self.colourFilter.iter_chunks(['x', 'y']):
+            counts += QTrend.quadCounts(chunk['x'], chunk['y'], ib.x0, ib.y0, pixelSize, qtWidthPixels)
+            n_events += len(chunk['x'])
+        
+        mdh['Rendering.NEventsRendered'] += n_events
+        im = QTrend.rendQTCounts(counts, leaf_size)
+        
+        return im[int(max(imb.x0 - ib.x0, 0)/pixelSize):int((imb.x1 - ib.x0)/pixelSize),int(max(imb.y0 - ib.y0, 0)/pixelSize):int((imb.y1 - ib.y0)/pixelSize)]
+
 
 class VoronoiRenderer(ColourRenderer):
     """2D histogram rendering"""
@@ -122,7 +122,7 @@ def Gauss2D(Xv,Yv, A,x0,y0,s):
     r = genGauss(Xv,Yv,A,x0,y0,s,0,0,0)
     return r
 
-def rendGauss(x, y, sx, imageBounds, pixelSize):
+def rendGauss(x, y, sx, imageBounds, pixelSize, roiSize=None):
     """
 
     Parameters
@@ -138,6 +138,9 @@ def rendGauss(x, y, sx, imageBounds, pixelSize):
         and (x1, y1) correspond to the inside edge of the outer pixels.
     pixelSize : float
         size of pixels to be rendered [nm]
+    roiSize : int, optional
+        half-size (in pixels) of the region each Gaussian is rendered into. By default this is chosen from the median
+        of sx. Specify it to get consistent results when rendering a data set in parts (e.g. chunks) and summing them.
 
     Returns
     -------
@@ -155,8 +158,9 @@ def rendGauss(x, y, sx, imageBounds, pixelSize):
     
     # choose a ROI size that is appropriate, and generate a padded image to render into
     sx = np.maximum(sx, pixelSize)
-    fuzz = 3*np.median(sx)
-    roiSize = int(fuzz/pixelSize)
+    if roiSize is None:
+        fuzz = 3*np.median(sx)
+        roiSize = int(fuzz/pixelSize)
     fuzz = pixelSize*roiSize
 
     # Gauss2D expects coordinates for pixel centres
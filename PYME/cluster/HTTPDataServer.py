@@ -81,6 +81,7 @@ from socketserver import ThreadingMixIn
 
 from io import StringIO, BytesIO
 import shutil
+import struct
 #import urllib
 import sys
 import ujson as json
@@ -116,6 +117,8 @@ procName = compName + ' - PID:%d' % os.getpid()
 
 LOG_REQUESTS = False#True
 USE_DIR_CACHE = True
+# coalesce incoming __aggregate_h5r rows and write in large batches (see PYME.cluster.h5r_aggregator)
+BATCH_H5R_APPENDS = config.get('dataserver-h5r-batched-append', True)
 
 startTime = datetime.datetime.now()
 #global_status = {}
@@ -139,6 +142,7 @@ def updateStatus():
     total, used, free = disk_usage(os.getcwd())
     status['Disk'] = {'total': total, 'used': used, 'free': free}
     status['Uptime'] = str(datetime.datetime.now() - startTime)
+    status['H5RQueues'] = h5r_aggregator.get_status()
 
     try:
         import psutil
@@ -189,25 +193,10 @@ def getTextFileLock(filename):
         return textfile_locks[filename]
 
 
-from collections import OrderedDict
+from PYME.IO.lru_cache import LRUByteCache
+from PYME.cluster import h5r_aggregator
 
-class _LimitedSizeDict(OrderedDict):
-    def __init__(self, *args, **kwds):
-        self.size_limit = kwds.pop("size_limit", None)
-        OrderedDict.__init__(self, *args, **kwds)
-        self._check_size_limit()
-
-    def __setitem__(self, key, value):
-        OrderedDict.__setitem__(self, key, value)
-        self._check_size_limit()
-
-    def _check_size_limit(self):
-        if self.size_limit is not None:
-            while len(self) > self.size_limit:
-                self.popitem(last=False)
-
-
-_dirCache = _LimitedSizeDict(size_limit=100)
+_dirCache = LRUByteCache(max_bytes=config.get('dataserver-dir-cache-size', 10e6))
 _dirCacheTimeout = 1
 
 #_listDirLock = threading.Lock()
@@ -226,7 +215,7 @@ class PYMEHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     timeout=None
     
     def __init__(self, *args, **kwargs):
-        self._path_cache = _LimitedSizeDict(size_limit=1000)
+        self._path_cache = LRUByteCache(max_bytes=1e5)
         http.server.SimpleHTTPRequestHandler.__init__(self, *args, **kwargs)
 
 
@@ -301,12 +290,17 @@ class PYMEHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
 
         MetaData: assumes we have sent PYME metadata in json format and saves to the file using the appropriate metadatahandler
         No table name: assumes we have a fitResults object (as returned by remFitBuf and saves to the the appropriate tables (as HDF task queue would)
+        __finalise: write any queued rows and sync the file to disk before responding (see clusterResults.finaliseResults)
+
+        Record arrays are queued and written in batches by h5r_aggregator (unless the `dataserver-h5r-batched-append`
+        config option is False).
         """
         import numpy as np
         from io import BytesIO
         from six.moves import cPickle
         from PYME.IO import MetaDataHandler
         from PYME.IO import h5rFile
+        from PYME.IO import columnar
 
         # path = self.translate_path(self.path.lstrip('/')[len('__aggregate_h5r'):])
         # filename, tablename = path.split('.h5r')
@@ -334,35 +328,53 @@ class PYMEHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             if USE_DIR_CACHE:
                 # only update directory cache on initial creation to avoid lock thrashing. Use a placeholder size to indicate file is not complete
                 cl.dir_cache.update_cache(filename, -1)
+            
+            # create the file now, rather than when the first batch of results is written, so that other workers can
+            # find it (see clusterResults.pickResultsServer)
+            with h5rFile.openH5R(filename, 'a'):
+                pass
 
-        #logging.debug('opening h5r file')
-        with h5rFile.openH5R(filename, 'a') as h5f:
-            if tablename == '/MetaData':
-                mdh_in = MetaDataHandler.CachingMDHandler(json.loads(data))
+        if tablename == '/' + h5r_aggregator.FINALISE_TABLE:
+            # write any pending rows and make sure they are on disk before we return
+            h5r_aggregator.get_aggregator().finalise(filename)
+        elif tablename == '/MetaData':
+            mdh_in = MetaDataHandler.CachingMDHandler(json.loads(data))
+            with h5rFile.openH5R(filename, 'a') as h5f:
                 h5f.updateMetadata(mdh_in)
-            elif tablename == '':
+        else:
+            if tablename == '':
                 #legacy fitResults structure
                 fitResults = cPickle.loads(data)
-                h5f.fileFitResult(fitResults)
+                tables = [('FitResults', fitResults.results), ('DriftResults', fitResults.driftResults)]
+                tables = [(tn, d) for tn, d in tables if len(d) > 0]
             else:
-                try:
-                    #pickle is much faster than numpy array format (despite the array format being simpler)
-                    #reluctanltly use pickles
-                    data = cPickle.loads(data)
-                except cPickle.UnpicklingError:
+                if columnar.is_columnar(data):
+                    # record arrays from clusterResults.fileResults
+                    data = columnar.loads(data)
+                else:
                     try:
-                        #try to read data as if it was numpy binary formatted
-                        data = np.load(BytesIO(data))
-                    except IOError:
-                        #it's not numpy formatted - try json
-                        import pandas as pd
-                        #FIXME!! - this will work, but will likely be really slow!
-                        data = pd.read_json(data).to_records(False)
-
-                #logging.debug('adding data to table')
-                h5f.appendToTable(tablename.lstrip('/'), data)
-                #logging.debug('added data to table')
+                        #pickle is much faster than numpy array format (despite the array format being simpler)
+                        #reluctanltly use pickles
+                        data = cPickle.loads(data)
+                    except cPickle.UnpicklingError:
+                        try:
+                            #try to read data as if it was numpy binary formatted
+                            data = np.load(BytesIO(data))
+                        except IOError:
+                            #it's not numpy formatted - try json
+                            import pandas as pd
+                            #FIXME!! - this will work, but will likely be really slow!
+                            data = pd.read_json(data).to_records(False)
+                
+                tables = [(tablename.lstrip('/'), data)]
 
+            for tn, d in tables:
+                if BATCH_H5R_APPENDS and (tn != 'PZFImageData') and isinstance(d, np.ndarray) and (d.dtype.names is not None):
+                    h5r_aggregator.get_aggregator().append(filename, tn, d)
+                else:
+                    #logging.debug('adding data to table')
+                    with h5rFile.openH5R(filename, 'a') as h5f:
+                        h5f.appendToTable(tn, d)
 
         self.send_response(200)
         self.send_header("Content-Length", "0")
@@ -544,6 +556,54 @@ class PYMEHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             self.end_headers()
             return
 
+    def do_POST(self):
+        """Serve a POST request. Only used for batched GETs (where the list of files to get is too long to
+        comfortably fit into a URL)"""
+        if self.path.lstrip('/').startswith('__batch_get'):
+            return self._batch_get()
+        
+        self.send_error(405, 'POST is only supported for __batch_get')
+        
+    def _batch_get(self):
+        """
+        Return the contents of multiple files in a single response. The request body is a json encoded list of
+        filenames (relative to the server root), and the response is the concatenation of an int64 (little-endian)
+        length and the file contents for each file, in the order requested. Files which don't exist have a length of -1
+        (and no contents).
+        """
+        filenames = json.loads(self._get_data())
+        
+        # stat the files up front so we can send a Content-Length, but only open them one at a time as we send them
+        # (keeps the number of open file handles bounded for large batches)
+        files = []
+        for fn in filenames:
+            path = self.translate_path(fn)
+            try:
+                files.append((path, os.stat(path).st_size))
+            except OSError:
+                files.append((None, -1))
+        
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(sum([8 + max(size, 0) for path, size in files])))
+        self.end_headers()
+        
+        for path, size in files:
+            self.wfile.write(struct.pack('<q', size))
+            
+            if path is None:
+                continue
+            
+            with open(path, 'rb') as f:
+                # copy exactly the number of bytes we announced, even if the file has been appended to since
+                remaining = size
+                while remaining > 0:
+                    buf = f.read(min(remaining, 1024*1024))
+                    if not buf:
+                        raise IOError('File truncated during read')
+                    self.wfile.write(buf)
+                    remaining -= len(buf)
+        
     def do_GET(self):
         """Serve a GET request."""
         if self.timeoutTesting:
@@ -766,7 +826,8 @@ class PYMEHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             .h5r/Events. Return format (for arrays) can additionally be 
             specified, as can slices
             using the following syntax: test.h5r/FitResults.json?from=0&to=100. 
-            Supported array formats include json and npy.
+            Supported array formats include json, npy, and pyrc (the compressed columnar format defined in
+            PYME.IO.columnar, which is the most efficient for large tables).
 
         Returns
         -------
@@ -782,13 +843,16 @@ class PYMEHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         filename, details = path.split(ext + os.sep)
         filename = filename + ext  # path to file on dataserver disk
         query = urlparse.urlparse(details).query
-        details = details.strip('?' + query)
+        details = details.split('?')[0]
         if '.' in details:
             part, return_type = details.split('.')
         else:
             part, return_type = details, ''
 
 
+        # make sure that any rows we have accepted, but not yet written, are visible
+        h5r_aggregator.flush(filename)
+
         try:
             with h5rFile.openH5R(filename) as h5f:
                 if part == 'Metadata':
@@ -1037,6 +1101,9 @@ def main(protocol="HTTP/1.0"):
         httpd.shutdown()
         httpd.server_close()
         
+        # write any results which are still queued
+        h5r_aggregator.shutdown()
+        
         ns.unregister(service_name)
 
         if options.profile:
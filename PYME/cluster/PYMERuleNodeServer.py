@@ -117,13 +117,20 @@ def main():
     #numWorkers = conf.get('nodeserver-num_workers', cpu_count())
     numWorkers = args.num_workers
 
-    workerProcs = [subprocess.Popen('"%s" -m PYME.cluster.taskWorkerHTTP -s %d' % (sys.executable, serverPort), shell=True, stdin=subprocess.PIPE)
-                   for i in range(numWorkers -1)]
-
-    #last worker has profiling enabled
-    profiledir = os.path.join(nodeserver_log_dir, 'mProf')
-    workerProcs.append(subprocess.Popen('"%s" -m PYME.cluster.taskWorkerHTTP -s % d -p --profile-dir="%s"' % (sys.executable, serverPort, profiledir), shell=True,
-                                        stdin=subprocess.PIPE))
+    worker_cmd = '"%s" -m PYME.cluster.taskWorkerHTTP -s %d' % (sys.executable, serverPort)
+    
+    if conf.get('nodeserver-worker-mode', 'process') == 'pool':
+        # a single worker, running tasks on a pool of processes which share one frame fetch stage
+        worker_cmd = worker_cmd + ' --pool %d' % numWorkers
+        workerProcs = [subprocess.Popen(worker_cmd, shell=True, stdin=subprocess.PIPE)]
+    else:
+        workerProcs = [subprocess.Popen(worker_cmd, shell=True, stdin=subprocess.PIPE)
+                       for i in range(numWorkers -1)]
+    
+        #last worker has profiling enabled
+        profiledir = os.path.join(nodeserver_log_dir, 'mProf')
+        workerProcs.append(subprocess.Popen('"%s" -m PYME.cluster.taskWorkerHTTP -s % d -p --profile-dir="%s"' % (sys.executable, serverPort, profiledir), shell=True,
+                                            stdin=subprocess.PIPE))
 
     try:
         while proc.is_alive():
@@ -140,7 +147,7 @@ def main():
             for p in dead_workers:        
                 workerProcs.remove(p)
                 logger.debug('Spawning replacement worker')
-                workerProcs.append(subprocess.Popen('"%s" -m PYME.cluster.taskWorkerHTTP -s %d' % (sys.executable, serverPort), shell=True, stdin=subprocess.PIPE))
+                workerProcs.append(subprocess.Popen(worker_cmd, shell=True, stdin=subprocess.PIPE))
 
     finally:
         logger.info('Shutting down workers')
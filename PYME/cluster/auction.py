@@ -0,0 +1,272 @@
+"""
+Batched allocation of contested tasks for the rule server (see :meth:`PYME.cluster.ruleserver.IntegerIDRule.bid`).
+
+Bids where every task is below the rule's "Buy Now" cost threshold (local localisation tasks) are awarded directly and
+never reach this module. Any other bid is submitted to the rule's :class:`AuctionEngine`. The first bid opens an
+auction *epoch*, and bids which arrive while it is open join the same epoch. Once ``window`` seconds have passed since
+it opened, the epoch is resolved, in one go, by :func:`match`. Nothing sleeps for a fixed time: each bidder waits on
+its epoch's event, and the first waiter to reach the deadline does the resolution. Bids which arrive in the last few
+ms of an epoch therefore wait only a few ms.
+
+Bidders are blocked while their epoch is open. This is deliberate: the bid HTTP endpoint (and the node servers which
+call it) expect the awarded tasks in the response, and returning straight away with the awards sent on a later poll
+would need a change to the bid protocol, and would make every contested task wait a full node poll interval (about
+1 s) rather than the auction window. The wait is bounded by ``window`` (``ruleserver-auction-window`` config option,
+50 ms by default) plus the time to match, and only ties up the (threaded) server's thread for that request. Setting
+the window to 0 resolves each bid on its own, without waiting for other bids.
+"""
+import threading
+import time
+import logging
+
+import numpy as np
+
+from PYME import config
+
+logger = logging.getLogger(__name__)
+
+# use an exact (Hungarian algorithm) assignment when bidders cap the number of tasks they want, and the problem is
+# small enough for this to be fast.
+EXACT_MATCH_MAX_SIZE = 250000
+
+
+def match(bids):
+    """
+    Allocate tasks to bidders, minimising the total cost.
+
+    Parameters
+    ----------
+    bids : list of tuples
+        ``(task_ids, costs, max_tasks)`` for each bidder, where `max_tasks` is the maximum number of tasks that bidder
+        should be awarded (None = no limit beyond the number of tasks it bid on)
+
+    Returns
+    -------
+    awarded : list of np.ndarray
+        for each bidder, the indices into its `task_ids` of the tasks it has won
+
+    Notes
+    -----
+    Each task goes to at most one bidder. If no bidder is capped, giving each task to its lowest bidder is already the
+    minimum cost assignment. Ties are spread evenly across bidders, rather than all going to the first one.
+    If bidders are capped, we first award as many tasks as possible and then minimise the total cost. This is solved
+    exactly for small problems and greedily (lowest cost first) for large ones.
+    """
+    if len(bids) == 0:
+        return []
+
+    bidder = np.concatenate([np.full(len(b[0]), i, 'i4') for i, b in enumerate(bids)])
+    tasks = np.concatenate([np.asarray(b[0], 'i8') for b in bids])
+    costs = np.concatenate([np.asarray(b[1], 'f4') for b in bids])
+    offsets = np.cumsum([0] + [len(b[0]) for b in bids])
+
+    capacity = np.array([len(b[0]) if b[2] is None else min(int(b[2]), len(b[0])) for b in bids])
+    capped = np.any(capacity < [len(b[0]) for b in bids])
+
+    won = np.zeros(len(tasks), bool)
+
+    if not capped:
+        _match_lowest(tasks, bidder, costs, won)
+        return [np.flatnonzero(won[offsets[i]:offsets[i + 1]]) for i in range(len(bids))]
+
+    task_u, task_idx = np.unique(tasks, return_inverse=True)
+    n_slots = int(capacity.sum())
+    if len(task_u)*n_slots <= EXACT_MATCH_MAX_SIZE:
+        _match_exact(task_idx, len(task_u), bidder, costs, capacity, won)
+        return [np.flatnonzero(won[offsets[i]:offsets[i+1]]) for i in range(len(bids))]
+
+    # too large for an exact match, greedy - tasks are allocated in order of their lowest bid, each to the cheapest bidder which still has capacity.
+    # Ties go to the bidder which has won the fewest tasks so far (spreads identical bids evenly across bidders).
+    order = np.lexsort((costs, tasks))
+    task_start = np.flatnonzero(np.r_[True, tasks[order][1:] != tasks[order][:-1]])
+    task_end = np.r_[task_start[1:], len(order)]
+    task_order = np.argsort(costs[order][task_start], kind='stable')
+
+    n_won = np.zeros(len(bids), 'i8')
+    for t in task_order:
+        best = None
+        for e in order[task_start[t]:task_end[t]]:
+            b = bidder[e]
+            if n_won[b] >= capacity[b]:
+                continue
+
+            key = (costs[e], n_won[b], b)
+            if (best is None) or (key < best[0]):
+                best = (key, e)
+
+        if best is not None:
+            won[best[1]] = True
+            n_won[bidder[best[1]]] += 1
+
+    return [np.flatnonzero(won[offsets[i]:offsets[i + 1]]) for i in range(len(bids))]
+
+
+def _match_lowest(tasks, bidder, costs, won):
+    """Give each task to its lowest bidder (uncapped case), spreading ties across the tied bidders"""
+    if len(tasks) == 0:
+        return
+
+    # sort by task, then cost, so that the first row for each task is (one of) its lowest bids
+    order = np.lexsort((bidder, costs, tasks))
+    tasks_s, costs_s = tasks[order], costs[order]
+    task_start = np.flatnonzero(np.r_[True, tasks_s[1:] != tasks_s[:-1]])
+    n_bids = np.diff(np.r_[task_start, len(order)])
+
+    # the bids tied for lowest are at the start of each task's rows. Take the k-th of these for the k-th task (modulo
+    # the number of ties) so that identical bids are shared out evenly.
+    n_ties = np.add.reduceat(costs_s == np.repeat(costs_s[task_start], n_bids), task_start)
+    won[order[task_start + np.arange(len(task_start)) % n_ties]] = True
+
+
+def _match_exact(task_idx, n_tasks, bidder, costs, capacity, won):
+    from scipy.optimize import linear_sum_assignment
+
+    # one column per task a bidder could take
+    slot_bidder = np.repeat(np.arange(len(capacity)), capacity)
+    slot_start = np.cumsum(np.r_[0, capacity[:-1]])
+
+    # a large (but finite) cost for pairs which were not bid on means that we first maximise the number of tasks awarded
+    big = 1.0 + 2*len(slot_bidder)*max(float(np.abs(costs).max()), 1.0)
+    cost_matrix = np.full((n_tasks, len(slot_bidder)), big)
+    edge = -np.ones((n_tasks, len(slot_bidder)), 'i8')
+
+    for e in range(len(task_idx)):
+        b = bidder[e]
+        cols = slice(slot_start[b], slot_start[b] + capacity[b])
+        if costs[e] < cost_matrix[task_idx[e], slot_start[b]]:
+            cost_matrix[task_idx[e], cols] = costs[e]
+            edge[task_idx[e], cols] = e
+
+    rows, cols = linear_sum_assignment(cost_matrix)
+    for r, c in zip(rows, cols):
+        if edge[r, c] >= 0:
+            won[edge[r, c]] = True
+
+
+class _Epoch(object):
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.bids = []
+        self.submit_times = []
+        self.results = None
+        self.resolving = False
+        self.resolved = threading.Event()
+
+
+class AuctionEngine(object):
+    """
+    Collects concurrent bids on a rule's tasks into auction epochs and resolves each epoch with :func:`match`.
+
+    Parameters
+    ----------
+    window : float
+        how long (in s) an epoch stays open for other bids after the first bid arrives. Defaults to the
+        ``ruleserver-auction-window`` config option (0.05 s).
+    """
+    def __init__(self, window=None):
+        if window is None:
+            window = config.get('ruleserver-auction-window', 0.05)
+
+        self.window = float(window)
+
+        self._epoch = None
+        self._lock = threading.Lock()
+
+        # statistics
+        self.n_auctions = 0
+        self.n_bids = 0
+        self.n_tasks_bid = 0
+        self.n_tasks_won = 0
+        self._total_latency = 0
+        self.max_latency = 0
+
+    def submit(self, task_ids, costs, max_tasks=None):
+        """
+        Submit a bid and wait for the epoch it joins to be resolved. This blocks the calling thread for up to `window`
+        seconds (see the module docstring for why awards are not delivered asynchronously).
+
+        Parameters
+        ----------
+        task_ids : np.ndarray
+        costs : np.ndarray
+        max_tasks : int, optional
+            maximum number of tasks the bidder wants
+
+        Returns
+        -------
+        mask : np.ndarray
+            boolean mask, True for the tasks (in `task_ids`) which have been won. Callers should still check that the
+            tasks are available.
+        """
+        t = time.time()
+        with self._lock:
+            if self._epoch is None:
+                self._epoch = _Epoch(deadline=t + self.window)
+
+            epoch = self._epoch
+            idx = len(epoch.bids)
+            epoch.bids.append((task_ids, costs, max_tasks))
+            epoch.submit_times.append(t)
+
+        epoch.resolved.wait(max(epoch.deadline - time.time(), 0))
+        self._resolve(epoch)
+
+        mask = np.zeros(len(task_ids), bool)
+        mask[epoch.results[idx]] = True
+        return mask
+
+    def _resolve(self, epoch):
+        with self._lock:
+            resolving = epoch.resolving
+            epoch.resolving = True
+            
+            if self._epoch is epoch:
+                # stop accepting bids into this epoch
+                self._epoch = None
+        
+        if resolving:
+            # another bidder got here first, wait for it to finish
+            epoch.resolved.wait()
+            return
+        
+        # no more bids can join the epoch, so we can match without holding the lock (and blocking new bids)
+        try:
+            results = match(epoch.bids)
+        except:
+            logger.exception('Error resolving auction, no tasks awarded')
+            results = [np.zeros(0, 'i8') for b in epoch.bids]
+
+        t = time.time()
+        latencies = [t - ts for ts in epoch.submit_times]
+        with self._lock:
+            epoch.results = results
+            
+            self.n_auctions += 1
+            self.n_bids += len(epoch.bids)
+            self.n_tasks_bid += int(sum([len(b[0]) for b in epoch.bids]))
+            self.n_tasks_won += int(sum([len(r) for r in epoch.results]))
+            self._total_latency += sum(latencies)
+            self.max_latency = max(self.max_latency, max(latencies))
+
+        epoch.resolved.set()
+
+    def stats(self):
+        """
+        Auction statistics
+
+        Returns
+        -------
+        dict
+            with keys 'auctions', 'bids', 'tasksBid', 'tasksWon', 'winRate' (fraction of tasks bid on which were
+            won), 'bidsPerAuction', 'meanLatency' and 'maxLatency' (time in s between bid submission and resolution)
+        """
+        with self._lock:
+            return {'auctions': self.n_auctions,
+                    'bids': self.n_bids,
+                    'tasksBid': self.n_tasks_bid,
+                    'tasksWon': self.n_tasks_won,
+                    'winRate': float(self.n_tasks_won)/self.n_tasks_bid if self.n_tasks_bid else 0.0,
+                    'bidsPerAuction': float(self.n_bids)/self.n_auctions if self.n_auctions else 0.0,
+                    'meanLatency': self._total_latency/self.n_bids if self.n_bids else 0.0,
+                    'maxLatency': self.max_latency,
+                    }
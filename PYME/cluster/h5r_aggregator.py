@@ -0,0 +1,252 @@
+"""
+Batched writing of aggregated results (``__aggregate_h5r`` PUTs) on the dataserver.
+
+During distributed localisation, hundreds of workers each PUT small chunks of fit results to the same .h5r file. Handing
+each chunk straight to :class:`PYME.IO.h5rFile.H5RFile` means that every request pays for a (cached) file open, and that
+pytables sees lots of small appends. The :class:`H5RAggregator` instead coalesces incoming rows per (file, table) in
+memory and writes them in large appends from a single writer thread, either once a table has accumulated
+``flush_rows`` rows, or once the oldest pending rows are ``flush_interval`` seconds old.
+
+Durability: rows are held in memory after the PUT returns (as was already the case with the `H5RFile` queues).
+:meth:`H5RAggregator.finalise` writes all rows received for a file before the call, flushes the HDF5 file and fsyncs it
+to disk before returning. The dataserver exposes this as a PUT to ``__aggregate_h5r/path/to/file.h5r/__finalise``, see
+:func:`PYME.IO.clusterResults.finaliseResults`.
+"""
+import os
+import threading
+import time
+import logging
+
+import numpy as np
+
+from PYME import config
+from PYME.IO import h5rFile
+
+logger = logging.getLogger(__name__)
+
+FINALISE_TABLE = '__finalise'
+
+
+class _PendingFile(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.tables = {} # tablename -> list of record arrays
+        self.nrows = 0
+        self.oldest = None # time at which the oldest pending rows were received
+        self.last_write = time.time()
+
+        self.h5f = None
+        self.write_lock = threading.Lock()
+
+
+class H5RAggregator(object):
+    """
+    Coalesce appends to tables in h5r files and write them in large batches.
+
+    Parameters
+    ----------
+    flush_rows : int
+        write a file's pending rows once this many rows have accumulated for one of its tables
+    flush_interval : float
+        maximum time (in s) rows are held in memory before being written
+    idle_timeout : float
+        how long (in s) to keep a file open after the last write
+    """
+    def __init__(self, flush_rows=None, flush_interval=None, idle_timeout=20.):
+        if flush_rows is None:
+            flush_rows = config.get('dataserver-h5r-flush-rows', 50000)
+
+        if flush_interval is None:
+            flush_interval = config.get('dataserver-h5r-flush-interval', 1.0)
+
+        self.flush_rows = int(flush_rows)
+        self.flush_interval = float(flush_interval)
+        self.idle_timeout = float(idle_timeout)
+
+        # apply back-pressure (write synchronously in the calling thread) if the writer thread falls this far behind
+        self.max_pending_rows = 10*self.flush_rows
+
+        self._files = {}
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+
+        self._alive = True
+        self._thread = threading.Thread(target=self._run, name='H5RAggregator')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def append(self, filename, tablename, data):
+        """
+        Queue records for appending to a table. Returns immediately unless the writer is too far behind.
+
+        Parameters
+        ----------
+        filename : str
+            path to the .h5r file on disk
+        tablename : str
+            name of the table in the file
+        data : np.ndarray
+            structured array of records
+        """
+        data = np.atleast_1d(data)
+
+        with self._lock:
+            pf = self._files.get(filename, None)
+            if pf is None:
+                pf = _PendingFile(filename)
+                self._files[filename] = pf
+
+            pf.tables.setdefault(tablename, []).append(data)
+            pf.nrows += len(data)
+            if pf.oldest is None:
+                pf.oldest = time.time()
+
+            nrows = pf.nrows
+            if nrows >= self.flush_rows:
+                self._cond.notify()
+
+        if nrows > self.max_pending_rows:
+            self._write(pf)
+
+    def flush(self, filename):
+        """Write any pending rows for a file and flush the HDF5 buffers (rows are then visible to readers)"""
+        with self._lock:
+            pf = self._files.get(filename, None)
+
+        if pf is not None:
+            self._write(pf)
+
+    def finalise(self, filename):
+        """
+        Write all pending rows for a file and make sure they are on disk (flushed and fsynced) before returning.
+        Also releases our hold on the file so that it is closed once idle.
+        """
+        with self._lock:
+            pf = self._files.pop(filename, None)
+
+        if pf is None:
+            return
+
+        self._write(pf, sync=True)
+        with pf.write_lock:
+            self._release(pf)
+
+    def get_status(self):
+        """Return the queue depth (number of pending rows per table) for each file which has pending data"""
+        with self._lock:
+            return {fn: {tn: int(sum([len(r) for r in recs])) for tn, recs in pf.tables.items()}
+                    for fn, pf in self._files.items() if pf.nrows > 0}
+
+    def stop(self):
+        """Write all pending data and stop the writer thread"""
+        self._alive = False
+        with self._lock:
+            self._cond.notify()
+        self._thread.join()
+
+    def _write(self, pf, sync=False):
+        with pf.write_lock:
+            with self._lock:
+                tables = pf.tables
+                pf.tables = {}
+                pf.nrows = 0
+                pf.oldest = None
+
+            if len(tables) == 0 and (pf.h5f is None or not sync):
+                return
+
+            if pf.h5f is None or not pf.h5f.is_alive:
+                pf.h5f = h5rFile.openH5R(pf.filename, 'a')
+                # hold the file open (and keep the H5RFile poll thread alive) whilst we are using it
+                pf.h5f.__enter__()
+
+            for tablename, recs in tables.items():
+                try:
+                    rows = np.hstack(recs)
+                except (ValueError, TypeError):
+                    # incompatible dtypes - fall back on writing chunks individually
+                    logger.exception('Could not merge records for %s/%s, appending individually' % (pf.filename, tablename))
+                    for r in recs:
+                        pf.h5f._appendToTable(tablename, r)
+                else:
+                    pf.h5f._appendToTable(tablename, rows)
+
+            with h5rFile.tablesLock:
+                pf.h5f._h5file.flush()
+                if sync:
+                    os.fsync(pf.h5f._h5file.fileno())
+
+            pf.last_write = time.time()
+
+    def _release(self, pf):
+        if pf.h5f is not None:
+            pf.h5f.__exit__(None, None, None)
+            pf.h5f = None
+
+    def _run(self):
+        while self._alive:
+            with self._lock:
+                self._cond.wait(timeout=0.25*self.flush_interval)
+                t = time.time()
+                due = [pf for pf in self._files.values() if (pf.nrows >= self.flush_rows) or
+                       (pf.oldest is not None and (t - pf.oldest) >= self.flush_interval)]
+
+                idle = [fn for fn, pf in self._files.items() if (pf.nrows == 0) and
+                        ((t - pf.last_write) > self.idle_timeout)]
+                idle = [self._files.pop(fn) for fn in idle]
+
+            for pf in due:
+                try:
+                    self._write(pf)
+                except:
+                    logger.exception('Error writing aggregated results to %s' % pf.filename)
+
+            for pf in idle:
+                with pf.write_lock:
+                    self._release(pf)
+
+        # write everything on shutdown
+        with self._lock:
+            files = list(self._files.values())
+            self._files.clear()
+
+        for pf in files:
+            try:
+                self._write(pf, sync=True)
+            except:
+                logger.exception('Error writing aggregated results to %s' % pf.filename)
+            with pf.write_lock:
+                self._release(pf)
+
+
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+def get_aggregator():
+    """Return the (lazily created) process-wide aggregator"""
+    global _aggregator
+    with _aggregator_lock:
+        if _aggregator is None:
+            _aggregator = H5RAggregator()
+
+        return _aggregator
+
+def flush(filename):
+    """Write any pending rows for a file (no-op if nothing has been aggregated)"""
+    if _aggregator is not None:
+        _aggregator.flush(filename)
+
+def shutdown():
+    """Write all pending rows and stop the writer thread"""
+    global _aggregator
+    with _aggregator_lock:
+        if _aggregator is not None:
+            _aggregator.stop()
+            _aggregator = None
+
+def get_status():
+    """Per-file queue depths for the dataserver status endpoint (empty if nothing has been aggregated)"""
+    if _aggregator is None:
+        return {}
+
+    return _aggregator.get_status()
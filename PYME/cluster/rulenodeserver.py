@@ -15,10 +15,14 @@ from PYME.misc import computerName
 from PYME import config
 from PYME.IO import clusterIO
 import os
+import posixpath
+
+import numpy as np
 
 from PYME.util import webframework
 
 from PYME.cluster import distribution
+from PYME.cluster import task_ranges
 
 import ujson as json
 
@@ -41,93 +45,325 @@ def template_fill(template, **kwargs):
     
     return s
 
-class Rater(object):
-    def __init__(self, rule):
-        self.rule = rule
-        self.taskIDs = rule['availableTaskIDs']
-        self.template = rule['taskTemplate']
-        inputs = rule.get('inputsByTask', {})
-        self.inputs = {int(k):v for k, v in inputs.items()}
+class LocalFileMap(object):
+    """
+    A cached map of which files (and which frames of spooled series) are held by the local dataserver.
+    
+    Rating tasks for data locality used to test for the existence of each frame / input file individually. Instead we
+    list each directory on the local data root once, and re-list it at most every `refresh_interval` seconds (so that
+    frames which arrive while a series is being spooled are picked up). Lookups for a whole range of frames are then a
+    single vectorised operation.
+    
+    Parameters
+    ----------
+    refresh_interval : float
+        maximum age (in s) of a cached directory listing
+    """
+    def __init__(self, refresh_interval=None):
+        if refresh_interval is None:
+            refresh_interval = config.get('rulenodeserver-locality-refresh', 2.0)
+            
+        self.refresh_interval = float(refresh_interval)
+        
+        self._dirs = {} # dirname -> (expiry, set of filenames, boolean array of frames present)
+        self._lock = threading.Lock()
+        
+    def _listing(self, dirname):
+        t = time.time()
+        with self._lock:
+            entry = self._dirs.get(dirname, None)
+            if (entry is not None) and (entry[0] > t):
+                return entry
+            
+            if len(self._dirs) > 1000:
+                # discard stale listings
+                self._dirs = {k: v for k, v in self._dirs.items() if v[0] > t}
+        
+        try:
+            names = set(os.listdir(os.path.join(clusterIO.local_dataroot, dirname)))
+        except OSError:
+            names = set()
         
-        #logger.debug('rater inputs: %s' % self.inputs)
+        frames = np.array([int(n[5:-4]) for n in names if n.startswith('frame') and n.endswith('.pzf') and n[5:-4].isdigit()], 'i8')
+        frames_present = np.zeros(frames.max() + 1 if len(frames) else 0, bool)
+        frames_present[frames] = True
         
-        #logger.debug('Template: %s'  % self.template)
+        entry = (t + self.refresh_interval, names, frames_present, task_ranges.ranges_from_mask(frames_present))
+        with self._lock:
+            self._dirs[dirname] = entry
         
-        self.n = 0
+        return entry
+    
+    def _is_local_server(self, serverfilter):
+        return (serverfilter == clusterIO.local_serverfilter) and clusterIO.local_dataroot
         
-        self._non_local = []
+    def is_local(self, filename, serverfilter):
+        """Cached equivalent of `clusterIO.is_local`"""
+        if not self._is_local_server(serverfilter):
+            return False
         
-    def __iter__(self):
-        return self
+        dirname, name = posixpath.split(filename.lstrip('/'))
+        return name in self._listing(dirname)[1]
     
-    def __next__(self):
-        try:
-            taskID = self.taskIDs[self.n]
-            self.n += 1
-        except IndexError:
-            raise StopIteration
+    def frames_local(self, series, serverfilter, frame_indices):
+        """
+        Test which frames of a spooled series are held locally
         
-        #logger.debug('taskID: %s, taskInputs: %s' % (taskID, self.inputs.get(taskID)))
+        Parameters
+        ----------
+        series : str
+            cluster path to the series directory
+        serverfilter : str
+        frame_indices : np.ndarray
+            integer frame indices
+
+        Returns
+        -------
+        local : np.ndarray
+            boolean array, True for frames which are on the local disk
+        """
+        frame_indices = np.asarray(frame_indices, 'i8')
+        if not self._is_local_server(serverfilter):
+            return np.zeros(len(frame_indices), bool)
         
-        task_inputs = self.inputs.get(taskID)
-        if not task_inputs is None:
-            task_inputs = json.dumps(task_inputs)
+        frames_present = self._listing(series.strip('/'))[2]
+        local = np.zeros(len(frame_indices), bool)
+        valid = (frame_indices >= 0) & (frame_indices < len(frames_present))
+        local[valid] = frames_present[frame_indices[valid]]
+        return local
+    
+    def local_frame_ranges(self, series, serverfilter):
+        """
+        Find which frames of a spooled series are held locally, as runs of consecutive frames
+
+        Parameters
+        ----------
+        series : str
+            cluster path to the series directory
+        serverfilter : str
+
+        Returns
+        -------
+        ranges : np.ndarray
+            (N, 2) array of [start, end) frame ranges which are on the local disk
+        """
+        if not self._is_local_server(serverfilter):
+            return np.zeros((0, 2), 'i8')
+        
+        return self._listing(series.strip('/'))[3]
+
+
+class Rater(object):
+    """
+    Rate (assign a cost to) the tasks advertised by a rule according to data locality.
+    
+    Tasks are rated as ranges of task IDs rather than one by one. The available tasks are split into sub-ranges with a
+    uniform cost (for localisation, at the boundaries of the runs of frames held locally - see `LocalFileMap`), and
+    we bid on these ranges directly, so that the work done scales with the number of ranges rather than the number of
+    tasks. Local tasks cost 0.01 for localisation and 0.2 per local input for recipes. Non-local tasks cost 1.0.
+    
+    Parameters
+    ----------
+    rule : dict
+        the rule advert, either range encoded (see `ruleserver.IntegerIDRule.range_advert`) or a legacy advert with a
+        list of 'availableTaskIDs' (see `ruleserver.IntegerIDRule.advert`)
+    file_map : LocalFileMap, optional
+        cached map of locally held files (a new, un-shared, map is used if not provided)
+    """
+    LOCAL_THRESHOLD = 0.99 # tasks with a cost above this are considered non-local
+    
+    def __init__(self, rule, file_map=None):
+        self.rule = rule
+        if 'availableTasks' in rule:
+            self.ranges = task_ranges.decode_available(rule['availableTasks'])
+        else:
+            self.ranges = task_ranges.ranges_from_ids(rule['availableTaskIDs'])
+            
+        self.template = rule['taskTemplate']
+        inputs = rule.get('inputsByTask', {})
+        self.inputs = {int(k):v for k, v in inputs.items()}
         
-        filled_template = template_fill(self.template, taskID=taskID, taskInputs=task_inputs)
+        if file_map is None:
+            file_map = LocalFileMap()
+            
+        self._file_map = file_map
+        self._segments = None
+        self._taken = None # number of tasks from the start of each segment which we have already chosen to bid on
+        self._input_costs = {}
         
-        #logger.debug('filled template: %s' % filled_template)
+    def _fill(self, taskID):
+        task_inputs = self.inputs.get(int(taskID))
+        if not task_inputs is None:
+            task_inputs = json.dumps(task_inputs)
+    
+        return json.loads(template_fill(self.template, taskID=taskID, taskInputs=task_inputs))
+    
+    @property
+    def segments(self):
+        """
+        The available tasks, split into ranges with a uniform cost
         
-        task = json.loads(filled_template)
+        Returns
+        -------
+        ranges : np.ndarray
+            (N, 2) array of [start, end) task ID ranges
+        costs : np.ndarray
+            the cost of each task in the corresponding range
+        """
+        if self._segments is None:
+            self._segments = self._rate()
+            self._taken = np.zeros(len(self._segments[0]), 'i8')
+            
+        return self._segments
+    
+    def _rate(self):
+        ranges = self.ranges
+        if len(ranges) == 0:
+            return ranges, np.ones(0, 'f4')
         
-        cost = 1.0
+        task = None
         try:
+            # all tasks of a rule share the same structure, use the first to decide how to rate them
+            task = self._fill(ranges[0, 0])
             if task['type'] == 'localization':
-                series_name = task['inputs']['frames']
-                if os.path.exists(series_name):
-                    # cluster of one special case
-                    cost = 0.01
-                else:
-                    filename, serverfilter = clusterIO.parseURL(series_name)
-                    filename = '/'.join([filename.lstrip('/'), 'frame%05d.pzf' % int(task['taskdef']['frameIndex'])])
-                
-                    if clusterIO.is_local(filename, serverfilter):
-                        cost = .01
-        
+                return self._rate_localization(task)
             elif task['type'] == 'recipe':
-                for key, URL in task['inputs'].items():
-                    if key == '__sim':
-                        #special case for no-input simulation tasks
-                        # NB - only needed to suppress error, simulation tasks just get cost=1 otherwise.
-                        cost *= 0.2
-                    elif os.path.exists(URL):
-                        #cluster of one special case
-                        cost *= .2
-                    elif clusterIO.is_local(*clusterIO.parseURL(URL)):
-                        cost *= .2
+                return self._rate_recipe(task)
         except:
             logger.exception('Error rating task (%s)' % task)
-                    
-        return taskID, cost
+            
+        return ranges, np.ones(len(ranges), 'f4')
     
-    def next(self):
-        return self.__next__()
+    def _per_task(self, cost_fcn):
+        """
+        Rate each available task individually with `cost_fcn(taskID)` and group the results into ranges. Only used
+        when tasks can't be rated a range at a time.
+        """
+        task_ids = task_ranges.ids_from_ranges(self.ranges)
+        ranges, costs = task_ranges.encode_bid(task_ids, [cost_fcn(taskID) for taskID in task_ids])
+        return np.asarray(ranges, 'i8').reshape(-1, 2), np.asarray(costs, 'f4')
     
+    def _frames_per_task(self, taskdef):
+        """
+        The spacing of the (first) frames of consecutive tasks if task IDs map directly onto frames (or blocks of
+        frames), otherwise None
+        """
+        taskID0 = self.ranges[0, 0]
+        if 'blockSize' in taskdef:
+            if int(taskdef['blockIndex']) == taskID0:
+                return int(taskdef['blockSize'])
+        elif int(taskdef['frameIndex']) == taskID0:
+            return 1
     
-    def get_local(self):
-        cost = 1.0
-        while cost > 0.99:
-            taskID, cost = self.next()
-            if cost > 0.99:
-                self._non_local.append((taskID, cost))
-            else:
-                return taskID, cost
+    def _rate_localization(self, task):
+        series_name = task['inputs']['frames']
+        if os.path.exists(series_name):
+            # cluster of one special case
+            return self.ranges, np.full(len(self.ranges), 0.01, 'f4')
+        
+        filename, serverfilter = clusterIO.parseURL(series_name)
+        step = self._frames_per_task(task['taskdef'])
+        
+        if step is None:
+            # template doesn't map task IDs directly to frames/blocks, fill it for each task
+            def _cost(taskID):
+                taskdef = self._fill(taskID)['taskdef']
+                if 'blockSize' in taskdef:
+                    frame_index = int(taskdef['blockIndex'])*int(taskdef['blockSize'])
+                else:
+                    frame_index = int(taskdef['frameIndex'])
+                
+                return 0.01 if self._file_map.frames_local(filename, serverfilter, [frame_index])[0] else 1.0
             
-    def get_any(self):
+            return self._per_task(_cost)
+        
+        # rate on the locality of the (first) frame of each task. Task t is local if frame t*step is, so a run of local
+        # frames [start, end) maps onto a run of local tasks [ceil(start/step), ceil(end/step))
+        local_tasks = -(-self._file_map.local_frame_ranges(filename, serverfilter) // step)
+        ranges, local = task_ranges.split_ranges(self.ranges, local_tasks)
+        return ranges, np.where(local, 0.01, 1.0).astype('f4')
+    
+    def _rate_input(self, URL):
         try:
-            taskID, cost = self._non_local.pop()
-            return taskID, cost
-        except IndexError:
-            return self.next()
+            return self._input_costs[URL]
+        except KeyError:
+            pass
+        
+        if os.path.exists(URL):
+            #cluster of one special case
+            cost = .2
+        elif self._file_map.is_local(*clusterIO.parseURL(URL)):
+            cost = .2
+        else:
+            cost = 1.0
+            
+        self._input_costs[URL] = cost
+        return cost
+    
+    def _rate_inputs(self, inputs):
+        cost = 1.0
+        for key, URL in inputs.items():
+            if key == '__sim':
+                #special case for no-input simulation tasks
+                # NB - only needed to suppress error, simulation tasks just get cost=1 otherwise.
+                cost *= 0.2
+            else:
+                cost *= self._rate_input(URL)
+                
+        return cost
+    
+    def _rate_recipe(self, task):
+        if '{{taskInputs}}' in self.template:
+            # inputs vary by task (but the locality of each input file is only looked up once)
+            return self._per_task(lambda taskID: self._rate_inputs(self.inputs.get(int(taskID), {})))
+        
+        if '{{taskID}}' in self.template:
+            # check whether the inputs depend on the task ID by filling the template with a different ID
+            probe = self._fill(self.ranges[0, 0] + 1)
+            if probe['inputs'] != task['inputs']:
+                return self._per_task(lambda taskID: self._rate_inputs(self._fill(taskID)['inputs']))
+        
+        # hard coded inputs, all tasks are equivalent
+        return self.ranges, np.full(len(self.ranges), self._rate_inputs(task['inputs']), 'f4')
+    
+    def _take(self, mask, n):
+        ranges, costs = self.segments
+        start = ranges[:, 0] + self._taken
+        remaining = np.where(mask, ranges[:, 1] - start, 0)
+        
+        # take tasks from the start of each (selected) segment, in order, until we have n
+        n_before = np.cumsum(remaining) - remaining
+        n_take = np.clip(max(n, 0) - n_before, 0, remaining)
+        
+        I = np.flatnonzero(n_take)
+        self._taken[I] += n_take[I]
+        return np.stack([start[I], start[I] + n_take[I]], 1), costs[I]
+    
+    def get_local(self, n):
+        """
+        Get up to `n` local tasks (which have not already been returned by a previous call)
+        
+        Returns
+        -------
+        ranges : np.ndarray
+            (N, 2) array of [start, end) task ID ranges
+        costs : np.ndarray
+            the cost of each task in the corresponding range
+        """
+        return self._take(self.segments[1] <= self.LOCAL_THRESHOLD, n)
+    
+    def get_any(self, n):
+        """
+        Get up to `n` tasks, regardless of locality (excluding those already returned by a previous call)
+        
+        Returns
+        -------
+        ranges : np.ndarray
+            (N, 2) array of [start, end) task ID ranges
+        costs : np.ndarray
+            the cost of each task in the corresponding range
+        """
+        return self._take(np.ones(len(self.segments[1]), bool), n)
                 
             
         
@@ -166,6 +402,13 @@ class NodeServer(object):
         self._update_tasks_lock = threading.Lock()
 
         self._num_connection_fails = 0
+        
+        # range encoded, incremental, adverts (falls back to legacy adverts if the ruleserver doesn't support them)
+        self._use_range_adverts = config.get('nodeserver-range-adverts', True)
+        self._advert_version = -1
+        self._adverts = {}
+        
+        self._local_files = LocalFileMap()
 
         #set up threads to poll the distributor and announce ourselves and get and return tasks
         self.handinSession = requests.Session()
@@ -207,6 +450,55 @@ class NodeServer(object):
               
         
 
+    def _get_range_adverts(self):
+        """
+        Get range encoded adverts from the ruleserver (only those which have changed since our last call are
+        transmitted - see `ruleserver.RuleServer.task_advertisements`), and update our cached adverts.
+        
+        Returns
+        -------
+        rules : list of dict or None
+            range encoded adverts (with 'availableTasks' rather than the 'availableTaskIDs' of legacy adverts, see
+            `Rater`), or None if the ruleserver does not support range encoded adverts. Empty if the request failed
+            (we will try again on the next update).
+        """
+        url = self.distributor_url + 'task_advertisements?encoding=ranges&since=%d' % self._advert_version
+        r = self.taskSession.get(url, timeout=120)
+        if r.status_code != 200:
+            # most likely transient (e.g. ruleserver overloaded), don't give up on range encoding
+            logger.error('Error getting task adverts (status %d), will retry' % r.status_code)
+            return []
+        
+        try:
+            resp = json.loads(r.content)
+        except ValueError:
+            logger.error('Could not parse task adverts, will retry')
+            return []
+        
+        if isinstance(resp, list):
+            # older ruleservers ignore the parameters and return a list of legacy adverts
+            logger.info('Ruleserver does not support range encoded adverts, falling back to legacy adverts')
+            self._use_range_adverts = False
+            return None
+        
+        for advert in resp['adverts']:
+            cached = self._adverts.get(advert['ruleID'], {})
+            # inputs are only sent the first time we see a rule
+            advert.setdefault('inputsByTask', cached.get('inputsByTask', {}))
+            self._adverts[advert['ruleID']] = advert
+        
+        rule_ids = resp['ruleIDs']
+        self._adverts = {ruleID: self._adverts[ruleID] for ruleID in rule_ids if ruleID in self._adverts}
+        
+        if len(self._adverts) < len(rule_ids):
+            # we've got out of sync with the server - get everything next time
+            logger.warning('Missing adverts for some rules, requesting full adverts')
+            self._advert_version = -1
+        else:
+            self._advert_version = resp['version']
+            
+        return [self._adverts[ruleID] for ruleID in rule_ids if ruleID in self._adverts]
+    
     def _update_tasks(self):
         """Update our task queue"""
         #logger.debug('Updating tasks')
@@ -226,55 +518,43 @@ class NodeServer(object):
             
             try:
                 #get adverts
-                url = self.distributor_url + 'task_advertisements'
-                r = self.taskSession.get(url, timeout=120)
-                rules = json.loads(r.content) #r.json()
+                url, r = None, None
+                rules = None
+                if self._use_range_adverts:
+                    rules = self._get_range_adverts()
+                    
+                if rules is None:
+                    url = self.distributor_url + 'task_advertisements'
+                    r = self.taskSession.get(url, timeout=120)
+                    rules = json.loads(r.content) #r.json()
                 
                 #decide which tasks to bid on
                 n_tasks = 0
                 task_requests = []
-                raters = [Rater(rule) for rule in rules]
+                raters = [Rater(rule, self._local_files) for rule in rules]
                 templates_by_ID = {rule['ruleID']: rule['taskTemplate'] for rule in rules}
                 inputs_by_ID = {rule['ruleID']: rule.get('inputsByTask', {}) for rule in rules}
                 
                 #try to get local tasks
                 for rater in raters:
-                    taskIDs = []
-                    costs = []
-                    try:
-                        while n_tasks < n_tasks_to_request:
-                            taskID, cost = rater.get_local()
-                            taskIDs.append(taskID)
-                            costs.append(cost)
-                            n_tasks += 1
-                    except StopIteration:
-                        pass
+                    ranges, costs = rater.get_local(n_tasks_to_request - n_tasks)
                     
                     if len(costs) > 0:  # don't bother with empty bids
-                        task_requests.append(dict(ruleID=rater.rule['ruleID'], taskIDs=taskIDs, costs=costs))
+                        task_requests.append(self._make_bid(rater.rule['ruleID'], ranges, costs))
+                        n_tasks += task_ranges.n_in_ranges(ranges)
                     
                     if n_tasks >= n_tasks_to_request:
                         break
                         
                 if n_tasks < 1 and config.get('rulenodeserver-nonlocal', True):
                     # only bid on non-local if we haven't found any local tasks
-                    #logger.debug('Found %d local tasks' % n_tasks)
-                    #logger.debug('Could not find enough local tasks, bidding on non-local')
                     #bid for non-local tasks
                     for rater in raters:
-                        taskIDs = []
-                        costs = []
-                        try:
-                            while n_tasks < n_tasks_to_request:
-                                taskID, cost = rater.get_any()
-                                taskIDs.append(taskID)
-                                costs.append(cost)
-                                n_tasks += 1
-                        except StopIteration:
-                            pass
+                        ranges, costs = rater.get_any(n_tasks_to_request - n_tasks)
     
                         if len(costs) > 0:  # don't bother with empty bids
-                            task_requests.append(dict(ruleID=rater.rule['ruleID'], taskIDs=taskIDs, costs=costs))
+                            task_requests.append(self._make_bid(rater.rule['ruleID'], ranges, costs))
+                            n_tasks += task_ranges.n_in_ranges(ranges)
     
                         if n_tasks >= n_tasks_to_request:
                             break
@@ -298,7 +578,12 @@ class NodeServer(object):
                     template = templates_by_ID[ruleID]
                     rule_inputs = inputs_by_ID[ruleID]
                     logging.debug('rule_inputs:' + repr(rule_inputs))
-                    for taskID in bid['taskIDs']:
+                    if 'taskRanges' in bid:
+                        taskIDs = task_ranges.ids_from_ranges(bid['taskRanges'])
+                    else:
+                        taskIDs = bid['taskIDs']
+                        
+                    for taskID in taskIDs:
                         
                         logging.debug('taskID: ' + repr(taskID) )
                         taskInputs = json.dumps(rule_inputs.get(u'%s' % taskID, {}))
@@ -324,6 +609,14 @@ class NodeServer(object):
                 logger.exception('Error getting tasks')
                 print(url, r)
                 
+    def _make_bid(self, ruleID, ranges, costs):
+        """ Bid on [start, end) ranges of tasks, with a cost per task for each range (see `Rater.get_local`)"""
+        if self._use_range_adverts:
+            # the ruleserver supports range encoding
+            return dict(ruleID=ruleID, taskRanges=np.asarray(ranges, 'i8').tolist(), costs=[float(c) for c in costs])
+        
+        taskIDs, costs = task_ranges.decode_bid(ranges, costs)
+        return dict(ruleID=ruleID, taskIDs=[int(t) for t in taskIDs], costs=[float(c) for c in costs])
 
     def _do_handins(self):
         #TODO - FIXME to make rule-based
@@ -748,16 +748,34 @@ class LocalisationRule(Rule):
         self.mdh = metadata
         self.start_at = startAt
         self.serverfilter = serverfilter
+        
+        # number of frames per task. When > 1, task IDs are block indices rather than frame indices and each task
+        # fits a contiguous block of frames (see `remFitBuf.fitBlockTask`).
+        self.block_size = int(metadata.getOrDefault('Analysis.BlockSize', 1))
     
     def _task_template(self, context):
+        if self.block_size > 1:
+            taskdef = {'blockIndex': '{{taskID}}', 'blockSize': self.block_size, 'startAt': self.start_at,
+                       'metadata': self.results_md_uri}
+        else:
+            taskdef = {'frameIndex': '{{taskID}}', 'metadata': self.results_md_uri}
+            
         tt = {'id': '{{ruleID}}~{{taskID}}',
               'type': 'localization',
-              'taskdef': {'frameIndex': '{{taskID}}', 'metadata': self.results_md_uri},
+              'taskdef': taskdef,
               'inputs': {'frames': self.dataSourceID},
               'outputs': {'fitResults': self.worker_resultsURI + '/FitResults',
                           'driftResults': self.worker_resultsURI + '/DriftResults'}
               }
         return json.dumps(tt)
+    
+    def _n_tasks(self, n_frames):
+        """ Number of tasks needed to cover n_frames frames. Partial blocks at the end of the series are only counted
+        once the data is complete (a block task fits all of its frames in one go, so they all need to be present)."""
+        if self.data_complete:
+            return -(-n_frames // self.block_size)
+        else:
+            return n_frames // self.block_size
 
     def prepare(self):
         """
@@ -786,7 +804,7 @@ class LocalisationRule(Rule):
         self._next_release_start = self.start_at
         self.frames_outstanding=self.total_frames - self._next_release_start
         if self.data_complete:
-            return dict(max_tasks=self.total_frames)
+            return dict(max_tasks=self._n_tasks(self.total_frames))
         return {}
     
     @property
@@ -828,6 +846,17 @@ class LocalisationRule(Rule):
 
         if numTotalFrames <= self._next_release_start:
             raise NoNewTasks('not new localisation tasks available at this time')
+        elif self.block_size > 1:
+            # tasks are blocks of frames
+            release_start = self._next_release_start // self.block_size
+            release_end = min(release_start + max(100000 // self.block_size, 1), self._n_tasks(numTotalFrames))
+            if release_end <= release_start:
+                raise NoNewTasks('no complete blocks of frames available at this time')
+            
+            self._next_release_start = min(release_end*self.block_size, numTotalFrames)
+            self.frames_outstanding = numTotalFrames - self._next_release_start
+            
+            return release_start, release_end
         else:
             logging.debug('we have unpublished frames - push them')
             release_end = min(self._next_release_start + 100000, numTotalFrames)
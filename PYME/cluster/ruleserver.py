@@ -38,6 +38,7 @@ import sys
 import ujson as json
 #import json
 import os
+import re
 
 from PYME.misc import computerName
 from PYME import config
@@ -50,14 +51,27 @@ import uuid
 
 import numpy as np
 
+from PYME.cluster import task_ranges
+from PYME.cluster import auction
+
 class Rule(object):
     pass
 
-STATUS_UNAVAILABLE, STATUS_AVAILABLE, STATUS_ASSIGNED, STATUS_COMPLETE, STATUS_FAILED = range(5)
+# global advert version counter. Incremented every time the set of tasks advertised by any rule changes, allowing
+# clients to request only the adverts which have changed since their last request (see RuleServer.task_advertisements)
+_advert_version = 0
+_advert_version_lock = threading.Lock()
 
-Bid = collections.namedtuple('Bid', 'bidder_id, cost')
+def _next_advert_version():
+    global _advert_version
+    with _advert_version_lock:
+        _advert_version += 1
+        return _advert_version
 
-DEFAULT_BID = Bid(0, sys.maxsize)
+def current_advert_version():
+    return _advert_version
+
+STATUS_UNAVAILABLE, STATUS_AVAILABLE, STATUS_ASSIGNED, STATUS_COMPLETE, STATUS_FAILED = range(5)
 
 class IntegerIDRule(Rule):
     """
@@ -196,6 +210,12 @@ class IntegerIDRule(Rule):
         
         self._rule_timeout = rule_timeout
         self._cached_advert = None
+        self._cached_range_advert = None
+        
+        # advert versioning for incremental (range encoded) adverts
+        self.version = 0 # advert version at which our available tasks last changed
+        self._advert_start_version = 0 # advert version at which we started advertising (after having no tasks available)
+        self._was_advertised = False
         self._active = True # making this rule inactive will cause it not to generate adverts (this is the closest we  get to aborting)
         self._seen_as_finished = False # flag to make sure completion logic only gets triggered once.
         
@@ -216,9 +236,8 @@ class IntegerIDRule(Rule):
         
         self.expiry = time.time() + self._rule_timeout
         
-        # store pending bids
-        self._pending_bids = {}
-        self._current_bidder_id = 0
+        # allocation of contested (non-local) tasks
+        self._auction = auction.AuctionEngine()
               
         self._info_lock = threading.Lock()
         self._advert_lock = threading.Lock()
@@ -263,6 +282,19 @@ class IntegerIDRule(Rule):
         self.nAvailable = int((self._task_info['status'] == STATUS_AVAILABLE).sum())
         self.nAssigned = int((self._task_info['status'] == STATUS_ASSIGNED).sum())
         
+    def _bump_version(self):
+        """Invalidate our cached adverts and record the advert version at which our available tasks changed"""
+        v = _next_advert_version()
+        with self._advert_lock:
+            self.version = v
+            advertised = self._active and (self.nAvailable > 0)
+            if advertised and not self._was_advertised:
+                self._advert_start_version = v
+            self._was_advertised = advertised
+            
+            self._cached_advert = None
+            self._cached_range_advert = None
+        
     def _update_cost(self):
         av_cost = np.mean(self._task_info['cost'][self._task_info['status'] > STATUS_AVAILABLE])
         if np.isnan(av_cost):
@@ -303,20 +335,24 @@ class IntegerIDRule(Rule):
 
         self.expiry = time.time() + self._rule_timeout
         
-        with self._advert_lock:
-            self._cached_advert = None
+        self._bump_version()
             
     def bid(self, bid):
-        """Bid on tasks (and return any that match). Note the current implementation is very naive and doesn't
-        check bid cost - i.e. the first bid gets the task. This works if (and only if) the clients are well behaved
-        and preferentially bid on tasks which have a lowest cost for them.
+        """Bid on tasks (and return any that match). If all the bid costs are below `COST_THRESHOLD` the tasks are
+        awarded immediately (first come, first served). Otherwise the bid goes to auction with any other bids received
+        within a short window, and tasks are allocated to minimise the total cost (see :mod:`PYME.cluster.auction`).
         
         Parameters
         ----------
         
         bid : dict
             A dictionary containing the ruleID, the IDs of the tasks to bid on, and their costs
-            ``{"ruleID" : str ,"taskIDs" : [list of int],"taskCosts" : [list of float]}``
+            ``{"ruleID" : str ,"taskIDs" : [list of int],"costs" : [list of float]}``. An optional "maxTasks" entry
+            limits the number of tasks awarded, allowing bidders to bid on more tasks than they want and giving the
+            auction more freedom in how it allocates tasks.
+            
+            or, in range encoded form (see :func:`PYME.cluster.task_ranges.encode_bid`), with a cost for each range
+            ``{"ruleID" : str ,"taskRanges" : [list of [start, end)],"costs" : [list of float]}``
         
         Returns
         -------
@@ -324,45 +360,35 @@ class IntegerIDRule(Rule):
         successful_bids: dict
             A dictionary containing the ruleID, the IDs of the tasks awarded, and the rule template
             ``{"ruleID" : ruleID, "taskIDs": [list of int], "template" : "<rule template>"}``
+            
+            or, for range encoded bids, the ranges of tasks awarded (the template is omitted as it is part of the
+            range encoded advert) ``{"ruleID" : ruleID, "taskRanges": [list of [start, end)]}``
         
         """
+        range_encoded = 'taskRanges' in bid
+        
         if not self._active:
             # don't accept any bids
+            if range_encoded:
+                return {'ruleID': bid['ruleID'], 'taskRanges': []}
             return {'ruleID': bid['ruleID'], 'taskIDs':[], 'template' : ''}
         
-        taskIDs = np.array(bid['taskIDs'], 'i')
-        costs = np.array(bid['costs'], 'f4')
+        if range_encoded:
+            taskIDs, costs = task_ranges.decode_bid(bid['taskRanges'], bid['costs'])
+            taskIDs = taskIDs.astype('i')
+        else:
+            taskIDs = np.array(bid['taskIDs'], 'i')
+            costs = np.array(bid['costs'], 'f4')
         
         if np.all(costs < self.COST_THRESHOLD):
             # all tasks are below the "Buy Now" threshold, take a shortcut and directly award them to the bidder bypassing
             # the rest of the biddng process. This enables high performance on localisation tasks
             pass
         else:
-            # NOTE: this bidding code is not high-performance. This is probably OK as code is bypassed in normal
-            # localisation scenario but might need to be revisited as it will be triggered in mixed cases where
-            # some bids are local and some are not.
-            with self._info_lock:
-                # get a unique bidder ID
-                self._current_bidder_id += 1
-                bidder_id = self._current_bidder_id
-                
-                # record bids
-                for taskID, cost in zip(taskIDs, costs):
-                    # get existing winning bid
-                    _, winning_cost = self._pending_bids.get(taskID, DEFAULT_BID)
-                    if cost < winning_cost:
-                        # if we have a lower cost, over-write the winning bid
-                        self._pending_bids[taskID] = Bid(bidder_id, cost)
-            
-            #wait for other bids
-            time.sleep(0.2) #TODO - make this time configurable??
-            
-            with self._info_lock:
-                # filter our tasks to only keep the wining ones
-                winners = [self._pending_bids[taskID].bidder_id==bidder_id for taskID in taskIDs]
-                
-                taskIDs = taskIDs[winners]
-                costs = costs[winners]
+            # some tasks are non-local - allocate (in batches with any concurrent bids) to the lowest cost bidders.
+            won = self._auction.submit(taskIDs, costs, bid.get('maxTasks', None))
+            taskIDs = taskIDs[won]
+            costs = costs[won]
         
         
         with self._info_lock:
@@ -380,8 +406,10 @@ class IntegerIDRule(Rule):
 
         self.expiry = time.time() + self._rule_timeout
         
-        with self._advert_lock:
-            self._cached_advert = None
+        self._bump_version()
+        
+        if range_encoded:
+            return {'ruleID': bid['ruleID'], 'taskRanges': task_ranges.ranges_from_ids(successful_bid_ids).tolist()}
             
         return {'ruleID': bid['ruleID'], 'taskIDs':successful_bid_ids.tolist(), 'template' : self._template}
     
@@ -427,6 +455,10 @@ class IntegerIDRule(Rule):
             self.nAssigned -= nTasks
 
         self.expiry = time.time() + self._rule_timeout
+        
+        if n_not_assigned > 0:
+            # tasks which had timed out (and been made available again) are now complete
+            self._bump_version()
             
     @property
     def advert(self):
@@ -457,6 +489,35 @@ class IntegerIDRule(Rule):
                         self._cached_advert['inputsByTask'] = {taskID: self._inputs_by_task[taskID] for taskID in availableTasks}
                 
             return self._cached_advert
+        
+    @property
+    def range_advert(self):
+        """ Compact version of the task advertisement, with available tasks range encoded.
+        
+        If the rule has tasks available, a dictionary of the form:
+        ``{"ruleID" : str, "taskTemplate" : str, "availableTasks" : <encoded task IDs>, "nAvailable" : int, "version" : int}``
+        
+        where "availableTasks" is encoded using :func:`PYME.cluster.task_ranges.encode_available`. Unlike
+        :attr:`advert`, this does not include inputs - see :meth:`RuleServer.task_advertisements`.
+        """
+        if not self._active:
+            return None
+        
+        with self._advert_lock:
+            if self._cached_range_advert is None:
+                available = self._task_info['status'] == STATUS_AVAILABLE
+                n_available = int(available.sum())
+                
+                if n_available == 0:
+                    self._cached_range_advert = False
+                else:
+                    self._cached_range_advert = {'ruleID' : self.ruleID,
+                                                 'taskTemplate': self._template,
+                                                 'availableTasks': task_ranges.encode_available(available),
+                                                 'nAvailable' : n_available,
+                                                 'version' : self.version}
+            
+            return self._cached_range_advert or None
     
     # @property
     # def nAvailable(self):
@@ -494,11 +555,38 @@ class IntegerIDRule(Rule):
         
         return (self.nAvailable == 0) and ((self.nCompleted + self.nFailed) >= self._n_max)
     
+    def finalise_results(self):
+        """
+        Finalise any aggregated results files (``__aggregate_h5r`` outputs in the task template) which the tasks of this
+        rule have been writing to, so that all results are on disk before any chained rules start reading them (see
+        :func:`PYME.IO.clusterResults.finaliseResults`). Called once, when the rule has finished.
+        """
+        from PYME.IO import clusterResults
+        
+        try:
+            outputs = json.loads(self._template).get('outputs', {})
+        except (ValueError, AttributeError):
+            # not a json task template, or one without output files
+            return
+        
+        results_files = set()
+        for uri in outputs.values():
+            # skip outputs which are filled in per task (these are not aggregated)
+            if '__aggregate_h5r' in uri and not '{{' in uri:
+                results_files.add(re.sub(r'(\.h5r|\.hdf)/.*$', r'\1', uri))
+        
+        for uri in results_files:
+            try:
+                clusterResults.finaliseResults(uri)
+            except Exception:
+                logger.exception('Error finalising results file %s for rule %s' % (uri, self.ruleID))
+    
     def inactivate(self):
         """
         Mark rule as inactive (generates no adverts) to facilitate aborting / pausing long-running rules.
         """
         self._active = False
+        self._bump_version()
     
     def info(self):
         """
@@ -522,6 +610,7 @@ class IntegerIDRule(Rule):
                   'tasksCompleteAfterTimeout' : self.n_returned_after_timeout,
                   'finished' : self.finished,
                   'expired' : self.expired,
+                  'auction' : self._auction.stats(),
                 }
     
     def poll_timeouts(self):
@@ -547,9 +636,12 @@ class IntegerIDRule(Rule):
                 self.nFailed += int(retry_failed.sum())
                 
                 #self._update_nums()
-            
-        with self._advert_lock:
-            self._cached_advert = None
+        
+        if nTimedOut > 0:
+            self._bump_version()
+        else:
+            with self._advert_lock:
+                self._cached_advert = None
         
         
     
@@ -588,9 +680,16 @@ class RuleServer(object):
         
         self._rule_lock = threading.Lock() # lock for when we modify the dictionary of rules
         
+        # finished rules, waiting for their results to be finalised (see _finalise_rules)
+        self._finalise_queue = Queue.Queue()
+        
         self.rulePollThread = threading.Thread(target=self._poll_rules)
         self.rulePollThread.start()
         
+        self.finaliseThread = threading.Thread(target=self._finalise_rules)
+        self.finaliseThread.daemon = True
+        self.finaliseThread.start()
+        
         with open(os.path.join(resources.get_web_dir(),  'ruleserver.html'), 'r') as f:
             self._status_page = f.read()
     
@@ -621,23 +720,9 @@ class RuleServer(object):
                             # Allow some time so that rules can be seen as complete in the GUI
                             r.expiry = time.time() + self._finished_rule_timeout
                         
-                        follow_on = r.on_completion
-                        if follow_on is not None:
-                            # if a follow on rule is defined, add it
-                            template = follow_on['template']
-                            n_tasks = follow_on.get('max_tasks', 1)
-                            timeout = follow_on.get('rule_timeout', 3600.)
-                            ruleID = '%06d-%s' % (self._rule_n, uuid.uuid4().hex)
-        
-                            rule = IntegerIDRule(ruleID, template, max_task_ID=int(n_tasks),
-                                                rule_timeout=float(timeout), on_completion=follow_on.get('on_completion', None))
-        
-                            rule.make_range_available(0, int(n_tasks))
-        
-                            with self._rule_lock:
-                                self._rules[ruleID] = rule
-        
-                            self._rule_n += 1
+                        # Finalise aggregated results (and then chain any follow-on rule, which might read them) on
+                        # a separate thread, so that a slow dataserver doesn't hold up polling of the other rules.
+                        self._finalise_queue.put(r)
                     
                 
                 #remore queue if expired (no activity for an hour) to free up memory
@@ -649,6 +734,36 @@ class RuleServer(object):
             
             time.sleep(5)
     
+    def _finalise_rules(self):
+        while self._do_poll:
+            try:
+                r = self._finalise_queue.get(timeout=1)
+            except Queue.Empty:
+                continue
+            
+            # make sure aggregated results are written before anything downstream reads them
+            r.finalise_results()
+            self._add_follow_on(r)
+    
+    def _add_follow_on(self, r):
+        follow_on = r.on_completion
+        if follow_on is not None:
+            # if a follow on rule is defined, add it
+            template = follow_on['template']
+            n_tasks = follow_on.get('max_tasks', 1)
+            timeout = follow_on.get('rule_timeout', 3600.)
+            ruleID = '%06d-%s' % (self._rule_n, uuid.uuid4().hex)
+
+            rule = IntegerIDRule(ruleID, template, max_task_ID=int(n_tasks),
+                                rule_timeout=float(timeout), on_completion=follow_on.get('on_completion', None))
+
+            rule.make_range_available(0, int(n_tasks))
+
+            with self._rule_lock:
+                self._rules[ruleID] = rule
+
+            self._rule_n += 1
+    
     def stop(self):
         self._do_poll = False
         
@@ -656,20 +771,42 @@ class RuleServer(object):
         #    queue.stop()
             
     @webframework.register_endpoint('/task_advertisements')
-    def task_advertisements(self):
+    def task_advertisements(self, encoding=None, since=None):
         """
         HTTP endpoint (GET) for retrieving task advertisements.
         
         Note - by default, a limited number of advertisements are posted at any given time (to limit bandwidth). This
         should be enough to keep all the workers busy, with new adverts being posted once tasks are assigned to workers.
         
+        Parameters
+        ----------
+        encoding : str, optional
+            If omitted, return the legacy advert format (every available task ID listed explicitly). If "ranges", return
+            compact, incremental, adverts (see below). Clients should fall back to the legacy format if the server
+            does not understand this parameter (older versions return an error).
+        since : int, optional
+            (ranges encoding only) the "version" returned by the client's previous request. Only adverts for rules
+            which have changed since this version are returned.
+        
         Returns
         -------
         
         adverts : json str
             List of advertisements. See :attr:`IntegerIDRule.advert`
+            
+            or, for the "ranges" encoding, a dictionary of the form:
+            ``{"version" : int, "ruleIDs" : [list of str], "adverts" : [list of adverts]}``. "ruleIDs" lists all
+            rules which currently have tasks available (clients should discard cached adverts for any rules not in
+            this list) and "adverts" the :attr:`IntegerIDRule.range_advert` for those which changed since `since`.
+            If a rule is new to the client, its advert also includes the "inputsByTask" dictionary (recipes only),
+            which clients should cache.
 
         """
+        if encoding == 'ranges':
+            return self._range_advertisements(since)
+        elif encoding is not None:
+            raise ValueError('Unknown advert encoding: %s' % encoding)
+        
         with self._advert_lock:
             t = time.time()
             if (t > self._cached_advert_expiry):
@@ -691,6 +828,30 @@ class RuleServer(object):
                 self._cached_advert_expiry = time.time() + 1 #regenerate advert once every second
             
         return self._cached_advert
+    
+    def _range_advertisements(self, since=None):
+        since = -1 if since is None else int(since)
+        
+        # NB - get the version before looking at the rules so that any changes made while we are generating adverts
+        # are included in the client's next request.
+        version = current_advert_version()
+        
+        rule_ids = []
+        adverts = []
+        for rule in list(self._rules.values()):
+            advert = rule.range_advert
+            if advert is None:
+                continue
+            
+            rule_ids.append(rule.ruleID)
+            if rule.version > since:
+                if (rule._inputs_by_task is not None) and (rule._advert_start_version > since):
+                    # rule is new to the client
+                    advert = dict(advert, inputsByTask=rule._inputs_by_task)
+                    
+                adverts.append(advert)
+        
+        return json.dumps({'version': version, 'ruleIDs': rule_ids, 'adverts': adverts})
         
         
     @webframework.register_endpoint('/bid_on_tasks')
@@ -702,8 +863,9 @@ class RuleServer(object):
         ----------
         body : json list of bids
             A list of bids, each of which is a dictionary of the form
-            ``{"ruleID" : str ,"taskIDs" : [list of int],"taskCosts" : [list of float]}``
-            see :meth:`IntegerIDRule.Bid` for details.
+            ``{"ruleID" : str ,"taskIDs" : [list of int],"costs" : [list of float]}``
+            or range encoded bids ``{"ruleID" : str ,"taskRanges" : [list of [start, end)],"costs" : [list of float]}``.
+            See :meth:`IntegerIDRule.bid` for details.
 
         Returns
         -------
@@ -917,18 +1079,36 @@ class RuleServer(object):
         -------
         
         status: json str
-            A dictionary of the form ``{"ok" : True, "result" : {ruleID0 : rule0.info(), ruleID1 : rule1.info()}}``
-            See :meth:`IntegerIDRule.info`.
+            A dictionary of the form ``{"ok" : True, "result" : {ruleID0 : rule0.info(), ruleID1 : rule1.info()},
+            "auction" : {...}}``. See :meth:`IntegerIDRule.info`. "auction" summarises the auction statistics (latency and
+            win rates for contested bids) across all current rules, see :meth:`PYME.cluster.auction.AuctionEngine.stats`.
         """
         with self._info_lock:
             t = time.time()
             if (t > self._cached_info_expiry):
                 with self._rule_lock:
-                    self._cached_info = json.dumps({'ok': True, 'result': {qn: self._rules[qn].info() for qn in self._rules.keys()}})
+                    result = {qn: self._rules[qn].info() for qn in self._rules.keys()}
+                    self._cached_info = json.dumps({'ok': True, 'result': result,
+                                                    'auction': self._auction_summary([r['auction'] for r in result.values()])})
                 self._cached_info_expiry = time.time() + self._cached_info_timeout
                 
         return self._cached_info
     
+    @staticmethod
+    def _auction_summary(stats):
+        n_auctions = sum([st['auctions'] for st in stats])
+        n_bids = sum([st['bids'] for st in stats])
+        n_tasks_bid = sum([st['tasksBid'] for st in stats])
+        n_tasks_won = sum([st['tasksWon'] for st in stats])
+        return {'auctions': n_auctions,
+                'bids': n_bids,
+                'tasksBid': n_tasks_bid,
+                'tasksWon': n_tasks_won,
+                'winRate': float(n_tasks_won)/n_tasks_bid if n_tasks_bid else 0.0,
+                'meanLatency': sum([st['meanLatency']*st['bids'] for st in stats])/n_bids if n_bids else 0.0,
+                'maxLatency': max([st['maxLatency'] for st in stats] + [0.0]),
+                }
+    
     @webframework.register_endpoint('/queue_info_longpoll')
     def get_queue_info(self):
         """
@@ -201,6 +201,112 @@ Traceback:
         return {'recipe': self.taskDescr['taskdef'].get('recipe', 'see taskdef.recipeURI')}
         
 
+def run_task(taskDescr, recipe_cache):
+    """
+    Run a single (localization or recipe) task
+
+    Parameters
+    ----------
+    taskDescr : dict
+        the task description, as received from the nodeserver
+    recipe_cache : PYME.recipes.recipe_cache.RecipeCache
+        cache of constructed recipes to use for recipe tasks
+
+    Returns
+    -------
+    res : the task result - a `fitResult` for localization tasks, True for (successful) recipe tasks, or a `TaskError`
+    """
+    if taskDescr['type'] == 'localization':
+        try:
+            task = remFitBuf.createFitTaskFromTaskDef(taskDescr)
+            return task()
+
+        except:
+            import traceback
+            traceback.print_exc()
+            tb = traceback.format_exc()
+            logger.exception(tb)
+            return TaskError(taskDescr, tb)
+
+    elif taskDescr['type'] == 'recipe':
+        from PYME.recipes import modules
+
+        try:
+            taskdefRef = taskDescr.get('taskdefRef', None)
+            if taskdefRef: #recipe is defined in a file - go find it
+                recipe_yaml = unifiedIO.read(taskdefRef)
+
+            else: #recipe is defined in the task
+                recipe_yaml = taskDescr['taskdef']['recipe']
+
+            recipe_key, recipe = recipe_cache.get(recipe_yaml)
+
+            #initial context
+            context = {'data_root' : clusterIO.local_dataroot,
+                       'task_id' : taskDescr['id'].split('~')[0]}
+
+            #load recipe inputs
+            logging.debug(taskDescr)
+            recipe.load_inputs(taskDescr['inputs'])
+
+            for key, url in taskDescr['inputs'].items():
+                if key == '__sim':
+                    # special case for no-input simulation recipes
+                    # for now, essentially ignore `__sim` inputs, but propagate into context just in case
+                    # TODO?? find a way of encoding simulation parameters?
+                    context['sim_tag'] = url
+                # else:    
+                #     logging.debug('RECIPE: loading %s as %s' % (url, key))
+                #     recipe.loadInput(url, key)
+
+            #print recipe.namespace
+            recipe.execute()
+
+            #update context with file stub and input directory
+            try:
+                principle_input = taskDescr['inputs']['input'] #default input
+                context['file_stub'] = os.path.splitext(os.path.basename(principle_input))[0]
+                context['input_dir'] = unifiedIO.dirname(principle_input)
+            except KeyError:
+                pass
+
+            try:
+                od = taskDescr['output_dir']
+                # make sure we have a trailing slash
+                # TODO - this should be fine for most windows use cases, as you should generally
+                # use POSIX urls for the cluster/cluster of one, but might need checking
+                if not od.endswith('/'):
+                    od = od + '/'
+
+                context['output_dir'] = unifiedIO.dirname(od)
+            except KeyError:
+                pass
+
+            #print taskDescr['inputs']
+            #print context
+
+            #abuse outputs as context
+            outputs = taskDescr.get('outputs', None)
+            if not outputs is None:
+                context.update(outputs)
+            #print context, context['input_dir']
+            recipe.save(context)
+
+            # only re-use recipes which succeeded
+            recipe_cache.put(recipe_key, recipe)
+
+            return True
+
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            tb = traceback.format_exc()
+            logger.exception(tb)
+            return RecipeTaskError(taskDescr, tb, e)
+
+
+
+
 class taskWorker(object):
     def __init__(self, nodeserver_port):
         self.inputQueue = Queue.Queue()
@@ -212,6 +318,10 @@ class taskWorker(object):
         self._local_queue_url = 'http://127.0.0.1:%d/' % self._nodeserver_port
 
         self._loop_alive = True
+        
+        # keep constructed recipes (and the resources their modules load) around between tasks
+        from PYME.recipes.recipe_cache import RecipeCache
+        self._recipe_cache = RecipeCache()
 
     def loop_forever(self):
         self.tCompute = threading.Thread(target=self.computeLoop)
@@ -396,95 +506,219 @@ class taskWorker(object):
             #logger.debug('computeLoop-inputQueue.get()')
             queueURL, taskDescr = self.inputQueue.get()
             #logger.debug('computeLoop-%s' %taskDescr)
-            if taskDescr['type'] == 'localization':
-                try:
-                    task = remFitBuf.createFitTaskFromTaskDef(taskDescr)
-                    res = task()
-
-                    self.resultsQueue.put((queueURL, taskDescr, res))
+            self.resultsQueue.put((queueURL, taskDescr, run_task(taskDescr, self._recipe_cache)))
 
-                except:
-                    import traceback
-                    traceback.print_exc()
-                    tb = traceback.format_exc()
-                    logger.exception(tb)
-                    self.resultsQueue.put((queueURL, taskDescr, TaskError(taskDescr, tb)))
-                    #self.resultsQueue.put((queueURL, taskDescr, None))
+        
+def _pool_worker(ring, job_queue, done_queue, current_job=None):
+    """
+    Main loop for the processes in a `PooledTaskWorker` pool. Runs tasks from `job_queue`, reading localization frames
+    from the shared memory `ring`, and puts ``(job_id, result)`` on `done_queue`. The ID of the job being run (-1 if
+    idle) is kept in `current_job` (a shared ``multiprocessing.Value``), so that it can be failed if this process dies.
+    """
+    import pickle
+    from PYME.recipes.recipe_cache import RecipeCache
+    from PYME.util.shmarray.frame_ring import RingDataSource, series_key
+    
+    remFitBuf.bufferManager.dataSourceWrapper = lambda ds, dataSourceID: RingDataSource(ds, ring, series_key(dataSourceID))
+    recipe_cache = RecipeCache()
+    
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+            
+        job_id, taskDescr = job
+        if current_job is not None:
+            current_job.value = job_id
+            
+        res = run_task(taskDescr, recipe_cache)
+        
+        if isinstance(res, TaskError):
+            try:
+                pickle.dumps(res.exception)
+            except Exception:
+                # the error report is still useful without the exception object
+                res.exception = None
+            
+        done_queue.put((job_id, res))
+        
+        if current_job is not None:
+            current_job.value = -1
 
-            elif taskDescr['type'] == 'recipe':
-                from PYME.recipes import Recipe
-                from PYME.recipes import modules
 
+class PooledTaskWorker(taskWorker):
+    """
+    A task worker which runs tasks on a pool of worker processes, rather than in this process.
+    
+    A single worker per node (rather than one per core) talks to the nodeserver, reads and decompresses the frames each
+    localization task needs and places them in a shared memory ring (see :mod:`PYME.util.shmarray.frame_ring`), where
+    the pool processes can read them without each fetching them from the cluster. Frames which are needed by several
+    tasks (e.g. for background estimation) are only fetched once. Frames which are not in the ring (e.g. because it was
+    full) are fetched directly by the pool process.
+    
+    Parameters
+    ----------
+    nodeserver_port : int
+    n_workers : int
+        number of pool processes
+    ring_frames : int
+        number of frames in the shared memory ring. Defaults to the ``taskworker-pool-ring-frames`` config option (128).
+    ring_slot_mb : float
+        maximum size of a frame (in MB). Defaults to the ``taskworker-pool-ring-slot-mb`` config option (8).
+    """
+    def __init__(self, nodeserver_port, n_workers, ring_frames=None, ring_slot_mb=None):
+        import multiprocessing
+        from PYME.util.shmarray.frame_ring import SharedFrameRing
+        
+        taskWorker.__init__(self, nodeserver_port)
+        
+        if ring_frames is None:
+            ring_frames = config.get('taskworker-pool-ring-frames', 128)
+        if ring_slot_mb is None:
+            ring_slot_mb = config.get('taskworker-pool-ring-slot-mb', 8)
+        
+        self.n_workers = int(n_workers)
+        
+        # NB - the ring must exist before the pool processes are started
+        self._ring = SharedFrameRing(ring_frames, int(ring_slot_mb*1024*1024))
+        self._job_queue = multiprocessing.Queue(maxsize=2*self.n_workers)
+        self._done_queue = multiprocessing.Queue()
+        
+        self._jobs = {} # job_id -> (queueURL, taskDescr, pinned ring slots)
+        self._jobs_lock = threading.Lock()
+        self._next_job_id = 0
+        
+        self._datasources = {}
+        
+        # the job each pool process is running (-1 if idle)
+        self._current_jobs = [multiprocessing.Value('q', -1) for i in range(self.n_workers)]
+        self._procs = [self._start_process(i) for i in range(self.n_workers)]
+        
+    def _start_process(self, i):
+        import multiprocessing
+        self._current_jobs[i].value = -1
+        p = multiprocessing.Process(target=_pool_worker, args=(self._ring, self._job_queue, self._done_queue,
+                                                               self._current_jobs[i]))
+        p.daemon = True
+        p.start()
+        return p
+    
+    def loop_forever(self):
+        self.tCollect = threading.Thread(target=self.collectLoop)
+        self.tCollect.daemon = True
+        self.tCollect.start()
+        
+        try:
+            taskWorker.loop_forever(self)
+        finally:
+            for p in self._procs:
+                p.terminate()
+    
+    def _get_datasource(self, dataSourceID):
+        ds = self._datasources.get(dataSourceID, None)
+        if ds is None:
+            import PYME.IO.DataSources
+            
+            if len(self._datasources) > 10:
+                self._datasources.clear()
+            
+            ds = PYME.IO.DataSources.getDataSourceForFilename(dataSourceID)(dataSourceID, None)
+            self._datasources[dataSourceID] = ds
+            
+        return ds
+    
+    def _prefetch(self, taskDescr):
+        """Read the frames a localization task needs into the ring. Returns a list of (pinned) ring slots."""
+        from PYME.util.shmarray.frame_ring import series_key
+        
+        task = remFitBuf.createFitTaskFromTaskDef(taskDescr)
+        ds = self._get_datasource(task.dataSourceID)
+        key = series_key(task.dataSourceID)
+        n_frames = ds.getNumSlices()
+        
+        slots = []
+        for i in task.required_frames():
+            if i >= n_frames:
+                break
+                
+            slot = self._ring.pin(key, i)
+            if slot < 0:
+                slot = self._ring.put(key, i, ds.getSlice(i))
+                if slot < 0:
+                    # ring is full (or frame is too big) - the pool process will fetch this frame itself
+                    continue
+                    
+            slots.append(slot)
+            
+        return slots
+    
+    def computeLoop(self):
+        while self._loop_alive:
+            queueURL, taskDescr = self.inputQueue.get()
+            
+            slots = []
+            if taskDescr['type'] == 'localization':
                 try:
-                    taskdefRef = taskDescr.get('taskdefRef', None)
-                    if taskdefRef: #recipe is defined in a file - go find it
-                        recipe_yaml = unifiedIO.read(taskdefRef)
-                        
-                    else: #recipe is defined in the task
-                        recipe_yaml = taskDescr['taskdef']['recipe']
-
-                    recipe = Recipe.fromYAML(recipe_yaml)
-
-                    #initial context
-                    context = {'data_root' : clusterIO.local_dataroot,
-                               'task_id' : taskDescr['id'].split('~')[0]}
+                    slots = self._prefetch(taskDescr)
+                except:
+                    # not fatal - let the pool process try (and report the error if it also fails)
+                    logger.exception('Error prefetching frames for task %s' % taskDescr['id'])
                     
-                    #load recipe inputs
-                    logging.debug(taskDescr)
-                    recipe.load_inputs(taskDescr['inputs'])
-
-                    for key, url in taskDescr['inputs'].items():
-                        if key == '__sim':
-                            # special case for no-input simulation recipes
-                            # for now, essentially ignore `__sim` inputs, but propagate into context just in case
-                            # TODO?? find a way of encoding simulation parameters?
-                            context['sim_tag'] = url
-                        # else:    
-                        #     logging.debug('RECIPE: loading %s as %s' % (url, key))
-                        #     recipe.loadInput(url, key)
-
-                    #print recipe.namespace
-                    recipe.execute()
-
-                    #update context with file stub and input directory
-                    try:
-                        principle_input = taskDescr['inputs']['input'] #default input
-                        context['file_stub'] = os.path.splitext(os.path.basename(principle_input))[0]
-                        context['input_dir'] = unifiedIO.dirname(principle_input)
-                    except KeyError:
-                        pass
-
-                    try:
-                        od = taskDescr['output_dir']
-                        # make sure we have a trailing slash
-                        # TODO - this should be fine for most windows use cases, as you should generally
-                        # use POSIX urls for the cluster/cluster of one, but might need checking
-                        if not od.endswith('/'):
-                            od = od + '/'
-                            
-                        context['output_dir'] = unifiedIO.dirname(od)
-                    except KeyError:
-                        pass
-
-                    #print taskDescr['inputs']
-                    #print context
-
-                    #abuse outputs as context
-                    outputs = taskDescr.get('outputs', None)
-                    if not outputs is None:
-                        context.update(outputs)
-                    #print context, context['input_dir']
-                    recipe.save(context)
-
-                    self.resultsQueue.put((queueURL, taskDescr, True))
-
-                except Exception as e:
-                    import traceback
-                    traceback.print_exc()
-                    tb = traceback.format_exc()
-                    logger.exception(tb)
-                    self.resultsQueue.put((queueURL, taskDescr, RecipeTaskError(taskDescr, tb, e)))
-
+            with self._jobs_lock:
+                job_id = self._next_job_id
+                self._next_job_id += 1
+                self._jobs[job_id] = (queueURL, taskDescr, slots)
+            
+            # blocks if all the pool processes are busy and there are already tasks waiting
+            self._job_queue.put((job_id, taskDescr))
+            
+    def collectLoop(self):
+        """Collect results from the pool, release their frames, and queue them to be returned to the nodeserver"""
+        last_check = time.time()
+        while self._loop_alive:
+            try:
+                job_id, res = self._done_queue.get(timeout=1)
+            except Queue.Empty:
+                job_id = None
+            
+            # check for dead processes at least once a second, even when the other processes keep us busy with results
+            if (time.time() - last_check) >= 1:
+                self._respawn_dead()
+                last_check = time.time()
+            
+            if job_id is None:
+                continue
+            
+            with self._jobs_lock:
+                job = self._jobs.pop(job_id, None)
+                
+            if job is None:
+                # already failed when the process running it died (see _respawn_dead)
+                continue
+            
+            queueURL, taskDescr, slots = job
+            self._ring.release(slots)
+            self.resultsQueue.put((queueURL, taskDescr, res))
+            
+    def _respawn_dead(self):
+        for i, p in enumerate(self._procs):
+            if not p.is_alive():
+                logger.error('Pool process (%d) has died, spawning replacement' % p.pid)
+                
+                # fail the task it was running (if any) and release its frames. NB - a task taken from the queue just
+                # before the process died can still be lost, and will time out on the server.
+                job_id = self._current_jobs[i].value
+                with self._jobs_lock:
+                    job = self._jobs.pop(job_id, None)
+                    
+                if job is not None:
+                    queueURL, taskDescr, slots = job
+                    self._ring.release(slots)
+                    self.resultsQueue.put((queueURL, taskDescr, TaskError(taskDescr, 'Pool process (%d) died with exit '
+                                                                          'code %s while running task' % (p.pid, p.exitcode))))
+                
+                self._procs[i] = self._start_process(i)
+        
         
 def on_SIGHUP(signum, frame):
     raise RuntimeError('Recieved SIGHUP')
@@ -500,6 +734,8 @@ if __name__ == '__main__':
     op.add_argument('--profile-dir', dest='profile_dir')
     op.add_argument('-s', '--server-port', dest='server_port', type=int, default=config.get('nodeserver-port', 15347),
                     help='Optionally restrict advertisements to local machine')
+    op.add_argument('--pool', dest='pool', type=int, default=0,
+                    help='run tasks on a pool of this many worker processes (sharing a single frame fetch stage)')
     
     args = op.parse_args()
     
@@ -512,7 +748,10 @@ if __name__ == '__main__':
     
     try:
         #main()
-        tW = taskWorker(nodeserver_port=args.server_port)
+        if args.pool > 0:
+            tW = PooledTaskWorker(nodeserver_port=args.server_port, n_workers=args.pool)
+        else:
+            tW = taskWorker(nodeserver_port=args.server_port)
         tW.loop_forever()
     except KeyboardInterrupt:
         #supress error message here -  we only want to know if something bad happened
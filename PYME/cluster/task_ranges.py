@@ -0,0 +1,165 @@
+"""
+Compact encodings for sets of integer task IDs, as used in task adverts and bids between the rule server
+(:mod:`PYME.cluster.ruleserver`) and node servers (:mod:`PYME.cluster.rulenodeserver`).
+
+Task IDs are usually frame numbers (localisation) or input indices (recipes), and the set of available tasks is
+almost always a small number of contiguous runs. We therefore describe sets of task IDs as a list of half-open
+``[start, end)`` ranges. If the set is badly fragmented (e.g. after lots of tasks have timed out and been re-queued), a
+zlib compressed bitmap is used instead if it is smaller.
+
+An encoded set of task IDs (see :func:`encode_available`) is a dictionary with either a ``ranges`` key, or a ``bitmap``
+key:
+
+.. code-block:: json
+
+    {"ranges" : [[0, 1000], [1500, 2000]]}
+    {"bitmap" : {"start" : 0, "size" : 2000, "data" : "<base64 encoded, zlib compressed, np.packbits() bitmap>"}}
+"""
+import base64
+import zlib
+
+import numpy as np
+
+
+def ranges_from_mask(mask, offset=0):
+    """
+    Find runs of True values in a boolean mask.
+
+    Returns
+    -------
+    ranges : np.ndarray
+        (N, 2) array of [start, end) ranges (with `offset` added)
+    """
+    m = np.zeros(len(mask) + 2, 'i1')
+    m[1:-1] = mask
+    edges = np.flatnonzero(np.diff(m))
+    return edges.reshape(-1, 2) + offset
+
+
+def ranges_from_ids(task_ids):
+    """Convert a list of task IDs into a (N, 2) array of [start, end) ranges"""
+    task_ids = np.unique(np.asarray(task_ids, 'i8'))
+    if len(task_ids) == 0:
+        return np.zeros((0, 2), 'i8')
+
+    breaks = np.flatnonzero(np.diff(task_ids) != 1) + 1
+    starts = task_ids[np.r_[0, breaks]]
+    ends = task_ids[np.r_[breaks - 1, len(task_ids) - 1]] + 1
+    return np.stack([starts, ends], 1)
+
+
+def ids_from_ranges(ranges):
+    """Expand a list of [start, end) ranges into an array of task IDs"""
+    ranges = np.asarray(ranges, 'i8').reshape(-1, 2)
+    if len(ranges) == 0:
+        return np.zeros(0, 'i8')
+
+    return np.concatenate([np.arange(s, e) for s, e in ranges])
+
+
+def n_in_ranges(ranges):
+    ranges = np.asarray(ranges, 'i8').reshape(-1, 2)
+    return int((ranges[:, 1] - ranges[:, 0]).sum())
+
+
+def split_ranges(ranges, runs):
+    """
+    Split [start, end) ranges at the boundaries of a second set of (sorted, non-overlapping) ranges, `runs`.
+
+    Returns
+    -------
+    sub_ranges : np.ndarray
+        (N, 2) array of [start, end) ranges covering the same task IDs as `ranges`
+    inside : np.ndarray
+        boolean array, True for sub-ranges which lie within one of the `runs`
+    """
+    ranges = np.asarray(ranges, 'i8').reshape(-1, 2)
+    runs = np.asarray(runs, 'i8').reshape(-1, 2)
+    runs = runs[runs[:, 1] > runs[:, 0]]
+    boundaries = runs.ravel()
+
+    sub_ranges = [np.zeros((0, 2), 'i8')]
+    for start, end in ranges:
+        cuts = boundaries[np.searchsorted(boundaries, start, 'right'):np.searchsorted(boundaries, end, 'left')]
+        edges = np.r_[start, cuts, end]
+        sub_ranges.append(np.stack([edges[:-1], edges[1:]], 1))
+
+    sub_ranges = np.concatenate(sub_ranges)
+    sub_ranges = sub_ranges[sub_ranges[:, 1] > sub_ranges[:, 0]]
+
+    if len(runs) == 0:
+        return sub_ranges, np.zeros(len(sub_ranges), bool)
+
+    I = np.searchsorted(runs[:, 0], sub_ranges[:, 0], 'right') - 1
+    inside = (I >= 0) & (sub_ranges[:, 0] < runs[np.maximum(I, 0), 1])
+    return sub_ranges, inside
+
+
+def encode_available(mask):
+    """
+    Encode a boolean task mask (True = available) as either ranges or a compressed bitmap, whichever is smaller.
+    """
+    ranges = ranges_from_mask(mask)
+    if len(ranges) == 0:
+        return {'ranges': []}
+
+    start, end = int(ranges[0, 0]), int(ranges[-1, 1])
+
+    # ~ 16 bytes of json per range vs. 1 bit per task (before compression) plus ~ 64 bytes of overhead for the bitmap
+    if 16*len(ranges) > (end - start)/8 + 64:
+        data = zlib.compress(np.packbits(mask[start:end]).tobytes())
+        return {'bitmap': {'start': start, 'size': end - start, 'data': base64.b64encode(data).decode('ascii')}}
+
+    return {'ranges': ranges.tolist()}
+
+
+def decode_available(encoded):
+    """Decode the output of :func:`encode_available` into a (N, 2) array of ranges"""
+    if 'bitmap' in encoded:
+        bm = encoded['bitmap']
+        bits = np.unpackbits(np.frombuffer(zlib.decompress(base64.b64decode(bm['data'])), 'u1'), count=bm['size'])
+        return ranges_from_mask(bits.astype(bool), offset=bm['start'])
+
+    return np.asarray(encoded['ranges'], 'i8').reshape(-1, 2)
+
+
+def encode_bid(task_ids, costs):
+    """
+    Encode a bid as ranges of consecutive task IDs with the same cost.
+
+    Returns
+    -------
+    ranges : list
+        [start, end) ranges
+    range_costs : list
+        the cost for each task in the corresponding range
+    """
+    task_ids = np.asarray(task_ids, 'i8')
+    costs = np.asarray(costs, 'f4')
+    if len(task_ids) == 0:
+        return [], []
+
+    I = np.argsort(task_ids, kind='stable')
+    task_ids, costs = task_ids[I], costs[I]
+
+    breaks = np.flatnonzero((np.diff(task_ids) != 1) | (np.diff(costs) != 0)) + 1
+    first = np.r_[0, breaks]
+    last = np.r_[breaks - 1, len(task_ids) - 1]
+
+    return np.stack([task_ids[first], task_ids[last] + 1], 1).tolist(), costs[first].tolist()
+
+
+def decode_bid(ranges, range_costs):
+    """
+    Expand a bid encoded with :func:`encode_bid`
+
+    Returns
+    -------
+    task_ids : np.ndarray
+    costs : np.ndarray
+        per-task costs
+    """
+    ranges = np.asarray(ranges, 'i8').reshape(-1, 2)
+    task_ids = ids_from_ranges(ranges)
+    costs = np.repeat(np.asarray(range_costs, 'f4'), ranges[:, 1] - ranges[:, 0])
+    return task_ids, costs
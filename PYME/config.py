@@ -207,6 +207,31 @@ This is a non-exhaustive list of configuration keys - if adding a new key, pleas
     two nameservers, which has performance implications on very high bandwidth 
     systems."
 
+    clusterIO-file-cache-size, default=100e6, "memory budget (in bytes) for the least-recently-used cache of file contents
+    in `clusterIO.get_file`. Files larger than the budget are not cached."
+
+    clusterIO-dir-cache-size, default=10e6, "memory budget (in bytes) for the cache of per-node directory listings in
+    `cluster_directory.DirectoryInfoManager`."
+
+    clusterIO-locate-cache-size, default=1e6, "memory budget (in bytes) for the cache of file locations in
+    `cluster_directory.DirectoryInfoManager`."
+
+    dataserver-dir-cache-size, default=10e6, "memory budget (in bytes) for the cache of serialized directory listings in
+    PYMEDataServer."
+
+    dataserver-h5r-batched-append, default=True, "coalesce rows sent to PYMEDataServer via `__aggregate_h5r` and write
+    them to the .h5r file in large batches from a dedicated writer thread (see `PYME.cluster.h5r_aggregator`)."
+
+    dataserver-h5r-flush-rows, default=50000, "write queued `__aggregate_h5r` rows for a file once this many rows have
+    accumulated."
+
+    dataserver-h5r-flush-interval, default=1.0, "maximum time (in s) that queued `__aggregate_h5r` rows are held in memory
+    before being written."
+
+    clusterResults-wire-format, default='columnar', "format used to upload record arrays (e.g. fit results) to the
+    dataserver in `clusterResults.fileResults`. Either 'columnar' (see `PYME.IO.columnar`) or 'pickle' (needed if
+    sending results to dataservers running an older version of PYME)."
+
     h5r-flush_interval, default=1, "how often (in s) should we call the .flush() method and write records from the HDF/pytables
     caches to disk when writing h5r files."
 
@@ -222,18 +247,113 @@ This is a non-exhaustive list of configuration keys - if adding a new key, pleas
 
     nodeserver-num_workers, default= CPU count, Number of workers to launch on an individual node.
 
+    tabular-mapping-numexpr, default=False, "Evaluate MappingFilter mappings (given as strings) with numexpr, if it is
+    installed. numexpr works block-wise, avoiding full length temporary arrays when mapping very long tables. Mappings
+    which numexpr can't evaluate fall back to python eval."
+
+    tabular-chunk-size, default=1000000, "Number of rows read at once when tabular data sources are read in chunks (see
+    PYME.IO.tabular.TabularBase.iter_chunks) - e.g. by the renderers in the pipeline's out-of-core mode."
+
+    pipeline-out-of-core-rows, default=50000000, "Pipelines with more localisations than this run in out-of-core mode,
+    where the histogram, Gaussian and quadtree renderers read the filtered points a chunk at a time, rather than holding
+    whole columns in memory. Set to 0 to disable."
+
+    pipeline-column-cache, default=False, "When opening .h5r files in the pipeline (e.g. in VisGUI), convert the
+    localisations to a column store (see PYME.IO.column_store) in the column cache and work from that, rather than
+    reading the whole table out of the .h5r file. The first open of each file is slower (and the cache uses disk
+    space), so this is only worthwhile for large data sets which are opened repeatedly."
+
+    pipeline-column-cache-dir, default=<user config dir>/column_cache, "Directory for the pipeline column cache."
+
+    pipeline-column-cache-size-mb, default=10240, "Maximum size of the pipeline column cache. The least recently used
+    files are removed first."
+
+    recipes-blocked-threshold-mb, default=1024, "Image filters (recipes.base.Filter) with inputs larger than this run
+    blocked and out-of-core (see Filter.bfilter), streaming blocks from the input and writing the output to a memory
+    mapped scratch file, rather than holding the whole output in memory."
+
+    recipes-blocked-tile-size, default=1024, "Size (in x and y) of the tiles used by blocked filters which can be tiled
+    (those which define an overlap)."
+
+    recipes-blocked-workers, default=2, "Number of blocks blocked filters process in parallel. Only used for filters
+    which declare themselves safe to run on several blocks at once (Filter._block_thread_safe), others are run one
+    block at a time."
+
+    recipes-scratch-dir, default=<system temporary directory>, "Directory for the scratch files which back the outputs
+    of blocked filters."
+
+    recipes-lazy-filters, default=False, "Image filters (recipes.base.Filter) produce lazily evaluated outputs (see
+    Filter.lfilter), which compute planes on demand as they are accessed, rather than filtering the whole image up
+    front."
+
+    recipes-lazy-filters-in-editor, default=True, "Use lazily evaluated filter outputs for recipes in the recipe editor
+    (recipeGui), so that only the planes which are displayed are computed."
+
+    recipes-lazy-cache-size, default=32, "Number of computed planes (or volumes, for 3D filters) each lazy filter output
+    keeps in memory."
+
+    recipe-executor-workers, default=0, "If greater than 1, recipes run independent modules concurrently, with up to
+    this many modules running at once (see PYME.recipes.executor). 0 or 1 runs modules one at a time."
+
+    recipe-executor-processes, default=False, "When running recipes in parallel, run GIL-bound modules (those which
+    declare ``_execution_mode = 'process'``) on a process pool rather than a thread pool."
+
+    recipe-output-cache-dir, default=None, "If set, recipe module outputs are cached (persistently) in this directory,
+    keyed on the module parameters and the content of its inputs, so that re-running a recipe (e.g. in a new process)
+    only re-computes modules whose parameters or inputs have changed (see PYME.recipes.output_cache)."
+
+    recipe-output-cache-size-mb, default=2048, "Maximum size of the recipe output cache. The least recently used
+    outputs are removed first."
+
+    taskworker-recipe-cache-size, default=10, "The number of distinct recipes each cluster worker keeps constructed (and
+    re-uses, together with any PSFs, shift maps etc. their modules have loaded) between recipe tasks."
+
+    taskworker-pool-ring-frames, default=128, "[pooled workers, see nodeserver-worker-mode] The number of frames in the
+    shared memory ring used to pass frames from the fetch stage to the worker processes."
+
+    taskworker-pool-ring-slot-mb, default=8, "[pooled workers] The maximum size (in MB) of a frame which can be passed
+    through the shared memory ring. Larger frames are fetched by the worker processes directly."
+
+    nodeserver-range-adverts, default=True, [new-style task distribution] Request compact, range-encoded and incremental
+    task adverts from the ruleserver (and bid using task ranges). Falls back to the legacy advert format automatically
+    if the ruleserver does not support it.
+
+    nodeserver-worker-mode, default='process', [new-style task distribution] How the nodeserver runs tasks. 'process'
+    launches one independent worker process per core. 'pool' launches a single worker which fetches and decompresses
+    frames once, and passes them to a pool of fitting processes through shared memory.
+
     ruleserver-retries, default = 3, [new-style task distribution]. The number of times to retry a given task before it is deemed to have failed.
 
+    ruleserver-auction-window, default=0.05, [new-style task distribution]. How long (in s) the ruleserver collects
+    concurrent bids on contested (non-local) tasks before allocating them to the lowest cost bidders. Each bid request
+    waits for up to this long before it gets its answer. Set to 0 to allocate each bid on its own, without waiting.
+
     rulenodeserver-nonlocal, default = True, "Whether to bid for non-local tasks if no local tasks are found. Disabling
     non-local bidding (setting this to False) will make task distribution less robust, but is potentially a viable
     workarond if trying to e.g. run recipes which use stupid ammounts of memory and will crash when run non-locally.
     The need for this should be removed by better recipe costing."
 
+    rulenodeserver-locality-refresh, default=2.0, "Maximum age (in s) of the nodeserver's cached listings of the local
+    data directory, which are used to rate tasks for data locality. Shorter times pick up newly spooled frames faster
+    at the expense of more frequent directory listings."
+
     httpspooler-chunksize, default=50, "how many frames we spool in each chunk 
     before (potentially) switching which PYMEDataServer we send the next chunk
     to. Increasing the chunksize can increase data-locality for faster analysis,
     but has spooling/writing bandwidth implications."
 
+    cluster-streaming-async, default=False, "use the asyncio based streamer (`PYME.IO.cluster_streaming.AsyncStreamer`)
+    when spooling to the cluster. This pipelines PUTs with a bounded window per server, applies back-pressure when the
+    servers can't keep up, routes frames to the least loaded server (unless a distribution function is specified), and
+    reports throughput / latency statistics in the spooler status."
+
+    clusterpzf-read-ahead, default=0, "how many frames ClusterPZFDataSource should fetch (with a single batched request
+    to each dataserver) when it needs a frame which it has not already fetched. 0 (the default) fetches frames
+    individually."
+
+    pzf-num-threads, default=2, "how many threads (and chunks) to use when compressing / decompressing PZF frames with
+    `DATA_COMP_HUFFCODE_CHUNKS`. Can also be changed at runtime with `PYME.IO.PZFFormat.set_num_threads()`."
+
     pymevis-zoom-factor, default = 1.1, adjusts zoom sensitivity by adjusting magnification factor per scroll event
 
 
@@ -145,6 +145,84 @@ class FFBase(object):
             
         return X, Y, dataMean, bgMean, sigma, xslice, yslice, zslice
 
+    def getROIsAtPoints(self, xs, ys, roiHalfSize=5):
+        """Batched version of `getROIAtPoint` which extracts ROIs at many points at once, stacking them into
+        (n_rois, roi_size, roi_size) arrays for use with `_fithelpers.FitModelWeightedBatch`.
+
+        To keep a common shape, ROIs which would be clipped at the edge of the frame are instead padded, with the
+        padding pixels flagged in `valid` and given an infinite sigma (i.e. zero weight in the fit). Data is averaged
+        over all z slices (only single-plane data is expected here).
+
+        Parameters
+        ----------
+        xs, ys : np.ndarray
+            ROI center positions [pixels] relative to self.roi_offset
+        roiHalfSize : int
+            lateral ROI extent. Lateral ROI size will be (2 * roiHalfSize) + 1
+
+        Returns
+        -------
+            X - (n_rois, roi_size) x coordinates of pixels in ROIs in nm
+            Y - (n_rois, roi_size) y coordinates of pixels in ROIs in nm
+            data - (n_rois, roi_size, roi_size) raw pixel data of ROIs
+            background - (n_rois, roi_size, roi_size) estimated background for ROIs (or 0)
+            sigma - (n_rois, roi_size, roi_size) estimated error (std. dev) of pixel values, inf for padding pixels
+            valid - (n_rois, roi_size, roi_size) boolean mask of pixels which fall within the frame
+            slicesUsed - (n_rois, 3, 3) integer array of (start, stop, step) for the clipped x, y, and z slices
+                (equivalent to `fitCommon.fmtSlicesUsed((xslice, yslice, zslice))` for each ROI)
+        """
+        roiHalfSize = int(roiHalfSize)
+        xs = np.round(np.atleast_1d(xs)).astype('i4')
+        ys = np.round(np.atleast_1d(ys)).astype('i4')
+        n_rois = len(xs)
+
+        offsets = np.arange(-roiHalfSize, roiHalfSize + 1)
+        xi = xs[:, None] + offsets[None, :]
+        yi = ys[:, None] + offsets[None, :]
+
+        x_valid = (xi >= 0) & (xi < self.data.shape[0])
+        y_valid = (yi >= 0) & (yi < self.data.shape[1])
+        valid = x_valid[:, :, None] & y_valid[:, None, :]
+
+        # clip indices so we can gather (the resulting values for padding pixels are ignored)
+        xc = np.clip(xi, 0, self.data.shape[0] - 1)[:, :, None]
+        yc = np.clip(yi, 0, self.data.shape[1] - 1)[:, None, :]
+
+        data = self.data[xc, yc, :].mean(3)
+
+        if self.noiseSigma is None:
+            sigma = self._calc_sigma(data, n_slices_averaged=self.data.shape[2])
+        else:
+            sigma = np.array(self.noiseSigma[xc, yc, 0], dtype='f8')
+        sigma[~valid] = np.inf
+
+        if (not self.background is None) and (not np.isscalar(self.background)) and (self.metadata.get('Analysis.subtractBackground', True)):
+            background = self.background[xc, yc, :].mean(3)
+        else:
+            background = 0
+
+        slicesUsed = np.empty((n_rois, 3, 3), 'i4')
+        slicesUsed[:, 0, 0] = np.maximum(xs - roiHalfSize, 0)
+        slicesUsed[:, 0, 1] = np.minimum(xs + roiHalfSize + 1, self.data.shape[0])
+        slicesUsed[:, 1, 0] = np.maximum(ys - roiHalfSize, 0)
+        slicesUsed[:, 1, 1] = np.minimum(ys + roiHalfSize + 1, self.data.shape[1])
+        slicesUsed[:, 2, 0] = 0
+        slicesUsed[:, 2, 1] = self.data.shape[2]
+        slicesUsed[:, :, 2] = 1
+
+        #pixel size in nm
+        vx, vy, _ = self.metadata.voxelsize_nm
+
+        #generate grids to evaluate function on
+        X = vx * (xi + self.roi_offset[0])
+        Y = vy * (yi + self.roi_offset[1])
+
+        return X, Y, data, background, sigma, valid, slicesUsed
+
+    def _from_points_serial(self, xs, ys, roiHalfSize=5):
+        """Fallback for `FromPoints` which simply calls `FromPoint` for each point in turn"""
+        return np.hstack([self.FromPoint(x, y, roiHalfSize=roiHalfSize) for x, y in zip(xs, ys)])
+
     def get3DROIAtPoint(self, x, y, z=None, roiHalfSize=5, axialHalfSize=15):
         """Helper fcn to extract ROI from frame at given x,y, point.
 
@@ -394,7 +472,11 @@ class FFBase(object):
         uses FitResultsDType to pre-allocate an array for the results)"""
         
         raise NotImplementedError('This function should be over-ridden in derived class')
-        
+
+    # Fit factories which support batched fitting of all the ROIs in a frame (see `remFitBuf.fitTask` and the
+    # `Analysis.BatchFit` metadata entry) should define a `FromPoints(self, xs, ys, roiHalfSize=5)` method which
+    # returns a FitResultsDType array with one entry per point.
+
         
 FitFactory = FFBase
 
@@ -28,10 +28,10 @@
 import numpy as np
 import types
 
-from .fitCommon import fmtSlicesUsed 
+from .fitCommon import fmtSlicesUsed, pack_results_batch
 from . import FFBase 
 
-from PYME.Analysis._fithelpers import FitModelWeighted_, FitModelWeighted, FitModelWeightedJac
+from PYME.Analysis._fithelpers import FitModelWeighted_, FitModelWeighted, FitModelWeightedJac, FitModelWeightedBatch
 
 def f_Interp3d(p, interpolator, X, Y, Z, safeRegion, *args):
     """3D PSF model function with constant background - parameter vector [A, x0, y0, z0, background]"""
@@ -49,6 +49,47 @@ def f_Interp3d(p, interpolator, X, Y, Z, safeRegion, *args):
 
     return interpolator.interp(X - x0 + 1, Y - y0 + 1, Z - z0 + 1)*A + b
 
+def _clamp_batch(p, safeRegion):
+    x0 = np.clip(p[:, 1], safeRegion[:, 0, 0], safeRegion[:, 0, 1])
+    y0 = np.clip(p[:, 2], safeRegion[:, 1, 0], safeRegion[:, 1, 1])
+    z0 = np.minimum(np.nanmax([p[:, 3], safeRegion[:, 2, 0]], 0), safeRegion[:, 2, 1])
+    return x0, y0, z0
+
+def f_Interp3d_batch(p, interpolator, X, Y, Z, safeRegion):
+    """Batched version of f_Interp3d. p is a (n_rois, 4 or 5) parameter array, X and Y (n_rois, roi_size) coordinate
+    arrays, Z (n_rois, 1) and safeRegion (n_rois, 3, 2).
+    
+    The interpolation itself is still performed one ROI at a time (the interpolators only work on a single regular grid),
+    but this is called once per iteration for all ROIs rather than once per ROI and parameter."""
+    n_rois, n_x = X.shape
+    x0, y0, z0 = _clamp_batch(p, safeRegion)
+    b = p[:, 4] if p.shape[1] == 5 else np.zeros(n_rois)
+
+    out = np.empty((n_rois, n_x, Y.shape[1]), 'f8')
+    for i in range(n_rois):
+        out[i] = np.reshape(interpolator.interp(X[i] - x0[i] + 1, Y[i] - y0[i] + 1, Z[i] - z0[i] + 1), out.shape[1:])
+    
+    return out*p[:, 0, None, None] + b[:, None, None]
+
+def f_J_Interp3d_batch(p, interpolator, X, Y, Z, safeRegion):
+    """Jacobian of f_Interp3d_batch, using the interpolated PSF gradients"""
+    n_rois, n_x = X.shape
+    x0, y0, z0 = _clamp_batch(p, safeRegion)
+    
+    out = np.zeros((n_rois, n_x, Y.shape[1], p.shape[1]), 'f8')
+    for i in range(n_rois):
+        Xi, Yi, Zi = X[i] - x0[i] + 1, Y[i] - y0[i] + 1, Z[i][0] - z0[i] + 1
+        out[i, :, :, 0] = np.reshape(interpolator.interp(Xi, Yi, Zi), out.shape[1:3])
+        for j, g in enumerate(interpolator.interpG(Xi, Yi, Zi)):
+            out[i, :, :, j + 1] = p[i, 0]*np.reshape(g, out.shape[1:3])
+    
+    if p.shape[1] == 5:
+        out[:, :, :, 4] = 1
+        
+    return out
+
+f_Interp3d_batch.D = f_J_Interp3d_batch
+
 
 
 fresultdtype=[('tIndex', '<i4'),
@@ -209,6 +250,53 @@ class PSFFitFactory(FFBase.FFBase):
 
         return PSFFitResultR(res, self.metadata,(xslice, yslice, zslice), resCode, fitErrors, np.array(startParameters), nchi2, np.mean(bgMean))
 
+    def FromPoints(self, xs, ys, roiHalfSize=5):
+        """Fit all the given points at once using a batched, vectorised, solver. Equivalent to calling `FromPoint`
+        for each point. Used by remFitBuf when `Analysis.BatchFit` is set."""
+        if (self.fitfcn is not f_Interp3d) or (type(self).FromPoint is not PSFFitFactory.FromPoint) or (self.data.shape[2] > 1):
+            # derived fit factories with a different model / fitting procedure
+            return self._from_points_serial(xs, ys, roiHalfSize)
+        
+        _, _, dataMean, bgMean, sigma, valid, slicesUsed = self.getROIsAtPoints(xs, ys, roiHalfSize)
+        dataROI = dataMean - bgMean
+        
+        n_rois = len(dataROI)
+        roiHalfSize = int(roiHalfSize)
+        xi = np.round(np.atleast_1d(xs)).astype('i4') - roiHalfSize
+        yi = np.round(np.atleast_1d(ys)).astype('i4') - roiHalfSize
+        n_r = 2*roiHalfSize + 1
+        
+        fitBackground = self.metadata.getOrDefault('Analysis.FitBackground', True)
+        n_params = 5 if fitBackground else 4
+        
+        X = np.empty((n_rois, n_r))
+        Y = np.empty((n_rois, n_r))
+        Z = np.empty((n_rois, 1))
+        safeRegion = np.empty((n_rois, 3, 2))
+        startParameters = np.empty((n_rois, n_params))
+        
+        for i in range(n_rois):
+            # generate (unclipped) grids to evaluate function on and estimate start parameters on the valid part of the ROI
+            X_i, Y_i, Z_i, safeRegion[i] = self.interpolator.getCoords(self.metadata, slice(xi[i], xi[i] + n_r), slice(yi[i], yi[i] + n_r), slice(0, 1))
+            X[i], Y[i], Z[i] = X_i.ravel(), Y_i.ravel(), Z_i
+            vx, vy = valid[i].any(1), valid[i].any(0)
+            startParameters[i] = self.startPosEstimator.getStartParameters(dataROI[i][vx, :][:, vy], X[i][vx], Y[i][vy])[:n_params]
+        
+        #do the fit
+        (res, cov_x, infodict, mesg, resCode) = FitModelWeightedBatch(f_Interp3d_batch, startParameters, dataROI, sigma,
+                                                                       X, Y, Z, safeRegion, shared_args=(self.interpolator,))
+
+        chi2 = (infodict['fvec']**2).sum(1)
+        dof = valid.sum((1, 2)) - n_params
+        fitErrors = np.sqrt(np.diagonal(cov_x, axis1=1, axis2=2)*(chi2/dof)[:, None])
+        fitErrors[~np.all(np.isfinite(fitErrors), 1)] = -5e3
+        
+        bgm = np.where(valid, bgMean, 0).sum((1, 2))/valid.sum((1, 2))
+
+        return pack_results_batch(fresultdtype, tIndex=self.metadata['tIndex'], fitResults=res, fitError=fitErrors,
+                                  startParams=startParameters, resultCode=resCode, slicesUsed=slicesUsed,
+                                  nchi2=chi2/dof, subtractedBackground=bgm)
+
      
 
 #so that fit tasks know which class to use
@@ -229,7 +317,8 @@ PARAMETERS = [#mde.ChoiceParam('Analysis.InterpModule','Interp:','CSInterpolator
               mde.ChoiceParam('Analysis.EstimatorModule', 'Z Start Est:', 'astigEstimator', choices=zEstimators.estimatorList),
               mde.ChoiceParam('PRI.Axis', 'PRI Axis:', 'none', choices=['x', 'y', 'none']),
               mde.BoolParam('Analysis.FitBackground', 'Fit Background', True),
-              mde.IntParam('Analysis.ROISize', u'ROI half size', 7),]
+              mde.IntParam('Analysis.ROISize', u'ROI half size', 7),
+              mde.BoolParam('Analysis.BatchFit', 'Batch fit ROIs', False),]
               
 DESCRIPTION = '3D, single colour fitting using an interpolated measured PSF.'
 LONG_DESCRIPTION = '3D, single colour fitting using an interpolated measured PSF. Should work for any 3D engineered PSF, with the default parameterisation optimised for astigmatism.'
@@ -90,7 +90,78 @@ def pack_results(dtype, tIndex, fitResults, fitError=None, startParams=None, sli
     ns.update(kwargs)
     
     return np.array(tuple([_tuplify(ns[n]) for n in dtype.names]), dtype=dtype)
-    
+
+
+def _fill_field(out, value):
+    """ Recursively assign a (n_rois, ...) array to a (possibly nested) structured field. Nested sub-fields are
+    filled from successive columns of value, with any trailing sub-fields which have no corresponding column left
+    untouched (mirroring the `[:n_params]` assignments used for single results)"""
+    if out.dtype.names is None:
+        out[:] = value
+        return
+
+    value = np.atleast_1d(value)
+    if value.ndim == 1:
+        # same values for every ROI
+        value = value[None, :]
+
+    for i, n in enumerate(out.dtype.names):
+        if i >= value.shape[1]:
+            break
+        _fill_field(out[n], value[:, i])
+
+
+def pack_results_batch(dtype, tIndex, fitResults, fitError=None, startParams=None, slicesUsed=None, resultCode=-1, **kwargs):
+    """ Pack fit results for a batch of ROIs into a structured array of the given dtype
+
+    Vectorised equivalent of `pack_results` for use with batched fitting (see `_fithelpers.FitModelWeightedBatch`).
+
+    Parameters
+    ----------
+    dtype  : np.dtype
+        the numpy dtype of the structured array we want to pack into
+    tIndex : int
+        the current frame number
+    fitResults : np.ndarray
+        (n_rois, n_params) array of fit parameters in the order they are defined in the dtype
+    fitError   : np.ndarray, optional
+        (n_rois, n_params) array of fit errors in the order they are defined in the dtype
+    startParams : np.ndarray, optional
+        (n_rois, n_params) array of start parameters in the order they are defined in the dtype
+    slicesUsed : np.ndarray, optional
+        (n_rois, 3, 3) array of (start, stop, step) for the x, y, and z slices used for each ROI
+    resultCode : int or np.ndarray, optional
+        the result code(s) as returned by the fitting routine
+    **kwargs :  dict, optional
+        any additional information which gets stored in the structured array, either a scalar or a (n_rois, ...) array
+
+    Returns
+    -------
+    np.ndarray
+        The packed results array, with one entry per ROI
+    """
+    dtype = np.dtype(dtype)
+    fitResults = np.atleast_2d(fitResults)
+    n_rois = fitResults.shape[0]
+
+    if fitError is None:
+        fitError = -5e3 + 0 * fitResults
+
+    if startParams is None:
+        startParams = -5e3 + 0 * fitResults
+
+    if slicesUsed is None:
+        slicesUsed = -np.ones((n_rois, 3, 3), 'i4')
+
+    ns = locals()
+    ns.update(kwargs)
+
+    res = np.zeros(n_rois, dtype=dtype)
+    for n in dtype.names:
+        _fill_field(res[n], ns[n])
+
+    return res
+
 
 ###############################################
 # Below are various experimental alternatives to pack_results. They are still a work in progress, but should
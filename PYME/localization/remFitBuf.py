@@ -79,6 +79,10 @@ class BufferManager(object):
         self.bBuffer = None
         self.dataSourceID = None
         
+        # optional callable, ``wrapper(dataSource, dataSourceID) -> dataSource``, applied to data sources as they are
+        # opened. Used by pooled workers to read frames from shared memory (see PYME.cluster.taskWorkerHTTP.PooledTaskWorker)
+        self.dataSourceWrapper = None
+        
     def updateBuffers(self, md, dataSourceModule, bufferLen):
         """Update the various buffers. """
         if dataSourceModule is None:
@@ -90,12 +94,24 @@ class BufferManager(object):
 
         #read the data
         if not self.dataSourceID == md['dataSourceID']: #avoid unnecessary opening and closing 
-            self.dBuffer = buffers.SliceBuffer(DataSource(md['dataSourceID'], md['taskQueue']), bufferLen)
+            ds = DataSource(md['dataSourceID'], md['taskQueue'])
+            if self.dataSourceWrapper is not None:
+                ds = self.dataSourceWrapper(ds, md['dataSourceID'])
+            
+            self.dBuffer = buffers.SliceBuffer(ds, bufferLen)
             self.bBuffer = None
         
         #fix our background buffers
         if md.getOrDefault('Analysis.PCTBackground', 0) > 0:
-            if not isinstance(self.bBuffer, buffers.backgroundBufferM):
+            # the incremental sorted-window implementation gives the same results as the original (re-ranking)
+            # implementation, but is much faster. Allow falling back to the original for comparison.
+            if md.getOrDefault('Analysis.PCTBackgroundImpl', 'sorted') == 'legacy':
+                cpuBufferClass = buffers.backgroundBufferM
+            else:
+                cpuBufferClass = buffers.backgroundBufferMS
+            
+            if not isinstance(self.bBuffer, buffers.backgroundBufferM) or (not md.getOrDefault('Analysis.GPUPCTBackground', False)
+                                                                           and type(self.bBuffer) is not cpuBufferClass):
                 try:
                     from warpdrive.buffers import Buffer as GPUPercentileBuffer
                     HAVE_GPU_PCT_BUFFER = True
@@ -112,7 +128,7 @@ class BufferManager(object):
                                                        md['Camera.ElectronsPerCount'])
                 else: 
                     # use our default CPU implementation
-                    self.bBuffer = buffers.backgroundBufferM(self.dBuffer, md['Analysis.PCTBackground'])
+                    self.bBuffer = cpuBufferClass(self.dBuffer, md['Analysis.PCTBackground'])
             else:
                 # we already have a percentile buffer - just change the settings
                 self.bBuffer.refresh_settings(md['Analysis.PCTBackground'],
@@ -252,30 +268,22 @@ class CameraInfoManager(object):
 
 cameraMaps = CameraInfoManager()
 
-def createFitTaskFromTaskDef(task):
+def _metadata_from_taskdef(md):
     """
-    Creates a fit task from a new-style json task definition
+    Parse the metadata entry of a new-style json task definition
+
     Parameters
     ----------
-    task : dict
-        The parsed task definition. As the task definition will need to be parsed by the worker before we get here,
-        we expect this to take the form of a python dictionary.
+    md : dict or str
+        metadata as a dictionary, a quoted json dump, or the URI of a .json file
 
     Returns
     -------
 
-    a fitTask instance
-
+    a PYME.IO.MetaDataHandler.NestedClassMDHandler instance
     """
     from PYME.IO import MetaDataHandler
 
-    dataSourceID = task['inputs']['frames']
-    frameIndex = int(task['taskdef']['frameIndex'])
-
-    #logger.debug('Creating a task for %s - frame %d' % (dataSourceID, frameIndex))
-
-    md = task['taskdef']['metadata']
-
     #sort out our metadata
     #TODO - Move this somewhere saner - e.g. a helper function in the MetaDataHandler module
     mdh = MetaDataHandler.NestedClassMDHandler()
@@ -296,6 +304,40 @@ def createFitTaskFromTaskDef(task):
             else:
                 raise NotImplementedError('Loading metadata from a URI in task description is not yet supported')
 
+    return mdh
+
+def createFitTaskFromTaskDef(task):
+    """
+    Creates a fit task from a new-style json task definition
+    Parameters
+    ----------
+    task : dict
+        The parsed task definition. As the task definition will need to be parsed by the worker before we get here,
+        we expect this to take the form of a python dictionary. Task definitions with a 'blockSize' entry in the
+        taskdef describe a block of consecutive frames (see `fitBlockTask`) rather than a single frame.
+
+    Returns
+    -------
+
+    a fitTask (or fitBlockTask) instance
+
+    """
+    dataSourceID = task['inputs']['frames']
+    taskdef = task['taskdef']
+
+    mdh = _metadata_from_taskdef(taskdef['metadata'])
+
+    if 'blockSize' in taskdef:
+        blockSize = int(taskdef['blockSize'])
+        startFrame = max(int(taskdef['blockIndex'])*blockSize, int(taskdef.get('startAt', 0)))
+        numFrames = (int(taskdef['blockIndex']) + 1)*blockSize - startFrame
+
+        return fitBlockTask(dataSourceID=dataSourceID, startFrame=startFrame, numFrames=numFrames, metadata=mdh)
+
+    frameIndex = int(taskdef['frameIndex'])
+
+    #logger.debug('Creating a task for %s - frame %d' % (dataSourceID, frameIndex))
+
     return fitTask(dataSourceID=dataSourceID, frameIndex=frameIndex, metadata=mdh)
 
 class fitTask(taskDef.Task):
@@ -344,6 +386,15 @@ class fitTask(taskDef.Task):
         # makes bufferLen at least 1
         self.bufferLen = max(0, max(self.md['Analysis.BGRange'][1], drift_ind[-1]) - min(self.md['Analysis.BGRange'][0], drift_ind[0])) + 1
         
+    def required_frames(self):
+        """The frames which this task reads from the data source (fitted frame, background and drift frames)"""
+        frames = set(self.bgindices)
+        frames.add(self.index)
+        if self.driftEst:
+            frames.update(int(i) for i in self.index + self.md.getOrDefault('Analysis.DriftIndices', np.array([-10, 0, 10])))
+            
+        return sorted(i for i in frames if i >= 0)
+    
     @property
     def fitMod(self):
         if self._fitMod is None:
@@ -533,7 +584,12 @@ class fitTask(taskDef.Task):
         
         if 'FitResultsDType' in dir(self.fitMod):
             self.res = numpy.empty(len(self.ofd), self.fitMod.FitResultsDType)
-            if 'Analysis.ROISize' in md.getEntryNames():
+            if md.getOrDefault('Analysis.BatchFit', False) and ('FromPoints' in dir(fitFac)):
+                # fit all candidates in one vectorised call (see FFBase.getROIsAtPoints)
+                if len(self.ofd) > 0:
+                    rs = md.getOrDefault('Analysis.ROISize', 5)
+                    self.res[:] = fitFac.FromPoints(numpy.array([p.x for p in self.ofd]), numpy.array([p.y for p in self.ofd]), roiHalfSize=rs)
+            elif 'Analysis.ROISize' in md.getEntryNames():
                 rs = md.getEntry('Analysis.ROISize')
                 for i in range(len(self.ofd)):
                     p = self.ofd[i]
@@ -655,3 +711,76 @@ class fitTask(taskDef.Task):
         #gca().set_ylim([255,0])
         plt.colorbar()
         plt.show()
+
+
+class fitBlockTask(taskDef.Task):
+    def __init__(self, dataSourceID, startFrame, numFrames, metadata, dataSourceModule=None, resultsURI=None):
+        """
+        A fit task which localizes a block of consecutive frames in one call, rather than one frame per task.
+
+        Frames are fitted in order, so that the background buffers (see `BufferManager`) are updated incrementally as
+        a sliding window (one frame added and one removed per frame) rather than being rebuilt for each task, and the
+        results for the whole block are returned (and handed in) together. On long series this cuts the number of
+        tasks, and hence task queue traffic and result uploads, by a factor of the block size.
+
+        Parameters
+        ----------
+        dataSourceID : str
+            A filename or URI which identifies the data source
+        startFrame : int
+            The first frame to fit
+        numFrames : int
+            The number of frames in the block. Blocks which run over the end of the series are truncated.
+        metadata : PYME.IO.MetaDataHandler object
+            The image metadata. This defines most of the analysis parameters.
+        dataSourceModule : str
+            The name of the data source module to use. If None, the dataSourceModule is inferred from the dataSourceID.
+        resultsURI : str
+            A URI dictating where to store the analysis results.
+        """
+        taskDef.Task.__init__(self, resultsURI=resultsURI)
+
+        self.dataSourceID = dataSourceID
+        self.dataSourceModule = dataSourceModule
+        self.index = startFrame
+        self.numFrames = numFrames
+
+        self.md = metadata
+
+    def required_frames(self):
+        """The frames which this task reads from the data source (may run past the end of the series)"""
+        startFrame = max(self.index, self.md.get('Analysis.StartAt', 0))
+        frames = set()
+        for frameIndex in range(startFrame, self.index + self.numFrames):
+            frames.update(fitTask(self.dataSourceID, frameIndex, self.md).required_frames())
+            
+        return sorted(frames)
+
+    def __call__(self, gui=False, taskQueue=None):
+        startFrame = max(self.index, self.md.get('Analysis.StartAt', 0))
+
+        #make sure we're buffering the right data stream, and find out how long it is
+        md = copy.copy(self.md)
+        md['taskQueue'] = taskQueue
+        md['dataSourceID'] = self.dataSourceID
+        bufferManager.updateBuffers(md, self.dataSourceModule, fitTask(self.dataSourceID, startFrame, self.md).bufferLen)
+
+        # truncate blocks which run over the end of the data
+        endFrame = min(self.index + self.numFrames, bufferManager.dBuffer.dataSource.getNumSlices())
+
+        results = []
+        driftResults = []
+
+        for frameIndex in range(startFrame, endFrame):
+            # NB - the frame tasks share the module level bufferManager, so the data and background buffers persist
+            # between frames and are updated incrementally
+            res = fitTask(dataSourceID=self.dataSourceID, frameIndex=frameIndex, metadata=self.md,
+                          dataSourceModule=self.dataSourceModule)(gui=gui, taskQueue=taskQueue)
+
+            if len(res.results) > 0:
+                results.append(res.results)
+            if len(res.driftResults) > 0:
+                driftResults.append(res.driftResults)
+
+        return fitResult(self, numpy.hstack(results) if len(results) else [],
+                         numpy.hstack(driftResults) if len(driftResults) else [])
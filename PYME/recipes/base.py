@@ -24,6 +24,7 @@ from PYME.recipes.traits import HasTraits, HasStrictTraits, Float, List, Bool, I
 
 from PYME.IO.image import ImageStack
 import numpy as np
+import os
 from PYME import config
 
 try:
@@ -149,6 +150,17 @@ class ModuleBase(HasStrictTraits):
     _initial_set = Bool(False)
     _success = Bool(False)
     _last_error = Instance(object)
+    _resource_cache = Instance(dict, ())
+    
+    # how the module may be run when recipes are executed in parallel (see PYME.recipes.executor). 'thread' (thread-safe,
+    # mostly GIL-releasing numeric code), 'process' (thread-safe, but GIL-bound) or 'serial' (not thread-safe). Modules
+    # run serially unless they have been checked for thread safety and opt in.
+    _execution_mode = 'serial'
+    
+    # set to True in modules whose outputs may be stored in the persistent output cache (see
+    # PYME.recipes.output_cache) - i.e. modules which are deterministic, have no side-effects, and only depend on their
+    # inputs and parameters (files named in parameters are identified by name, size and modification time).
+    _cache_outputs = False
 
     
     def __init__(self, parent=None, invalidate_parent = True, **kwargs):
@@ -202,6 +214,23 @@ class ModuleBase(HasStrictTraits):
             
             self._parent.invalidate_data()
             
+    def cached_resource(self, key, loader):
+        """
+        Get an expensive to load, read-only, resource (e.g. a PSF, shift map or camera map), calling ``loader()`` to load
+        it on first use.
+        
+        Resources are cached for the lifetime of the module instance, and so persist across repeated executions of the
+        recipe - in particular when cluster workers re-use a recipe for successive tasks (see
+        :class:`PYME.recipes.recipe_cache.RecipeCache`). `key` should uniquely identify the resource, and is usually its
+        URI. Resources should not be modified by the caller.
+        """
+        try:
+            return self._resource_cache[key]
+        except KeyError:
+            resource = loader()
+            self._resource_cache[key] = resource
+            return resource
+        
     def _check_outputs(self):
         """
         This function exists to help with debugging when writing a new recipe module. It generates an
@@ -690,6 +719,9 @@ class OutputModule(ModuleBase):
     """
     filePattern = CStr('{output_dir}/{file_stub}.csv')
     scheme = Enum('File', 'pyme-cluster://', 'pyme-cluster:// - aggregate')
+    
+    _execution_mode = 'serial'
+    _cache_outputs = False
 
     def _schemafy_filename(self, out_filename):
         if self.scheme == 'File':
@@ -776,6 +808,29 @@ def ModuleCollection(*args, **kwargs):
     warnings.warn(DeprecationWarning('recipes.base.ModuleCollection is deprecated, use recipes.recipe.Recipe instead'))
     return Recipe(*args, **kwargs)
         
+def _remove_file(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+def _scratch_array(shape, dtype):
+    """
+    A memory mapped array backed by a temporary file in the ``recipes-scratch-dir`` config directory (defaults to the
+    system temporary directory), for outputs which might not fit in memory. The file is removed once the array is no
+    longer referenced.
+    """
+    import tempfile
+    import weakref
+    
+    fd, filename = tempfile.mkstemp(suffix='.raw', prefix='pyme_', dir=config.get('recipes-scratch-dir', None))
+    os.close(fd)
+    
+    out = np.memmap(filename, dtype=dtype, mode='w+', shape=tuple(shape))
+    weakref.finalize(out, _remove_file, filename)
+    return out
+
 class ImageModuleBase(ModuleBase):
     # NOTE - if a derived class only supports, e.g. XY analysis, it should redefine this trait ro only include the dimensions
     # it supports
@@ -819,6 +874,11 @@ class Filter(ImageModuleBase):
     # flag which can be set to false in derived classes (e.g. Projection, Zoom)
     # which (in their current forms) will behave badly if run blocked
     _block_safe = True 
+    
+    # set to True in derived classes whose `apply_filter()` can be called on several blocks at once (from different
+    # threads) by the blocked engine (see `bfilter()`). Filters which keep state between calls (e.g. the cached
+    # deconvolution objects used by processing.Deconvolve) must leave this False and are run one block at a time.
+    _block_thread_safe = False
 
     def _block_overlap(self):
         # override in derrived classes to specify desired overlap between blocks
@@ -893,8 +953,14 @@ class Filter(ImageModuleBase):
         chunksize = self._chunk_dims(chunksize)
 
         c_image = da.from_array(image.data_xyztc, chunks = chunksize)
+        
+        # only overlap along the dimensions the filter is applied in
+        depth = self._block_overlap()
+        if depth is not None:
+            depth = {i: depth for i in range({'XY': 2, 'XYZ': 3, 'XYZT': 4}[self.dimensionality])}
+        
         #NB - map_overlap reduces to map_chunks if depth is None (or 0)  - the default case
-        out = c_image.map_overlap(self.__apply_filter, depth=self._block_overlap(), voxelsize=image.voxelsize, dtype='f')      
+        out = c_image.map_overlap(self.__apply_filter, depth=depth, voxelsize=image.voxelsize, dtype='f')      
         
         im = ImageStack(ArrayDataSource.XYZTCArrayDataSource(out), titleStub = self.outputName)
         im.mdh.copyEntriesFrom(image.mdh)
@@ -904,6 +970,224 @@ class Filter(ImageModuleBase):
         
         return im
 
+    def _units(self, shape):
+        """Iterate over the independent units (planes, volumes or time series) a filter is applied to, as
+        (z, t, c) index tuples (with None for dimensions which are processed together)"""
+        for c in range(shape[4]):
+            if self.dimensionality == 'XYZT':
+                yield (None, None, c)
+            else:
+                for t in range(shape[3]):
+                    if self.dimensionality == 'XYZ':
+                        yield (None, t, c)
+                    else:
+                        for z in range(shape[2]):
+                            yield (z, t, c)
+    
+    def _unit_output_shape(self, res, shape):
+        """The (unsqueezed) shape of the output for one unit, given the filter result `res` for that unit and the 5D
+        input shape"""
+        n_dims = {'XY': 2, 'XYZ': 3, 'XYZT': 4}[self.dimensionality]
+        if res.size == np.prod(shape[:n_dims]):
+            return tuple(shape[:n_dims])
+        
+        return tuple(res.shape) + (1,)*(n_dims - res.ndim)
+    
+    def _tile_size(self, image, tile_size):
+        """Tile size (in x and y) for blocked execution, or None if the filter should not be tiled"""
+        shape = tuple(image.data_xyztc.shape)
+        overlap = self._block_overlap()
+        if (not self._block_safe) or (overlap is None) or (tuple(self.output_shapes({self.inputName: shape})[self.outputName]) != shape):
+            return None
+        
+        if tile_size is None:
+            tile_size = config.get('recipes-blocked-tile-size', 1024)
+        
+        return max(int(tile_size), 2*int(overlap) + 1)
+    
+    def _read_block(self, image, sl, read_lock=None):
+        if read_lock is None:
+            return np.asarray(image.data_xyztc[sl])
+        
+        with read_lock:
+            return np.asarray(image.data_xyztc[sl])
+    
+    def _filter_unit(self, image, out, unit, tile=None, overlap=0, read_lock=None):
+        z, t, c = unit
+        sl = tuple([slice(None) if i is None else i for i in unit])
+        
+        if tile is None:
+            # whole unit, as in `filter()`
+            data = self._read_block(image, (slice(None), slice(None)) + sl, read_lock).squeeze().astype('f')
+            res = np.asarray(self._apply_filter(data, image, c=c, t=t, z=z))
+            if z is not None:
+                res = np.atleast_2d(res.squeeze())
+            
+            return res
+        
+        # a tile, with a halo of `overlap` pixels (where possible)
+        (x0, x1), (y0, y1) = tile
+        sx, sy = image.data_xyztc.shape[:2]
+        hx0, hx1 = max(x0 - overlap, 0), min(x1 + overlap, sx)
+        hy0, hy1 = max(y0 - overlap, 0), min(y1 + overlap, sy)
+        
+        block = self._read_block(image, (slice(hx0, hx1), slice(hy0, hy1)) + sl, read_lock).astype('f')
+        
+        # drop the dimensions the full unit would drop when squeezed, but keep tile dimensions which happen to be 1
+        unit_shape = np.asarray(image.data_xyztc.shape)[[0, 1] + [i + 2 for i, u in enumerate(unit) if u is None]]
+        res = np.asarray(self._apply_filter(block.reshape([n for n, N in zip(block.shape, unit_shape) if N > 1]),
+                                            image, c=c, t=t, z=z)).reshape(block.shape)
+        
+        out[(slice(x0, x1), slice(y0, y1)) + sl] = res[(x0 - hx0):(x1 - hx0), (y0 - hy0):(y1 - hy0)]
+    
+    def bfilter(self, image, tile_size=None, n_workers=None):
+        """
+        Blocked, out-of-core, version of `filter()`.
+        
+        The input is read (one plane, volume, or - for block safe filters which define `_block_overlap()` - one x-y
+        tile of these, plus overlap) at a time, filtered, and the result written to a memory mapped scratch file (see
+        the ``recipes-scratch-dir`` config option) which backs the output image, so that only a few blocks are ever in
+        memory at once.
+        
+        Parameters
+        ----------
+        image : ImageStack
+        tile_size : int
+            size (in x and y) of tiles, if the filter can be tiled. Defaults to the ``recipes-blocked-tile-size`` config
+            option (1024)
+        n_workers : int
+            number of blocks to filter in parallel. Defaults to the ``recipes-blocked-workers`` config option (2).
+            Ignored (one block at a time) unless the filter sets `_block_thread_safe`.
+        
+        Notes
+        -----
+        When filtering blocks in parallel, the input is accessed from several threads through `image.data_xyztc`. Reads
+        are serialised here (data sources such as the pytables backed HDFDataSource are not thread-safe), but anything
+        else the data source does on other threads (e.g. in its `shape` or `dtype` properties) must be thread-safe.
+        """
+        import concurrent.futures
+        import threading
+        
+        if n_workers is None:
+            n_workers = config.get('recipes-blocked-workers', 2)
+        
+        if not self._block_thread_safe:
+            n_workers = 1
+        
+        n_workers = max(int(n_workers), 1)
+        read_lock = threading.Lock() if n_workers > 1 else None
+        
+        shape = tuple(image.data_xyztc.shape)
+        tile_size = self._tile_size(image, tile_size)
+        units = list(self._units(shape))
+        
+        if tile_size is None:
+            # untiled - the output shape is that of the (first) filtered unit
+            res = self._filter_unit(image, None, units[0])
+            unit_shape = self._unit_output_shape(res, shape)
+            out_shape = unit_shape + shape[len(unit_shape):]
+            if tuple(self.output_shapes({self.inputName: shape})[self.outputName]) != out_shape:
+                logger.debug('output_shapes() does not match filtered output shape for %s' % self)
+                
+            out = _scratch_array(out_shape, 'f4')
+            
+            def _store(unit, r):
+                dest = out[(slice(None), slice(None)) + tuple([slice(None) if i is None else i for i in unit])]
+                dest[...] = r.reshape(dest.shape)
+            
+            _store(units[0], res)
+            
+            def _do(unit):
+                _store(unit, self._filter_unit(image, None, unit, read_lock=read_lock))
+            
+            jobs = units[1:]
+        else:
+            overlap = int(self._block_overlap())
+            out = _scratch_array(shape, 'f4')
+            tiles = [((x0, min(x0 + tile_size, shape[0])), (y0, min(y0 + tile_size, shape[1])))
+                     for x0 in range(0, shape[0], tile_size) for y0 in range(0, shape[1], tile_size)]
+            
+            def _do(job):
+                unit, tile = job
+                self._filter_unit(image, out, unit, tile, overlap, read_lock)
+            
+            jobs = [(u, tile) for u in units for tile in tiles]
+        
+        # keep a bounded number of blocks in flight
+        with concurrent.futures.ThreadPoolExecutor(n_workers) as pool:
+            in_flight = set()
+            for job in jobs:
+                if len(in_flight) >= 2*n_workers:
+                    done, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for f in done:
+                        f.result()
+                in_flight.add(pool.submit(_do, job))
+            
+            for f in concurrent.futures.as_completed(in_flight):
+                f.result()
+        
+        out.flush()
+        
+        im = ImageStack(out, titleStub=self.outputName)
+        im.mdh.copyEntriesFrom(image.mdh)
+        im.mdh['Parent'] = image.filename
+        
+        self.completeMetadata(im)
+        
+        return im
+    
+    def lfilter(self, image, cache_size=None):
+        """
+        Lazy version of `filter()`. Returns an image which applies the filter on demand, one plane (or volume / time
+        series, depending on `dimensionality`) at a time, when its data is accessed, keeping the most recently used
+        results (see :class:`PYME.IO.DataSources.FilteredDataSource.DataSource`). Useful when only some of the output
+        is likely to be looked at, e.g. when interactively editing a recipe.
+        
+        The filter uses a snapshot of the current module parameters, so that changing them later does not affect
+        images which have already been generated.
+        """
+        from PYME.IO.DataSources import FilteredDataSource
+        
+        inputs, outputs, params = self.get_params()
+        mod = self.__class__(invalidate_parent=False, **self.trait_get(inputs + outputs + params))
+        
+        shape = tuple(image.data_xyztc.shape)
+        units = list(self._units(shape))
+        
+        out_shape = tuple(self.output_shapes({self.inputName: shape})[self.outputName])
+        if self._block_safe and (out_shape == shape):
+            unit_shape = shape[:{'XY': 2, 'XYZ': 3, 'XYZT': 4}[self.dimensionality]]
+        else:
+            # we don't trust output_shapes() for filters which change the image shape - filter the first unit to find
+            # out what the output shape really is
+            unit_shape = self._unit_output_shape(mod._filter_unit(image, None, units[0]), shape)
+        
+        def _filter_unit(unit):
+            return mod._filter_unit(image, None, unit).reshape(unit_shape)
+        
+        ds = FilteredDataSource.DataSource(_filter_unit, unit_shape + shape[len(unit_shape):], self.dimensionality,
+                                           cache_size=cache_size)
+        
+        im = ImageStack(ds, titleStub=self.outputName)
+        im.mdh.copyEntriesFrom(image.mdh)
+        im.mdh['Parent'] = image.filename
+        
+        self.completeMetadata(im)
+        
+        return im
+    
+    def _use_lazy(self):
+        """Use lazy outputs if our recipe asks for them (see `Recipe.lazy_filters`)"""
+        if self._parent is None:
+            return config.get('recipes-lazy-filters', False)
+        
+        return getattr(self._parent, 'lazy_filters', False)
+    
+    def _use_blocked(self, image):
+        """Use the blocked engine if the input is larger than the ``recipes-blocked-threshold-mb`` config option"""
+        nbytes = np.prod(image.data_xyztc.shape)*np.dtype(image.data_xyztc.dtype).itemsize
+        return nbytes > config.get('recipes-blocked-threshold-mb', 1024)*1024*1024
+    
     def __apply_filter(self, data, voxelsize):
         d2 = np.array(data, copy=False).squeeze().astype('f')
         return  np.array(self.apply_filter(d2,voxelsize), copy=False, ndmin=5)
@@ -925,6 +1209,10 @@ class Filter(ImageModuleBase):
     def run(self, inputName):
         if da and config.get('recipes-use_dask', False):
             return self.dfilter(inputName)
+        elif self._use_lazy():
+            return self.lfilter(inputName)
+        elif self._use_blocked(inputName):
+            return self.bfilter(inputName)
         else:
             return self.filter(inputName)
         
@@ -977,6 +1265,9 @@ class ArithmaticFilter(ModuleBase):
     
     processFramesIndividually = Bool(False)
     
+    _execution_mode = 'thread'
+    _cache_outputs = True
+    
     def filter(self, image0, image1):
         if self.processFramesIndividually:
             filt_ims = []
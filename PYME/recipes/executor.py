@@ -0,0 +1,217 @@
+"""
+Parallel execution of recipe modules.
+
+:meth:`PYME.recipes.recipe.Recipe.execute` normally runs modules one after another in dependency order. If a recipe has
+independent branches (e.g. filtering two colour channels separately before a colocalisation step), a
+:class:`ParallelExecutor` can instead run each module as soon as the modules it depends on have finished, with
+independent modules running concurrently.
+
+How a module is run is controlled by its ``_execution_mode`` class attribute (see
+:class:`PYME.recipes.base.ModuleBase`):
+
+- ``'thread'`` : the module is thread-safe, and does most of its work in code which releases the GIL (numpy, scipy
+  etc.). It runs on a thread pool.
+- ``'process'`` : the module is thread-safe, but holds the GIL for most of its run time (e.g. pure python loops). It
+  runs on a process pool if the executor has one (its parameters and inputs are pickled and sent to the pool process,
+  and its outputs are pickled and sent back), otherwise on the thread pool. Either way, input checks and the output
+  cache (see :meth:`Recipe._execute_module`) are handled in this process, as for other modules.
+- ``'serial'`` : the module is not thread-safe (e.g. it uses a GUI toolkit, or has side-effects). It runs on the thread
+  which called :meth:`Recipe.execute`, one module at a time, although thread / process modules can run alongside it.
+  This is the default, so modules only run concurrently once they have been checked for thread safety and opt in.
+
+Recipes share a single executor (see :func:`shared_executor`), so that the pools are not duplicated (and leaked) for
+every recipe instance.
+"""
+import concurrent.futures
+import pickle
+import threading
+import time
+import logging
+
+from PYME import config
+
+logger = logging.getLogger(__name__)
+
+EXECUTION_MODES = ('thread', 'process', 'serial')
+
+
+def _run_module_in_process(module_class, params, inputs):
+    """Entry point in the pool process for 'process' modules. Returns the module outputs"""
+    mod = module_class(None, invalidate_parent=False, **params)
+    namespace = dict(inputs)
+    mod.execute(namespace)
+    return {k: namespace[k] for k in mod.outputs}
+
+
+class ParallelExecutor(object):
+    """
+    Executes the modules of a recipe concurrently, respecting their dependencies.
+
+    Parameters
+    ----------
+    max_workers : int
+        maximum number of modules to run at the same time. Defaults to the ``recipe-executor-workers`` config option.
+    processes : bool
+        run 'process' modules on a process pool (if False, they run on the thread pool). Defaults to the
+        ``recipe-executor-processes`` config option (False).
+    """
+    def __init__(self, max_workers=None, processes=None):
+        if max_workers is None:
+            max_workers = config.get('recipe-executor-workers', 4)
+        if processes is None:
+            processes = config.get('recipe-executor-processes', False)
+
+        self.max_workers = max(int(max_workers), 1)
+        self.processes = bool(processes)
+
+        self._thread_pool = None
+        self._process_pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_thread_pool(self):
+        with self._pool_lock:
+            if self._thread_pool is None:
+                self._thread_pool = concurrent.futures.ThreadPoolExecutor(self.max_workers)
+            return self._thread_pool
+
+    def _get_process_pool(self):
+        with self._pool_lock:
+            if self._process_pool is None:
+                self._process_pool = concurrent.futures.ProcessPoolExecutor(self.max_workers)
+            return self._process_pool
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._thread_pool is not None:
+                self._thread_pool.shutdown()
+                self._thread_pool = None
+            if self._process_pool is not None:
+                self._process_pool.shutdown()
+                self._process_pool = None
+
+    def _submit(self, recipe, m):
+        namespace = recipe.namespace
+        mode = getattr(m, '_execution_mode', 'serial')
+
+        if (mode == 'process') and self.processes and all([k in namespace for k in m.inputs]):
+            inputs, outputs, params = m.get_params()
+            kwargs = m.trait_get(inputs + outputs + params)
+            inputs = {k: namespace[k] for k in m.inputs}
+            try:
+                # check we can actually send the module and its inputs to another process
+                pickle.dumps((type(m), kwargs, inputs), pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                logger.debug('Could not pickle %s or its inputs, running in a thread instead' % m)
+            else:
+                process_pool = self._get_process_pool()
+                
+                def _execute_in_process(namespace):
+                    namespace.update(process_pool.submit(_run_module_in_process, type(m), kwargs, inputs).result())
+                
+                # NB - run through the recipe (on a thread which waits for the process) so that inputs are checked and
+                # the output cache is used as for modules which run here.
+                return self._get_thread_pool().submit(recipe._execute_module, m, _execute_in_process)
+
+        return self._get_thread_pool().submit(recipe._execute_module, m)
+
+    def run(self, recipe, modules, progress_callback=None):
+        """
+        Execute `modules` (in dependency order, as given by :meth:`Recipe.resolveDependencies`) which have not yet
+        been run successfully. Results are written to ``recipe.namespace``.
+
+        If a module fails, no further modules are started, modules which are already running are allowed to finish,
+        and the failure is reported (and the exception re-raised) as for sequential execution.
+        """
+        from PYME.recipes.base import ModuleBase
+
+        namespace = recipe.namespace
+        pending = [m for m in modules if isinstance(m, ModuleBase) and not getattr(m, '_success', False)]
+
+        # modules which produce the inputs of each pending module
+        producers = {}
+        for m in pending:
+            for op in m.outputs:
+                producers[op] = m
+
+        deps = {m: {producers[i] for i in m.inputs if i in producers} - {m} for m in pending}
+
+        running = {}  # future -> (module, start time)
+        done = set()
+        error = None
+
+        while pending or running:
+            if error is None:
+                ready = [m for m in pending if deps[m].issubset(done)]
+                for m in ready:
+                    pending.remove(m)
+                    if getattr(m, '_execution_mode', 'serial') == 'serial':
+                        continue
+
+                    logger.debug('Executing %s' % m)
+                    fut = self._submit(recipe, m)
+                    running[fut] = (m, time.time())
+
+                # run (at most one) serial module on this thread while the pool modules are running
+                serial = [m for m in ready if getattr(m, '_execution_mode', 'serial') == 'serial']
+                for m in serial[1:]:
+                    pending.insert(0, m)
+
+                if serial:
+                    m = serial[0]
+                    logger.debug('Executing %s' % m)
+                    ts = time.time()
+                    try:
+                        recipe._execute_module(m)
+                        recipe._module_succeeded(m, time.time() - ts, progress_callback)
+                        done.add(m)
+                    except Exception as e:
+                        recipe._module_failed(m)
+                        error = e
+
+                    continue
+
+            elif not running:
+                break
+
+            if not running:
+                if pending and (error is None):
+                    # should never happen - would mean a dependency cycle or a missing producer
+                    raise RuntimeError('Could not schedule modules: %s' % pending)
+                continue
+
+            finished, _ = concurrent.futures.wait(list(running.keys()), return_when=concurrent.futures.FIRST_COMPLETED)
+            for fut in finished:
+                m, ts = running.pop(fut)
+                try:
+                    fut.result()
+
+                    if error is None:
+                        recipe._module_succeeded(m, time.time() - ts, progress_callback)
+                    else:
+                        # we are aborting - record the success, but don't report progress
+                        recipe._module_succeeded(m, time.time() - ts, None)
+                    done.add(m)
+                except Exception as e:
+                    recipe._module_failed(m)
+                    if error is None:
+                        error = e
+
+        if error is not None:
+            raise error
+
+
+_shared_executor = None
+_shared_executor_lock = threading.Lock()
+
+
+def shared_executor():
+    """
+    The :class:`ParallelExecutor` used by all recipes (created, using the config options, on first use). Sharing one
+    executor means that the number of pool threads and processes does not grow with the number of recipes (e.g. those
+    kept by a cluster worker's recipe cache).
+    """
+    global _shared_executor
+    with _shared_executor_lock:
+        if _shared_executor is None:
+            _shared_executor = ParallelExecutor()
+        return _shared_executor
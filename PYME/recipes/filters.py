@@ -30,6 +30,10 @@ class GaussianFilter(Filter):
     * implemented as a call to `scipy.ndimage.gaussian_filter`
     * sigmaZ is ignored and a 2D filtering performed if ``processFramesIndividually`` is selected
     """
+    _execution_mode = 'thread'
+    _cache_outputs = True
+    _block_thread_safe = True
+
     sigmaY = Float(1.0)
     sigmaX = Float(1.0)
     sigmaZ = Float(1.0)
@@ -40,6 +44,10 @@ class GaussianFilter(Filter):
     def sigmas(self):
         return [self.sigmaX, self.sigmaY, self.sigmaZ, self.sigmaT]
     
+    def _block_overlap(self):
+        # scipy truncates the kernel at 4 sigma
+        return int(4*max(self.sigmaX, self.sigmaY) + 0.5) + 1
+    
     def apply_filter(self, data, voxelsize):
         return ndimage.gaussian_filter(data, self.sigmas[:len(data.shape)])
     
@@ -66,6 +74,10 @@ class MedianFilter(Filter):
     * implemented as a call to `scipy.ndimage.median_filter`
     * sizeZ is ignored and a 2D filtering performed if ``processFramesIndividually`` is selected
     """
+    _execution_mode = 'thread'
+    _cache_outputs = True
+    _block_thread_safe = True
+
     sizeX = Int(3)
     sizeY = Int(3)
     sizeZ = Int(3)
@@ -76,6 +88,9 @@ class MedianFilter(Filter):
     def sigmas(self):
         return [self.sizeX, self.sizeY, self.sizeZ, self.sizeT]
     
+    def _block_overlap(self):
+        return max(self.sizeX, self.sizeY)//2 + 1
+    
     def apply_filter(self, data, voxelsize):
         return ndimage.median_filter(data, self.sigmas[:len(data.shape)])
     
@@ -102,6 +117,10 @@ class MaxFilter(Filter):
     * implemented as a call to `scipy.ndimage.maximum_filter`
     * sizeZ is ignored and a 2D filtering performed if ``processFramesIndividually`` is selected
     """
+    _execution_mode = 'thread'
+    _cache_outputs = True
+    _block_thread_safe = True
+
     sizeX = Int(3)
     sizeY = Int(3)
     sizeZ = Int(3)
@@ -113,6 +132,9 @@ class MaxFilter(Filter):
     def sigmas(self):
         return [self.sizeX, self.sizeY, self.sizeZ, self.sizeT]
 
+    def _block_overlap(self):
+        return max(self.sizeX, self.sizeY)//2 + 1
+    
     def apply_filter(self, data, voxelsize):
         return ndimage.maximum_filter(data, self.sigmas[:len(data.shape)])
 
@@ -138,6 +160,10 @@ class MinFilter(Filter):
     * implemented as a call to `scipy.ndimage.maximum_filter`
     * sizeZ is ignored and a 2D filtering performed if ``processFramesIndividually`` is selected
     """
+    _execution_mode = 'thread'
+    _cache_outputs = True
+    _block_thread_safe = True
+
     sizeX = Int(3)
     sizeY = Int(3)
     sizeZ = Int(3)
@@ -149,6 +175,9 @@ class MinFilter(Filter):
     def sigmas(self):
         return [self.sizeX, self.sizeY, self.sizeZ, self.sizeT]
 
+    def _block_overlap(self):
+        return max(self.sizeX, self.sizeY)//2 + 1
+    
     def apply_filter(self, data, voxelsize):
         return ndimage.minimum_filter(data, self.sigmas[:len(data.shape)])
 
@@ -182,6 +211,10 @@ class DespeckleFilter(Filter):
       It should **NOT** be used if intensities need to be quantified or prior to operations such as deconvolution.
     * sizeZ is ignored and a 2D filtering performed if ``processFramesIndividually`` is selected
     """
+    # python callback per pixel, holds the GIL
+    _execution_mode = 'process'
+    _cache_outputs = True
+
     sizeX = Int(3)
     sizeY = Int(3)
     sizeZ = Int(3)
@@ -227,6 +260,10 @@ class MeanFilter(Filter):
     * implemented as a call to `scipy.ndimage.mean_filter`
     * sizeZ is ignored and a 2D filtering performed if ``processFramesIndividually`` is selected
     """
+    _execution_mode = 'thread'
+    _cache_outputs = True
+    _block_thread_safe = True
+
     sizeX = Int(3)
     sizeY = Int(3)
     sizeZ = Int(3)
@@ -237,6 +274,9 @@ class MeanFilter(Filter):
     def sigmas(self):
         return [self.sizeX, self.sizeY, self.sizeZ, self.sizeT]
     
+    def _block_overlap(self):
+        return max(self.sizeX, self.sizeY)//2 + 1
+    
     def apply_filter(self, data, voxelsize):
         return ndimage.uniform_filter(data, self.sigmas[:len(data.shape)])
     
@@ -259,6 +299,10 @@ class Zoom(Filter):
     * zoom only zooms in x and y if ``processFramesIndividually`` is ``True``
 
     """
+    _execution_mode = 'thread'
+    _cache_outputs = True
+    _block_thread_safe = True
+
     dimensionality = Enum('XY', 'XYZ', desc='Which image dimensions should the filter be applied to?')
     
     zoom = Float(1.0)
@@ -292,6 +336,10 @@ class Subsample(Filter):
     * zoom only zooms in x and y if ``processFramesIndividually`` is ``True``
 
     """
+    _execution_mode = 'thread'
+    _cache_outputs = True
+    _block_thread_safe = True
+
     dimensionality = Enum('XY', 'XYZ', desc='Which image dimensions should the filter be applied to?')
     
     step = Int(2)
@@ -326,6 +374,10 @@ class MaskEdges(Filter):
 
     widthPxels : the distance from the edge to mask with 0s
     """
+    _execution_mode = 'thread'
+    _cache_outputs = True
+    _block_thread_safe = True
+
     dimensionality = Enum('XY', desc='Which image dimensions should the filter be applied to?')
     
     widthPixels = Int(10)
@@ -360,6 +412,10 @@ class DoGFilter(Filter):
     * sigmaZ and sigmaZ2 are ignored and a 2D filtering performed if ``processFramesIndividually`` is selected
 
     """
+    _execution_mode = 'thread'
+    _cache_outputs = True
+    _block_thread_safe = True
+
     dimensionality = Enum('XY', 'XYZ', desc='Which image dimensions should the filter be applied to?')
     
     sigmaY = Float(1.0)
@@ -1067,7 +1067,7 @@ class AddMeasurementsByLabel(ModuleBase):
             can be accessed by '<label_key>_<measurement_key>', e.g. 'clumpIndex_gyrationRadius'.
         
         """
-        from PYME.IO.tabular import MappingFilter
+        from PYME.IO.tabular import MappingFilter, id_lookup
         
         # only propagate 1D measurements
         annotations = dict()
@@ -1076,20 +1076,18 @@ class AddMeasurementsByLabel(ModuleBase):
                 annotations[k] = np.zeros(len(input_points), dtype=input_measurements[k].dtype)
         
         try:
-            labels = np.unique(input_measurements[self.label_key])
+            labels = input_measurements[self.label_key]
         except KeyError:
             logger.exception('Label key %s not found in input_measurements, RISKY: continuing with assumption measurements are sorted by label and all present' % self.label_key)
             labels = np.arange(1, len(input_measurements) + 1)  # MeasureClusters3D ignores the unclustered points 'label 0' so index 0 corresponds to 'label 1'
         
-        for label in labels:
-            points_mask = label == input_points[self.label_key]
-            try:
-                measurement_mask = label == input_measurements[self.label_key]
-            except KeyError:
-                measurement_mask = label - 1  # MeasureClusters3D ignores the unclustered points 'label 0' so index 0 corresponds to 'label 1'
-            
-            for k in annotations.keys():
-                annotations[k][points_mask] = input_measurements[k][measurement_mask]
+        # the measurement row for each point (-1 for points with no measurement)
+        measurement_index = id_lookup(input_points[self.label_key], labels)
+        points_mask = measurement_index >= 0
+        measurement_index = measurement_index[points_mask]
+        
+        for k in annotations.keys():
+            annotations[k][points_mask] = input_measurements[k][measurement_index]
 
         output_points = MappingFilter(input_points)
         try:
@@ -1357,9 +1355,8 @@ class MapAstigZ(ModuleBase):
         else:
             calibration_location = self.astigmatism_calibration_location
 
-        s = unifiedIO.read(calibration_location)
-
-        astig_calibrations = json.loads(s)
+        astig_calibrations = self.cached_resource(('astig_calibration', calibration_location),
+                                                  lambda : json.loads(unifiedIO.read(calibration_location)))
 
         mapped = tabular.MappingFilter(inp)
 
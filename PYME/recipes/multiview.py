@@ -83,7 +83,7 @@ class ShiftCorrect(ModuleBase):
         else:
             loc = self.shift_map_path
 
-        shift_map = multiview.load_shiftmap(self.shift_map_path)
+        shift_map = self.cached_resource(('shiftmap', loc), lambda : multiview.load_shiftmap(loc))
 
         mapped = tabular.MappingFilter(inp)
 
@@ -239,9 +239,8 @@ class MapAstigZ(ModuleBase):
         else:
             calibration_location = self.astigmatism_calibration_location
 
-        s = unifiedIO.read(calibration_location)
-
-        astig_calibrations = json.loads(s)
+        astig_calibrations = self.cached_resource(('astig_calibration', calibration_location),
+                                                  lambda : json.loads(unifiedIO.read(calibration_location)))
 
         mapped = tabular.MappingFilter(inp)
 
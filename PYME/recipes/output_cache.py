@@ -0,0 +1,376 @@
+"""
+A persistent, content-addressed, on-disk cache of recipe module outputs.
+
+Within a single :class:`~PYME.recipes.recipe.Recipe` execution is already incremental (modules whose outputs are in the
+namespace are not re-run), but re-running the same recipe in a new process (e.g. successive ``bakeshop`` / ``runRecipe``
+runs, parameter sweeps, or on a cluster worker) recomputes everything. With an :class:`OutputCache`, the outputs of each
+module are stored on disk under a key derived from:
+
+- the module class
+- the module parameters (everything from ``get_params()`` which is not an input or output name), plus the size and
+  modification time of any local files named in file parameters (e.g. a PSF for deconvolution)
+- a hash of the *content* of each input (for images loaded from a file, the file name, size and modification time
+  are used instead, so that large file-backed images are not read in full just to compute the key)
+
+so that a module is only re-run if its parameters or inputs have actually changed. Hashes of module outputs are derived
+from the key of the module which produced them, so data is only hashed when it enters the recipe, not as it passes
+between modules.
+
+Image outputs are stored as ``.npy`` files (and memory mapped when loaded), and tabular outputs in the columnar format
+of :mod:`PYME.IO.columnar`. Modules with outputs of any other type (or with object columns etc.) are not cached, and
+nor are lazily evaluated image outputs (see :meth:`PYME.recipes.base.Filter.lfilter`), which would otherwise have to
+be computed in full. The cache is limited in size, with the least recently used entries being removed first.
+
+Only modules which opt in, by setting the ``_cache_outputs`` class attribute to True (see
+:class:`PYME.recipes.base.ModuleBase`), are cached. They must be deterministic, have no side-effects, and depend only
+on their inputs, their parameters and files named in file parameters. Note that the key does not include the module's
+code, so the cache should be cleared after changing the implementation of a module.
+
+The cache is enabled by setting the ``recipe-output-cache-dir`` config option.
+"""
+import hashlib
+import json
+import os
+import shutil
+import weakref
+import logging
+
+import numpy as np
+
+from PYME import config
+
+logger = logging.getLogger(__name__)
+
+
+def _file_identity(image):
+    """
+    A cheap identity for an image which was loaded from (and is unchanged since being loaded from) a file, to use in
+    place of hashing its contents. None for in-memory images.
+    """
+    filename = getattr(image, 'filename', None)
+    if (not filename) or (not getattr(image, 'saved', False)) or getattr(image, 'volatile', False):
+        return None
+
+    data = image.data_xyztc
+    ident = {'filename': filename, 'shape': tuple(data.shape), 'dtype': str(data.dtype)}
+
+    path_ident = _path_identity(filename)
+    if path_ident is not None:
+        ident.update(size=path_ident[0], mtime=path_ident[1])
+    # otherwise a cluster (or other) URI. Data on the cluster is write-once, so the name and shape identify the series
+
+    return ident
+
+
+def _path_identity(filename):
+    """Size and modification time of a local file named in a module parameter (None if it is not a local file)"""
+    path = filename.split('?')[0]
+    if not os.path.isfile(path):
+        return None
+
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _mdh_json(obj):
+    mdh = getattr(obj, 'mdh', None)
+    if mdh is None:
+        return None
+
+    return mdh.to_JSON()
+
+
+class OutputCache(object):
+    """
+    Parameters
+    ----------
+    cache_dir : str
+        directory to store cached outputs in. Defaults to the ``recipe-output-cache-dir`` config option.
+    max_size_mb : float
+        maximum size of the cache (in MB). Defaults to the ``recipe-output-cache-size-mb`` config option (2048).
+    """
+    def __init__(self, cache_dir=None, max_size_mb=None):
+        if cache_dir is None:
+            cache_dir = config.get('recipe-output-cache-dir')
+        if max_size_mb is None:
+            max_size_mb = config.get('recipe-output-cache-size-mb', 2048)
+
+        if cache_dir is None:
+            raise RuntimeError('No cache directory given, and recipe-output-cache-dir is not set')
+
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_mb*1024*1024)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # id(obj) -> (weakref to obj, content hash). Lets us avoid re-hashing data we have seen (or generated) before.
+        self._hashes = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    # --------------------------------------------------------------------------------------------
+    # hashing
+
+    def _remember_hash(self, obj, digest):
+        try:
+            ref = weakref.ref(obj)
+        except TypeError:
+            return
+
+        if len(self._hashes) > 10000:
+            # forget objects which no longer exist
+            self._hashes = {k: v for k, v in self._hashes.items() if v[0]() is not None}
+
+        self._hashes[id(obj)] = (ref, digest)
+
+    def content_hash(self, obj):
+        """
+        Hash of the content of a namespace value (image, tabular data, array or simple python value)
+
+        Returns
+        -------
+        digest : str, or None if the value cannot be hashed (in which case the module should not be cached)
+        """
+        from PYME.IO.image import ImageStack
+        from PYME.IO import tabular
+
+        entry = self._hashes.get(id(obj), None)
+        if (entry is not None) and (entry[0]() is obj):
+            return entry[1]
+
+        h = hashlib.sha1()
+        try:
+            if isinstance(obj, ImageStack):
+                ident = _file_identity(obj)
+                if ident is not None:
+                    # don't read (potentially very large) images from disk just to hash them
+                    h.update(b'image_file' + json.dumps(ident, sort_keys=True).encode())
+                else:
+                    data = obj.data_xyztc
+                    h.update(b'image' + repr((tuple(data.shape), str(data.dtype))).encode())
+                    for c in range(data.shape[4]):
+                        for t in range(data.shape[3]):
+                            for z in range(data.shape[2]):
+                                h.update(np.ascontiguousarray(data[:, :, z, t, c]).data)
+                h.update(str(_mdh_json(obj)).encode())
+            elif isinstance(obj, tabular.TabularBase):
+                h.update(b'tabular')
+                for k in sorted(obj.keys()):
+                    v = np.ascontiguousarray(obj[k])
+                    if v.dtype.hasobject:
+                        return None
+                    h.update(repr((k, v.shape, str(v.dtype))).encode())
+                    h.update(v.data)
+                h.update(str(_mdh_json(obj)).encode())
+            elif isinstance(obj, np.ndarray):
+                if obj.dtype.hasobject:
+                    return None
+                h.update(b'array' + repr((obj.shape, str(obj.dtype))).encode())
+                h.update(np.ascontiguousarray(obj).data)
+            elif isinstance(obj, (str, bytes, int, float, bool, type(None))):
+                h.update(repr(obj).encode())
+            else:
+                return None
+        except Exception:
+            logger.debug('Could not hash %s' % type(obj))
+            return None
+
+        digest = h.hexdigest()
+        self._remember_hash(obj, digest)
+        return digest
+
+    def key(self, module, namespace):
+        """Cache key for a module, given the current namespace. None if the module cannot be cached."""
+        from PYME.recipes import base
+        from PYME.recipes.traits import File
+
+        inputs, outputs, params = module.get_params()
+
+        input_hashes = {}
+        for trait_name, ns_key in module._input_traits.items():
+            digest = self.content_hash(namespace[ns_key])
+            if digest is None:
+                return None
+            input_hashes[trait_name] = digest
+
+        try:
+            param_s = json.dumps(module.trait_get(params), sort_keys=True, default=repr)
+        except Exception:
+            return None
+
+        # files named in parameters can change without the parameter changing
+        files = {}
+        for name in params:
+            value = getattr(module, name, None)
+            if isinstance(module.trait(name).trait_type, File) and value:
+                files[name] = _path_identity(value)
+
+        desc = json.dumps({'module': base.module_names.get(module.__class__, module.__class__.__name__),
+                           'params': param_s, 'inputs': input_hashes, 'files': files}, sort_keys=True)
+        return hashlib.sha1(desc.encode()).hexdigest()
+
+    # --------------------------------------------------------------------------------------------
+    # storage
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _output_hash(self, key, trait_name):
+        return hashlib.sha1((key + '/' + trait_name).encode()).hexdigest()
+
+    def load(self, module, namespace, key):
+        """
+        Load the outputs of `module` from the cache into `namespace`.
+
+        Returns
+        -------
+        bool : True if the outputs were found (and loaded)
+        """
+        from PYME.IO import columnar, tabular, MetaDataHandler
+        from PYME.IO.image import ImageStack
+
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, 'index.json')) as f:
+                index = json.load(f)
+
+            out = {}
+            for trait_name, ns_key in module._output_traits.items():
+                desc = index[trait_name]
+                fn = os.path.join(entry_dir, trait_name)
+                mdh = MetaDataHandler.from_json(desc['mdh']) if desc['mdh'] else None
+                if desc['type'] == 'image':
+                    v = ImageStack(data=np.load(fn + '.npy', mmap_mode='r'), mdh=mdh, haveGUI=False)
+                elif desc['type'] == 'tabular':
+                    v = tabular.DictSource(columnar.loads_columns(np.memmap(fn + columnar.EXTENSION, mode='r')))
+                    if mdh is not None:
+                        v.mdh = mdh
+                else:
+                    v = np.load(fn + '.npy', mmap_mode='r')
+
+                self._remember_hash(v, self._output_hash(key, trait_name))
+                out[ns_key] = v
+        except (IOError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return False
+
+        namespace.update(out)
+        try:
+            # mark as recently used
+            os.utime(entry_dir)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return True
+
+    def store(self, module, namespace, key):
+        """Store the outputs of (a just executed) `module` in the cache"""
+        from PYME.IO import columnar, tabular
+        from PYME.IO.image import ImageStack
+        from PYME.IO.DataSources import FilteredDataSource
+
+        entry_dir = self._entry_dir(key)
+        tmp_dir = entry_dir + '.%d.tmp' % os.getpid()
+        index = {}
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            for trait_name, ns_key in module._output_traits.items():
+                v = namespace[ns_key]
+                fn = os.path.join(tmp_dir, trait_name)
+                if isinstance(v, ImageStack) and isinstance(v.data_xyztc, FilteredDataSource.DataSource):
+                    # lazily evaluated - storing would force the whole output to be computed
+                    raise TypeError('lazy output')
+                elif isinstance(v, ImageStack):
+                    np.save(fn + '.npy', np.asarray(v.data_xyztc[:, :, :, :, :]))
+                    index[trait_name] = {'type': 'image', 'mdh': _mdh_json(v)}
+                elif isinstance(v, tabular.TabularBase):
+                    cols = {k: np.asarray(v[k]) for k in v.keys()}
+                    if any([c.dtype.hasobject for c in cols.values()]):
+                        raise TypeError('object column')
+                    rec = np.empty(len(v), dtype=[(k, c.dtype, c.shape[1:]) for k, c in cols.items()])
+                    for k, c in cols.items():
+                        rec[k] = c
+                    with open(fn + columnar.EXTENSION, 'wb') as f:
+                        f.write(columnar.dumps(rec))
+                    index[trait_name] = {'type': 'tabular', 'mdh': _mdh_json(v)}
+                elif isinstance(v, np.ndarray) and not v.dtype.hasobject:
+                    np.save(fn + '.npy', v)
+                    index[trait_name] = {'type': 'array', 'mdh': None}
+                else:
+                    raise TypeError('cannot cache %s' % type(v))
+
+                self._remember_hash(v, self._output_hash(key, trait_name))
+
+            with open(os.path.join(tmp_dir, 'index.json'), 'w') as f:
+                json.dump(index, f)
+
+            if os.path.exists(entry_dir):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            os.rename(tmp_dir, entry_dir)
+        except Exception as e:
+            logger.debug('Not caching outputs of %s: %s' % (module, e))
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        self._evict()
+
+    def _entries(self):
+        for prefix in os.listdir(self.cache_dir):
+            d = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(d):
+                continue
+            for key in os.listdir(d):
+                if key.endswith('.tmp'):
+                    continue
+                entry_dir = os.path.join(d, key)
+                try:
+                    size = sum([os.path.getsize(os.path.join(entry_dir, fn)) for fn in os.listdir(entry_dir)])
+                    yield os.path.getmtime(entry_dir), size, entry_dir
+                except OSError:
+                    # removed by someone else
+                    pass
+
+    def size(self):
+        return sum([e[1] for e in self._entries()])
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum([e[1] for e in entries])
+        for mtime, size, entry_dir in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for mtime, size, entry_dir in list(self._entries()):
+            shutil.rmtree(entry_dir, ignore_errors=True)
+
+    # --------------------------------------------------------------------------------------------
+
+    def execute(self, module, namespace, execute=None):
+        """
+        Execute `module`, using cached outputs if available, and caching them if not. `execute` is an optional
+        replacement for ``module.execute`` (see :meth:`PYME.recipes.recipe.Recipe._execute_module`).
+        """
+        if execute is None:
+            execute = module.execute
+        
+        key = None
+        if getattr(module, '_cache_outputs', False):
+            key = self.key(module, namespace)
+
+        if key is None:
+            execute(namespace)
+            return
+
+        if self.load(module, namespace, key):
+            logger.debug('Loaded outputs of %s from cache' % module)
+            return
+
+        execute(namespace)
+        self.store(module, namespace, key)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -1996,13 +1996,17 @@ class FlatfiledAndDarkCorrect(ModuleBase):
         #from PYME.IO import unifiedIO
         from PYME.IO.image import ImageStack
         
+        def _load_map(filename):
+            return self.cached_resource(('map', filename),
+                                        lambda : np.array(ImageStack(filename=filename).data_xyztc[:,:,0,0,0].squeeze()))
+        
         if self.flatfieldFilename != '':
-            flat = ImageStack(filename=self.flatfieldFilename).data_xyztc[:,:,0,0,0].squeeze()
+            flat = _load_map(self.flatfieldFilename)
         else:
             flat = None
         
         if not self.darkFilename == '':
-            dark = ImageStack(filename=self.darkFilename).data_xyztc[:,:,0, 0, 0].squeeze()
+            dark = _load_map(self.darkFilename)
         else:
             dark = None
         
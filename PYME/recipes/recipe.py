@@ -4,6 +4,7 @@ from .base import ModuleBase, OutputModule
 from PYME.recipes import base
 from PYME.IO.image import ImageStack
 from PYME.IO import tabular, csv_flavours
+from PYME import config
 import time
 
 import logging
@@ -53,6 +54,23 @@ class Recipe(HasTraits):
         self._dg_sig = None
 
         self._exec_times = {} #record module run times ...
+        
+        # optional PYME.recipes.executor.ParallelExecutor to run independent modules concurrently (None = run modules
+        # one at a time, in order)
+        self.executor = None
+        if config.get('recipe-executor-workers', 0) > 1:
+            from PYME.recipes.executor import shared_executor
+            self.executor = shared_executor()
+        
+        # if True, image filters produce lazily evaluated outputs (see PYME.recipes.base.Filter.lfilter), which only
+        # compute the planes that are actually looked at. Enabled by the recipe editor so that it responds immediately.
+        self.lazy_filters = config.get('recipes-lazy-filters', False)
+        
+        # optional persistent cache of module outputs (see PYME.recipes.output_cache)
+        self.output_cache = None
+        if config.get('recipe-output-cache-dir', None):
+            from PYME.recipes.output_cache import OutputCache
+            self.output_cache = OutputCache()
     
     def invalidate_data(self):
         if self.execute_on_invalidation:
@@ -61,6 +79,23 @@ class Recipe(HasTraits):
     def clear(self):
         self.namespace.clear()
     
+    def reset(self):
+        """
+        Prepare the recipe for re-use with new inputs (e.g. for the next task on a cluster worker).
+        
+        Clears the namespace and marks all modules as not having executed, but keeps the module instances (and any
+        resources they have cached, see :meth:`PYME.recipes.base.ModuleBase.cached_resource`). This is much cheaper
+        than re-constructing the recipe from YAML.
+        """
+        self.namespace.clear()
+        
+        for m in self.modules:
+            m._success = False
+            m._last_error = None
+            
+        self.failed = False
+        self._last_error = None
+    
     def new_output_name(self, stub):
         count = len([k for k in self.namespace.keys() if k.startswith(stub)])
         
@@ -227,36 +262,21 @@ class Recipe(HasTraits):
                 if isinstance(m, ModuleBase) and not m.outputs_in_namespace(self.namespace):
                     m._success = False
             
-            for m in exec_order:
-                #if isinstance(m, ModuleBase):
-                #    logger.debug('Checking whether to execute: %s, %s, %s' % (m, m._success, m.outputs_in_namespace(self.namespace)))
-                if isinstance(m, ModuleBase) and not getattr(m, '_success', False):
-                    try:
-                        logger.debug('Executing %s' % m)
-                        ts = time.time()
-                        m.check_inputs(self.namespace)
-                        m.execute(self.namespace)
-                        self._exec_times[base.module_names[m.__class__]] = time.time() - ts
-                        m._last_error = None
-                        m._success = True
-                        if progress_callback:
-                            progress_callback(self, m)
-                    except:
-                        import traceback
-                        logger.exception("Error in recipe module: %s" % m)
-                        
-                        #record our error so that we can associate it with a module
-                        m._last_error = traceback.format_exc()
-                        self.failed = True
-                        self._failing_module = m
-                        self._last_error = m._last_error
-                        
-                        # make sure we didn't leave any partial results
-                        logger.debug('removing failed module dependencies')
-                        self.prune_dependencies_from_namespace(m.outputs)
-                        logger.debug('notifying failure')
-                        self.recipe_failed.send_robust(self)
-                        raise
+            if self.executor is not None:
+                self.executor.run(self, exec_order, progress_callback)
+            else:
+                for m in exec_order:
+                    #if isinstance(m, ModuleBase):
+                    #    logger.debug('Checking whether to execute: %s, %s, %s' % (m, m._success, m.outputs_in_namespace(self.namespace)))
+                    if isinstance(m, ModuleBase) and not getattr(m, '_success', False):
+                        try:
+                            logger.debug('Executing %s' % m)
+                            ts = time.time()
+                            self._execute_module(m)
+                            self._module_succeeded(m, time.time() - ts, progress_callback)
+                        except:
+                            self._module_failed(m)
+                            raise
             
             if self.failed:
                 # make sure we update the GUI if we've fixed a broken recipe
@@ -282,6 +302,45 @@ class Recipe(HasTraits):
         except Exception as e:
             raise RecipeExecutionError('Recipe execution failed in module %s' % self._failing_module._module_name, self ) from e
     
+    def _execute_module(self, m, execute=None):
+        """
+        Execute a module (checking its inputs, and using the output cache if enabled). `execute` is an optional
+        replacement for ``m.execute``, called with the namespace, used by the executor to run modules in another process.
+        """
+        m.check_inputs(self.namespace)
+        
+        if execute is None:
+            execute = m.execute
+        
+        if self.output_cache is not None:
+            self.output_cache.execute(m, self.namespace, execute)
+        else:
+            execute(self.namespace)
+    
+    def _module_succeeded(self, m, exec_time, progress_callback=None):
+        self._exec_times[base.module_names[m.__class__]] = exec_time
+        m._last_error = None
+        m._success = True
+        if progress_callback:
+            progress_callback(self, m)
+    
+    def _module_failed(self, m):
+        """Record (and clean up after) a module failure. Must be called from an exception handler."""
+        import traceback
+        logger.exception("Error in recipe module: %s" % m)
+        
+        #record our error so that we can associate it with a module
+        m._last_error = traceback.format_exc()
+        self.failed = True
+        self._failing_module = m
+        self._last_error = m._last_error
+        
+        # make sure we didn't leave any partial results
+        logger.debug('removing failed module dependencies')
+        self.prune_dependencies_from_namespace(m.outputs)
+        logger.debug('notifying failure')
+        self.recipe_failed.send_robust(self)
+    
     @classmethod
     def fromMD(cls, md):
         c = cls()
@@ -22,6 +22,7 @@ from PYME.recipes import modules
 from PYME.recipes import Recipe
 #from PYME.recipes import runRecipe
 from PYME.recipes import batchProcess
+from PYME import config
 from PYME.recipes import recipeLayout
 
 # import pylab
@@ -785,6 +786,8 @@ class RecipeManager(object):
     def LoadRecipeText(self, s, filename=''):
         self.currentFilename  = filename
         self.activeRecipe = Recipe.fromYAML(s)
+        # only compute the parts of filter outputs which are actually displayed, so that editing is responsive
+        self.activeRecipe.lazy_filters = config.get('recipes-lazy-filters-in-editor', True)
         #self.mICurrent.SetItemLabel('Run %s\tF5' % os.path.split(filename)[1])
 
         try:        
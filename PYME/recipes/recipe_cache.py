@@ -0,0 +1,92 @@
+"""
+An LRU cache of constructed :class:`~PYME.recipes.recipe.Recipe` objects, for workers which run the same recipe over
+and over again with different inputs (e.g. the cluster task workers, see :mod:`PYME.cluster.taskWorkerHTTP`).
+
+Parsing recipe YAML and constructing the modules (a traits-heavy process) can take a substantial fraction of the total
+task time when each task is small. Instead, recipes are cached by a hash of their YAML text and :meth:`Recipe.reset`
+between tasks. As the module instances are retained, so are any expensive resources they have loaded (see
+:meth:`PYME.recipes.base.ModuleBase.cached_resource`).
+"""
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+from PYME import config
+
+logger = logging.getLogger(__name__)
+
+
+class RecipeCache(object):
+    """
+    LRU cache of recipes, keyed by (a hash of) their YAML.
+
+    Recipes are checked out with :meth:`get` and returned with :meth:`put` once the task has finished - a recipe is
+    only ever used by one task at a time. Recipes which failed should not be returned (they will be rebuilt).
+
+    Parameters
+    ----------
+    max_recipes : int
+        maximum number of recipes to keep. Defaults to the ``taskworker-recipe-cache-size`` config option (10).
+    """
+    def __init__(self, max_recipes=None):
+        if max_recipes is None:
+            max_recipes = config.get('taskworker-recipe-cache-size', 10)
+
+        self.max_recipes = int(max_recipes)
+
+        self._recipes = OrderedDict() # key -> list of idle recipes
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(recipe_yaml):
+        if not isinstance(recipe_yaml, bytes):
+            recipe_yaml = recipe_yaml.encode('utf-8')
+
+        return hashlib.sha1(recipe_yaml).hexdigest()
+
+    def get(self, recipe_yaml):
+        """
+        Get a recipe (ready to execute, with an empty namespace) for the given YAML
+
+        Returns
+        -------
+        key : str
+            the cache key (pass to :meth:`put`)
+        recipe : PYME.recipes.recipe.Recipe
+        """
+        from PYME.recipes.recipe import Recipe
+
+        key = self.key(recipe_yaml)
+        recipe = None
+        with self._lock:
+            idle = self._recipes.get(key, None)
+            if idle:
+                recipe = idle.pop()
+                self._recipes.move_to_end(key)
+
+        if recipe is None:
+            self.misses += 1
+            recipe = Recipe.fromYAML(recipe_yaml)
+        else:
+            self.hits += 1
+            recipe.reset()
+
+        return key, recipe
+
+    def put(self, key, recipe):
+        """Return a recipe to the cache after use (clears its namespace so that task data is not kept alive)"""
+        recipe.reset()
+
+        with self._lock:
+            self._recipes.setdefault(key, []).append(recipe)
+            self._recipes.move_to_end(key)
+
+            while len(self._recipes) > self.max_recipes:
+                self._recipes.popitem(last=False)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'n_recipes': len(self._recipes)}
@@ -36,6 +36,8 @@ class FilterTable(ModuleBase):
     inputName = Input('measurements')
     filters = Dict(str, list)
     outputName = Output('filtered')
+    
+    _cache_outputs = True
 
     # def execute(self, namespace):
     #     inp = namespace[self.inputName]
@@ -98,7 +100,7 @@ class FilterTableByIDs(ModuleBase):
         
     @property
     def _possible_ids(self):
-        ids = [int(id) for id in set(self._ds[self.idColumnName]) if id > 0]
+        ids = [int(id) for id in np.unique(self._ds[self.idColumnName]) if id > 0]
         
         return ids
 
@@ -0,0 +1,147 @@
+"""
+A ring of shared-memory frame slots, used to pass decoded camera frames from one process which fetches and decompresses
+them to a pool of processes which use them (see :class:`PYME.cluster.taskWorkerHTTP.PooledTaskWorker`).
+
+The ring is a fixed number of fixed size slots, allocated with :mod:`PYME.util.shmarray` (so it must be created before
+the worker processes are started, and passed to them as an argument). Each slot is tagged with the series it came from
+and the frame index. Slots are reference counted. The fetching process pins the frames a task needs until the task is
+complete, and readers pin a slot while they copy out of it. Slots with no references are re-used in least recently
+used order.
+"""
+import hashlib
+import multiprocessing
+
+import numpy as np
+
+from PYME.util.shmarray import shmarray
+
+# dtypes which can be stored in the ring (index is stored per slot)
+_DTYPES = [np.dtype(d) for d in ['u1', 'u2', 'i2', 'u4', 'i4', 'f4', 'f8']]
+
+
+def series_key(series_id):
+    """A (process independent) 63-bit integer key for a series ID string (python's hash() is salted per process)"""
+    return int.from_bytes(hashlib.sha1(series_id.encode('utf-8')).digest()[:8], 'little') & 0x7fffffffffffffff
+
+
+class SharedFrameRing(object):
+    """
+    Parameters
+    ----------
+    n_slots : int
+        number of frames the ring can hold
+    slot_bytes : int
+        maximum size of a frame (in bytes). Memory is only committed (by the OS) for the parts of each slot which are
+        actually written, so this can be generous.
+    """
+    def __init__(self, n_slots, slot_bytes):
+        self.n_slots = int(n_slots)
+        self.slot_bytes = int(slot_bytes)
+
+        self._data = shmarray.create([self.n_slots, self.slot_bytes], 'u1')
+        self._series = shmarray.zeros(self.n_slots, 'i8')
+        self._frame = shmarray.create(self.n_slots, 'i8')
+        self._frame[:] = -1
+        self._shape = shmarray.zeros([self.n_slots, 3], 'i8')
+        self._dtype = shmarray.zeros(self.n_slots, 'i8')
+        self._refs = shmarray.zeros(self.n_slots, 'i8')
+        self._stamp = shmarray.zeros(self.n_slots, 'i8') # time of last use, for LRU replacement
+        self._clock = shmarray.zeros(1, 'i8')
+
+        self._lock = multiprocessing.Lock()
+
+    def _find(self, key, frame):
+        slots = np.flatnonzero((self._frame == frame) & (self._series == key))
+        return int(slots[0]) if len(slots) else -1
+
+    def _touch(self, slot):
+        self._clock[0] += 1
+        self._stamp[slot] = self._clock[0]
+
+    def can_store(self, data):
+        return (1 <= data.ndim <= 3) and (data.nbytes <= self.slot_bytes) and (data.dtype in _DTYPES)
+
+    def pin(self, key, frame):
+        """Pin a frame if it is already in the ring. Returns the slot, or -1 if the frame is not in the ring"""
+        with self._lock:
+            slot = self._find(key, frame)
+            if slot >= 0:
+                self._refs[slot] += 1
+                self._touch(slot)
+
+            return slot
+
+    def put(self, key, frame, data):
+        """
+        Store (and pin) a frame.
+
+        Returns
+        -------
+        slot : int
+            the slot the frame is stored in, or -1 if it could not be stored (unsupported shape / dtype, or all slots
+            are pinned)
+        """
+        data = np.ascontiguousarray(data)
+        if not self.can_store(data):
+            return -1
+
+        with self._lock:
+            slot = self._find(key, frame)
+            if slot < 0:
+                free = np.flatnonzero(self._refs == 0)
+                if len(free) == 0:
+                    return -1
+
+                slot = int(free[np.argmin(self._stamp[free])])
+
+                self._data[slot, :data.nbytes] = data.reshape(-1).view('u1')
+                self._shape[slot, :] = 0
+                self._shape[slot, :data.ndim] = data.shape
+                self._dtype[slot] = _DTYPES.index(data.dtype)
+                self._series[slot] = key
+                self._frame[slot] = frame
+
+            self._refs[slot] += 1
+            self._touch(slot)
+            return slot
+
+    def release(self, slots):
+        """Un-pin slots returned by :meth:`put` or :meth:`pin`"""
+        with self._lock:
+            for slot in slots:
+                self._refs[slot] -= 1
+
+    def get(self, key, frame):
+        """Return a copy of a frame, or None if it is not in the ring"""
+        slot = self.pin(key, frame)
+        if slot < 0:
+            return None
+
+        try:
+            dtype = _DTYPES[self._dtype[slot]]
+            shape = tuple(int(n) for n in self._shape[slot] if n > 0)
+            nbytes = int(np.prod(shape))*dtype.itemsize
+            return self._data[slot, :nbytes].view(dtype).reshape(shape).copy().view(np.ndarray)
+        finally:
+            self.release([slot])
+
+
+class RingDataSource(object):
+    """
+    Wraps a data source so that frames are read from a :class:`SharedFrameRing` if possible, falling back on the
+    wrapped data source if they are not in the ring. All other attributes are delegated to the wrapped data source.
+    """
+    def __init__(self, datasource, ring, key):
+        self._datasource = datasource
+        self._ring = ring
+        self._key = key
+
+    def getSlice(self, ind):
+        sl = self._ring.get(self._key, ind)
+        if sl is None:
+            return self._datasource.getSlice(ind)
+
+        return sl
+
+    def __getattr__(self, item):
+        return getattr(self._datasource, item)
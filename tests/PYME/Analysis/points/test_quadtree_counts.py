@@ -0,0 +1,24 @@
+import numpy as np
+
+from PYME.Analysis.points.QuadTree import pointQT, QTrend
+
+
+def test_count_rendering_matches_tree():
+    r = np.random.RandomState(0)
+    x = np.concatenate([r.normal(300, 40, 3000), r.uniform(0, 1000, 2000)])
+    y = np.concatenate([r.normal(500, 60, 3000), r.uniform(0, 1000, 2000)])
+    size = 64
+
+    qt = pointQT.qtRoot(0, 1000, 0, 1000)
+    for xi, yi in zip(x, y):
+        qt.insert(pointQT.qtRec(xi, yi, None), 10)
+
+    im_tree = np.zeros((size, size))
+    QTrend.rendQTa(im_tree, qt)
+
+    # count in two chunks, as the out-of-core renderer does
+    counts = QTrend.quadCounts(x[:2500], y[:2500], 0, 0, 1000./size, size)
+    counts += QTrend.quadCounts(x[2500:], y[2500:], 0, 0, 1000./size, size)
+    im_counts = QTrend.rendQTCounts(counts, 10)
+
+    assert np.allclose(im_tree, im_counts)
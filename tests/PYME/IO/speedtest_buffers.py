@@ -0,0 +1,52 @@
+"""
+Timing comparison of the percentile background buffers for a sliding window analysis, as used when fitting with
+`Analysis.PCTBackground` set.
+"""
+import time
+import numpy as np
+
+from PYME.IO import buffers
+
+
+class _FakeDataBuffer(object):
+    def __init__(self, shape, n_frames):
+        self.frames = [np.random.poisson(100, shape).astype('uint16') for i in range(n_frames)]
+        self.dataSource = self
+
+    def getSlice(self, ind):
+        return self.frames[ind]
+
+    def getSliceShape(self):
+        return self.frames[0].shape
+
+    def getNumSlices(self):
+        return len(self.frames)
+
+
+def _time_buffer(buffer_class, shape, window=30, n_steps=10):
+    db = _FakeDataBuffer(shape, window + n_steps)
+    bb = buffer_class(db, 0.25)
+
+    bb.getBackground(range(window))
+
+    t = time.time()
+    for i in range(1, n_steps):
+        bb.getBackground(range(i, i + window))
+
+    return (time.time() - t)/(n_steps - 1)
+
+
+def _compare(shape):
+    t_legacy = _time_buffer(buffers.backgroundBufferM, shape)
+    t_sorted = _time_buffer(buffers.backgroundBufferMS, shape)
+
+    print('%s: backgroundBufferM %3.3f s/frame, backgroundBufferMS %3.3f s/frame (%3.1fx)' % (
+        shape, t_legacy, t_sorted, t_legacy/t_sorted))
+
+
+def test_background_512():
+    _compare((512, 512))
+
+
+def test_background_2048():
+    _compare((2048, 2048))
@@ -0,0 +1,49 @@
+"""
+Timing of ID set-membership (tabular.IdFilter / tabular.id_lookup) for a large table - 1e7 localisations filtered by 1e5
+cluster IDs - compared with the previous approach of comparing against each ID in turn (timed on a subset of the IDs
+and extrapolated, as running it in full takes many minutes).
+"""
+import time
+import numpy as np
+
+from PYME.IO import tabular
+
+N_ROWS = int(1e7)
+N_IDS = int(1e5)
+
+
+def _table(id_range):
+    r = np.random.RandomState(0)
+    return tabular.DictSource({'clumpIndex': r.randint(0, id_range, N_ROWS).astype('i4')})
+
+
+def _compare(id_range):
+    src = _table(id_range)
+    valid_ids = np.unique(np.random.RandomState(1).randint(0, id_range, int(1.2*N_IDS)))[:N_IDS]
+    
+    t = time.time()
+    f = tabular.IdFilter(src, 'clumpIndex', valid_ids)
+    t_new = time.time() - t
+    
+    n_sub = 20
+    col = src['clumpIndex']
+    t = time.time()
+    idx = np.zeros(N_ROWS)
+    for id in valid_ids[:n_sub]:
+        idx += (col == id)
+    t_legacy = (time.time() - t)*N_IDS/n_sub
+    
+    print('%d rows x %d IDs (ID range %d): IdFilter %3.3f s, per-ID comparison ~%3.1f s (%dx)' % (
+        N_ROWS, N_IDS, id_range, t_new, t_legacy, t_legacy/t_new))
+    
+    return f
+
+
+def test_id_filter_dense_ids():
+    # IDs drawn from a small range -> lookup table
+    _compare(2*N_IDS)
+
+
+def test_id_filter_sparse_ids():
+    # IDs drawn from a huge range -> sorted search
+    _compare(2**30)
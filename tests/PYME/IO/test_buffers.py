@@ -0,0 +1,67 @@
+"""
+Tests for the background buffers in PYME.IO.buffers
+"""
+
+import numpy as np
+import pytest
+
+from PYME.IO import buffers
+
+
+class _FakeDataSource(object):
+    def __init__(self, data):
+        self.data = data
+
+    def getSlice(self, ind):
+        return self.data[:, :, ind]
+
+    def getSliceShape(self):
+        return self.data.shape[:2]
+
+    def getNumSlices(self):
+        return self.data.shape[2]
+
+
+class _FakeDataBuffer(object):
+    def __init__(self, dataSource):
+        self.dataSource = dataSource
+
+    def getSlice(self, ind):
+        return self.dataSource.getSlice(ind)
+
+
+def _sliding_windows(n_frames, window=20, step=3):
+    for start in range(0, n_frames - window, step):
+        yield range(start, start + window)
+
+
+@pytest.mark.parametrize('dtype', ['uint16', 'f4'])
+def test_bgFrameBufferSorted(dtype):
+    np.random.seed(1)
+    data = np.random.poisson(50, (32, 24, 100)).astype(dtype)
+
+    bfb = buffers.bgFrameBufferSorted(initialSize=5)
+    current = set()
+    for window in _sliding_windows(data.shape[2]):
+        for fi in current.difference(window):
+            bfb.removeFrame(fi)
+        for fi in set(window).difference(current):
+            bfb.addFrame(fi, data[:, :, fi])
+        current = set(window)
+
+        s = np.sort(data[:, :, sorted(current)], axis=2)
+        for pct in [0.1, 0.25, 0.5, 0.9, 1.0]:
+            idx = min(max(int(len(current)*pct) - 1, 0), len(current) - 1)
+            assert np.all(bfb.getPercentile(pct) == s[:, :, idx])
+
+
+def test_backgroundBufferMS_matches_backgroundBufferM():
+    np.random.seed(2)
+    data = np.random.poisson(100, (16, 20, 80)).astype('uint16')
+    db = _FakeDataBuffer(_FakeDataSource(data))
+
+    ref = buffers.backgroundBufferM(db, 0.25)
+    fast = buffers.backgroundBufferMS(db, 0.25)
+
+    for window in _sliding_windows(data.shape[2], window=30, step=5):
+        assert np.allclose(ref.getBackground(window), fast.getBackground(window))
@@ -0,0 +1,144 @@
+"""
+Tests for the asyncio based streamer, using simple in-process HTTP servers in place of PYMEDataServer
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from PYME.IO import cluster_streaming
+
+
+def _make_server(delay=0):
+    files = {}
+    
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        
+        def do_PUT(self):
+            data = self.rfile.read(int(self.headers['Content-Length']))
+            time.sleep(delay)
+            files[self.path[1:]] = data
+            
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            
+        def log_message(self, *args):
+            pass
+            
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    
+    return server, files
+
+
+def test_async_streamer():
+    servers = [_make_server() for i in range(2)]
+    
+    streamer = cluster_streaming.AsyncStreamer(servers=[s.server_address for s, f in servers],
+                                               distribution_fcn=cluster_streaming.distribution_function_round_robin,
+                                               filter=lambda d: d*2, max_in_flight=4, queue_size=8)
+    
+    for i in range(50):
+        streamer.put('_testing/f%d' % i, b'abc', i=i)
+        
+    streamer.close()
+    
+    stats = streamer.get_stats()
+    assert stats['n_acked'] == 50
+    assert stats['n_errors'] == 0
+    assert stats['queue_depth'] == 0
+    assert stats['in_flight'] == 0
+    assert stats['bytes_sent'] == 300
+    
+    assert len(servers[0][1]) == 25
+    assert servers[1][1]['_testing/f1'] == b'abcabc'
+    
+    for s, f in servers:
+        s.shutdown()
+        
+
+def test_async_streamer_least_loaded():
+    fast, fast_files = _make_server()
+    slow, slow_files = _make_server(delay=0.05)
+    
+    streamer = cluster_streaming.AsyncStreamer(servers=[fast.server_address, slow.server_address], max_in_flight=2)
+    
+    for i in range(100):
+        streamer.put('_testing/f%d' % i, b'abc')
+        
+    streamer.close()
+    
+    assert len(fast_files) + len(slow_files) == 100
+    assert len(fast_files) > len(slow_files)
+    
+    fast.shutdown()
+    slow.shutdown()
+
+
+def _make_dying_server(n_ok):
+    """A server which drops the connection (without responding) after `n_ok` files"""
+    files = {}
+    
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        
+        def do_PUT(self):
+            data = self.rfile.read(int(self.headers['Content-Length']))
+            if len(files) >= n_ok:
+                self.close_connection = True
+                return
+            
+            files[self.path[1:]] = data
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    
+    return server, files
+
+
+def test_async_streamer_reroutes_on_failure():
+    good, good_files = _make_server(delay=0.01)
+    dying, dying_files = _make_dying_server(3)
+    
+    streamer = cluster_streaming.AsyncStreamer(servers=[dying.server_address, good.server_address], max_in_flight=4)
+    for i in range(50):
+        streamer.put('_testing/f%d' % i, b'abc')
+    streamer.close()
+    
+    # every file made it to one of the servers
+    assert len(dying_files) == 3
+    assert set(good_files.keys()) | set(dying_files.keys()) == {'_testing/f%d' % i for i in range(50)}
+    assert streamer.get_stats()['n_acked'] == 50
+    
+    good.shutdown()
+    dying.shutdown()
+
+
+def test_async_streamer_reports_failure():
+    dying, dying_files = _make_dying_server(3)
+    
+    # files assigned to the dying server by the distribution function can't be re-routed
+    streamer = cluster_streaming.AsyncStreamer(servers=[dying.server_address], max_in_flight=2,
+                                               distribution_fcn=cluster_streaming.distribution_function_round_robin)
+    with pytest.raises(IOError):
+        try:
+            for i in range(50):
+                streamer.put('_testing/f%d' % i, b'abc', i=i)
+                time.sleep(0.01)
+        finally:
+            streamer.close()
+    
+    dying.shutdown()
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+
+from PYME.IO import column_store, tabular, h5rFile, MetaDataHandler
+
+
+def _test_data(n=100):
+    d = np.zeros(n, dtype=[('tIndex', '<i4'),
+                           ('fitResults', [('A', '<f4'), ('x0', '<f4'), ('y0', '<f4')]),
+                           ('fitError', [('x0', '<f4'), ('y0', '<f4')])])
+    d['tIndex'] = np.random.RandomState(0).permutation(n)
+    d['fitResults']['x0'] = np.random.rand(n)
+    d['fitResults']['y0'] = np.random.rand(n)
+    return d
+
+
+def _write_h5r(filename, data):
+    mdh = MetaDataHandler.NestedClassMDHandler()
+    mdh['voxelsize.x'] = 0.1
+    with h5rFile.openH5R(filename, 'a') as f:
+        f.appendToTable('FitResults', data)
+        f.updateMetadata(mdh)
+        f.flush()
+
+
+def test_write_roundtrip(tmp_path):
+    src = tabular.DictSource({'x': np.random.rand(50), 'y': np.random.rand(50), 'n': np.arange(50)})
+    path = str(tmp_path / 'test.pyrcd')
+    src.to_column_store(path)
+    
+    ds = tabular.ColumnStoreSource(path)
+    assert len(ds) == 50
+    assert set(ds.keys()) == {'x', 'y', 'n'}
+    for k in src.keys():
+        assert np.all(ds[k] == src[k])
+    assert np.all(ds['x', 10:20] == src['x'][10:20])
+
+
+def test_from_h5r_matches_h5r_source(tmp_path):
+    fn = str(tmp_path / 'test.h5r')
+    _write_h5r(fn, _test_data())
+    
+    path = str(tmp_path / 'test.pyrcd')
+    column_store.from_h5r(fn, path)
+    ds = tabular.ColumnStoreSource(path)
+    
+    ref = tabular.H5RSource(fn)
+    assert sorted(ds.keys()) == sorted(ref.keys())
+    for k in ref.keys():
+        assert np.all(ds[k] == ref[k])
+    
+    assert ds.mdh['voxelsize.x'] == 0.1
+    
+    # columns are only read when used
+    assert list(ds._columns.keys()) == list(ref._keys)
+    ds2 = tabular.ColumnStoreSource(path)
+    ds2['x']
+    assert list(ds2._columns.keys()) == ['fitResults_x0']
+
+
+def test_from_h5r_chunked(tmp_path):
+    fn = str(tmp_path / 'test.h5r')
+    _write_h5r(fn, _test_data(1000))
+    ref = tabular.H5RSource(fn)
+    
+    # lots of small chunks, including a partial one at the end
+    path = str(tmp_path / 'test.pyrcd')
+    column_store.from_h5r(fn, path, chunk_size_mb=64*24/(1024*1024.))
+    ds = tabular.ColumnStoreSource(path)
+    assert len(ds) == 1000
+    for k in ref.keys():
+        assert np.all(ds[k] == ref[k])
+
+
+def test_cached_h5r(tmp_path):
+    fn = str(tmp_path / 'test.h5r')
+    _write_h5r(fn, _test_data())
+    cache_dir = str(tmp_path / 'cache')
+    
+    path = column_store.cached_h5r(fn, cache_dir=cache_dir)
+    assert column_store.cached_h5r(fn, cache_dir=cache_dir) == path
+    
+    # modifying the file invalidates the cached copy
+    _write_h5r(fn, _test_data())
+    os.utime(fn, (0, 1))
+    path2 = column_store.cached_h5r(fn, cache_dir=cache_dir)
+    assert path2 != path
+    assert len(tabular.ColumnStoreSource(path2)) == 200
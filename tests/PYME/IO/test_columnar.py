@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from PYME.IO import columnar
+
+
+def _test_data(n=100):
+    d = np.zeros(n, dtype=[('tIndex', '<i4'),
+                           ('fitResults', [('A', '<f4'), ('x0', '<f4'), ('y0', '<f4')]),
+                           ('slicesUsed', [('x', [('start', '<i4'), ('stop', '<i4'), ('step', '<i4')])]),
+                           ('sub', '<f8', (3,))])
+    d['tIndex'] = np.arange(n)
+    d['fitResults']['x0'] = np.random.rand(n)
+    d['slicesUsed']['x']['stop'] = 7
+    d['sub'] = np.random.rand(n, 3)
+    return d
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_roundtrip(compression):
+    d = _test_data()
+    r = columnar.loads(columnar.dumps(d, compression=compression))
+
+    assert r.dtype == d.dtype
+    assert np.all(r == d)
+
+
+def test_empty():
+    d = _test_data(0)
+    r = columnar.loads(columnar.dumps(d))
+    assert r.dtype == d.dtype
+    assert len(r) == 0
+
+
+def test_loads_columns_zero_copy():
+    d = _test_data()
+    buf = columnar.dumps(d)
+    cols = columnar.loads_columns(buf)
+
+    assert np.all(cols['fitResults_x0'] == d['fitResults']['x0'])
+    assert np.all(cols['sub'] == d['sub'])
+    # uncompressed columns should be views into the buffer
+    assert not cols['tIndex'].flags.owndata
+
+
+def test_is_columnar():
+    assert columnar.is_columnar(columnar.dumps(_test_data()))
+    assert not columnar.is_columnar(_test_data().dumps())
+
+
+def test_rejects_object_dtype():
+    with pytest.raises(TypeError):
+        columnar.dumps(np.zeros(2, dtype=[('a', 'O')]))
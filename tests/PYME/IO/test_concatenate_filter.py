@@ -0,0 +1,52 @@
+import numpy as np
+
+from PYME.IO import tabular
+
+
+def _sources(n_sources=5):
+    r = np.random.RandomState(0)
+    return [tabular.DictSource({'x': r.rand(n), 'y': r.rand(n)}) for n in r.randint(0, 50, n_sources)]
+
+
+def test_concatenate_columns():
+    sources = _sources()
+    f = tabular.ConcatenateFilter(*sources)
+    
+    x = np.hstack([s['x'] for s in sources])
+    assert len(f) == len(x)
+    assert np.all(f['x', 3:70] == x[3:70])
+    assert np.all(f['x'] == x)
+    assert np.all(f['x', 3:70] == x[3:70])
+    assert np.all(f['x', ::3] == x[::3])
+    assert np.all(f['x', x > 0.5] == x[x > 0.5])
+
+
+def test_concat_source_column():
+    sources = _sources()
+    f = tabular.ConcatenateFilter(*sources)
+    
+    cs = np.hstack([i*np.ones(len(s)) for i, s in enumerate(sources)])
+    assert np.issubdtype(f['concatSource'].dtype, np.integer)
+    assert np.all(f['concatSource'] == cs)
+    assert np.all(f['concatSource', 10:60] == cs[10:60])
+
+
+def test_partial_reads_do_not_concatenate():
+    sources = _sources()
+    f = tabular.ConcatenateFilter(*sources)
+    
+    f['x', 0:10]
+    assert 'x' not in f._cache
+    f['x']
+    assert 'x' in f._cache
+
+
+def test_invalidated_by_source_change():
+    r = np.random.RandomState(0)
+    m = tabular.MappingFilter(tabular.DictSource({'x': r.rand(10)}), x2='x*s')
+    m.addVariable('s', 1)
+    f = tabular.ConcatenateFilter(m, m)
+    
+    v = f['x2'].copy()
+    m.addVariable('s', 2)
+    assert np.allclose(f['x2'], 2*v)
@@ -57,6 +57,21 @@ def test_putfiles_and_list():
     assert(len(listing) == 10)
 
 
+def test_get_files():
+    test_files = [('_testing/test_get_files/file_%d' % i, b'testing %d ... \n' % i) for i in range(10)]
+    
+    clusterIO.put_files(test_files, 'TES1')
+    time.sleep(2)
+    
+    filenames = [fn for fn, data in test_files]
+    retrieved = clusterIO.get_files(filenames[::-1], 'TES1', use_file_cache=False)
+    
+    assert retrieved == [data for fn, data in test_files][::-1]
+    
+    with pytest.raises(IOError):
+        clusterIO.get_files(filenames + ['_testing/test_get_files/not_a_file'], 'TES1', use_file_cache=False, numRetries=1)
+
+
 def test_list_after_timeout():
     test_files = [('_testing/test_list2/file_%d' % i, b'testing ... \n') for i in range(10)]
     
@@ -96,6 +111,42 @@ def test_aggregate_h5r():
     clusterResults.fileResults('pyme-cluster://TES1/__aggregate_h5r/_testing/test_results.h5r/foo', testdata)
 
 
+
+def test_aggregate_h5r_finalise():
+    import numpy as np
+    import tables
+    from PYME.IO import clusterResults, unifiedIO
+    testdata = np.ones(10, dtype=[('a', '<f4'), ('b', '<f4')])
+    
+    dest = 'pyme-cluster://TES1/__aggregate_h5r/_testing/test_results_finalise.h5r'
+    for i in range(5):
+        clusterResults.fileResults(dest + '/foo', testdata)
+    
+    clusterResults.finaliseResults(dest)
+    
+    with unifiedIO.local_or_temp_filename('pyme-cluster://TES1/_testing/test_results_finalise.h5r') as f, \
+            tables.open_file(f) as t:
+        assert len(t.root.foo) == 50
+
+
+
+def test_tabular_part_columnar():
+    import numpy as np
+    import requests
+    from PYME.IO import clusterResults, columnar
+    testdata = np.ones(10, dtype=[('a', '<f4'), ('b', '<f4')])
+    
+    dest = 'pyme-cluster://TES1/__aggregate_h5r/_testing/test_results_columnar.h5r'
+    clusterResults.fileResults(dest + '/foo', testdata)
+    clusterResults.fileResults(dest + '/foo', testdata)
+    
+    url = clusterResults.pickResultsServer('__aggregate_h5r/_testing/test_results_columnar.h5r', 'TES1').replace('__aggregate_h5r/', '')
+    r = columnar.loads(requests.get(url + '/foo.pyrc?from=5').content)
+    
+    assert r.dtype == testdata.dtype
+    assert len(r) == 15
+
+
 def test_dircache_purge():
     testdata = b'foo bar\n'
     for i in range(1050):
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from PYME.IO import tabular
+
+
+def _reference_lookup(values, ids):
+    ids = list(ids)
+    return np.array([ids.index(v) if v in ids else -1 for v in values])
+
+
+@pytest.mark.parametrize('ids', [np.array([5, 3, 9, 3, 12]),  # small range (lookup table), with a duplicate
+                                 np.array([5, 3, 9, 3, 10**9]),  # large range (sorted search)
+                                 np.array([0.5, 2.0, 1.5])])  # not integers
+def test_id_lookup(ids):
+    values = np.array([3, 5, 7, 12, 10**9, 2.0, -1, 0.5, 9])
+    if ids.dtype.kind == 'i':
+        values = values.astype('i8')
+    
+    assert np.all(tabular.id_lookup(values, ids) == _reference_lookup(values, ids))
+
+
+def test_id_lookup_empty():
+    assert np.all(tabular.id_lookup(np.arange(5), []) == -1)
+    assert len(tabular.id_lookup([], [1, 2])) == 0
+
+
+def test_id_filter():
+    r = np.random.RandomState(0)
+    src = tabular.DictSource({'clumpIndex': r.randint(0, 1000, 10000), 'x': r.rand(10000)})
+    valid_ids = r.choice(1000, 50, replace=False)
+    
+    f = tabular.IdFilter(src, 'clumpIndex', valid_ids)
+    
+    mask = np.zeros(10000, bool)
+    for id in valid_ids:
+        mask |= (src['clumpIndex'] == id)
+    
+    assert f.Index.dtype == bool
+    assert np.all(f.Index == mask)
+    assert np.all(f['x'] == src['x'][mask])
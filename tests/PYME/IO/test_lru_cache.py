@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from PYME.IO.lru_cache import LRUByteCache, sizeof
+
+
+def test_sizeof():
+    assert sizeof(b'abc') == 3
+    assert sizeof(np.zeros(10, 'f8')) == 80
+    assert sizeof((b'abc', b'de')) == 5 + 16
+
+
+def test_byte_budget_lru_eviction():
+    c = LRUByteCache(max_bytes=100)
+
+    c['a'] = b'x'*40
+    c['b'] = b'x'*40
+    c['a'] # touch a, so that b is now least recently used
+    c['c'] = b'x'*40
+
+    assert 'a' in c
+    assert 'b' not in c
+    assert 'c' in c
+    assert c.nbytes == 80
+
+    s = c.stats()
+    assert s['evictions'] == 1
+    assert s['hits'] == 1
+
+
+def test_oversize_values_not_cached():
+    c = LRUByteCache(max_bytes=100)
+    c['a'] = b'x'*10
+    c['a'] = b'x'*200
+
+    assert 'a' not in c
+    assert c.nbytes == 0
+
+
+def test_hit_miss_stats():
+    c = LRUByteCache(max_bytes=100)
+    c['a'] = b'x'
+
+    c['a']
+    assert c.get('b') is None
+    with pytest.raises(KeyError):
+        c['b']
+
+    s = c.stats()
+    assert s['hits'] == 1
+    assert s['misses'] == 2
+    assert s['hit_rate'] == pytest.approx(1/3.)
+
+
+def test_pinning():
+    c = LRUByteCache(max_bytes=100)
+    c.pin('a')
+    c['a'] = b'x'*60
+    c['b'] = b'x'*30
+    c['c'] = b'x'*30
+
+    # a is least recently used, but pinned
+    assert 'a' in c
+    assert 'b' not in c
+    assert 'c' in c
+
+    c.unpin('a')
+    c['d'] = b'x'*30
+    assert 'a' not in c
+    assert c.nbytes == 60
+
+
+def test_pop():
+    c = LRUByteCache(max_bytes=100)
+    c['a'] = b'x'*10
+    assert c.pop('a') == b'x'*10
+    assert c.pop('a', None) is None
+    assert c.nbytes == 0
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from PYME.IO import tabular
+from PYME import config
+
+
+def _source(n=1000):
+    r = np.random.RandomState(0)
+    return tabular.DictSource({'x': r.rand(n), 'y': r.rand(n), 't': np.arange(n)})
+
+
+def test_mapping_values():
+    src = _source()
+    m = tabular.MappingFilter(src, xp='x + a*t', yp='y + xp')
+    m.addVariable('a', 2)
+    
+    assert np.allclose(m['xp'], src['x'] + 2*src['t'])
+    assert np.allclose(m['yp'], src['y'] + src['x'] + 2*src['t'])
+    assert np.allclose(m['yp', 10:20], (src['y'] + src['x'] + 2*src['t'])[10:20])
+
+
+def test_mapping_cached_and_invalidated():
+    src = _source()
+    m = tabular.MappingFilter(src, xp='x + a*t', yp='y*2')
+    m.addVariable('a', 1)
+    
+    xp = m['xp']
+    yp = m['yp']
+    assert m['xp'].base is xp.base
+    
+    # changing a variable only invalidates mappings which depend on it
+    m.addVariable('a', 3)
+    assert 'xp' not in m._cache
+    assert 'yp' in m._cache
+    assert np.allclose(m['xp'], src['x'] + 3*src['t'])
+    
+    # as does changing a mapping (directly in the dict, as the pipeline does)
+    m.mappings['yp'] = compile('y*3', '<mapping>', 'eval')
+    assert np.allclose(m['yp'], src['y']*3)
+    
+    # cached values can't be modified in place
+    with pytest.raises(ValueError):
+        m['xp'][:] = 0
+
+
+def test_mapping_invalidated_by_source_change():
+    src = _source()
+    inner = tabular.MappingFilter(src, xs='x*s')
+    inner.addVariable('s', 1)
+    outer = tabular.MappingFilter(tabular.ResultsFilter(inner, x=[0.2, 0.8]), xo='xs + 1')
+    
+    v1 = outer['xo'].copy()
+    inner.addVariable('s', 2)
+    assert np.allclose(outer['xo'], 2*(v1 - 1) + 1)
+
+
+def _fit_results(n):
+    fr = np.zeros(n, dtype=[('tIndex', 'i4'), ('fitResults', [('x0', 'f4'), ('y0', 'f4')])])
+    fr['tIndex'] = np.arange(n)
+    fr['fitResults']['x0'] = np.arange(n)
+    return fr
+
+
+def test_mapping_invalidated_by_live_analysis():
+    # LMAnalysis updates the pipeline source in place (setResults) as new results come in
+    src = tabular.FitResultsSource(_fit_results(5))
+    m = tabular.MappingFilter(src, x_raw='x', x='x_raw + 1')
+    assert len(m['x_raw']) == 5
+    assert len(m['x']) == 5
+    
+    src.setResults(_fit_results(8))
+    assert len(m['x_raw']) == 8
+    assert np.allclose(m['x'], np.arange(8) + 1)
+    
+    # a source modified in place without changing its version is caught by the length check
+    rsrc = tabular.RecArraySource(_fit_results(5)['fitResults'])
+    m = tabular.MappingFilter(rsrc, xp='x0*2')
+    assert len(m['xp']) == 5
+    rsrc.recArray = _fit_results(8)['fitResults']
+    assert len(m['xp']) == 8
+
+
+def test_dict_source_add_column():
+    src = _source(10)
+    m = tabular.MappingFilter(src, zp='z + 1')
+    v = src._version
+    src.addColumn('z', np.ones(10))
+    assert src._version > v
+    assert np.allclose(m['zp'], 2)
+
+
+def test_circular_mapping():
+    m = tabular.MappingFilter(_source(), a='b + 1', b='c + 1', c='a + 1')
+    with pytest.raises(RuntimeError):
+        m['a']
+
+
+def test_numexpr_matches_eval():
+    pytest.importorskip('numexpr')
+    src = _source()
+    
+    config.config['tabular-mapping-numexpr'] = True
+    try:
+        m = tabular.MappingFilter(src, r='sqrt(x**2 + y**2)*k', c='clip(x, 0.2, 0.8)')
+        m.addVariable('k', 2)
+        assert np.allclose(m['r'], 2*np.sqrt(src['x']**2 + src['y']**2))
+        assert 'r' not in m._numexpr_failed
+        
+        # not supported by numexpr - falls back to eval
+        assert np.allclose(m['c'], np.clip(src['x'], 0.2, 0.8))
+        assert 'c' in m._numexpr_failed
+    finally:
+        config.config.pop('tabular-mapping-numexpr')
@@ -0,0 +1,81 @@
+import numpy as np
+
+from PYME.IO import tabular
+
+
+def _source(tmpdir, n=5000):
+    r = np.random.RandomState(0)
+    p_a = r.rand(n)
+    d = {'x': 1000*r.rand(n), 'y': 1000*r.rand(n), 'tIndex': np.arange(n), 'error_x': 40*r.rand(n),
+         'p_a': p_a, 'p_b': 1 - p_a, 'ColourNorm': np.ones(n)}
+
+    path = str(tmpdir.join('test.pyrcd'))
+    tabular.DictSource(d).to_column_store(path)
+    return tabular.ColumnStoreSource(path)
+
+
+def _pipeline_chain(tmpdir):
+    # as in LMVis.pipeline.Pipeline.Rebuild
+    ds = tabular.MappingFilter(_source(tmpdir))
+    ds.setMapping('x_raw', 'x')
+
+    mapping = tabular.MappingFilter(ds)
+    mapping.setMapping('x', 'x_raw + 0.01*tIndex')
+    mapping.cache_mappings = False
+
+    filt = tabular.ResultsFilter(mapping, error_x=(0, 30), x=(100, 900))
+    colour = tabular.ColourFilter(filt)
+    colour.chromaticShifts = {'a': {'y': 5.0}}
+    return ds, mapping, filt, colour
+
+
+def _concat(chunks, keys):
+    chunks = list(chunks)
+    return {k: np.concatenate([c[k] for c in chunks]) for k in keys}
+
+
+def test_chunks_match_columns(tmpdir):
+    ds, mapping, filt, colour = _pipeline_chain(tmpdir)
+    keys = ['x', 'y', 'x_raw', 'error_x']
+
+    for chan in [None, 'a', 'b']:
+        colour.setColour(chan)
+        chunked = _concat(colour.iter_chunks(keys, chunk_size=97), keys)
+        for k in keys:
+            assert np.allclose(chunked[k], colour[k])
+
+    for ds_ in [ds, mapping, filt]:
+        chunked = _concat(ds_.iter_chunks(keys, chunk_size=97), keys)
+        for k in keys:
+            assert np.allclose(chunked[k], ds_[k])
+
+
+def test_chunks_are_bounded(tmpdir):
+    ds, mapping, filt, colour = _pipeline_chain(tmpdir)
+    colour.setColour('a')
+
+    for chunk in colour.iter_chunks(['x', 'y'], chunk_size=100):
+        assert len(chunk['x']) <= 100
+
+    # nothing should have been evaluated for the whole table
+    assert filt._index is None
+    assert len(ds._cache) == 0
+    assert len(mapping._cache) == 0
+    assert len(colour._index_cache) == 0
+
+
+def test_chunks_with_explicit_index(tmpdir):
+    ds, mapping, filt, colour = _pipeline_chain(tmpdir)
+    filt.Index = np.arange(len(mapping)) % 3 == 0
+
+    chunked = _concat(filt.iter_chunks(['x', 'tIndex'], chunk_size=50), ['x', 'tIndex'])
+    assert np.all(chunked['tIndex'] % 3 == 0)
+    assert np.allclose(chunked['x'], filt['x'])
+
+
+def test_selection_filter_chunks(tmpdir):
+    src = _source(tmpdir)
+    f = tabular.IdFilter(src, 'tIndex', np.arange(0, 5000, 7))
+
+    chunked = _concat(f.iter_chunks(['x'], chunk_size=33), ['x'])
+    assert np.all(chunked['x'] == f['x'])
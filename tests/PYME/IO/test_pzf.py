@@ -120,4 +120,59 @@ def test_PZFFormat_lossless_uint8():
 
     #print result.squeeze(), test_data, result.shape, test_data.shape
 
-    assert np.allclose(result.squeeze(), test_data.squeeze())
\ No newline at end of file
+    assert np.allclose(result.squeeze(), test_data.squeeze())
+
+
+def test_PZFFormat_raw_uint16_preallocated():
+    from PYME.IO import PZFFormat
+    test_data = np.random.poisson(100, 10000).reshape(100,100).astype('uint16')
+    
+    buf = bytearray(30000)
+    s = PZFFormat.dumps(test_data, out=buf)
+    
+    assert bytes(s) == PZFFormat.dumps(test_data)
+    
+    out = np.zeros((100, 100, 1), 'uint16')
+    result, header = PZFFormat.loads(buf, out=out)
+    
+    assert np.shares_memory(result, out)
+    assert np.allclose(out.squeeze(), test_data)
+
+
+def test_PZFFormat_chunks_uint16_preallocated():
+    from PYME.IO import PZFFormat
+    test_data = np.random.poisson(100, 10000).reshape(100,100).astype('uint16')
+    
+    buf = bytearray(30000)
+    s = PZFFormat.dumps(test_data, compression=PZFFormat.DATA_COMP_HUFFCODE_CHUNKS, out=buf)
+    
+    out = np.zeros((100, 100, 1), 'uint16')
+    result, header = PZFFormat.loads(s, out=out)
+    
+    assert np.allclose(out.squeeze(), test_data)
+
+
+def test_PZFFormat_raw_uint16_rows():
+    from PYME.IO import PZFFormat
+    test_data = np.random.poisson(100, 10000).reshape(100,100).astype('uint16')
+    
+    result, header = PZFFormat.loads(PZFFormat.dumps(test_data), rows=(10, 35))
+    
+    assert result.shape == (25, 100, 1)
+    assert np.allclose(result.squeeze(), test_data[10:35])
+
+
+def test_PZFFormat_bands_uint16_rows():
+    from PYME.IO import PZFFormat
+    test_data = np.random.poisson(100, 10000).reshape(100,100).astype('uint16')
+    
+    s = PZFFormat.dumps(test_data, compression=PZFFormat.DATA_COMP_HUFFCODE_BANDS, band_rows=16)
+    
+    assert PZFFormat.load_header(s)['Version'] == PZFFormat.FORMAT_VERSION_BANDS
+    
+    result, header = PZFFormat.loads(s)
+    assert np.allclose(result.squeeze(), test_data)
+    
+    for rows in [(0, 16), (10, 35), (90, 100)]:
+        result, header = PZFFormat.loads(s, rows=rows)
+        assert np.allclose(result.squeeze(), test_data[rows[0]:rows[1]])
@@ -0,0 +1,73 @@
+import numpy as np
+
+from PYME.IO import tabular
+
+
+class _CountingSource(tabular.DictSource):
+    """Counts column reads"""
+    def __init__(self, source):
+        tabular.DictSource.__init__(self, source)
+        self.reads = {}
+    
+    def __getitem__(self, keys):
+        key, sl = self._getKeySlice(keys)
+        self.reads[key] = self.reads.get(key, 0) + 1
+        return tabular.DictSource.__getitem__(self, keys)
+
+
+def _source(n=2000):
+    r = np.random.RandomState(0)
+    p_a = r.rand(n)
+    return _CountingSource({'x': r.rand(n), 'y': r.rand(n), 'p_a': p_a, 'p_b': 1 - p_a, 'ColourNorm': np.ones(n)})
+
+
+def test_chained_results_filters():
+    src = _source()
+    f1 = tabular.ResultsFilter(src, x=[0.1, 0.9])
+    f2 = tabular.ResultsFilter(f1, y=[0.2, 0.7])
+    
+    mask = (src['x'] > 0.1) & (src['x'] < 0.9) & (src['y'] > 0.2) & (src['y'] < 0.7)
+    assert np.all(f2['x'] == src['x'][mask])
+    assert len(f2) == mask.sum()
+    
+    # f2 gathers directly from the original source
+    source, index = f2._gather_index()
+    assert source is src
+    assert index.dtype == np.int32
+    
+    # replacing the index of an upstream filter is picked up
+    f1.Index = np.ones(len(src), bool)
+    mask = (src['y'] > 0.2) & (src['y'] < 0.7)
+    f2.Index = mask
+    assert np.all(f2['x'] == src['x'][mask])
+
+
+def test_colour_filter_index_cached():
+    src = _source()
+    cf = tabular.ColourFilter(tabular.ResultsFilter(src, x=[0.1, 0.9]), currentColour='a')
+    
+    x = cf['x']
+    src.reads.clear()
+    y = cf['y']
+    cf['x']
+    # only the columns themselves are read, the colour probabilities are not recalculated
+    assert src.reads == {'y': 1, 'x': 1}
+    
+    sel = (src['x'] > 0.1) & (src['x'] < 0.9)
+    p_a = src['p_a'][sel]
+    p_tot = 0.01 + 1.0
+    expected = ((p_a/p_tot) > 0.1) & (((1 - p_a)/p_tot) < 0.1)
+    assert np.all(cf.index == expected)
+    assert np.all(x == src['x'][sel][expected])
+    assert np.all(y == src['y'][sel][expected])
+    
+    # changing a threshold invalidates the cached index
+    cf.t_p_other = 0.5
+    expected = ((p_a/p_tot) > 0.1) & (((1 - p_a)/p_tot) < 0.5)
+    assert np.all(cf['x'] == src['x'][sel][expected])
+    
+    # as does changing the source
+    cf.resultsSource = tabular.ResultsFilter(src, x=[0.0, 0.5])
+    sel = (src['x'] > 0.0) & (src['x'] < 0.5)
+    assert len(cf.index) == sel.sum()
+    assert len(cf['x']) == cf.index.sum()
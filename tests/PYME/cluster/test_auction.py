@@ -0,0 +1,124 @@
+import threading
+import time
+
+import numpy as np
+
+from PYME.cluster import auction, ruleserver
+
+
+def test_match_lowest_cost():
+    res = auction.match([([0, 1, 2], [1.0, 1.0, 1.0], None),
+                         ([1, 2, 3], [0.2, 1.0, 1.0], None)])
+
+    # task 1 goes to the second bidder (lower cost), tasks 0 and 3 are uncontested
+    assert 1 not in res[0]
+    assert 0 in res[0]
+    assert 0 in res[1] and 2 in res[1]
+    # each task awarded exactly once
+    assert len(res[0]) + len(res[1]) == 4
+
+
+def test_match_spreads_ties():
+    ids = np.arange(10)
+    res = auction.match([(ids, np.ones(10), None), (ids, np.ones(10), None)])
+    assert len(res[0]) == 5
+    assert len(res[1]) == 5
+
+
+def test_match_uncapped_min_cost():
+    r = np.random.RandomState(0)
+    bids = [(r.choice(1000, 600, replace=False), r.choice([0.2, 0.5, 1.0], 600), None) for i in range(5)]
+    res = auction.match(bids)
+
+    awarded = np.concatenate([b[0][w] for b, w in zip(bids, res)])
+    assert np.all(np.sort(awarded) == np.unique(np.concatenate([b[0] for b in bids])))
+
+    # every task goes to (one of) its lowest bidders
+    lowest = {}
+    for ids, costs, _ in bids:
+        for t, c in zip(ids, costs):
+            lowest[t] = min(lowest.get(t, np.inf), c)
+
+    for (ids, costs, _), w in zip(bids, res):
+        assert np.all(costs[w] == [lowest[t] for t in ids[w]])
+
+
+def test_match_spreads_ties_3_bidders():
+    ids = np.arange(99)
+    res = auction.match([(ids, np.ones(99), None), (ids, np.ones(99), None), (ids, np.ones(99), None)])
+    assert [len(r) for r in res] == [33, 33, 33]
+
+
+def test_match_capped_exact():
+    # bidder 0 only wants one task, and would cost more on task 0 than bidder 1 would.
+    # The min cost assignment gives bidder 0 task 1, even though it bid lower there than on task 0
+    res = auction.match([([0, 1], [0.2, 0.5], 1),
+                         ([0, 1], [0.3, 1.0], 1)])
+
+    assert res[0].tolist() == [1]
+    assert res[1].tolist() == [0]
+
+
+def test_engine_batches_concurrent_bids():
+    engine = auction.AuctionEngine(window=0.1)
+    results = {}
+
+    def bid(name, cost):
+        results[name] = engine.submit(np.arange(4), np.full(4, cost, 'f4'))
+
+    threads = [threading.Thread(target=bid, args=(n, c)) for n, c in [('a', 1.0), ('b', 0.5)]]
+    t0 = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert time.time() - t0 < 1.0
+    # both bids are resolved in the same epoch, the lower cost bid wins everything
+    assert results['b'].all()
+    assert not results['a'].any()
+
+    stats = engine.stats()
+    assert stats['auctions'] == 1
+    assert stats['bids'] == 2
+    assert stats['winRate'] == 0.5
+    assert stats['maxLatency'] < 1.0
+
+
+def test_engine_zero_window():
+    # bids are resolved on their own, without waiting for other bidders
+    engine = auction.AuctionEngine(window=0)
+    t = time.time()
+    mask = engine.submit(np.arange(10), np.ones(10, 'f4'))
+    assert (time.time() - t) < 0.04
+    assert mask.all()
+    assert engine.stats()['auctions'] == 1
+
+
+def test_rule_bid_goes_to_auction():
+    rule = ruleserver.IntegerIDRule('test', '{{taskID}}', max_task_ID=100)
+    rule._auction.window = 0.01
+    rule.make_range_available(0, 10)
+
+    result = rule.bid({'ruleID': 'test', 'taskIDs': [0, 1, 2], 'costs': [1.0, 1.0, 1.0]})
+    assert result['taskIDs'] == [0, 1, 2]
+    assert rule.info()['auction']['auctions'] == 1
+
+    # buy now bids bypass the auction
+    rule.bid({'ruleID': 'test', 'taskIDs': [3], 'costs': [0.01]})
+    assert rule.info()['auction']['auctions'] == 1
+
+
+def test_engine_matches_outside_lock(monkeypatch):
+    engine = auction.AuctionEngine(window=0.01)
+    match = auction.match
+
+    def _match(bids):
+        # new bids can be accepted while an auction is being resolved
+        assert engine._lock.acquire(blocking=False)
+        engine._lock.release()
+        return match(bids)
+
+    monkeypatch.setattr(auction, 'match', _match)
+    assert engine.submit(np.arange(4), np.ones(4, 'f4')).all()
+    assert engine.stats()['auctions'] == 1
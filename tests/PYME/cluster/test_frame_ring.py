@@ -0,0 +1,94 @@
+import multiprocessing
+
+import numpy as np
+
+from PYME.util.shmarray.frame_ring import SharedFrameRing, RingDataSource, series_key
+
+
+def test_put_get():
+    ring = SharedFrameRing(4, 1024)
+    key = series_key('PYME-CLUSTER:///test/series.pcs')
+    
+    frame = np.arange(100, dtype='u2').reshape(10, 10)
+    slot = ring.put(key, 5, frame)
+    assert slot >= 0
+    
+    assert np.all(ring.get(key, 5) == frame)
+    assert ring.get(key, 5).dtype == frame.dtype
+    assert ring.get(key, 6) is None
+    assert ring.get(series_key('other'), 5) is None
+
+
+def test_unsupported_frames():
+    ring = SharedFrameRing(4, 64)
+    assert ring.put(0, 0, np.zeros((10, 10), 'u2')) == -1 # too big
+    assert ring.put(0, 0, np.zeros(4, 'c8')) == -1 # unsupported dtype
+
+
+def test_pinned_slots_are_not_replaced():
+    ring = SharedFrameRing(2, 64)
+    
+    s0 = ring.put(0, 0, np.zeros(4, 'f4'))
+    s1 = ring.put(0, 1, np.ones(4, 'f4'))
+    
+    # all slots pinned
+    assert ring.put(0, 2, np.ones(4, 'f4')) == -1
+    
+    # pin again, release twice
+    assert ring.pin(0, 0) == s0
+    ring.release([s0, s0])
+    
+    # frame 0 is now the only free slot, and gets replaced
+    assert ring.put(0, 2, np.full(4, 2, 'f4')) == s0
+    assert ring.get(0, 0) is None
+    assert np.all(ring.get(0, 1) == 1)
+    assert np.all(ring.get(0, 2) == 2)
+
+
+def test_lru_replacement():
+    ring = SharedFrameRing(3, 64)
+    slots = [ring.put(0, i, np.full(2, i, 'i4')) for i in range(3)]
+    ring.release(slots)
+    
+    ring.get(0, 0) # frame 0 is now the most recently used
+    ring.release([ring.put(0, 3, np.zeros(2, 'i4'))])
+    
+    assert ring.get(0, 1) is None
+    assert ring.get(0, 0) is not None
+    assert ring.get(0, 2) is not None
+
+
+def _read_frame(ring, key, q):
+    q.put(ring.get(key, 7))
+
+
+def test_shared_between_processes():
+    ring = SharedFrameRing(2, 1024)
+    key = series_key('series')
+    ring.put(key, 7, np.arange(12, dtype='f8').reshape(3, 4))
+    
+    q = multiprocessing.Queue()
+    p = multiprocessing.Process(target=_read_frame, args=(ring, key, q))
+    p.start()
+    frame = q.get(timeout=30)
+    p.join()
+    
+    assert np.all(frame == np.arange(12).reshape(3, 4))
+
+
+class _DataSource(object):
+    def getSlice(self, ind):
+        return np.full((2, 2), -1, 'i2')
+    
+    def getNumSlices(self):
+        return 10
+
+
+def test_ring_datasource():
+    ring = SharedFrameRing(2, 64)
+    ring.put(1, 3, np.full((2, 2), 3, 'i2'))
+    
+    ds = RingDataSource(_DataSource(), ring, 1)
+    assert np.all(ds.getSlice(3) == 3)
+    assert np.all(ds.getSlice(4) == -1) # not in ring - falls back to data source
+    assert ds.getNumSlices() == 10
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from PYME.cluster import rules
+
+
+class _GrowingSeries(object):
+    """Stand-in for a data source which is still being spooled"""
+    def __init__(self, n_frames=0):
+        self.n_frames = n_frames
+        self.is_complete = False
+
+    def getNumSlices(self):
+        return self.n_frames
+
+
+def _block_rule(block_size=10, start_at=0, n_frames=0):
+    # bypass __init__ / _setup, which need a cluster to pick a results server
+    rule = rules.LocalisationRule.__new__(rules.LocalisationRule)
+    rule.block_size = block_size
+    rule.start_at = start_at
+    rule.ds = _GrowingSeries(n_frames)
+    rule._next_release_start = start_at
+
+    rule.dataSourceID = 'PYME-CLUSTER://test/series.pcs'
+    rule.results_md_uri = 'PYME-CLUSTER://test/series.h5r.json'
+    rule.worker_resultsURI = 'http://127.0.0.1:8080/__aggregate_h5r/series.h5r'
+    return rule
+
+
+def test_block_release_while_spooling():
+    rule = _block_rule(block_size=10, n_frames=25)
+
+    # only complete blocks are released while the series is still being spooled
+    assert rule.get_new_tasks() == (0, 2)
+    assert rule._next_release_start == 20
+
+    with pytest.raises(rules.NoNewTasks):
+        rule.get_new_tasks()
+
+    rule.ds.n_frames = 37
+    assert rule.get_new_tasks() == (2, 3)
+    assert not rule.complete
+
+    # the final partial block is released once the series is complete
+    rule.ds.is_complete = True
+    assert rule._n_tasks(37) == 4
+    assert rule.get_new_tasks() == (3, 4)
+    assert rule._next_release_start == 37
+    assert rule.complete
+
+    with pytest.raises(rules.NoNewTasks):
+        rule.get_new_tasks()
+
+
+def test_block_release_exact_multiple():
+    rule = _block_rule(block_size=10, n_frames=30)
+    rule.ds.is_complete = True
+
+    assert rule._n_tasks(30) == 3
+    assert rule.get_new_tasks() == (0, 3)
+    assert rule.complete
+
+
+def test_block_release_with_start_at():
+    rule = _block_rule(block_size=10, start_at=15, n_frames=40)
+
+    # the first block (1) is partially before start_at, and is clamped when the task is created
+    assert rule.get_new_tasks() == (1, 4)
+    assert rule._next_release_start == 40
+
+
+def test_block_task_template():
+    rule = _block_rule(block_size=10, start_at=15)
+
+    task = json.loads(rule._task_template({}).replace('{{ruleID}}', 'r').replace('{{taskID}}', '3'))
+    assert task['id'] == 'r~3'
+    assert task['taskdef'] == {'blockIndex': '3', 'blockSize': 10, 'startAt': 15, 'metadata': rule.results_md_uri}
+    assert task['inputs'] == {'frames': rule.dataSourceID}
+
+    rule.block_size = 1
+    task = json.loads(rule._task_template({}).replace('{{ruleID}}', 'r').replace('{{taskID}}', '3'))
+    assert task['taskdef'] == {'frameIndex': '3', 'metadata': rule.results_md_uri}
@@ -0,0 +1,153 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from PYME.IO import MetaDataHandler
+from PYME.Analysis import MetaData
+from PYME.cluster import taskWorkerHTTP
+
+
+def _analysis_md():
+    md = MetaDataHandler.NestedClassMDHandler(MetaData.TIRFDefault)
+    md['voxelsize.x'] = 0.1
+    md['voxelsize.y'] = 0.1
+    md['Camera.ADOffset'] = 100
+    md['Camera.TrueEMGain'] = 1
+    md['Camera.ElectronsPerCount'] = 1
+    md['Camera.ReadNoise'] = 1
+    md['Camera.NoiseFactor'] = 1
+    md['Analysis.FitModule'] = 'LatGaussFitFR'
+    md['Analysis.DetectionThreshold'] = 1.5
+    md['Analysis.BGRange'] = [-5, 0]
+    md['Analysis.StartAt'] = 0
+    md['EstimatedLaserOnFrameNo'] = 0
+    return md
+
+
+@pytest.fixture(scope='module')
+def series():
+    from PYME.IO import dataExporter
+    from PYME.IO import events
+
+    np.random.seed(0)
+    X, Y = np.mgrid[:64, :64]
+    data = np.zeros((64, 64, 20))
+    for i in range(20):
+        for x, y in np.random.uniform(8, 56, (5, 2)):
+            data[:, :, i] += 500*np.exp(-((X - x)**2 + (Y - y)**2)/(2*1.3**2))
+    data = (np.random.poisson(data + 20) + 100).astype('uint16')
+
+    tempdir = tempfile.mkdtemp()
+    filename = os.path.join(tempdir, 'test_pool.h5')
+    try:
+        dataExporter.ExportData(data, mdh=_analysis_md(), events=np.zeros(3, dtype=events.EVENTS_DTYPE),
+                                filename=filename)
+        yield filename
+    finally:
+        shutil.rmtree(tempdir)
+
+
+@pytest.fixture
+def pool():
+    worker = taskWorkerHTTP.PooledTaskWorker(nodeserver_port=0, n_workers=2, ring_frames=32, ring_slot_mb=1)
+    yield worker
+    worker._loop_alive = False
+    for p in worker._procs:
+        p.terminate()
+
+
+def _localisation_task(filename, frame_index):
+    return {'id': 'test~%d' % frame_index, 'type': 'localization', 'inputs': {'frames': filename},
+            'taskdef': {'frameIndex': str(frame_index), 'metadata': _analysis_md().to_JSON()}}
+
+
+def test_pooled_localisation(series, pool):
+    for t in [pool.computeLoop, pool.collectLoop]:
+        threading.Thread(target=t, daemon=True).start()
+
+    frames = list(range(5, 15))
+    for i in frames:
+        pool.inputQueue.put(('http://127.0.0.1:0/', _localisation_task(series, i)))
+
+    results = {}
+    for i in frames:
+        queueURL, taskDescr, res = pool.resultsQueue.get(timeout=60)
+        assert not isinstance(res, taskWorkerHTTP.TaskError), res.traceback
+        results[taskDescr['id']] = res
+
+    # all frames have been released from the ring
+    assert len(pool._jobs) == 0
+
+    # same results as running in this process
+    from PYME.recipes.recipe_cache import RecipeCache
+    for i in frames:
+        expected = taskWorkerHTTP.run_task(_localisation_task(series, i), RecipeCache()).results
+        res = results['test~%d' % i].results
+        assert len(res) == len(expected)
+        assert np.allclose(res['fitResults']['x0'], expected['fitResults']['x0'])
+
+
+def test_dead_process_fails_task(pool, monkeypatch):
+    released = []
+    monkeypatch.setattr(pool._ring, 'release', released.append)
+
+    task = {'id': 'test~3', 'type': 'localization', 'inputs': {}, 'taskdef': {}}
+    pool._jobs[7] = ('http://127.0.0.1:0/', task, [1, 2])
+
+    # pretend the first process has picked up the job, and then dies
+    p = pool._procs[0]
+    pool._current_jobs[0].value = 7
+    p.terminate()
+    p.join()
+
+    pool._respawn_dead()
+
+    queueURL, taskDescr, res = pool.resultsQueue.get_nowait()
+    assert taskDescr is task
+    assert isinstance(res, taskWorkerHTTP.TaskError)
+    assert released == [[1, 2]]
+    assert len(pool._jobs) == 0
+
+    # replacement process is running, and idle
+    assert pool._procs[0] is not p and pool._procs[0].is_alive()
+    assert pool._current_jobs[0].value == -1
+
+    # a late result for the failed job is ignored
+    pool._done_queue.put((7, True))
+    threading.Thread(target=pool.collectLoop, daemon=True).start()
+    time.sleep(0.5)
+    with pytest.raises(queue.Empty):
+        pool.resultsQueue.get_nowait()
+
+
+def test_dead_process_detected_under_load(pool):
+    task = {'id': 'test~3', 'type': 'localization', 'inputs': {}, 'taskdef': {}}
+    pool._jobs[7] = ('http://127.0.0.1:0/', task, [])
+
+    p = pool._procs[0]
+    pool._current_jobs[0].value = 7
+    p.terminate()
+    p.join()
+
+    # keep results coming in (as the other processes would), so the collector is never idle
+    def _feed():
+        for i in range(50):
+            pool._done_queue.put((100 + i, True))
+            time.sleep(0.05)
+
+    threading.Thread(target=_feed, daemon=True).start()
+    threading.Thread(target=pool.collectLoop, daemon=True).start()
+
+    queueURL, taskDescr, res = pool.resultsQueue.get(timeout=2)
+    assert taskDescr is task
+    assert isinstance(res, taskWorkerHTTP.TaskError)
+    
+    # the replacement is started just after the task is failed
+    time.sleep(0.5)
+    assert pool._procs[0] is not p
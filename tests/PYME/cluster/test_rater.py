@@ -0,0 +1,112 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from PYME.IO import clusterIO
+from PYME.cluster import rulenodeserver
+
+
+@pytest.fixture
+def local_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(clusterIO, 'local_dataroot', str(tmp_path))
+    monkeypatch.setattr(clusterIO, 'local_serverfilter', 'test_local')
+
+    series_dir = tmp_path / 'series'
+    series_dir.mkdir()
+    for i in range(10, 20):
+        (series_dir / ('frame%05d.pzf' % i)).write_bytes(b'')
+
+    return tmp_path
+
+
+def _localisation_rule(task_ids, serverfilter='test_local', taskdef=None):
+    if taskdef is None:
+        taskdef = {'frameIndex': '{{taskID}}', 'metadata': 'x'}
+
+    template = json.dumps({'id': '{{ruleID}}~{{taskID}}', 'type': 'localization', 'taskdef': taskdef,
+                           'inputs': {'frames': 'PYME-CLUSTER://%s/series' % serverfilter}})
+    return {'ruleID': 'test', 'taskTemplate': template, 'availableTaskIDs': list(task_ids)}
+
+
+def test_localisation_costs(local_root):
+    rater = rulenodeserver.Rater(_localisation_rule(range(30)))
+    ranges, costs = rater.segments
+
+    # one cost per run of local / non-local frames
+    assert ranges.tolist() == [[0, 10], [10, 20], [20, 30]]
+    assert np.allclose(costs, [1.0, 0.01, 1.0])
+
+    ranges, costs = rater.get_local(5)
+    assert ranges.tolist() == [[10, 15]]
+    ranges, costs = rater.get_local(10)
+    assert ranges.tolist() == [[15, 20]]
+
+    # previously returned tasks are not returned again
+    ranges, costs = rater.get_any(12)
+    assert ranges.tolist() == [[0, 10], [20, 22]]
+    assert np.allclose(costs, [1.0, 1.0])
+
+
+def test_range_advert_costs(local_root):
+    rule = _localisation_rule([])
+    del rule['availableTaskIDs']
+    rule['availableTasks'] = {'ranges': [[5, 12], [18, 100000]]}
+    rater = rulenodeserver.Rater(rule)
+
+    ranges, costs = rater.segments
+    assert ranges.tolist() == [[5, 10], [10, 12], [18, 20], [20, 100000]]
+    assert np.allclose(costs, [1.0, 0.01, 0.01, 1.0])
+
+    ranges, costs = rater.get_local(100)
+    assert ranges.tolist() == [[10, 12], [18, 20]]
+
+
+def test_localisation_block_costs(local_root):
+    rater = rulenodeserver.Rater(_localisation_rule(range(5), taskdef={'blockIndex': '{{taskID}}', 'blockSize': 5}))
+    ranges, costs = rater.segments
+    assert ranges.tolist() == [[0, 2], [2, 4], [4, 5]]
+    assert np.allclose(costs, [1.0, 0.01, 1.0])
+
+
+def test_non_local_server(local_root):
+    rater = rulenodeserver.Rater(_localisation_rule(range(30), serverfilter='other'))
+    ranges, costs = rater.segments
+    assert ranges.tolist() == [[0, 30]]
+    assert np.allclose(costs, 1.0)
+
+
+def test_file_map_refresh(local_root):
+    file_map = rulenodeserver.LocalFileMap(refresh_interval=1000)
+    assert not file_map.frames_local('series', 'test_local', [25])[0]
+
+    (local_root / 'series' / 'frame00025.pzf').write_bytes(b'')
+    # cached listing
+    assert not file_map.frames_local('series', 'test_local', [25])[0]
+
+    file_map.refresh_interval = 0
+    file_map._dirs.clear()
+    assert file_map.frames_local('series', 'test_local', [25])[0]
+
+
+def test_recipe_costs(local_root):
+    (local_root / 'input_1.h5').write_bytes(b'')
+    inputs = {str(i): {'input': 'PYME-CLUSTER://test_local/input_%d.h5' % i} for i in range(3)}
+    template = '{"id": "{{ruleID}}~{{taskID}}", "type": "recipe", "inputs": {{taskInputs}}}'
+    rater = rulenodeserver.Rater({'ruleID': 'test', 'taskTemplate': template, 'availableTaskIDs': [0, 1, 2],
+                                  'inputsByTask': inputs})
+
+    ranges, costs = rater.segments
+    assert ranges.tolist() == [[0, 1], [1, 2], [2, 3]]
+    assert np.allclose(costs, [1.0, 0.2, 1.0])
+
+
+def test_recipe_fixed_input_costs(local_root):
+    (local_root / 'input.h5').write_bytes(b'')
+    template = '{"id": "{{ruleID}}~{{taskID}}", "type": "recipe", "inputs": {"input": "PYME-CLUSTER://test_local/input.h5"}}'
+    rater = rulenodeserver.Rater({'ruleID': 'test', 'taskTemplate': template, 'availableTaskIDs': list(range(1000))})
+
+    ranges, costs = rater.segments
+    assert ranges.tolist() == [[0, 1000]]
+    assert np.allclose(costs, 0.2)
@@ -0,0 +1,65 @@
+import json
+
+import numpy as np
+
+from PYME.cluster import rulenodeserver
+
+
+class _Response(object):
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+class _Session(object):
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    def get(self, url, **kwargs):
+        return self.responses.pop(0)
+
+
+def _node_server(*responses):
+    # bypass __init__, which starts polling threads
+    ns = rulenodeserver.NodeServer.__new__(rulenodeserver.NodeServer)
+    ns._distributor_url = 'http://127.0.0.1:1234/'
+    ns._use_range_adverts = True
+    ns._advert_version = -1
+    ns._adverts = {}
+    ns.taskSession = _Session(responses)
+    return ns
+
+
+def test_range_adverts_retry_on_error():
+    ns = _node_server(_Response(500, b'Internal Server Error'), _Response(200, b'<html>oops</html>'),
+                      _Response(200, json.dumps({'adverts': [], 'ruleIDs': [], 'version': 3}).encode()))
+
+    # transient errors don't disable range encoding
+    assert ns._get_range_adverts() == []
+    assert ns._use_range_adverts
+    assert ns._get_range_adverts() == []
+    assert ns._use_range_adverts
+
+    assert ns._get_range_adverts() == []
+    assert ns._advert_version == 3
+
+
+def test_range_adverts_unsupported():
+    ns = _node_server(_Response(200, json.dumps([{'ruleID': 'test'}]).encode()))
+
+    # a list of legacy adverts means the ruleserver doesn't know about range encoding
+    assert ns._get_range_adverts() is None
+    assert not ns._use_range_adverts
+
+
+def test_make_bid():
+    ns = _node_server()
+    ranges, costs = [[10, 13], [20, 22]], [0.01, 1.0]
+
+    assert ns._make_bid('test', ranges, costs) == {'ruleID': 'test', 'taskRanges': [[10, 13], [20, 22]],
+                                                   'costs': [0.01, 1.0]}
+
+    ns._use_range_adverts = False
+    bid = ns._make_bid('test', ranges, costs)
+    assert bid['taskIDs'] == [10, 11, 12, 20, 21]
+    assert np.allclose(bid['costs'], [0.01, 0.01, 0.01, 1.0, 1.0])
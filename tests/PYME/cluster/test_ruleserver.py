@@ -0,0 +1,116 @@
+import json
+
+import numpy as np
+import pytest
+
+from PYME.cluster import ruleserver, task_ranges
+
+
+@pytest.fixture
+def rule_server():
+    rs = ruleserver.RuleServer()
+    yield rs
+    rs.stop()
+    rs.rulePollThread.join()
+    rs.finaliseThread.join()
+
+
+def _add_rule(rs, **kwargs):
+    body = json.dumps(dict(template='{"id": "{{ruleID}}~{{taskID}}"}', **kwargs))
+    return json.loads(rs.add_integer_id_rule(max_tasks=1000, release_start=0, release_end=100, body=body))['ruleID']
+
+
+def test_range_bid():
+    rule = ruleserver.IntegerIDRule('test', '{{taskID}}', max_task_ID=100)
+    rule.make_range_available(0, 50)
+
+    advert = rule.range_advert
+    assert advert['nAvailable'] == 50
+    assert advert['availableTasks'] == {'ranges': [[0, 50]]}
+
+    result = rule.bid({'ruleID': 'test', 'taskRanges': [[0, 10], [20, 25]], 'costs': [0.1, 0.1]})
+    assert result['taskRanges'] == [[0, 10], [20, 25]]
+
+    assert rule.range_advert['availableTasks'] == {'ranges': [[10, 20], [25, 50]]}
+    assert rule.range_advert['nAvailable'] == 35
+
+
+def test_incremental_range_adverts(rule_server):
+    id_a = _add_rule(rule_server, inputsByTask={str(i): {'input': 'file_%d' % i} for i in range(100)})
+    id_b = _add_rule(rule_server)
+
+    resp = json.loads(rule_server.task_advertisements(encoding='ranges'))
+    assert resp['ruleIDs'] == [id_a, id_b]
+    adverts = {a['ruleID']: a for a in resp['adverts']}
+    assert len(adverts[id_a]['inputsByTask']) == 100
+    assert 'inputsByTask' not in adverts[id_b]
+
+    # nothing has changed
+    resp1 = json.loads(rule_server.task_advertisements(encoding='ranges', since=resp['version']))
+    assert resp1['ruleIDs'] == [id_a, id_b]
+    assert resp1['adverts'] == []
+
+    # only the changed rule is re-sent, and without inputs
+    rule_server._rules[id_a].bid({'ruleID': id_a, 'taskRanges': [[0, 10]], 'costs': [0.1]})
+    resp2 = json.loads(rule_server.task_advertisements(encoding='ranges', since=resp1['version']))
+    assert [a['ruleID'] for a in resp2['adverts']] == [id_a]
+    assert 'inputsByTask' not in resp2['adverts'][0]
+    assert task_ranges.n_in_ranges(task_ranges.decode_available(resp2['adverts'][0]['availableTasks'])) == 90
+
+    # rules without available tasks are dropped from the list
+    rule_server._rules[id_b].inactivate()
+    resp3 = json.loads(rule_server.task_advertisements(encoding='ranges', since=resp2['version']))
+    assert resp3['ruleIDs'] == [id_a]
+
+
+def test_legacy_adverts_unchanged(rule_server):
+    _add_rule(rule_server)
+    adverts = json.loads(rule_server.task_advertisements())
+    assert len(adverts) == 1
+    assert adverts[0]['availableTaskIDs'] == list(range(100))
+
+
+def test_finalise_results(monkeypatch):
+    from PYME.IO import clusterResults
+
+    finalised = []
+    monkeypatch.setattr(clusterResults, 'finaliseResults', finalised.append)
+
+    template = json.dumps({'id': '{{ruleID}}~{{taskID}}', 'type': 'localization',
+                           'outputs': {'fitResults': 'http://127.0.0.1:1234/__aggregate_h5r/test/series.h5r/FitResults',
+                                       'driftResults': 'http://127.0.0.1:1234/__aggregate_h5r/test/series.h5r/DriftResults',
+                                       'other': 'http://127.0.0.1:1234/__aggregate_h5r/test/{{taskID}}.h5r/Results',
+                                       'log': 'pyme-cluster:///test/log.txt'}})
+    ruleserver.IntegerIDRule('test', template, max_task_ID=10).finalise_results()
+
+    # one finalise per aggregated file
+    assert finalised == ['http://127.0.0.1:1234/__aggregate_h5r/test/series.h5r']
+
+    # non-json (e.g. recipe) templates have nothing to finalise
+    ruleserver.IntegerIDRule('test', '{"id": "{{ruleID}}~{{taskID}}", "recipe": {{taskInputs}}}',
+                             max_task_ID=10).finalise_results()
+    assert len(finalised) == 1
+
+
+def test_follow_on_after_finalise(rule_server, monkeypatch):
+    import threading
+    import time
+
+    release = threading.Event()
+    monkeypatch.setattr(ruleserver.IntegerIDRule, 'finalise_results', lambda self: release.wait(10))
+
+    follow_on = {'template': '{"id": "{{ruleID}}~{{taskID}}"}', 'max_tasks': 5}
+    rule = ruleserver.IntegerIDRule('test', '{"id": "{{ruleID}}~{{taskID}}"}', max_task_ID=10, on_completion=follow_on)
+    rule_server._finalise_queue.put(rule)
+
+    # the follow-on rule is only added once the results of the first rule are finalised
+    time.sleep(0.5)
+    assert len(rule_server._rules) == 0
+
+    release.set()
+    for i in range(20):
+        if len(rule_server._rules) == 1:
+            break
+        time.sleep(0.1)
+
+    assert len(rule_server._rules) == 1
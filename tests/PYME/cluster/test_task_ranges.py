@@ -0,0 +1,58 @@
+import numpy as np
+
+from PYME.cluster import task_ranges
+
+
+def test_ranges_from_ids():
+    r = task_ranges.ranges_from_ids([5, 1, 2, 3, 7, 8])
+    assert r.tolist() == [[1, 4], [5, 6], [7, 9]]
+    assert task_ranges.ids_from_ranges(r).tolist() == [1, 2, 3, 5, 7, 8]
+    assert task_ranges.n_in_ranges(r) == 6
+
+
+def test_encode_available_ranges():
+    mask = np.zeros(10000, bool)
+    mask[100:2000] = True
+    mask[5000:5010] = True
+
+    enc = task_ranges.encode_available(mask)
+    assert enc == {'ranges': [[100, 2000], [5000, 5010]]}
+    assert np.all(task_ranges.ids_from_ranges(task_ranges.decode_available(enc)) == np.flatnonzero(mask))
+
+
+def test_encode_available_bitmap():
+    # badly fragmented - should fall back to a bitmap
+    mask = np.zeros(10000, bool)
+    mask[1000:9000:2] = True
+
+    enc = task_ranges.encode_available(mask)
+    assert 'bitmap' in enc
+    assert np.all(task_ranges.ids_from_ranges(task_ranges.decode_available(enc)) == np.flatnonzero(mask))
+
+
+def test_encode_available_empty():
+    enc = task_ranges.encode_available(np.zeros(100, bool))
+    assert len(task_ranges.decode_available(enc)) == 0
+
+
+def test_bid_round_trip():
+    ids = np.array([10, 11, 12, 13, 20, 21, 3])
+    costs = np.array([0.1, 0.1, 0.5, 0.5, 1.0, 1.0, 0.1], 'f4')
+
+    ranges, range_costs = task_ranges.encode_bid(ids, costs)
+    assert ranges == [[3, 4], [10, 12], [12, 14], [20, 22]]
+
+    ids1, costs1 = task_ranges.decode_bid(ranges, range_costs)
+    I = np.argsort(ids)
+    assert np.all(ids1 == ids[I])
+    assert np.allclose(costs1, costs[I])
+
+
+def test_split_ranges():
+    sub, inside = task_ranges.split_ranges([[0, 10], [15, 30]], [[5, 8], [10, 20], [25, 26]])
+    assert sub.tolist() == [[0, 5], [5, 8], [8, 10], [15, 20], [20, 25], [25, 26], [26, 30]]
+    assert inside.tolist() == [False, True, False, True, False, True, False]
+
+    sub, inside = task_ranges.split_ranges([[0, 10]], [])
+    assert sub.tolist() == [[0, 10]]
+    assert not inside.any()
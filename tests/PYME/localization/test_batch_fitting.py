@@ -0,0 +1,148 @@
+"""
+Tests for batched (vectorised) fitting of many ROIs at once. These check that the batched code paths give the same
+results as fitting each ROI individually.
+"""
+
+import numpy as np
+
+from PYME.IO import MetaDataHandler
+from PYME.Analysis import _fithelpers
+
+
+def _gauss(p, X, Y):
+    A, x0, y0, s, b = p
+    return A*np.exp(-((X[:, None] - x0)**2 + (Y[None, :] - y0)**2)/(2*s**2)) + b
+
+def _gauss_batch(p, X, Y):
+    A, x0, y0, s, b = [c[:, None, None] for c in p.T]
+    return A*np.exp(-((X[:, :, None] - x0)**2 + (Y[:, None, :] - y0)**2)/(2*s**2)) + b
+
+
+def _test_rois(n_rois=50, roi_size=11):
+    np.random.seed(42)
+    X = np.arange(roi_size)[None, :] + np.zeros((n_rois, 1))
+    Y = np.arange(roi_size)[None, :] + np.zeros((n_rois, 1))
+    p_true = np.array([200., 5., 5., 1.3, 10.])[None, :] + np.random.uniform(-0.5, 0.5, (n_rois, 5))
+    data = np.random.poisson(_gauss_batch(p_true, X, Y)).astype('f')
+    sigma = np.sqrt(np.maximum(data, 1))
+    p0 = np.array([[data[i].max(), 5, 5, 2, data[i].min()] for i in range(n_rois)])
+
+    return X, Y, data, sigma, p0
+
+
+def test_FitModelWeightedBatch_matches_leastsq():
+    X, Y, data, sigma, p0 = _test_rois()
+
+    res, cov_x, infodict, mesg, resCode = _fithelpers.FitModelWeightedBatch(_gauss_batch, p0, data, sigma, X, Y)
+
+    assert np.all(resCode < 5)
+
+    for i in range(len(data)):
+        res_i, cov_i, info_i, _, _ = _fithelpers.FitModelWeighted(_gauss, p0[i], data[i], sigma[i], X[i], Y[i])
+
+        assert np.allclose(res[i], res_i, rtol=1e-3, atol=1e-3)
+        assert np.allclose((infodict['fvec'][i]**2).sum(), (info_i['fvec']**2).sum(), rtol=1e-4)
+        assert np.allclose(np.diag(cov_x[i]), np.diag(cov_i), rtol=1e-2)
+
+
+def test_FitModelWeightedBatch_masked_pixels():
+    """ROIs padded with infinite-sigma pixels should give the same result as the un-padded ROI"""
+    X, Y, data, sigma, p0 = _test_rois(n_rois=5)
+
+    X_p = np.hstack([X, X[:, -1:] + 1 + np.arange(3)[None, :]])
+    Y_p = np.hstack([Y, Y[:, -1:] + 1 + np.arange(3)[None, :]])
+    data_p = np.zeros((5, X_p.shape[1], Y_p.shape[1]))
+    sigma_p = np.full_like(data_p, np.inf)
+    data_p[:, :11, :11] = data
+    sigma_p[:, :11, :11] = sigma
+
+    res = _fithelpers.FitModelWeightedBatch(_gauss_batch, p0, data, sigma, X, Y)[0]
+    res_p = _fithelpers.FitModelWeightedBatch(_gauss_batch, p0, data_p, sigma_p, X_p, Y_p)[0]
+
+    assert np.allclose(res, res_p, rtol=1e-5)
+
+
+def _fit_frame(fit_module, n_points=40):
+    from PYME.localization.FitFactories import import_fit_factory
+
+    fitMod = import_fit_factory(fit_module)
+
+    md = MetaDataHandler.NestedClassMDHandler()
+    md['voxelsize.x'] = 0.1
+    md['voxelsize.y'] = 0.1
+    md['voxelsize.z'] = 0.2
+    md['tIndex'] = 0
+
+    np.random.seed(0)
+    X, Y = np.mgrid[:128, :128]
+    pts = np.random.uniform(0, 127, (n_points, 2))
+    pts[:2] = [[0.3, 5], [126.8, 60]] # exercise ROIs clipped at the edge of the frame
+
+    img = np.zeros((128, 128))
+    for x, y in pts:
+        img += 500*np.exp(-((X - x)**2 + (Y - y)**2)/(2*1.3**2))
+    img = np.random.poisson(img + 20).astype('f')[:, :, None]
+
+    ff = fitMod.FitFactory(img, md, background=np.full_like(img, 20.), noiseSigma=np.sqrt(img))
+
+    res_batch = ff.FromPoints(pts[:, 0], pts[:, 1], roiHalfSize=5)
+    res_serial = np.hstack([ff.FromPoint(x, y, roiHalfSize=5) for x, y in pts])
+
+    return res_batch, res_serial
+
+
+def test_LatGaussFitFR_batch():
+    res_batch, res_serial = _fit_frame('LatGaussFitFR')
+
+    assert res_batch.dtype == res_serial.dtype
+    assert np.all(res_batch['slicesUsed'] == res_serial['slicesUsed'])
+
+    ok = (res_batch['resultCode'] < 5) & (res_serial['resultCode'] < 5)
+    assert ok.mean() > 0.8
+    assert np.median(np.abs(res_batch['fitResults']['x0'] - res_serial['fitResults']['x0'])[ok]) < 1.0
+
+
+def test_AstigGaussFitFR_batch():
+    res_batch, res_serial = _fit_frame('AstigGaussFitFR')
+
+    assert res_batch.dtype == res_serial.dtype
+
+    ok = (res_batch['resultCode'] < 5) & (res_serial['resultCode'] < 5)
+    assert ok.mean() > 0.8
+    assert np.median(np.abs(res_batch['fitResults']['x0'] - res_serial['fitResults']['x0'])[ok]) < 1.0
+
+
+def test_InterpFitR_batch():
+    import os
+    from PYME.localization import Test
+    from PYME.localization.FitFactories import InterpFitR
+
+    md = MetaDataHandler.SimpleMDHandler(os.path.join(os.path.dirname(Test.__file__), 'astig.md'))
+    md['tIndex'] = 0
+
+    np.random.seed(0)
+    img = np.zeros((128, 128, 1))
+    ff = InterpFitR.FitFactory(img, md, background=np.zeros_like(img), noiseSigma=np.ones_like(img))
+
+    # render events with the interpolated PSF model itself (into an ROI around each event)
+    vs = md.voxelsize_nm
+    pts = np.random.uniform(12, 115, (30, 2))
+    for x, y in pts:
+        xs, ys = slice(int(x) - 8, int(x) + 9), slice(int(y) - 8, int(y) + 9)
+        X, Y, Z, safeRegion = ff.interpolator.getCoords(md, xs, ys, slice(0, 1))
+        p = [2000, x*vs.x, y*vs.y, np.random.uniform(-300, 300), 0]
+        img[xs, ys, 0] += np.reshape(InterpFitR.f_Interp3d(p, ff.interpolator, X, Y, Z, safeRegion), (17, 17))
+    img = np.random.poisson(np.maximum(img + 50, 0)).astype('f')
+
+    ff = InterpFitR.FitFactory(img, md, background=np.full_like(img, 50.), noiseSigma=np.sqrt(img))
+
+    res_batch = ff.FromPoints(pts[:, 0], pts[:, 1], roiHalfSize=7)
+    res_serial = np.hstack([ff.FromPoint(x, y, roiHalfSize=7) for x, y in pts])
+
+    assert res_batch.dtype == res_serial.dtype
+    assert np.all(res_batch['slicesUsed'] == res_serial['slicesUsed'])
+
+    ok = (res_batch['resultCode'] < 5) & (res_serial['resultCode'] < 5)
+    assert ok.mean() > 0.8
+    for k in ['x0', 'y0', 'z0']:
+        assert np.median(np.abs(res_batch['fitResults'][k] - res_serial['fitResults'][k])[ok]) < 5.0
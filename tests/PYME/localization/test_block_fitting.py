@@ -0,0 +1,133 @@
+"""
+Tests for block fit tasks (several consecutive frames per task, see `remFitBuf.fitBlockTask`). A block task should give
+the same results as fitting each of its frames with a separate `fitTask`.
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+
+from PYME.IO import MetaDataHandler
+from PYME.Analysis import MetaData
+
+
+N_FRAMES = 25
+
+
+def _analysis_md():
+    md = MetaDataHandler.NestedClassMDHandler(MetaData.TIRFDefault)
+    md['voxelsize.x'] = 0.1
+    md['voxelsize.y'] = 0.1
+    md['Camera.ADOffset'] = 100
+    md['Camera.TrueEMGain'] = 1
+    md['Camera.ElectronsPerCount'] = 1
+    md['Camera.ReadNoise'] = 1
+    md['Camera.NoiseFactor'] = 1
+    md['Analysis.FitModule'] = 'LatGaussFitFR'
+    md['Analysis.DetectionThreshold'] = 1.5
+    md['Analysis.BGRange'] = [-5, 0]
+    md['Analysis.StartAt'] = 0
+    md['EstimatedLaserOnFrameNo'] = 0
+    return md
+
+
+@pytest.fixture(scope='module')
+def series():
+    from PYME.IO import dataExporter
+    from PYME.IO import events
+
+    np.random.seed(0)
+    X, Y = np.mgrid[:64, :64]
+    data = np.zeros((64, 64, N_FRAMES))
+    for i in range(N_FRAMES):
+        for x, y in np.random.uniform(8, 56, (5, 2)):
+            data[:, :, i] += 500*np.exp(-((X - x)**2 + (Y - y)**2)/(2*1.3**2))
+    data = (np.random.poisson(data + 20) + 100).astype('uint16')
+
+    tempdir = tempfile.mkdtemp()
+    filename = os.path.join(tempdir, 'test_block.h5')
+    try:
+        dataExporter.ExportData(data, mdh=_analysis_md(), events=np.zeros(3, dtype=events.EVENTS_DTYPE),
+                                filename=filename)
+        yield filename
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def _fresh_buffers():
+    from PYME.localization import remFitBuf
+    remFitBuf.bufferManager = remFitBuf.BufferManager()
+
+
+def _per_frame(filename, start, end):
+    from PYME.localization import remFitBuf
+
+    _fresh_buffers()
+    res = [remFitBuf.fitTask(filename, i, _analysis_md())().results for i in range(start, end)]
+    return np.hstack([r for r in res if len(r) > 0])
+
+
+def _block(filename, start, num_frames):
+    from PYME.localization import remFitBuf
+
+    _fresh_buffers()
+    return remFitBuf.fitBlockTask(filename, start, num_frames, _analysis_md())().results
+
+
+def _assert_same_results(res_a, res_b):
+    assert res_a.dtype == res_b.dtype
+    assert len(res_a) == len(res_b)
+    assert np.all(res_a['tIndex'] == res_b['tIndex'])
+    for k in res_a['fitResults'].dtype.names:
+        assert np.allclose(res_a['fitResults'][k], res_b['fitResults'][k], equal_nan=True)
+
+
+def test_block_matches_per_frame(series):
+    _assert_same_results(_block(series, 10, 10), _per_frame(series, 10, 20))
+
+
+def test_block_past_end_of_series(series):
+    res = _block(series, 20, 10)
+
+    assert res['tIndex'].max() < N_FRAMES
+    _assert_same_results(res, _per_frame(series, 20, N_FRAMES))
+
+
+def test_block_required_frames(series):
+    from PYME.localization import remFitBuf
+
+    md = _analysis_md()
+    frames = remFitBuf.fitBlockTask(series, 10, 5, md).required_frames()
+
+    expected = set()
+    for i in range(10, 15):
+        expected.update(remFitBuf.fitTask(series, i, md).required_frames())
+
+    assert frames == sorted(expected)
+
+
+def test_block_taskdef_round_trip():
+    from PYME.localization import remFitBuf
+
+    md = _analysis_md()
+
+    task = {'id': 'r~3', 'type': 'localization', 'inputs': {'frames': 'series.h5'},
+            'taskdef': {'blockIndex': '3', 'blockSize': 10, 'startAt': 0, 'metadata': md.to_JSON()}}
+    ft = remFitBuf.createFitTaskFromTaskDef(task)
+    assert isinstance(ft, remFitBuf.fitBlockTask)
+    assert (ft.dataSourceID, ft.index, ft.numFrames) == ('series.h5', 30, 10)
+    assert ft.md['Analysis.FitModule'] == 'LatGaussFitFR'
+
+    # the first block is clamped to start at startAt
+    task['taskdef'].update(blockIndex='1', startAt=15)
+    ft = remFitBuf.createFitTaskFromTaskDef(task)
+    assert (ft.index, ft.numFrames) == (15, 5)
+
+    # a frame taskdef still gives a single frame task
+    task['taskdef'] = {'frameIndex': '7', 'metadata': md.to_JSON()}
+    ft = remFitBuf.createFitTaskFromTaskDef(task)
+    assert isinstance(ft, remFitBuf.fitTask)
+    assert ft.index == 7
@@ -0,0 +1,59 @@
+import numpy as np
+
+from PYME.recipes import filters
+from PYME.IO.image import ImageStack
+
+
+def _image():
+    im = ImageStack(np.random.RandomState(0).rand(100, 90, 3, 2, 2).astype('f'))
+    im.mdh['voxelsize.x'] = 0.1
+    im.mdh['voxelsize.y'] = 0.1
+    im.mdh['voxelsize.z'] = 0.2
+    return im
+
+
+def test_tiled_matches_unblocked():
+    im = _image()
+    for mod in [filters.GaussianFilter(sigmaX=2, sigmaY=1.5), filters.MedianFilter(),
+                filters.GaussianFilter(dimensionality='XYZ')]:
+        ref = mod.filter(im).data_xyztc[:, :, :, :, :]
+        out = mod.bfilter(im, tile_size=32, n_workers=3)
+        assert isinstance(out.data_xyztc[:, :, :, :, :], np.ndarray)
+        assert np.allclose(ref, out.data_xyztc[:, :, :, :, :])
+
+
+def test_shape_changing_filter():
+    im = _image()
+    mod = filters.Zoom(zoom=0.5)
+    ref = mod.filter(im)
+    out = mod.bfilter(im, n_workers=2)
+    
+    assert tuple(out.data_xyztc.shape) == tuple(ref.data_xyztc.shape)
+    assert np.allclose(ref.data_xyztc[:, :, :, :, :], out.data_xyztc[:, :, :, :, :])
+    assert out.mdh['voxelsize.x'] == ref.mdh['voxelsize.x']
+
+
+def test_stateful_filter_not_run_concurrently():
+    import threading
+    import time
+    
+    class _Stateful(filters.GaussianFilter):
+        # like processing.Deconvolve, keeps state between calls
+        _block_thread_safe = False
+        
+        def apply_filter(self, data, voxelsize):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.001)
+            with lock:
+                active[0] -= 1
+            return data
+    
+    lock = threading.Lock()
+    active = [0, 0]
+    
+    im = _image()
+    out = _Stateful().bfilter(im, tile_size=32, n_workers=4)
+    assert active[1] == 1
+    assert np.allclose(out.data_xyztc[:, :, :, :, :], im.data_xyztc[:, :, :, :, :])
@@ -0,0 +1,49 @@
+import numpy as np
+
+from PYME.recipes import filters
+from PYME.recipes.recipe import Recipe
+from PYME.IO.image import ImageStack
+
+
+def _image():
+    im = ImageStack(np.random.RandomState(0).rand(60, 50, 4, 2, 2).astype('f'))
+    im.mdh['voxelsize.x'] = 0.1
+    im.mdh['voxelsize.y'] = 0.1
+    im.mdh['voxelsize.z'] = 0.2
+    return im
+
+
+def test_lazy_matches_eager():
+    im = _image()
+    for mod in [filters.GaussianFilter(sigmaX=2, sigmaY=1.5), filters.GaussianFilter(dimensionality='XYZ'),
+                filters.Zoom(zoom=0.5)]:
+        ref = mod.filter(im)
+        out = mod.lfilter(im)
+        assert tuple(out.data_xyztc.shape) == tuple(ref.data_xyztc.shape)
+        assert np.allclose(ref.data_xyztc[:, :, :, :, :], out.data_xyztc[:, :, :, :, :])
+
+
+def test_only_requested_planes_computed():
+    im = _image()
+    out = filters.GaussianFilter(sigmaX=2, sigmaY=2).lfilter(im, cache_size=4)
+    ds = out.data_xyztc
+    
+    assert ds.n_computed == 0
+    out.data_xyztc[:, :, 1, 0, 1]
+    out.data_xyztc[:, :, 1, 0, 1]
+    assert ds.n_computed == 1
+
+
+def test_lazy_recipe_output_uses_snapshot_of_params():
+    im = _image()
+    rec = Recipe()
+    rec.lazy_filters = True
+    mod = filters.GaussianFilter(rec, sigmaX=1, sigmaY=1, inputName='input', outputName='filtered')
+    rec.add_module(mod)
+    rec.execute(input=im)
+    out = rec.namespace['filtered']
+    
+    # changing a parameter must not change an output we already have
+    mod.sigmaX = 3
+    ref = filters.GaussianFilter(sigmaX=1, sigmaY=1).filter(im)
+    assert np.allclose(ref.data_xyztc[:, :, 2, 1, 0], out.data_xyztc[:, :, 2, 1, 0])
@@ -0,0 +1,137 @@
+import os
+
+import numpy as np
+
+from PYME.recipes import filters, tablefilters
+from PYME.recipes.recipe import Recipe
+from PYME.recipes.output_cache import OutputCache
+from PYME.IO.image import ImageStack
+from PYME.IO import tabular
+
+recipe_yaml = '''
+- filters.GaussianFilter:
+    inputName: input
+    outputName: filtered
+- filters.MeanFilter:
+    inputName: filtered
+    outputName: smoothed
+'''
+
+
+def _recipe(cache_dir):
+    recipe = Recipe.fromYAML(recipe_yaml)
+    recipe.output_cache = OutputCache(cache_dir=str(cache_dir))
+    return recipe
+
+
+def test_outputs_reused_across_recipes(tmp_path):
+    data = np.random.RandomState(0).rand(20, 20, 2)
+    
+    r0 = _recipe(tmp_path)
+    r0.execute(input=ImageStack(data.copy()))
+    assert r0.output_cache.stats() == {'hits': 0, 'misses': 2}
+    
+    # a new recipe (as if in a new process), with equal (but not identical) input data
+    r1 = _recipe(tmp_path)
+    r1.execute(input=ImageStack(data.copy()))
+    assert r1.output_cache.stats() == {'hits': 2, 'misses': 0}
+    assert np.allclose(r1.namespace['smoothed'].data_xyztc[:, :, :, :, :], r0.namespace['smoothed'].data_xyztc[:, :, :, :, :])
+    
+    # changing a parameter re-computes only that module and those downstream of it
+    r2 = _recipe(tmp_path)
+    [m for m in r2.modules if isinstance(m, filters.MeanFilter)][0].sizeX = 5
+    r2.execute(input=ImageStack(data.copy()))
+    assert r2.output_cache.stats() == {'hits': 1, 'misses': 1}
+    
+    # different data misses
+    r3 = _recipe(tmp_path)
+    r3.execute(input=ImageStack(data + 1))
+    assert r3.output_cache.stats() == {'hits': 0, 'misses': 2}
+
+
+def test_tabular_outputs(tmp_path):
+    yaml = '''
+- tablefilters.FilterTable:
+    inputName: input
+    outputName: filtered
+    filters:
+      x: [0, 5]
+'''
+    source = tabular.DictSource({'x': np.arange(10.), 'y': np.arange(10.)*2})
+    
+    r0 = Recipe.fromYAML(yaml)
+    r0.output_cache = OutputCache(cache_dir=str(tmp_path))
+    r0.execute(input=source)
+    
+    r1 = Recipe.fromYAML(yaml)
+    r1.output_cache = OutputCache(cache_dir=str(tmp_path))
+    r1.execute(input=source)
+    
+    assert r1.output_cache.stats()['hits'] == 1
+    assert np.all(r1.namespace['filtered']['x'] == r0.namespace['filtered']['x'])
+    assert np.all(r1.namespace['filtered']['y'] == r0.namespace['filtered']['y'])
+
+
+def test_eviction(tmp_path):
+    cache = OutputCache(cache_dir=str(tmp_path), max_size_mb=0.05)
+    r = Recipe.fromYAML(recipe_yaml)
+    r.output_cache = cache
+    for i in range(5):
+        r.execute(input=ImageStack(np.random.rand(32, 32, 2)))
+    
+    assert cache.size() <= 0.05*1024*1024
+
+
+def test_file_backed_images(tmp_path):
+    fn = str(tmp_path / 'input.npy')
+    np.save(fn, np.random.RandomState(0).rand(20, 20, 2))
+    
+    cache = OutputCache(cache_dir=str(tmp_path / 'cache'))
+    im = ImageStack(filename=fn, haveGUI=False)
+    digest = cache.content_hash(im)
+    
+    # file-backed images are identified by file, not content
+    assert digest == OutputCache(cache_dir=str(tmp_path / 'cache')).content_hash(ImageStack(filename=fn, haveGUI=False))
+    assert digest != cache.content_hash(ImageStack(np.load(fn)))
+    
+    # re-writing the file changes the hash
+    np.save(fn, np.random.RandomState(1).rand(20, 20, 2))
+    os.utime(fn, ns=(0, 0))
+    assert digest != OutputCache(cache_dir=str(tmp_path / 'cache')).content_hash(ImageStack(filename=fn, haveGUI=False))
+
+
+def test_opt_in(tmp_path):
+    from PYME.recipes import base, processing
+    
+    assert not base.ModuleBase._cache_outputs
+    assert filters.GaussianFilter._cache_outputs
+    assert not processing.Deconvolve._cache_outputs
+
+
+def test_file_parameters_in_key(tmp_path):
+    from PYME.recipes import processing
+    
+    fn = str(tmp_path / 'psf.npy')
+    np.save(fn, np.zeros(3))
+    
+    cache = OutputCache(cache_dir=str(tmp_path / 'cache'))
+    mod = processing.Deconvolve(psfType='file')
+    mod.trait_setq(psfFilename=fn)
+    namespace = {'input': ImageStack(np.random.rand(8, 8, 1))}
+    k0 = cache.key(mod, namespace)
+    assert cache.key(mod, namespace) == k0
+    
+    # editing the file (but not the parameter) changes the key
+    np.save(fn, np.ones(5))
+    os.utime(fn, ns=(0, 0))
+    assert cache.key(mod, namespace) != k0
+
+
+def test_lazy_outputs_not_stored(tmp_path):
+    r = _recipe(tmp_path)
+    r.lazy_filters = True
+    r.execute(input=ImageStack(np.random.rand(20, 20, 2)))
+    assert r.output_cache.size() == 0
+    
+    # nothing has been computed
+    assert len(r.namespace['smoothed'].data_xyztc._cache) == 0
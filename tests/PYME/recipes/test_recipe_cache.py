@@ -0,0 +1,57 @@
+import numpy as np
+
+from PYME.recipes import filters
+from PYME.recipes.recipe_cache import RecipeCache
+from PYME.IO.image import ImageStack
+
+recipe_yaml = '''
+- filters.GaussianFilter:
+    inputName: input
+    outputName: filtered
+'''
+
+
+def test_recipe_reuse():
+    cache = RecipeCache(max_recipes=2)
+
+    key, recipe = cache.get(recipe_yaml)
+    recipe.execute(input=ImageStack(np.ones((10, 10, 1))))
+    mod = recipe.modules[0]
+    cache.put(key, recipe)
+    assert len(recipe.namespace) == 0
+
+    key1, recipe1 = cache.get(recipe_yaml)
+    assert key1 == key
+    assert recipe1 is recipe
+    assert recipe1.modules[0] is mod
+    assert not mod._success
+
+    # re-executes with the new input
+    recipe1.execute(input=ImageStack(2*np.ones((10, 10, 1))))
+    assert np.allclose(recipe1.namespace['filtered'].data_xyztc[:, :, 0, 0, 0], 2)
+
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_recipe_cache_checkout():
+    # a recipe which is in use is not handed out again
+    cache = RecipeCache()
+    key, recipe = cache.get(recipe_yaml)
+    key, recipe1 = cache.get(recipe_yaml)
+    assert recipe1 is not recipe
+
+
+def test_cached_resource():
+    _, recipe = RecipeCache().get(recipe_yaml)
+    mod = recipe.modules[0]
+
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return np.ones(3)
+
+    mod.cached_resource('psf.tif', loader)
+    mod.cached_resource('psf.tif', loader)
+    assert len(calls) == 1
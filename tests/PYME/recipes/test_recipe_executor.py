@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+from PYME.recipes import filters, base
+from PYME.recipes.recipe import Recipe, RecipeExecutionError
+from PYME.recipes.executor import ParallelExecutor
+from PYME.IO.image import ImageStack
+
+recipe_yaml = '''
+- filters.GaussianFilter:
+    inputName: chan0
+    outputName: filtered0
+- filters.GaussianFilter:
+    inputName: chan1
+    outputName: filtered1
+    sigmaX: 2.0
+    sigmaY: 2.0
+- base.Add:
+    inputName0: filtered0
+    inputName1: filtered1
+    outputName: sum
+'''
+
+
+def _inputs():
+    rng = np.random.RandomState(0)
+    return {'chan0': ImageStack(rng.rand(32, 32, 1)), 'chan1': ImageStack(rng.rand(32, 32, 1))}
+
+
+def _execute(executor, progress=None):
+    recipe = Recipe.fromYAML(recipe_yaml)
+    recipe.executor = executor
+    recipe.execute(progress_callback=progress, **_inputs())
+    return recipe
+
+
+def test_parallel_matches_sequential():
+    seq = _execute(None)
+    executed = []
+    par = _execute(ParallelExecutor(max_workers=2), progress=lambda r, m: executed.append(m))
+    
+    assert np.allclose(seq.namespace['sum'].data_xyztc[:, :, :, :, :], par.namespace['sum'].data_xyztc[:, :, :, :, :])
+    
+    # all modules reported, with the dependent module last
+    assert len(executed) == 3
+    assert executed[-1] is par.modules[2]
+    assert set(par._exec_times.keys()) == set(seq._exec_times.keys())
+
+
+def test_parallel_incremental():
+    executor = ParallelExecutor(max_workers=2)
+    recipe = _execute(executor)
+    
+    # changing one branch only re-runs that branch and its dependents
+    executed = []
+    recipe.modules[1].sigmaX = 3.0
+    recipe.execute(progress_callback=lambda r, m: executed.append(m))
+    assert executed == [recipe.modules[1], recipe.modules[2]]
+
+
+def test_parallel_failure():
+    recipe = Recipe.fromYAML(recipe_yaml)
+    recipe.executor = ParallelExecutor(max_workers=2)
+    
+    # chan1 is missing
+    with pytest.raises(RecipeExecutionError):
+        recipe.execute(chan0=_inputs()['chan0'])
+    
+    assert recipe.failed
+    assert recipe._failing_module is recipe.modules[1]
+    assert 'sum' not in recipe.namespace
+
+
+def test_execution_modes():
+    # modules run serially unless they opt in
+    assert base.ModuleBase._execution_mode == 'serial'
+    assert filters.GaussianFilter._execution_mode == 'thread'
+    assert filters.DespeckleFilter._execution_mode == 'process'
+    assert base.Add._execution_mode == 'thread'
+
+
+def test_process_modules_use_output_cache(tmp_path, monkeypatch):
+    from PYME.recipes.output_cache import OutputCache
+    
+    checked = []
+    check_inputs = filters.DespeckleFilter.check_inputs
+    
+    def _check_inputs(self, namespace):
+        checked.append(self)
+        check_inputs(self, namespace)
+    
+    monkeypatch.setattr(filters.DespeckleFilter, 'check_inputs', _check_inputs)
+    
+    yaml = '''
+- filters.DespeckleFilter:
+    inputName: input
+    outputName: despeckled
+'''
+    data = np.random.RandomState(0).rand(16, 16, 1)
+    executor = ParallelExecutor(max_workers=2, processes=True)
+    try:
+        for i in range(2):
+            recipe = Recipe.fromYAML(yaml)
+            recipe.executor = executor
+            recipe.output_cache = OutputCache(cache_dir=str(tmp_path))
+            recipe.execute(input=ImageStack(data.copy()))
+            assert 'despeckled' in recipe.namespace
+        
+        # run in the process pool the first time, from the cache the second
+        assert executor._process_pool is not None
+        assert recipe.output_cache.stats() == {'hits': 1, 'misses': 0}
+        
+        # inputs were checked (in this process) both times
+        assert len(checked) == 2
+    finally:
+        executor.shutdown()
+
+
+def test_recipes_share_executor(monkeypatch):
+    from PYME import config
+    
+    monkeypatch.setitem(config.config, 'recipe-executor-workers', 2)
+    assert Recipe().executor is Recipe().executor